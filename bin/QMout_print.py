@@ -40,8 +40,12 @@ try:
   import numpy
   NONUMPY=False
 except ImportError:
-  import subprocess as sp
   NONUMPY=True
+
+# shared modules in $SHARC/../lib
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.realpath(__file__)),'..','lib'))
+import eigensolver
+from qmout import QMOUT, FLAGS, as_lists
   
 # =========================================================0
 # compatibility stuff
@@ -114,47 +118,22 @@ def itnmstates(states):
 
 # ======================================================================= #
 def read_QMout(path,nstates,natom,request):
-  targets={'h':         {'flag': 1,
-                         'type': complex,
-                         'dim':  (1,nstates,nstates)},
-           'dm':        {'flag': 2,
-                         'type': complex,
-                         'dim':  (3,nstates,nstates)},
-           'grad':      {'flag': 3,
-                         'type': float,
-                         'dim':  (nstates,natom,3)}
-          }
-
-  # read QM.out
-  lines=readfile(path)
+  try:
+    qmout=QMOUT(path)
+  except (IOError,OSError):
+    print 'File %s could not be read!' % (path)
+    sys.exit(12)
 
   # obtain all targets
   QMout={}
-  for t in targets:
+  for t in ['h','dm','grad']:
     if t in request:
-      iline=-1
-      while True:
-        iline+=1
-        if iline>=len(lines):
-          print 'Could not find target %s with flag %i in file %s!' % (t,targets[t]['flag'],f)
-          sys.exit(11)
-        line=lines[iline]
-        if '! %i' % (targets[t]['flag']) in line:
-          break
-      values=[]
-      for iblocks in range(targets[t]['dim'][0]):
-        iline+=1
-        block=[]
-        for irow in range(targets[t]['dim'][1]):
-          iline+=1
-          line=lines[iline].split()
-          if targets[t]['type']==complex:
-            row=[ complex(float(line[2*i]),float(line[2*i+1])) for i in range(targets[t]['dim'][2]) ]
-          elif targets[t]['type']==float:
-            row=[ float(line[i]) for i in range(targets[t]['dim'][2]) ]
-          block.append(row)
-        values.append(block)
-      QMout[t]=values
+      if not t in qmout:
+        print 'Could not find target %s with flag %i in file %s!' % (t,FLAGS[t],path)
+        sys.exit(11)
+      QMout[t]=as_lists(qmout.get(t))
+  if 'h' in QMout:
+    QMout['h']=[QMout['h']]
 
   #pprint.pprint(QMout)
   return QMout
@@ -179,43 +158,12 @@ def read_QMin(path,request):
 
 # ======================================================================================================================
 
-class diagonalizer:
-  def __init__(self):
-    exe=os.getenv('SHARC')
-    exe=os.path.expanduser(os.path.expandvars(exe))+'/diagonalizer.x'
-    if not os.path.isfile(exe):
-      print 'SHARC auxilliary diagonalizer not found at %s!' % (exe)
-      sys.exit(1)
-    self.exe=exe
-  def eigh(self,H):
-    STDIN='C %i %i\nTitle\n' % (len(H),len(H))
-    for x in H:
-      for y in x:
-        STDIN+='%20.13f %20.13f ' % (y.real,y.imag)
-      STDIN+='\n'
-    proc=sp.Popen(self.exe,stdin=sp.PIPE,stdout=sp.PIPE)
-    STDOUT=proc.communicate(input=STDIN)[0].split('\n')
-    shift=1
-    for ix in range(len(H)):
-      line=STDOUT[shift+ix].split()
-      for iy in range(len(H)):
-        H[ix][iy]=complex(float(line[0+2*iy]),float(line[1+2*iy]))
-    U=[ [ 0. for i in range(len(H)) ] for j in range(len(H)) ]
-    shift=2+len(H)
-    for ix in range(len(H)):
-      line=STDOUT[shift+ix].split()
-      for iy in range(len(H)):
-        U[ix][iy]=complex(float(line[0+2*iy]),float(line[1+2*iy]))
-    return H,U
-
-# ======================================================================================================================
-
 def transform(H,DM,P):
   '''transforms the H and DM matrices in the representation where H is diagonal.'''
 
   if NONUMPY:
-    diagon=diagonalizer()
-    H,U=diagon.eigh(H)
+    eig,U=eigensolver.eigh(H)
+    H=[ [ complex(eig[i] if i==j else 0.) for j in range(len(H)) ] for i in range(len(H)) ]
     UDMU=[ [ [ 0. for i in range(len(H)) ] for j in range(len(H)) ] for k in range(3) ]
     for xyz in range(3):
       temp=[ [ 0. for i in range(len(H)) ] for j in range(len(H)) ]
@@ -242,7 +190,7 @@ def transform(H,DM,P):
             P[a][b]+=temp[a][i]*U[i][b]
 
   else:
-    eig,U=numpy.linalg.eigh(H)
+    eig,U=eigensolver.eigh(H)
     Ucon=[ [ 0. for i in range(len(H)) ] for j in range(len(H)) ]
     for ix in range(len(U)):
       for iy in range(len(U)):
@@ -45,6 +45,8 @@ import cmath
 import datetime
 # copy of arrays of arrays
 from copy import deepcopy
+# ordered dictionary
+from collections import OrderedDict
 # parallel calculations
 from multiprocessing import Pool
 import time
@@ -55,6 +57,11 @@ import traceback
 # parse Python literals from input
 import ast
 
+# shared modules in $SHARC/../lib
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.realpath(__file__)),'..','lib'))
+import determinants
+import scheduler
+
 import numpy
 #try:
 #except ImportError:
@@ -313,13 +320,16 @@ def readfile(filename):
 
 # ======================================================================= #
 def writefile(filename,content):
-  # content can be either a string or a list of strings
+  # content can be either a string, a list of strings, or bytes (binary files)
   try:
-    f=open(filename,'w')
+    if isinstance(content,bytes):
+      f=open(filename,'wb')
+    else:
+      f=open(filename,'w')
     if isinstance(content,list):
       for line in content:
         f.write(line)
-    elif isinstance(content,str):
+    elif isinstance(content,(str,bytes)):
       f.write(content)
     else:
       print('Content %s cannot be written to file!' % (content))
@@ -1687,6 +1697,11 @@ def readQMin(QMinfilename):
     if line[0]:
         QMin['nooverlap']=[]
 
+    # write the dets files in the binary format of wfoverlap
+    line=getsh2ADFkey(sh2ADF,'binary_dets')
+    if line[0]:
+        QMin['binary_dets']=[]
+
 
     # TheoDORE settings
     if 'theodore' in QMin:
@@ -2412,6 +2427,24 @@ def divide_slots(ncpu,ntasks,scaling):
     #print nrounds,nslots,cpu_per_run
     return nrounds,nslots,cpu_per_run
 
+# =============================================================================================== #
+def schedule_jobs(QMin,jobs,timings):
+    # distributes the cores over the jobs of one jobset,
+    # using the runtimes measured in the previous steps if available (see scheduler.py), otherwise divide_slots
+    #   returns the number of slots which should be set in the Pool,
+    #   the number of cores for each job,
+    #   and the jobs in the order in which they should be submitted.
+    plan=scheduler.schedule(QMin['ncpu'],jobs,QMin['schedule_scaling'],timings)
+    if not plan:
+        nrounds,nslots,cpu_per_run=divide_slots(QMin['ncpu'],len(jobs),QMin['schedule_scaling'])
+        return nslots,dict(zip(jobs,cpu_per_run)),jobs
+    nslots,cpu_per_run,order,makespan=plan
+    if PRINT:
+        print('Schedule from measured runtimes (predicted: %.1f s):' % (makespan))
+        for job in order:
+            print('  %-20s %i cores' % (job,cpu_per_run[job]))
+    return nslots,cpu_per_run,order
+
 # =============================================================================================== #
 
 def generate_joblist(QMin):
@@ -2458,54 +2491,43 @@ def generate_joblist(QMin):
     schedule=[]
     QMin['nslots_pool']=[]
 
+    # runtimes of the previous steps
+    timings=scheduler.load(QMin['savedir'])
+
     # add the master calculations
-    ntasks=0
-    for i in gradjob:
-        if 'master' in i:
-            ntasks+=1
-    nrounds,nslots,cpu_per_run=divide_slots(QMin['ncpu'],ntasks,QMin['schedule_scaling'])
+    jobs=[ i for i in sorted(gradjob) if 'master' in i ]
+    nslots,cpu_per_run,order=schedule_jobs(QMin,jobs,timings)
     QMin['nslots_pool'].append(nslots)
-    schedule.append({})
-    icount=0
-    for i in sorted(gradjob):
-        if 'master' in i:
+    schedule.append(OrderedDict())
+    for i in order:
+        QMin1=deepcopy(QMin)
+        QMin1['master']=True
+        QMin1['IJOB']=int(i.split('_')[1])
+        remove=['gradmap','ncpu']
+        for r in remove:
+            QMin1=removekey(QMin1,r)
+        QMin1['gradmap']=list(gradjob[i])
+        QMin1['ncpu']=cpu_per_run[i]
+        schedule[-1][i]=QMin1
+
+    # add the gradient calculations
+    jobs=[ i for i in sorted(gradjob) if 'grad' in i ]
+    if len(jobs)>0:
+        nslots,cpu_per_run,order=schedule_jobs(QMin,jobs,timings)
+        QMin['nslots_pool'].append(nslots)
+        schedule.append(OrderedDict())
+        for i in order:
             QMin1=deepcopy(QMin)
-            QMin1['master']=True
-            QMin1['IJOB']=int(i.split('_')[1])
-            remove=['gradmap','ncpu']
+            mult=list(gradjob[i])[0][0]
+            QMin1['IJOB']=QMin['multmap'][mult]
+            remove=['gradmap','ncpu','h','soc','dm','overlap','ion','always_guess','always_orb_init','init']
             for r in remove:
                 QMin1=removekey(QMin1,r)
             QMin1['gradmap']=list(gradjob[i])
-            QMin1['ncpu']=cpu_per_run[icount]
-            icount+=1
+            QMin1['ncpu']=cpu_per_run[i]
+            QMin1['gradonly']=[]
             schedule[-1][i]=QMin1
 
-
-
-    # add the gradient calculations
-    ntasks=0
-    for i in gradjob:
-        if 'grad' in i:
-            ntasks+=1
-    if ntasks>0:
-        nrounds,nslots,cpu_per_run=divide_slots(QMin['ncpu'],ntasks,QMin['schedule_scaling'])
-        QMin['nslots_pool'].append(nslots)
-        schedule.append({})
-        icount=0
-        for i in gradjob:
-            if 'grad' in i:
-                QMin1=deepcopy(QMin)
-                mult=list(gradjob[i])[0][0]
-                QMin1['IJOB']=QMin['multmap'][mult]
-                remove=['gradmap','ncpu','h','soc','dm','overlap','ion','always_guess','always_orb_init','init']
-                for r in remove:
-                    QMin1=removekey(QMin1,r)
-                QMin1['gradmap']=list(gradjob[i])
-                QMin1['ncpu']=cpu_per_run[icount]
-                QMin1['gradonly']=[]
-                icount+=1
-                schedule[-1][i]=QMin1
-
     return QMin,schedule
 
 
@@ -2531,13 +2553,19 @@ def runjobs(schedule,QMin):
             QMin1=jobset[job]
             WORKDIR=os.path.join(QMin['scratchdir'],job)
 
-            errorcodes[job]=pool.apply_async(run_calc , [WORKDIR,QMin1])
+            errorcodes[job]=pool.apply_async(scheduler.timed , [run_calc,WORKDIR,QMin1])
             time.sleep(QMin['delay'])
         pool.close()
         pool.join()
 
-    for i in errorcodes:
-        errorcodes[i]=errorcodes[i].get()
+    # wall times of the successful jobs, for the scheduling of the next steps
+    runtimes=[]
+    for jobset in schedule:
+        for job in jobset:
+            errorcodes[job],walltime=errorcodes[job].get()
+            if errorcodes[job]==0:
+                runtimes.append( (job,jobset[job]['ncpu'],walltime) )
+    scheduler.record(QMin['savedir'],runtimes)
     j=0
     string='Error Codes:\n'
     for i in errorcodes:
@@ -3293,29 +3321,19 @@ def get_dets_from_tape21(filename,QMin):
                 eigl=f.read(section,key)
                 for i in range(len(eig)):
                     eig[i]=(eig[i]+eigl[i])/2.
-            # make dictionary
-            dets={}
+            # truncate vectors, only the remaining elements are put into the dictionary
+            nexc_A=nocc_A*nvir_A
             if restr:
-                for iocc in range(nocc_A):
-                    for ivirt in range(nvir_A):
-                        index=iocc*nvir_A+ivirt
-                        dets[ (iocc,ivirt,1) ]=eig[index]
+                amplitudes=list(eig[:nexc_A])
             else:
-                for iocc in range(nocc_A):
-                    for ivirt in range(nvir_A):
-                        index=iocc*nvir_A+ivirt
-                        dets[ (iocc,ivirt,1) ]=eig[index]
-                for iocc in range(nocc_B):
-                    for ivirt in range(nvir_B):
-                        index=iocc*nvir_B+ivirt + max(nvir_A,nvir_B)*max(nocc_A,nocc_B)
-                        dets[ (iocc,ivirt,2) ]=eig[index]
-            # truncate vectors
-            norm=0.
-            for k in sorted(dets,key=lambda x: dets[x]**2,reverse=True):
-                if norm>QMin['wfthres']:
-                    del dets[k]
-                    continue
-                norm+=dets[k]**2
+                offset=max(nvir_A,nvir_B)*max(nocc_A,nocc_B)
+                amplitudes=list(eig[:nexc_A])+list(eig[offset:offset+nocc_B*nvir_B])
+            dets={}
+            for index in determinants.truncate(amplitudes,QMin['wfthres']):
+                if index<nexc_A:
+                    dets[ (index//nvir_A,index%nvir_A,1) ]=amplitudes[index]
+                else:
+                    dets[ ((index-nexc_A)//nvir_B,(index-nexc_A)%nvir_B,2) ]=amplitudes[index]
             # create strings and expand singlets
             dets2={}
             if restr:
@@ -3374,41 +3392,10 @@ def get_dets_from_tape21(filename,QMin):
     strings={}
     for imult,mult in enumerate(mults):
         filename=os.path.join(QMin['savedir'],'dets.%i' % mult)
-        strings[filename]=format_ci_vectors(eigenvectors[mult])
+        strings[filename]=determinants.format_ci_vectors(eigenvectors[mult],'binary_dets' in QMin)
 
     return strings
 
-# ======================================================================= #
-def format_ci_vectors(ci_vectors):
-
-    # get nstates, norb and ndets
-    alldets=set()
-    for dets in ci_vectors:
-        for key in dets:
-            alldets.add(key)
-    ndets=len(alldets)
-    nstates=len(ci_vectors)
-    norb=len(next(iter(alldets)))
-
-    string='%i %i %i\n' % (nstates,norb,ndets)
-    for det in sorted(alldets,reverse=True):
-        for o in det:
-            if o==0:
-                string+='e'
-            elif o==1:
-                string+='a'
-            elif o==2:
-                string+='b'
-            elif o==3:
-                string+='d'
-        for istate in range(len(ci_vectors)):
-            if det in ci_vectors[istate]:
-                string+=' %11.7f ' % ci_vectors[istate][det]
-            else:
-                string+=' %11.7f ' % 0.
-        string+='\n'
-    return string
-
 # ======================================================================= #
 def saveAOmatrix(WORKDIR,QMin):
     filename=os.path.join(WORKDIR,'TAPE15')
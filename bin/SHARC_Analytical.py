@@ -32,6 +32,7 @@
 # Writes these back to QM.out
 
 from copy import deepcopy 
+import ast
 import math
 import sys
 import re
@@ -44,9 +45,12 @@ try:
   import numpy
   NONUMPY=False
 except ImportError:
-  import subprocess as sp
   NONUMPY=True
 
+# shared modules in $SHARC/../lib
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.realpath(__file__)),'..','lib'))
+import eigensolver
+
 
 # =========================================================
 # compatibility stuff
@@ -357,45 +361,13 @@ def checkscratch(SCRATCHDIR):
 # =========================================================
 # =========================================================
 # diagonalization and transformation stuff
-class diagonalizer:
-  def __init__(self):
-    exe=os.getenv('SHARC')
-    exe=os.path.expanduser(os.path.expandvars(exe))+'/diagonalizer.x'
-    if not os.path.isfile(exe):
-      print 'SHARC auxilliary diagonalizer not found at %s!' % (exe)
-      sys.exit(14)
-    self.exe=exe
-  def eigh(self,H):
-    STDIN='C %i %i\nTitle\n' % (len(H),len(H))
-    for x in H:
-      for y in x:
-        STDIN+='%20.13f %20.13f ' % (y.real,y.imag)
-      STDIN+='\n'
-    proc=sp.Popen(self.exe,stdin=sp.PIPE,stdout=sp.PIPE)
-    STDOUT=proc.communicate(input=STDIN)[0].split('\n')
-    shift=1
-    for ix in range(len(H)):
-      line=STDOUT[shift+ix].split()
-      for iy in range(len(H)):
-        H[ix][iy]=complex(float(line[0+2*iy]),float(line[1+2*iy]))
-    U=[ [ 0. for i in range(len(H)) ] for j in range(len(H)) ]
-    shift=2+len(H)
-    for ix in range(len(H)):
-      line=STDOUT[shift+ix].split()
-      for iy in range(len(H)):
-        U[ix][iy]=complex(float(line[0+2*iy]),float(line[1+2*iy]))
-    return H,U
-
 # =========================================================
 def diagonalize(A):
+  # diagonalize Hamiltonian
+  Hd,U=eigensolver.eigh(A)
   if NONUMPY:
-    diagon=diagonalizer()
+    Hd=[ [ complex(Hd[i] if i==j else 0.) for j in range(len(Hd)) ] for i in range(len(Hd)) ]
   else:
-    diagon=numpy.linalg
-
-  # diagonalize Hamiltonian
-  Hd,U=diagon.eigh(A)
-  if not NONUMPY:
     Hd=numpy.diag(Hd)
 
   return Hd,U
@@ -828,6 +800,32 @@ def writeQmoutPhases(QMin,QMout):
 # includes derivatives
 #
 # using eval is probably risky, because it can execute any code...
+#
+# the lower triangle elements are compiled only once into one expression
+# if numpy is available, math functions are replaced by their numpy counterparts,
+# so that the matrix can be evaluated for many geometries at once
+
+# math functions whose numpy counterparts have different names
+MathToNumpy={
+             'acos': 'arccos', 
+             'asin': 'arcsin', 
+             'atan': 'arctan', 
+             'atan2': 'arctan2', 
+             'acosh': 'arccosh', 
+             'asinh': 'arcsinh', 
+             'atanh': 'arctanh', 
+             'pow': 'power'
+             }
+
+class math_to_numpy(ast.NodeTransformer):
+  def visit_Attribute(self,node):
+    self.generic_visit(node)
+    if isinstance(node.value,ast.Name) and node.value.id=='math':
+      name=MathToNumpy.get(node.attr,node.attr)
+      if hasattr(numpy,name):
+        return ast.copy_location(ast.Attribute(value=ast.Name(id='_numpy',ctx=ast.Load()),attr=name,ctx=node.ctx),node)
+    return node
+
 class func_mat:
   def split_strings(self,n,strings):
     a=[]
@@ -839,59 +837,99 @@ class func_mat:
       a.append(s)
     return a
 
+  def compile_elements(self,a):
+    # all lower triangle elements in one tuple, in the order of numpy.tril_indices
+    expr='(%s,)' % (','.join( [ '(%s)' % (a[i][j].strip()) for i in range(self.n) for j in range(i+1) ] ))
+    try:
+      tree=ast.parse(expr,mode='eval')
+    except SyntaxError:
+      print 'Syntax error in matrix definition!'
+      sys.exit(17)
+    if not NONUMPY:
+      tree=ast.fix_missing_locations(math_to_numpy().visit(tree))
+    return compile(tree,'<Analytical.template>','eval')
+
   def __init__(self, rstrings, istrings=None):
     # rstring: list of strings defining the matrix elements for the real part
     # istrings: for the imaginary part
     # both matrices should be defined with lower triangle matrices
     self.n=int(len(rstrings))
     self.cmpx=False
-    self.r=self.split_strings(self.n,rstrings)
+    self.r=self.compile_elements(self.split_strings(self.n,rstrings))
 
     if istrings!=None:
       self.cmpx=True
-      self.i=self.split_strings(self.n,istrings)
+      self.i=self.compile_elements(self.split_strings(self.n,istrings))
+
+  def evaluate(self,_values):
+    # returns the lower triangle elements of the real and imaginary matrices
+    _ns=dict(_values)
+    if not NONUMPY:
+      _ns['_numpy']=numpy
+    _R=eval(self.r,globals(),_ns)
+    if self.cmpx:
+      _I=eval(self.i,globals(),_ns)
+    else:
+      _I=[ 0. for _x in _R ]
+    return _R,_I
 
   def mat(self,_geom,_var):
     # geom is list of list of atom coordinates
     # e.g. [['I', 0.6, 0.0, 0.0], ['Br', 2.4, 0.0, 0.0]]
     # var is dictionary of variable mappings
     # e.g. {'y': (1, 0), 'x': (0, 0)}
+    if not NONUMPY:
+      return self.mats([_geom],_var)[0]
 
     # set the variables
+    _values={}
     for _v in _var:
       if isinstance(_var[_v],list):
         _i,_j=tuple(_var[_v])
-        exec('%s=%f' % (_v,_geom[_i][_j+1]) )
+        _values[_v]=float(_geom[_i][_j+1])
       else:
-        exec('%s=%f' % (_v,_var[_v] ) )
-
-    # build the real matrix
-    _R=[ [ 0. for _i in range(self.n) ] for _j in range(self.n) ]
-    for _i in range(self.n):
-      for _j in range(_i+1):
-        _R[_i][_j]=eval(self.r[_i][_j])
-
-    # build the imaginary matrix
-    _I=[ [ 0. for _i in range(self.n) ] for _j in range(self.n) ]
-    if self.cmpx:
-      for _i in range(self.n):
-        for _j in range(_i+1):
-          _I[_i][_j]=eval(self.i[_i][_j])
+        _values[_v]=float(_var[_v])
+    _R,_I=self.evaluate(_values)
 
     # build the Hermitian matrix
     _M=[ [ 0. for _i in range(self.n) ] for _j in range(self.n) ]
+    _k=0
     for _i in range(self.n):
-      for _j in range(self.n):
-        if _i<_j:
-          _M[_i][_j]=complex(_R[_j][_i],-_I[_j][_i])
-        elif _i==_j:
-          _M[_i][_j]=complex(_R[_i][_j],0)
-        elif _i>_j:
-          _M[_i][_j]=complex(_R[_i][_j],_I[_i][_j])
+      for _j in range(_i+1):
+        if _i==_j:
+          _M[_i][_j]=complex(_R[_k],0)
+        else:
+          _M[_i][_j]=complex(_R[_k],_I[_k])
+          _M[_j][_i]=complex(_R[_k],-_I[_k])
+        _k+=1
 
     # return
     return _M
 
+  def mats(self,_geoms,_var):
+    # evaluates the matrix for a list of geometries at once (needs numpy)
+    # returns a complex array of shape (len(geoms),n,n)
+    _values={}
+    for _v in _var:
+      if isinstance(_var[_v],list):
+        _i,_j=tuple(_var[_v])
+        _values[_v]=numpy.array([ _geom[_i][_j+1] for _geom in _geoms ],dtype=float)
+      else:
+        _values[_v]=float(_var[_v])
+    _R,_I=self.evaluate(_values)
+
+    # build the Hermitian matrix
+    _ngeom=len(_geoms)
+    _R=numpy.array([ numpy.zeros(_ngeom)+_x for _x in _R ]).T
+    _I=numpy.array([ numpy.zeros(_ngeom)+_x for _x in _I ]).T
+    _low=numpy.tril_indices(self.n)
+    _diag=numpy.arange(self.n)
+    _L=numpy.zeros((_ngeom,self.n,self.n),dtype=complex)
+    _L[:,_low[0],_low[1]]=_R+1j*_I
+    _M=_L+numpy.conj(_L.swapaxes(1,2))
+    _M[:,_diag,_diag]=_L[:,_diag,_diag].real
+    return _M
+
 # =========================================================
 def read_QMin():
   # reads the geometry, unit keyword, nstates keyword
@@ -1133,65 +1171,102 @@ def read_SH2Ana(QMin):
       QMin['nodiag']=[]
 
 
-  # obtain the Hamiltonian
+  # compile the matrices, each template string is parsed only once
+  fmat={}
   Hstring=find_lines(nstates,'Hamiltonian',sh2ana)
   if Hstring==[]:
     print 'No Hamiltonian defined in SH2Ana.inp!'
     sys.exit(27)
-  fmat=func_mat(Hstring)
-  SH2ANA['H']=fmat.mat(QMin['geom'],SH2ANA['var'])
+  fmat['H']=func_mat(Hstring)
 
-  # obtain the old Hamiltonian
-  SH2ANA['Hold']=fmat.mat(QMin['geomold'],SH2ANA['var'])
-
-  # obtain the derivatives
-  SH2ANA['deriv']={}
+  # derivatives
+  fmat['deriv']={}
   for v in var:
     if isinstance(var[v],list):
       Dstring=find_lines(nstates,'Derivatives %s' % (v),sh2ana)
       if Dstring==[]:
         print 'No derivative matrix for variable %s defined in SH2Ana.inp!' % (v)
         sys.exit(28)
-      fmat=func_mat(Dstring)
-      SH2ANA['deriv'][v]=fmat.mat(QMin['geom'],SH2ANA['var'])
+      fmat['deriv'][v]=func_mat(Dstring)
 
-  # obtain the dipole matrices
-  SH2ANA['dipole']={}
+  # dipole matrices
+  fmat['dipole']={}
   for idir in range(1,4):
     Dstring=find_lines(nstates,'Dipole %s' % (idir),sh2ana)
     if Dstring==[]:
-      SH2ANA['dipole'][idir]=[ [ complex(0.,0.) for i in range(nstates) ] for j in range(nstates) ]
+      fmat['dipole'][idir]=None
     else:
-      fmat=func_mat(Dstring)
-      SH2ANA['dipole'][idir]=fmat.mat(QMin['geom'],SH2ANA['var'])
+      fmat['dipole'][idir]=func_mat(Dstring)
 
-  # obtain the dipole derivative matrices
-  SH2ANA['dipolederiv']={}
+  # dipole derivative matrices
+  fmat['dipolederiv']={}
   for idir in range(1,4):
-    SH2ANA['dipolederiv'][idir]={}
+    fmat['dipolederiv'][idir]={}
     for v in var:
       if isinstance(var[v],list):
         Dstring=find_lines(nstates,'Dipolederivatives %s %s' % (idir,v),sh2ana)
         if Dstring==[]:
-          SH2ANA['dipolederiv'][idir][v]=[ [ complex(0.,0.) for i in range(nstates) ] for j in range(nstates) ]
+          fmat['dipolederiv'][idir][v]=None
         else:
-          fmat=func_mat(Dstring)
-          SH2ANA['dipolederiv'][idir][v]=fmat.mat(QMin['geom'],SH2ANA['var'])
+          fmat['dipolederiv'][idir][v]=func_mat(Dstring)
 
-  # obtain the SO matrix
+  # SO matrix
   Rstring=find_lines(nstates,'SpinOrbit R',sh2ana)
   if Rstring==[]:
-    SH2ANA['soc']=[ [ complex(0.,0.) for i in range(nstates) ] for j in range(nstates) ]
+    fmat['soc']=None
   else:
     Istring=find_lines(nstates,'SpinOrbit I',sh2ana)
     if Istring==[]:
-      fmat=func_mat(Rstring)
+      fmat['soc']=func_mat(Rstring)
     else:
-      fmat=func_mat(Rstring,Istring)
-    SH2ANA['soc']=fmat.mat(QMin['geom'],SH2ANA['var'])
+      fmat['soc']=func_mat(Rstring,Istring)
+  SH2ANA['fmat']=fmat
+
+  # evaluate all matrices at the current geometry
+  SH2ANA.update(evaluate_SH2Ana(SH2ANA,QMin['geom']))
+
+  # obtain the old Hamiltonian
+  SH2ANA['Hold']=fmat['H'].mat(QMin['geomold'],SH2ANA['var'])
 
   return SH2ANA, QMin
 
+# =========================================================
+def evaluate_SH2Ana(SH2ANA,geom,batch=False):
+  '''Evaluates the Hamiltonian, derivative, dipole, dipole derivative and SO matrices.
+
+  With batch=True, geom is a list of geometries and all matrices are 
+  complex arrays with the geometries along the first axis (needs numpy).
+  Useful for scans of the model, where the template is compiled only once.'''
+
+  fmat=SH2ANA['fmat']
+  var=SH2ANA['var']
+  nstates=fmat['H'].n
+
+  def evaluate(f):
+    if f==None:
+      if batch:
+        return numpy.zeros((len(geom),nstates,nstates),dtype=complex)
+      return [ [ complex(0.,0.) for i in range(nstates) ] for j in range(nstates) ]
+    if batch:
+      return f.mats(geom,var)
+    return f.mat(geom,var)
+
+  mats={}
+  mats['H']=evaluate(fmat['H'])
+  mats['deriv']={}
+  for v in fmat['deriv']:
+    mats['deriv'][v]=evaluate(fmat['deriv'][v])
+  mats['dipole']={}
+  for idir in range(1,4):
+    mats['dipole'][idir]=evaluate(fmat['dipole'][idir])
+  mats['dipolederiv']={}
+  for idir in range(1,4):
+    mats['dipolederiv'][idir]={}
+    for v in fmat['dipolederiv'][idir]:
+      mats['dipolederiv'][idir][v]=evaluate(fmat['dipolederiv'][idir][v])
+  mats['soc']=evaluate(fmat['soc'])
+  return mats
+
 
 # ============================================================================
 # ============================================================================
@@ -1203,11 +1278,6 @@ def getQMout(QMin,SH2ANA):
 
   #pprint.pprint(SH2ANA,width=192)
 
-  if NONUMPY:
-    diagon=diagonalizer()
-  else:
-    diagon=numpy.linalg
-
   # diagonalize Hamiltonian
   if not 'nodiag' in QMin:
     Hd,U=diagonalize(SH2ANA['H'])
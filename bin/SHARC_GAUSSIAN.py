@@ -47,6 +47,8 @@ import cmath
 import datetime
 # copy of arrays of arrays
 from copy import deepcopy
+# ordered dictionary
+from collections import OrderedDict
 # parallel calculations
 from multiprocessing import Pool
 import time
@@ -57,6 +59,12 @@ import traceback
 # parse Python literals from input
 import ast
 
+# shared modules in $SHARC/../lib
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.realpath(__file__)),'..','lib'))
+import determinants
+import interface_daemon
+import scheduler
+
 # =========================================================0
 # compatibility stuff
 
@@ -1502,6 +1510,11 @@ def readQMin(QMinfilename):
     if line[0]:
         QMin['nooverlap']=[]
 
+    # write the dets files in the binary format of wfoverlap
+    line=getsh2Gaukey(sh2Gau,'binary_dets')
+    if line[0]:
+        QMin['binary_dets']=[]
+
 
     # TheoDORE settings
     if 'theodore' in QMin:
@@ -2042,6 +2055,24 @@ def divide_slots(ncpu,ntasks,scaling):
     #print nrounds,nslots,cpu_per_run
     return nrounds,nslots,cpu_per_run
 
+# =============================================================================================== #
+def schedule_jobs(QMin,jobs,timings):
+    # distributes the cores over the jobs of one jobset,
+    # using the runtimes measured in the previous steps if available (see scheduler.py), otherwise divide_slots
+    #   returns the number of slots which should be set in the Pool,
+    #   the number of cores for each job,
+    #   and the jobs in the order in which they should be submitted.
+    plan=scheduler.schedule(QMin['ncpu'],jobs,QMin['schedule_scaling'],timings)
+    if not plan:
+        nrounds,nslots,cpu_per_run=divide_slots(QMin['ncpu'],len(jobs),QMin['schedule_scaling'])
+        return nslots,dict(zip(jobs,cpu_per_run)),jobs
+    nslots,cpu_per_run,order,makespan=plan
+    if PRINT:
+        print 'Schedule from measured runtimes (predicted: %.1f s):' % (makespan)
+        for job in order:
+            print '  %-20s %i cores' % (job,cpu_per_run[job])
+    return nslots,cpu_per_run,order
+
 # =============================================================================================== #
 
 def generate_joblist(QMin):
@@ -2087,58 +2118,50 @@ def generate_joblist(QMin):
     #print jobgrad
     #sys.exit(63)
 
+    # the jobs share the contents of QMin, hence nested entries are replaced, not modified
     schedule=[]
     QMin['nslots_pool']=[]
 
+    # runtimes of the previous steps
+    timings=scheduler.load(QMin['savedir'])
+
     # add the master calculations
-    ntasks=0
-    for i in gradjob:
-        if 'master' in i:
-            ntasks+=1
-    nrounds,nslots,cpu_per_run=divide_slots(QMin['ncpu'],ntasks,QMin['schedule_scaling'])
+    jobs=[ i for i in sorted(gradjob) if 'master' in i ]
+    nslots,cpu_per_run,order=schedule_jobs(QMin,jobs,timings)
     QMin['nslots_pool'].append(nslots)
-    schedule.append({})
-    icount=0
-    for i in sorted(gradjob):
-        if 'master' in i:
-            QMin1=deepcopy(QMin)
-            QMin1['master']=True
-            QMin1['IJOB']=int(i.split('_')[1])
-            remove=['gradmap','ncpu']
+    schedule.append(OrderedDict())
+    for i in order:
+        QMin1=dict(QMin)
+        QMin1['master']=True
+        QMin1['IJOB']=int(i.split('_')[1])
+        remove=['gradmap','ncpu']
+        for r in remove:
+            QMin1=removekey(QMin1,r)
+        QMin1['gradmap']=list(gradjob[i])
+        QMin1['ncpu']=cpu_per_run[i]
+        if 3 in QMin['multmap'][-QMin1['IJOB']] and QMin['jobs'][QMin1['IJOB']]['restr']:
+          QMin1['states']=[1]+QMin['states'][1:]
+          QMin1['states_to_do']=[1]+QMin['states_to_do'][1:]
+        schedule[-1][i]=QMin1
+
+    # add the gradient calculations
+    jobs=[ i for i in sorted(gradjob) if 'grad' in i ]
+    if len(jobs)>0:
+        nslots,cpu_per_run,order=schedule_jobs(QMin,jobs,timings)
+        QMin['nslots_pool'].append(nslots)
+        schedule.append(OrderedDict())
+        for i in order:
+            QMin1=dict(QMin)
+            mult=list(gradjob[i])[0][0]
+            QMin1['IJOB']=QMin['multmap'][mult]
+            remove=['gradmap','ncpu','h','soc','dm','overlap','ion','always_guess','always_orb_init','init']
             for r in remove:
                 QMin1=removekey(QMin1,r)
             QMin1['gradmap']=list(gradjob[i])
-            QMin1['ncpu']=cpu_per_run[icount]
-            if 3 in QMin['multmap'][-QMin1['IJOB']] and QMin['jobs'][QMin1['IJOB']]['restr']:
-              QMin1['states'][0]=1
-              QMin1['states_to_do'][0]=1
-            icount+=1
+            QMin1['ncpu']=cpu_per_run[i]
+            QMin1['gradonly']=[]
             schedule[-1][i]=QMin1
 
-    # add the gradient calculations
-    ntasks=0
-    for i in gradjob:
-        if 'grad' in i:
-            ntasks+=1
-    if ntasks>0:
-        nrounds,nslots,cpu_per_run=divide_slots(QMin['ncpu'],ntasks,QMin['schedule_scaling'])
-        QMin['nslots_pool'].append(nslots)
-        schedule.append({})
-        icount=0
-        for i in gradjob:
-            if 'grad' in i:
-                QMin1=deepcopy(QMin)
-                mult=list(gradjob[i])[0][0]
-                QMin1['IJOB']=QMin['multmap'][mult]
-                remove=['gradmap','ncpu','h','soc','dm','overlap','ion','always_guess','always_orb_init','init']
-                for r in remove:
-                    QMin1=removekey(QMin1,r)
-                QMin1['gradmap']=list(gradjob[i])
-                QMin1['ncpu']=cpu_per_run[icount]
-                QMin1['gradonly']=[]
-                icount+=1
-                schedule[-1][i]=QMin1
-
     return QMin,schedule
 
 
@@ -2160,17 +2183,24 @@ def runjobs(schedule,QMin):
         if not jobset:
             continue
         pool = Pool(processes=QMin['nslots_pool'][ijobset])
-        for job in jobset:
+        for ijob,job in enumerate(jobset):
+            if ijob>0 and QMin['delay']>0.:
+                time.sleep(QMin['delay'])
             QMin1=jobset[job]
             WORKDIR=os.path.join(QMin['scratchdir'],job)
 
-            errorcodes[job]=pool.apply_async(run_calc , [WORKDIR,QMin1])
-            time.sleep(QMin['delay'])
+            errorcodes[job]=pool.apply_async(scheduler.timed , [run_calc,WORKDIR,QMin1])
         pool.close()
         pool.join()
 
-    for i in errorcodes:
-        errorcodes[i]=errorcodes[i].get()
+    # wall times of the successful jobs, for the scheduling of the next steps
+    runtimes=[]
+    for jobset in schedule:
+        for job in jobset:
+            errorcodes[job],walltime=errorcodes[job].get()
+            if errorcodes[job]==0:
+                runtimes.append( (job,jobset[job]['ncpu'],walltime) )
+    scheduler.record(QMin['savedir'],runtimes)
     j=0
     string='Error Codes:\n'
     for i in errorcodes:
@@ -2790,35 +2820,22 @@ def get_dets_from_chk(filename,QMin):
             # get X vector
             for i in range(len(eig)):
               eig[i]=(eig[i]+eigl[i])/2.
-            # make dictionary
-            dets={}
+            # truncate vectors, only the remaining elements are put into the dictionary
             if restr:
-                for iocc in range(nocc_A):
-                    for ivirt in range(nvir_A):
-                        index=iocc*nvir_A+ivirt
-                        dets[ (iocc,ivirt,1) ]=eig[index]
+                factor=0.5
             else:
-                for iocc in range(nocc_A):
-                    for ivirt in range(nvir_A):
-                        index=iocc*nvir_A+ivirt
-                        dets[ (iocc,ivirt,1) ]=eig[index]
-                for iocc in range(nocc_B):
-                    for ivirt in range(nvir_B):
-                        index=iocc*nvir_B+ivirt + nvir_A*nocc_A
-                        dets[ (iocc,ivirt,2) ]=eig[index]
-            #pprint.pprint(dets)
-            # truncate vectors
-            norm=0.
-            for k in sorted(dets,key=lambda x: dets[x]**2,reverse=True):
-                if restr:
-                    factor=0.5
+                factor=1.
+            nexc_A=nocc_A*nvir_A
+            if restr:
+                amplitudes=list(eig[:nexc_A])
+            else:
+                amplitudes=list(eig[:nexc_A])+list(eig[nexc_A:nexc_A+nocc_B*nvir_B])
+            dets={}
+            for index in determinants.truncate(amplitudes,factor*QMin['wfthres']):
+                if index<nexc_A:
+                    dets[ (index/nvir_A,index%nvir_A,1) ]=amplitudes[index]
                 else:
-                    factor=1.
-                if norm>factor*QMin['wfthres']:
-                    del dets[k]
-                    continue
-                norm+=dets[k]**2
-            #pprint.pprint(dets)
+                    dets[ ((index-nexc_A)/nvir_B,(index-nexc_A)%nvir_B,2) ]=amplitudes[index]
             # create strings and expand singlets
             dets2={}
             if restr:
@@ -2881,41 +2898,10 @@ def get_dets_from_chk(filename,QMin):
     strings={}
     for imult,mult in enumerate(mults):
         filename=os.path.join(QMin['savedir'],'dets.%i' % mult)
-        strings[filename]=format_ci_vectors(eigenvectors[mult])
+        strings[filename]=determinants.format_ci_vectors(eigenvectors[mult],'binary_dets' in QMin)
 
     return strings
 
-# ======================================================================= #
-def format_ci_vectors(ci_vectors):
-
-    # get nstates, norb and ndets
-    alldets=set()
-    for dets in ci_vectors:
-        for key in dets:
-            alldets.add(key)
-    ndets=len(alldets)
-    nstates=len(ci_vectors)
-    norb=len(next(iter(alldets)))
-
-    string='%i %i %i\n' % (nstates,norb,ndets)
-    for det in sorted(alldets,reverse=True):
-        for o in det:
-            if o==0:
-                string+='e'
-            elif o==1:
-                string+='a'
-            elif o==2:
-                string+='b'
-            elif o==3:
-                string+='d'
-        for istate in range(len(ci_vectors)):
-            if det in ci_vectors[istate]:
-                string+=' %11.7f ' % ci_vectors[istate][det]
-            else:
-                string+=' %11.7f ' % 0.
-        string+='\n'
-    return string
-
 # ======================================================================= #
 def saveAOmatrix(WORKDIR,QMin):
     filename=os.path.join(WORKDIR,'GAUSSIAN.rwf')
@@ -3129,7 +3115,8 @@ def run_wfoverlap(QMin,errorcodes):
 
     print '>>>>>>>>>>>>> Starting the WFOVERLAP job execution'
 
-    # do Dyson calculations
+    jobs=[]
+    # collect Dyson calculations
     if 'ion' in QMin:
         for ionpair in QMin['ionmap']:
             WORKDIR=os.path.join(QMin['scratchdir'],'Dyson_%i_%i_%i_%i' % ionpair)
@@ -3138,10 +3125,9 @@ def run_wfoverlap(QMin,errorcodes):
                    'det.b': 'dets.%i' % ionpair[2],
                    'mo.a':    'mos.%i' % ionpair[1],
                    'mo.b':    'mos.%i' % ionpair[3] }
-            setupWORKDIR_WF(WORKDIR,QMin,files)
-            errorcodes['Dyson_%i_%i_%i_%i' % ionpair]=runWFOVERLAP(WORKDIR,QMin['wfoverlap'],memory=QMin['memory'],ncpu=QMin['ncpu'])
+            jobs.append(('Dyson_%i_%i_%i_%i' % ionpair,WORKDIR,files))
 
-    # do overlap calculations
+    # collect overlap calculations
     if 'overlap' in QMin:
         get_Double_AOovl(QMin)
         for m in itmult(QMin['states']):
@@ -3152,8 +3138,23 @@ def run_wfoverlap(QMin,errorcodes):
                          'det.b': 'dets.%i' % m,
                          'mo.a':    'mos.%i.old' % job,
                          'mo.b':    'mos.%i' % job }
-            setupWORKDIR_WF(WORKDIR,QMin,files)
-            errorcodes['WFOVL_%i_%i' % (m,job)]=runWFOVERLAP(WORKDIR,QMin['wfoverlap'],memory=QMin['memory'],ncpu=QMin['ncpu'])
+            jobs.append(('WFOVL_%i_%i' % (m,job),WORKDIR,files))
+
+    # run all jobs at once, the cores are distributed with the same model as for the QM jobs
+    # the memory is shared among the simultaneously running jobs
+    if jobs:
+        nrounds,nslots,cpu_per_run=divide_slots(QMin['ncpu'],len(jobs),QMin['schedule_scaling'])
+        memory=max(1,QMin['memory']/nslots)
+        if PRINT or DEBUG:
+            print 'Running %i jobs in %i slots (%i rounds)\n' % (len(jobs),nslots,nrounds)
+        pool=Pool(processes=nslots)
+        for ijob,(name,WORKDIR,files) in enumerate(jobs):
+            setupWORKDIR_WF(WORKDIR,QMin,files,cpu_per_run[ijob])
+            errorcodes[name]=pool.apply_async(runWFOVERLAP,[WORKDIR,QMin['wfoverlap'],memory,cpu_per_run[ijob]])
+        pool.close()
+        pool.join()
+        for name,WORKDIR,files in jobs:
+            errorcodes[name]=errorcodes[name].get()
 
     # Error code handling
     j=0
@@ -3175,7 +3176,7 @@ def run_wfoverlap(QMin,errorcodes):
     return errorcodes
 
 # ======================================================================= #
-def setupWORKDIR_WF(WORKDIR,QMin,files):
+def setupWORKDIR_WF(WORKDIR,QMin,files,ncpu):
     # mkdir the WORKDIR, or clean it if it exists, then copy all necessary files from pwd and savedir
 
     # setup the directory
@@ -3194,7 +3195,7 @@ ao_read=0
     if 'ion' in QMin:
         if QMin['ndocc']>0:
             inputstring+='ndocc=%i\n' % (QMin['ndocc'])
-    if QMin['ncpu']>=8:
+    if ncpu>=8:
         inputstring+='force_direct_dets\n'
     filename=os.path.join(WORKDIR,'wfovl.inp')
     writefile(filename,inputstring)
@@ -3215,18 +3216,17 @@ ao_read=0
 
 # ======================================================================= #
 def runWFOVERLAP(WORKDIR,WFOVERLAP,memory=100,ncpu=1):
-    prevdir=os.getcwd()
-    os.chdir(WORKDIR)
     string=WFOVERLAP+' -m %i' % (memory)+' -f wfovl.inp'
     stdoutfile=open(os.path.join(WORKDIR,'wfovl.out'),'w')
     stderrfile=open(os.path.join(WORKDIR,'wfovl.err'),'w')
-    os.environ['OMP_NUM_THREADS']=str(ncpu)
+    env=dict(os.environ)
+    env['OMP_NUM_THREADS']=str(ncpu)
     if PRINT or DEBUG:
         starttime=datetime.datetime.now()
         sys.stdout.write('START:\t%s\t%s\t"%s"\n' % (shorten_DIR(WORKDIR),starttime,shorten_DIR(string)))
         sys.stdout.flush()
     try:
-        runerror=sp.call(string,shell=True,stdout=stdoutfile,stderr=stderrfile)
+        runerror=sp.call(string,shell=True,cwd=WORKDIR,env=env,stdout=stdoutfile,stderr=stderrfile)
     except OSError:
         print 'Call have had some serious problems:',OSError
         sys.exit(79)
@@ -3236,7 +3236,6 @@ def runWFOVERLAP(WORKDIR,WFOVERLAP,memory=100,ncpu=1):
         endtime=datetime.datetime.now()
         sys.stdout.write('FINISH:\t%s\t%s\tRuntime: %s\tError Code: %i\n' % (shorten_DIR(WORKDIR),endtime,endtime-starttime,runerror))
         sys.stdout.flush()
-    os.chdir(prevdir)
     return runerror
 
 
@@ -4067,8 +4066,14 @@ def main():
     print datetime.datetime.now()
     print '#================ END ================#'
 
+# ======================================================================= #
+def reset_starttime():
+    # the persistent process (see interface_daemon) runs main() in a fork for each call
+    global starttime
+    starttime=datetime.datetime.now()
+
 if __name__ == '__main__':
-    main()
+    interface_daemon.run(main,reset_starttime)
 
 
 
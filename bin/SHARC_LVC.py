@@ -39,15 +39,20 @@ import sys
 import os
 import datetime
 import shutil
+import hashlib
 from copy import deepcopy
 try:
   # Importing numpy takes about 100 ms, which is ~50% of the execution time!
   import numpy
   NONUMPY=False
 except ImportError:
-  import subprocess as sp
   NONUMPY=True
 
+# shared modules in $SHARC/../lib
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.realpath(__file__)),'..','lib'))
+import eigensolver
+from qmout import write_binary
+
 print "Import: CPU time: % .3f s, wall time: %.3f s"%(time.clock() - tc, time.time() - tt)
 
 # =========================================================
@@ -363,47 +368,15 @@ def printQMout(QMin,QMout):
 # =========================================================
 # =========================================================
 # diagonalization and transformation stuff
-class diagonalizer:
-  def __init__(self):
-    exe=os.getenv('SHARC')
-    exe=os.path.expanduser(os.path.expandvars(exe))+'/diagonalizer.x'
-    if not os.path.isfile(exe):
-      print 'SHARC auxilliary diagonalizer not found at %s!' % (exe)
-      sys.exit(14)
-    self.exe=exe
-  def eigh(self,H):
-    STDIN='C %i %i\nTitle\n' % (len(H),len(H))
-    for x in H:
-      for y in x:
-        STDIN+='%20.13f %20.13f ' % (y.real,y.imag)
-      STDIN+='\n'
-    proc=sp.Popen(self.exe,stdin=sp.PIPE,stdout=sp.PIPE)
-    STDOUT=proc.communicate(input=STDIN)[0].split('\n')
-    shift=1
-    for ix in range(len(H)):
-      line=STDOUT[shift+ix].split()
-      for iy in range(len(H)):
-        assert abs(float(line[1+2*iy])) <= 1.e-10
-        H[ix][iy]=float(line[0+2*iy])
-    U=[ [ 0. for i in range(len(H)) ] for j in range(len(H)) ]
-    shift=2+len(H)
-    for ix in range(len(H)):
-      line=STDOUT[shift+ix].split()
-      for iy in range(len(H)):
-        assert abs(float(line[1+2*iy])) <= 1.e-10
-        U[ix][iy]=float(line[0+2*iy])
-    return H,U
-
 # =========================================================
 def diagonalize(A):
+  # diagonalize Hamiltonian
+  Hd,U=eigensolver.eigh(A)
   if NONUMPY:
-    diagon=diagonalizer()
+    # the LVC matrices are real symmetric
+    Hd=[ [ (Hd[i] if i==j else 0.) for j in range(len(Hd)) ] for i in range(len(Hd)) ]
+    U=[ [ x.real for x in row ] for row in U ]
   else:
-    diagon=numpy.linalg
-
-  # diagonalize Hamiltonian
-  Hd,U=diagon.eigh(A)
-  if not NONUMPY:
     Hd=numpy.diag(Hd)
 
   return Hd,U
@@ -475,6 +448,9 @@ def writeQMout(QMin,QMout,QMinfilename):
     outfilename=QMinfilename+'.out'
   else:
     outfilename=QMinfilename[:k]+'.out'
+  if 'binary' in QMin:
+    writeQMoutbinary(QMin,QMout,outfilename)
+    return
   if PRINT:
     print '===> Writing output to file %s in SHARC Format\n' % (outfilename)
   string=''
@@ -517,6 +493,36 @@ def writeQMout(QMin,QMout,QMinfilename):
       print 'WARNING: Could not write QM output backup!'
   return
 
+# ======================================================================= #
+def writeQMoutbinary(QMin,QMout,outfilename):
+  '''Writes the requested quantities to outfilename in the binary QM.out format (see $SHARC/../lib/qmout.py).
+
+  Arguments:
+  1 dictionary: QMin
+  2 dictionary: QMout
+  3 string: outfilename'''
+
+  if PRINT:
+    print '===> Writing output to file %s in binary SHARC Format\n' % (outfilename)
+  sections={'runtime': QMout['runtime']}
+  if 'h' in QMin or 'soc' in QMin:
+    sections['h']=QMout['h']
+  for key in ['dm','angular','grad','nacdr','overlap','dmdr']:
+    if key in QMin:
+      sections[key]=QMout[key]
+  if 'ion' in QMin:
+    sections['prop']=QMout['prop']
+  try:
+    write_binary(outfilename,sections,QMin['nmstates'],QMin['natom'])
+  except IOError:
+    print 'Could not write QM output!'
+    sys.exit(15)
+  if 'backup' in QMin:
+    try:
+      shutil.copy(outfilename,QMin['backup']+'/'+outfilename)
+    except IOError:
+      print 'WARNING: Could not write QM output backup!'
+
 # ======================================================================= #
 def writeQMoutsoc(QMin,QMout):
   '''Generates a string with the Spin-Orbit Hamiltonian in SHARC format.
@@ -889,12 +895,17 @@ def read_QMin():
   if 'init' in QMin:
     checkscratch(QMin['savedir'])
   if not 'init' in QMin and not 'samestep' in QMin and not 'restart' in QMin:
-    fromfile=os.path.join(QMin['savedir'],'U.out')
-    if not os.path.isfile(fromfile):
+    # U.npy is written if numpy is available, U.out otherwise (or by older versions)
+    found=False
+    for fname in ['U.npy','U.out']:
+      fromfile=os.path.join(QMin['savedir'],fname)
+      if os.path.isfile(fromfile):
+        tofile=os.path.join(QMin['savedir'],fname.replace('U.','Uold.'))
+        shutil.copy(fromfile,tofile)
+        found=True
+    if not found:
       print 'ERROR: savedir does not contain U.out! Maybe you need to add "init" to QM.in.'
       sys.exit(17)
-    tofile=os.path.join(QMin['savedir'],'Uold.out')
-    shutil.copy(fromfile,tofile)
 
 
   # find forbidden keywords and optional keywords
@@ -911,6 +922,8 @@ def read_QMin():
     if 'dmdr' in s[0]:
       print 'DMDR is not supported!'
       sys.exit(19)
+    if s[0]=='binary':
+      QMin['binary']=[]
 
   QMin['pwd']=os.getcwd()
   return QMin
@@ -960,18 +973,15 @@ def read_V0(QMin, SH2LVC, fname='V0.txt'):
   v0=f.readlines()
   f.close()
 
-  # read the coordinates and compute Cartesian displacements
-  disp=[] # displacement as one 3N-vector
+  # read the reference coordinates
+  SH2LVC['labels']=[] # atom labels
+  SH2LVC['CEq']=[] # reference geometry as one 3N-vector
   SH2LVC['Ms']=[] # Squareroot masses in a.u.
-  geom = QMin['geom']
   tmp = find_lines(QMin['natom'], 'Geometry',v0)
   for i in range(QMin['natom']):
     s=tmp[i].lower().split()
-    if s[0]!=geom[i][0].lower():
-      print s[0], geom[i][0]
-      print 'Inconsistent atom labels in QM.in and %s!'%fname
-      sys.exit(21)
-    disp += [geom[i][1] - float(s[2]), geom[i][2] - float(s[3]), geom[i][3] - float(s[4])]
+    SH2LVC['labels'].append(s[0])
+    SH2LVC['CEq'] += [float(s[2]), float(s[3]), float(s[4])]
     SH2LVC['Ms'] += 3*[(float(s[5])*U_TO_AMU)**.5]
 
   # Frequencies (a.u.)
@@ -988,8 +998,76 @@ def read_V0(QMin, SH2LVC, fname='V0.txt'):
     sys.exit(23)
   SH2LVC['V']  = [map(float,line.split()) for line in tmp] # transformation matrix
 
+  return get_displacement(QMin, SH2LVC, fname)
+
+# =========================================================
+def get_displacement(QMin, SH2LVC, fname='V0.txt'):
+  """
+  Checks the atom labels of QM.in against the reference geometry.
+  Returns the Cartesian displacement as one 3N-vector.
+  """
+  disp=[]
+  geom = QMin['geom']
+  for i in range(QMin['natom']):
+    if SH2LVC['labels'][i]!=geom[i][0].lower():
+      print SH2LVC['labels'][i], geom[i][0]
+      print 'Inconsistent atom labels in QM.in and %s!'%fname
+      sys.exit(21)
+    disp += [geom[i][j+1] - SH2LVC['CEq'][3*i+j] for j in range(3)]
   return disp
 
+# =========================================================
+def LVC_cachefile(fname, sh2lvc):
+  """
+  Returns the path of the binary parameter cache for the given template.
+  The cache is keyed by the content hash of the template and the V0 file.
+  """
+  h=hashlib.sha1()
+  h.update(''.join(sh2lvc))
+  try:
+    f=open(sh2lvc[0].strip())
+    h.update(f.read())
+    f.close()
+  except IOError:
+    return None
+  return os.path.join(os.path.dirname(os.path.abspath(fname)), 'LVC.cache.%s.npz' % (h.hexdigest()))
+
+# =========================================================
+def write_LVC_cache(cachefile, SH2LVC):
+  """
+  Writes all geometry-independent LVC arrays to a .npz file.
+  The file is written under a temporary name and renamed, so that concurrent trajectories never read a partial cache.
+  """
+  arrays={}
+  for key in ['labels', 'CEq', 'Ms', 'Om', 'V', 'W', 'dipole', 'soc']:
+    arrays[key]=numpy.asarray(SH2LVC[key])
+  for key in ['H0', 'dHQ', 'dHcart']:
+    for imult, a in enumerate(SH2LVC[key]):
+      arrays['%s_%i' % (key,imult)]=a
+  tmpfile='%s.%i.tmp' % (cachefile,os.getpid())
+  try:
+    f=open(tmpfile,'wb')
+    numpy.savez(f, **arrays)
+    f.close()
+    os.rename(tmpfile,cachefile)
+  except (IOError, OSError):
+    print 'WARNING: Could not write LVC parameter cache %s!' % (cachefile)
+
+# =========================================================
+def read_LVC_cache(cachefile, states):
+  """
+  Reads the geometry-independent LVC arrays written by write_LVC_cache.
+  """
+  data=numpy.load(cachefile)
+  SH2LVC={}
+  for key in ['CEq', 'Ms', 'Om', 'V', 'W', 'dipole', 'soc']:
+    SH2LVC[key]=data[key]
+  SH2LVC['labels']=[ str(l) for l in data['labels'] ]
+  for key in ['H0', 'dHQ', 'dHcart']:
+    SH2LVC[key]=[ data['%s_%i' % (key,imult)] for imult in range(len(states)) ]
+  data.close()
+  return SH2LVC
+
 # =========================================================
 
 def read_SH2LVC(QMin, fname='LVC.template'):
@@ -1004,40 +1082,26 @@ def read_SH2LVC(QMin, fname='LVC.template'):
       print 'Input file "LVC.template" not found.'
       sys.exit(24)
   sh2lvc=f.readlines()
+  fname=f.name
   f.close()
 
-  disp = read_V0(QMin, SH2LVC, sh2lvc[0].strip())
-
   # check nstates
   states=[int(s) for s in sh2lvc[1].split()]
   if not states==QMin['states']:
     print 'states from QM.in and nstates from LVC.template are inconsistent!', QMin['states'], states
     sys.exit(25)
-  nstates = QMin['nstates']
   nmstates = QMin['nmstates']
-  nmult = len(states)
-  r3N = range(3*QMin['natom'])
-  Om = SH2LVC['Om']
 
-  # Transform the coordinates to dimensionless mass-weighted normal modes
-  MR = [SH2LVC['Ms'][i] * disp[i] for i in r3N]
-  MRV = [0. for i in r3N]
-  for i in r3N:
-    MRV[i] = sum(MR[j] * SH2LVC['V'][j][i] for j in r3N)
-  Q =  [MRV[i] * Om[i]**0.5 for i in r3N]
-
-  # Compute the ground state potential and gradient
-  V0 = sum(0.5 * Om[i] * Q[i]*Q[i] for i in r3N)
-  HMCH =  [[[0. for istate in range(states[imult])] for jstate in range(states[imult])] for imult in range(nmult)]
-  for imult in range(nmult):
-    for istate in range(states[imult]):
-      HMCH[imult][istate][istate] = V0
+  # use the binary parameter cache, if it was already built for this template
+  if not NONUMPY:
+    cachefile = LVC_cachefile(fname, sh2lvc)
+    if cachefile and os.path.isfile(cachefile):
+      SH2LVC = read_LVC_cache(cachefile, states)
+      disp = get_displacement(QMin, SH2LVC, sh2lvc[0].strip())
+      build_LVC_arrays(SH2LVC, numpy.array(disp))
+      return SH2LVC, QMin
 
-  dHMCH = [[[[0. for istate in range(states[imult])] for jstate in range(states[imult])] for imult in range(nmult)] for i in r3N]
-  for i in r3N:
-    for imult in range(nmult):
-      for istate in range(states[imult]):
-        dHMCH[i][imult][istate][istate] = Om[i] * Q[i]
+  disp = read_V0(QMin, SH2LVC, sh2lvc[0].strip())
 
   # Add the vertical energies (epsilon)
   # Enter in separate lines as:
@@ -1045,20 +1109,15 @@ def read_SH2LVC(QMin, fname='LVC.template'):
   # <mult> <state> <epsilon>
   # <mult> <state> <epsilon>
 
+  eps = []
   tmp = find_lines(1, 'epsilon',sh2lvc)
   if not tmp==[]:
-    eps = []
     neps = int(tmp[0])
     tmp = find_lines(neps+1, 'epsilon', sh2lvc)
     for line in tmp[1:]:
       words = line.split()
       eps.append((int(words[0])-1, int(words[1])-1, float(words[-1])))
-
-    for e in eps:
-      (imult, istate, val) = e
-      HMCH[imult][istate][istate] += val
-
-  #for imult in range(nmult): print numpy.array(HMCH[imult])
+  SH2LVC['epsilon'] = eps
 
   # Add the intrastate LVC constants (kappa)
   # Enter in separate lines as:
@@ -1066,19 +1125,15 @@ def read_SH2LVC(QMin, fname='LVC.template'):
   # <mult> <state> <mode> <kappa>
   # <mult> <state> <mode> <kappa>
 
+  kappa = []
   tmp = find_lines(1, 'kappa', sh2lvc)
   if not tmp==[]:
-    kappa = []
     nkappa = int(tmp[0])
     tmp = find_lines(nkappa+1, 'kappa', sh2lvc)
     for line in tmp[1:]:
       words = line.split()
       kappa.append((int(words[0])-1, int(words[1])-1, int(words[2])-1, float(words[-1])))
-
-    for k in kappa:
-      (imult, istate, i, val) = k
-      HMCH[imult][istate][istate]  += val * Q[i]
-      dHMCH[i][imult][istate][istate] += val
+  SH2LVC['kappa'] = kappa
 
   # Add the interstate LVC constants (lambda)
   # Enter in separate lines as:
@@ -1086,24 +1141,15 @@ def read_SH2LVC(QMin, fname='LVC.template'):
   # <mult> <state1> <state2> <mode> <lambda>
   # <mult> <state1> <state2> <mode> <lambda>
 
+  lam = []
   tmp = find_lines(1, 'lambda', sh2lvc)
   if not tmp==[]:
-    lam = []
     nlam = int(tmp[0])
     tmp = find_lines(nlam+1, 'lambda', sh2lvc)
     for line in tmp[1:]:
       words = line.split()
       lam.append((int(words[0])-1, int(words[1])-1, int(words[2])-1, int(words[3])-1, float(words[-1])))
-
-    for l in lam:
-      (imult, istate, jstate, i, val) = l
-      HMCH[imult][istate][jstate]  += val * Q[i]
-      HMCH[imult][jstate][istate]  += val * Q[i]
-      dHMCH[i][imult][istate][jstate] += val
-      dHMCH[i][imult][jstate][istate] += val
-
-  SH2LVC['H']  = HMCH
-  SH2LVC['dH'] = dHMCH
+  SH2LVC['lambda'] = lam
 
   SH2LVC['dipole'] = {}
   SH2LVC['dipole'][1]= read_LVC_mat(nmstates, 'DMX', sh2lvc)
@@ -1113,13 +1159,192 @@ def read_SH2LVC(QMin, fname='LVC.template'):
   # obtain the SOC matrix
   SH2LVC['soc'] = read_LVC_mat(nmstates, 'SOC', sh2lvc)
 
+  if NONUMPY:
+    build_LVC_lists(QMin, SH2LVC, disp)
+  else:
+    for key in ['CEq', 'Ms', 'Om', 'V', 'soc']:
+      SH2LVC[key] = numpy.array(SH2LVC[key])
+    SH2LVC['dipole'] = numpy.array([ SH2LVC['dipole'][idir+1] for idir in range(3) ])
+    setup_LVC_arrays(SH2LVC, states)
+    if cachefile:
+      write_LVC_cache(cachefile, SH2LVC)
+    build_LVC_arrays(SH2LVC, numpy.array(disp))
+
   return SH2LVC, QMin
 
+# =========================================================
+def build_LVC_lists(QMin, SH2LVC, disp):
+  '''Computes the diabatic Hamiltonian and its normal mode derivatives 
+  as nested lists (used if numpy is not available).'''
+
+  states = QMin['states']
+  nmult = len(states)
+  r3N = range(3*QMin['natom'])
+  Om = SH2LVC['Om']
+
+  # Transform the coordinates to dimensionless mass-weighted normal modes
+  MR = [SH2LVC['Ms'][i] * disp[i] for i in r3N]
+  MRV = [0. for i in r3N]
+  for i in r3N:
+    MRV[i] = sum(MR[j] * SH2LVC['V'][j][i] for j in r3N)
+  Q =  [MRV[i] * Om[i]**0.5 for i in r3N]
+
+  # Compute the ground state potential and gradient
+  V0 = sum(0.5 * Om[i] * Q[i]*Q[i] for i in r3N)
+  HMCH =  [[[0. for istate in range(states[imult])] for jstate in range(states[imult])] for imult in range(nmult)]
+  for imult in range(nmult):
+    for istate in range(states[imult]):
+      HMCH[imult][istate][istate] = V0
+
+  dHMCH = [[[[0. for istate in range(states[imult])] for jstate in range(states[imult])] for imult in range(nmult)] for i in r3N]
+  for i in r3N:
+    for imult in range(nmult):
+      for istate in range(states[imult]):
+        dHMCH[i][imult][istate][istate] = Om[i] * Q[i]
+
+  for (imult, istate, val) in SH2LVC['epsilon']:
+    HMCH[imult][istate][istate] += val
+
+  for (imult, istate, i, val) in SH2LVC['kappa']:
+    HMCH[imult][istate][istate]  += val * Q[i]
+    dHMCH[i][imult][istate][istate] += val
+
+  for (imult, istate, jstate, i, val) in SH2LVC['lambda']:
+    HMCH[imult][istate][jstate]  += val * Q[i]
+    HMCH[imult][jstate][istate]  += val * Q[i]
+    dHMCH[i][imult][istate][jstate] += val
+    dHMCH[i][imult][jstate][istate] += val
+
+  SH2LVC['H']  = HMCH
+  SH2LVC['dH'] = dHMCH
+
+# =========================================================
+def setup_LVC_arrays(SH2LVC, states):
+  '''Precomputes all geometry-independent arrays of the LVC model.
+
+  Adds to SH2LVC:
+  'W'     : transformation from dimensionless normal mode derivatives to Cartesian gradients (3N x 3N)
+  'H0'    : list over multiplicities of diagonal epsilon matrices (n x n)
+  'dHQ'   : list over multiplicities of kappa/lambda matrices in normal mode coordinates (3N x n x n)
+  'dHcart': list over multiplicities of kappa/lambda matrices in Cartesian coordinates (3N x n x n)'''
+
+  Om = SH2LVC['Om']
+  r3N = len(Om)
+  sqOm = numpy.where(numpy.abs(Om) > 1.e-8, numpy.sqrt(numpy.abs(Om)), 0.)
+  SH2LVC['W'] = sqOm[:,None] * SH2LVC['V'].T * SH2LVC['Ms'][None,:]
+  H0 = [ numpy.zeros((n, n)) for n in states ]
+  dHQ = [ numpy.zeros((r3N, n, n)) for n in states ]
+  for (imult, istate, val) in SH2LVC['epsilon']:
+    H0[imult][istate, istate] += val
+  for (imult, istate, i, val) in SH2LVC['kappa']:
+    dHQ[imult][i, istate, istate] += val
+  for (imult, istate, jstate, i, val) in SH2LVC['lambda']:
+    dHQ[imult][i, istate, jstate] += val
+    dHQ[imult][i, jstate, istate] += val
+  SH2LVC['H0'] = H0
+  SH2LVC['dHQ'] = dHQ
+  SH2LVC['dHcart'] = [ numpy.tensordot(SH2LVC['W'], dH, axes=(0, 0)) for dH in dHQ ]
+
+# =========================================================
+def build_LVC_arrays(SH2LVC, disp):
+  '''Computes the diabatic Hamiltonian of each multiplicity and the Cartesian gradient of the ground state potential for the displacement vector disp.'''
+
+  Om = SH2LVC['Om']
+
+  # Transform the coordinates to dimensionless mass-weighted normal modes
+  Q = numpy.dot(SH2LVC['Ms'] * disp, SH2LVC['V']) * numpy.sqrt(Om)
+
+  # Compute the ground state potential and gradient
+  V0 = 0.5 * numpy.dot(Om * Q, Q)
+  SH2LVC['gradV0'] = numpy.dot(Om * Q, SH2LVC['W'])
+
+  # Add epsilon and the kappa/lambda terms
+  SH2LVC['H'] = [ H0 + V0 * numpy.eye(len(H0)) + numpy.tensordot(Q, dHQ, axes=1) for H0, dHQ in zip(SH2LVC['H0'], SH2LVC['dHQ']) ]
+
 # ============================================================================
 # ============================================================================
 # ============================================================================
 def getQMout(QMin,SH2LVC):
-  '''Calculates the MCH Hamiltonian, SOC matrix ,overlap matrix, gradients, DM'''
+  '''Calculates the MCH Hamiltonian, SOC matrix ,overlap matrix, gradients, DM
+
+  Each multiplicity block is diagonalized once and the derivative matrices of all 3N Cartesian coordinates are transformed in one batched product. The results are then replicated over the Ms components.'''
+
+  if NONUMPY:
+    return getQMout_nonumpy(QMin,SH2LVC)
+
+  QMout={}
+
+  states = QMin['states']
+  nmstates = QMin['nmstates']
+  natom = QMin['natom']
+  r3N = 3*natom
+
+  # Diagonalize Hamiltonian and expand to the full ms-basis
+  U  = numpy.zeros((nmstates, nmstates))
+  Hd = numpy.zeros(nmstates)
+  grad = numpy.zeros((nmstates, r3N))
+  if 'nacdr' in QMin:
+    nacdr = numpy.zeros((nmstates, nmstates, r3N))
+  offs = 0
+  for imult, dim in enumerate(states):
+    if dim == 0:
+      continue
+    Hdtmp, Utmp = numpy.linalg.eigh(SH2LVC['H'][imult])
+    # all Cartesian derivative matrices in the MCH basis
+    dE = numpy.matmul(Utmp.T, numpy.matmul(SH2LVC['dHcart'][imult], Utmp))
+    dE += SH2LVC['gradV0'][:,None,None] * numpy.eye(dim)[None,:,:]
+    dE = dE.transpose(1, 2, 0)
+    if 'nacdr' in QMin:
+      dEn = Hdtmp[None,:] - Hdtmp[:,None]
+      numpy.fill_diagonal(dEn, numpy.inf)
+      nac = dE / dEn[:,:,None]
+    for ms in range(imult+1):
+      block = slice(offs, offs+dim)
+      Hd[block] = Hdtmp
+      U[block, block] = Utmp
+      grad[block] = dE[numpy.arange(dim), numpy.arange(dim)]
+      if 'nacdr' in QMin:
+        nacdr[block, block] = nac
+      offs += dim
+
+  QMout['grad'] = grad.reshape(nmstates, natom, 3)
+  if 'nacdr' in QMin:
+    QMout['nacdr'] = nacdr.reshape(nmstates, nmstates, natom, 3)
+
+  # transform dipole matrices
+  dipole = numpy.matmul(U.T, numpy.matmul(SH2LVC['dipole'], U))
+
+  # get overlap matrix
+  if 'overlap' in QMin:
+      if 'init' in QMin:
+        overlap = numpy.eye(nmstates)
+      else:
+        Uoldfile=os.path.join(QMin['savedir'],'Uold.npy')
+        if os.path.isfile(Uoldfile):
+          Uold = numpy.load(Uoldfile)
+        else:
+          Uold = numpy.loadtxt(os.path.join(QMin['savedir'],'Uold.out'), ndmin=2)
+        overlap = numpy.dot(Uold.T,U)
+      QMout['overlap']=overlap
+
+  numpy.save(os.path.join(QMin['savedir'],'U.npy'), U)
+
+  # transform SOC matrix
+  SO=transform(SH2LVC['soc'],U)
+  numpy.fill_diagonal(SO, 0.)
+  Hfull=(numpy.diag(Hd)+SO).T
+
+  # assign QMout elements
+  QMout['h']=Hfull
+  QMout['dm']=dipole
+  #QMout['dmdr']=dmdr
+  QMout['runtime']=0.
+
+  return QMout
+
+# ============================================================================
+def getQMout_nonumpy(QMin,SH2LVC):
+  '''Calculates the MCH Hamiltonian, SOC matrix ,overlap matrix, gradients, DM (with nested lists, if numpy is not available)'''
 
   QMout={}
 
@@ -1162,11 +1387,8 @@ def getQMout(QMin,SH2LVC):
     for iQ in r3N:
       if abs(SH2LVC['Om'][iQ]) > 1.e-8:
         OdE[iQ] = dE[istate][istate][iQ] * SH2LVC['Om'][iQ]**0.5
-    if NONUMPY:
-      for iQ in r3N:
-        VOdE[iQ] = sum(SH2LVC['V'][iQ][jQ] * OdE[jQ] for jQ in r3N)
-    else:
-      VOdE = numpy.dot(SH2LVC['V'], OdE)
+    for iQ in r3N:
+      VOdE[iQ] = sum(SH2LVC['V'][iQ][jQ] * OdE[jQ] for jQ in r3N)
 
     grad.append([])
     for iat in range(QMin['natom']):
@@ -1189,11 +1411,8 @@ def getQMout(QMin,SH2LVC):
           for iQ in r3N:
             if abs(SH2LVC['Om'][iQ]) > 1.e-8:
               OdE[iQ] = dE[istate][jstate][iQ] * SH2LVC['Om'][iQ]**0.5
-          if NONUMPY:
-            for iQ in r3N:
-              VOdE[iQ] = sum(SH2LVC['V'][iQ][jQ] * OdE[jQ] for jQ in r3N)
-          else:
-            VOdE = numpy.dot(SH2LVC['V'], OdE)
+          for iQ in r3N:
+            VOdE[iQ] = sum(SH2LVC['V'][iQ][jQ] * OdE[jQ] for jQ in r3N)
 
           deriv = []
           for iat in range(QMin['natom']):
@@ -1217,15 +1436,12 @@ def getQMout(QMin,SH2LVC):
         overlap = [ [ float(i==j) for i in range(QMin['nmstates']) ] for j in range(QMin['nmstates']) ]
       else:
         Uold = [[float(v) for v in line.split()] for line in open(Uoldfile, 'r').readlines()]
-        if NONUMPY:
-          overlap = [ [ 0. for i in range(QMin['nmstates']) ] for j in range(QMin['nmstates']) ]
-          rS = range(QMin['nmstates'])
-          for a in rS:
-            for b in rS:
-              for i in rS:
-                overlap[a][b]+=Uold[i][a]*U[i][b]
-        else:
-          overlap = numpy.dot(numpy.array(Uold).T,U)
+        overlap = [ [ 0. for i in range(QMin['nmstates']) ] for j in range(QMin['nmstates']) ]
+        rS = range(QMin['nmstates'])
+        for a in rS:
+          for b in rS:
+            for i in rS:
+              overlap[a][b]+=Uold[i][a]*U[i][b]
       QMout['overlap']=overlap
 
 
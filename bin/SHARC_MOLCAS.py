@@ -98,6 +98,11 @@ import itertools
 # write debug traces when in pool threads
 import traceback
 
+# shared modules in $SHARC/../lib
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.realpath(__file__)),'..','lib'))
+import determinants
+import interface_daemon
+
 
 # =========================================================0
 # compatibility stuff
@@ -2924,7 +2929,8 @@ def runMOLCAS(WORKDIR,MOLCAS,ncpu,strip=False):
 # ======================================================================= #
 def doDisplacement(QMin,idir,displ):
     iatom,ixyz,isign=tuple(idir)
-    QMin1=deepcopy(QMin)
+    QMin1=dict(QMin)
+    QMin1['geo']=[list(atom) for atom in QMin['geo']]
     QMin1['geo'][iatom][ixyz+1]+=isign*displ
     return QMin1
 
@@ -2980,12 +2986,13 @@ def generate_joblist(QMin):
     '''split the full job into subtasks, each with a QMin dict, a WORKDIR
     structure: joblist = [ {WORKDIR: QMin, ..}, {..}, .. ]
     each element of the joblist is a set of jobs, 
-    and all jobs from the first set need to be completed before the second set can be processed.'''
+    and all jobs from the first set need to be completed before the second set can be processed.
+    the jobs share the contents of QMin, hence nested entries are replaced, not modified.'''
 
     joblist=[]
     if QMin['gradmode']==0:
         # case of serial gradients on one cpu
-        QMin1=deepcopy(QMin)
+        QMin1=dict(QMin)
         QMin1['master']=[]
         if 'ion' in QMin:
             QMin1['keepintegrals']=[]
@@ -3002,7 +3009,7 @@ def generate_joblist(QMin):
 
         # we will do wavefunction and dm, soc, overlap always first
         # afterwards we will do all gradients and nacdr asynchonously
-        QMin1=deepcopy(QMin)
+        QMin1=dict(QMin)
         QMin1['master']=[]
         QMin1['keepintegrals']=[]
         QMin1['gradmap']=[]
@@ -3016,7 +3023,7 @@ def generate_joblist(QMin):
         QMin['nslots_pool']=[1]
         joblist.append({'master':QMin1})
 
-        QMin2=deepcopy(QMin)
+        QMin2=dict(QMin)
         remove=['h','soc','dm','always_guess','always_orb_init','comment','ncpu','init','veloc','overlap','ion']
         for r in remove:
             QMin2=removekey(QMin2,r)
@@ -3036,14 +3043,14 @@ def generate_joblist(QMin):
         joblist.append({})
         icount=0
         for grad in QMin['gradmap']:
-            QMin3=deepcopy(QMin2)
+            QMin3=dict(QMin2)
             QMin3['gradmap']=[grad]
             QMin3['nacmap']=[]
             QMin3['ncpu']=cpu_per_run[icount]
             icount+=1
             joblist[-1]['grad_%i_%i' % grad]=QMin3
         for nac in QMin['nacmap']:
-            QMin3=deepcopy(QMin2)
+            QMin3=dict(QMin2)
             QMin3['nacmap']=[nac]
             QMin3['gradmap']=[]
             QMin3['ncpu']=cpu_per_run[icount]
@@ -3056,7 +3063,7 @@ def generate_joblist(QMin):
         # if only energy gradients:
         # -> do central point first, and n-1 displacements in parallel
         # -> do all other displacements afterwards
-        QMin1=deepcopy(QMin)
+        QMin1=dict(QMin)
         QMin1['master']=[]
         if 'ion' in QMin:
             QMin1['keepintegrals']=[]
@@ -3080,7 +3087,7 @@ def generate_joblist(QMin):
         QMin['nslots_pool']=[1]
         joblist.append({'master':QMin1})
 
-        QMin2=deepcopy(QMin)
+        QMin2=dict(QMin)
         remove=['comment','ncpu','veloc','grad','h','soc','dm','overlap','socdr','dmdr','ion']
         for r in remove:
             QMin2=removekey(QMin2,r)
@@ -3110,8 +3117,7 @@ def generate_joblist(QMin):
                     #idispl+=1
                     #if idispl==QMin['ncpu']:
                         #joblist.append({})
-                    QMin3=deepcopy(QMin2)
-                    QMin3=doDisplacement(QMin3,[iatom,ixyz,isign],QMin['displ'])
+                    QMin3=doDisplacement(QMin2,[iatom,ixyz,isign],QMin['displ'])
 
                     #if 'socdr' in QMin or 'dmdr' in QMin or idispl>QMin['ncpu']:
                     QMin3['displacement']=[]
@@ -3179,13 +3185,14 @@ def runjobs(joblist,QMin):
         if not jobset:
             continue
         pool = Pool(processes=QMin['nslots_pool'][ijobset])
-        for job in jobset:
+        for ijob,job in enumerate(jobset):
+            if ijob>0 and QMin['delay']>0.:
+                time.sleep(QMin['delay'])
             QMin1=jobset[job]
             WORKDIR=os.path.join(QMin['scratchdir'],job)
 
             errorcodes[job]=pool.apply_async(run_calc , [WORKDIR,QMin1])
             #errorcodes[job]=run_calc(WORKDIR,QMin1)
-            time.sleep(QMin['delay'])
         pool.close()
         pool.join()
 
@@ -3851,56 +3858,24 @@ def get_determinants(out,mult):
 
 # ======================================================================= #
 def format_ci_vectors(ci_vectors):
-    # get nstates, norb and ndets
-    for key in ci_vectors:
-        if key!='ndocc' and key!='nvirt':
-            nstates=len(ci_vectors[key])
-            norb=len(key)
-    ndets=len(ci_vectors)-2
-    ndocc=ci_vectors['ndocc']
-    nvirt=ci_vectors['nvirt']
-
-    # sort determinant strings
-    dets=[]
-    for key in ci_vectors:
-        if key!='ndocc' and key!='nvirt':
-            dets.append(key)
-    dets.sort(reverse=True)
-
-    string='%i %i %i\n' % (nstates,norb+ndocc+nvirt,ndets)
-    for det in dets:
-        for i in range(ndocc):
-            string+='d'
-        for o in det:
-            if o==0:
-                string+='e'
-            elif o==1:
-                string+='a'
-            elif o==2:
-                string+='b'
-            elif o==3:
-                string+='d'
-        for i in range(nvirt):
-            string+='e'
-        for c in ci_vectors[det]:
-            string+=' %16.12f ' % c
-        string+='\n'
-    return string
+    # ci_vectors contains the coefficients of all states for each determinant,
+    # and the numbers of doubly occupied and empty orbitals which are not part of the determinants
+    table=dict([ (key,ci_vectors[key]) for key in ci_vectors if key!='ndocc' and key!='nvirt' ])
+    return determinants.from_table(table,ci_vectors['ndocc'],ci_vectors['nvirt']).text(' %16.12f ')
 
 # ======================================================================= #
 def runWFOVERLAPS(WORKDIR,wfoverlaps,memory=100,ncpu=1):
-    prevdir=os.getcwd()
-    os.chdir(WORKDIR)
     string=wfoverlaps+' -m %i' % (memory) +' -f dyson.in'
     stdoutfile=open(os.path.join(WORKDIR,'dyson.out'),'w')
     stderrfile=open(os.path.join(WORKDIR,'dyson.err'),'w')
-    os.environ['OMP_NUM_THREADS']=str(ncpu)
+    env=dict(os.environ)
+    env['OMP_NUM_THREADS']=str(ncpu)
     if PRINT or DEBUG:
         starttime=datetime.datetime.now()
         sys.stdout.write('START:\t%s\t%s\t"%s"\n' % (WORKDIR,starttime,string))
         sys.stdout.flush()
     try:
-        runerror=sp.call(string,shell=True,stdout=stdoutfile,stderr=stderrfile)
+        runerror=sp.call(string,shell=True,cwd=WORKDIR,env=env,stdout=stdoutfile,stderr=stderrfile)
     except OSError:
         print 'Call have had some serious problems:',OSError
         sys.exit(85)
@@ -3910,7 +3885,6 @@ def runWFOVERLAPS(WORKDIR,wfoverlaps,memory=100,ncpu=1):
         endtime=datetime.datetime.now()
         sys.stdout.write('FINISH:\t%s\t%s\tRuntime: %s\tError Code: %i\n' % (WORKDIR,endtime,endtime-starttime,runerror))
         sys.stdout.flush()
-    os.chdir(prevdir)
     return runerror
 
 # ======================================================================= #
@@ -4017,12 +3991,20 @@ same_aos
         #string+='\nndocc=%i\n' % (frozen)
         writefile(inputfile,string)
 
-    # run the jobs subsequently with full number of CPUs
+    # run the jobs simultaneously, the cores are distributed with the same model as for the MOLCAS jobs
+    # the memory is shared among the simultaneously running jobs
     errorcodes={}
-    for pair in mult_pairs:
-        path=os.path.join(QMin['scratchdir'],'Dyson_%i_%i' % (pair[0],pair[1]))
-        runerror=runWFOVERLAPS(path,QMin['wfoverlap'],QMin['memory'],QMin['ncpu'])
-        errorcodes['Dyson_%i_%i' % (pair[0],pair[1])]=runerror
+    if mult_pairs:
+        nrounds,nslots,cpu_per_run=divide_slots(QMin['ncpu'],len(mult_pairs),QMin['schedule_scaling'])
+        memory=max(1,QMin['memory']/nslots)
+        pool=Pool(processes=nslots)
+        for ipair,pair in enumerate(mult_pairs):
+            path=os.path.join(QMin['scratchdir'],'Dyson_%i_%i' % (pair[0],pair[1]))
+            errorcodes['Dyson_%i_%i' % (pair[0],pair[1])]=pool.apply_async(runWFOVERLAPS,[path,QMin['wfoverlap'],memory,cpu_per_run[ipair]])
+        pool.close()
+        pool.join()
+        for i in errorcodes:
+            errorcodes[i]=errorcodes[i].get()
     if PRINT:
         string='\n  '+'='*40+'\n'
         string+='||'+' '*40+'||\n'
@@ -4159,8 +4141,14 @@ def main():
     if PRINT or DEBUG:
         print '#================ END ================#'
 
+# ======================================================================= #
+def reset_starttime():
+    # the persistent process (see interface_daemon) runs main() in a fork for each call
+    global starttime
+    starttime=datetime.datetime.now()
+
 if __name__ == '__main__':
-    main()
+    interface_daemon.run(main,reset_starttime)
 
 
 
@@ -53,6 +53,10 @@ import itertools
 from multiprocessing import Pool
 import time
 
+# shared modules in $SHARC/../lib
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.realpath(__file__)),'..','lib'))
+import determinants
+
 
 # =========================================================0
 # compatibility stuff
@@ -3543,42 +3547,10 @@ def decompose_csf(ms2,step):
 
 # ======================================================================= #
 def format_ci_vectors(ci_vectors):
-  # get nstates, norb and ndets
-  for key in ci_vectors:
-    if key!='ndocc' and key!='nvirt':
-      nstates=len(ci_vectors[key])
-      norb=len(key)
-      break
-  ndets=len(ci_vectors)-2
-  ndocc=ci_vectors['ndocc']
-  nvirt=ci_vectors['nvirt']
-
-  # sort determinant strings
-  dets=[]
-  for key in ci_vectors:
-    if key!='ndocc' and key!='nvirt':
-      dets.append(key)
-  dets.sort(reverse=True)
-
-  string='%i %i %i\n' % (nstates,norb+ndocc+nvirt,ndets)
-  for det in dets:
-    for i in range(ndocc):
-      string+='d'
-    for o in det:
-      if o==0:
-        string+='e'
-      elif o==1:
-        string+='a'
-      elif o==2:
-        string+='b'
-      elif o==3:
-        string+='d'
-    for i in range(nvirt):
-      string+='e'
-    for c in ci_vectors[det]:
-      string+=' %16.12f ' % c
-    string+='\n'
-  return string
+  # ci_vectors contains the coefficients of all states for each determinant,
+  # and the numbers of doubly occupied and empty orbitals which are not part of the determinants
+  table=dict([ (key,ci_vectors[key]) for key in ci_vectors if key!='ndocc' and key!='nvirt' ])
+  return determinants.from_table(table,ci_vectors['ndocc'],ci_vectors['nvirt']).text(' %16.12f ')
 
 # =============================================================================================== #
 # =============================================================================================== #
@@ -45,6 +45,8 @@ import cmath
 import datetime
 # copy of arrays of arrays
 from copy import deepcopy
+# ordered dictionary
+from collections import OrderedDict
 # parallel calculations
 from multiprocessing import Pool
 import time
@@ -56,6 +58,13 @@ import traceback
 import ast
 import struct
 
+# shared modules in $SHARC/../lib
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.realpath(__file__)),'..','lib'))
+import gbw
+import determinants
+import interface_daemon
+import scheduler
+
 # =========================================================0
 # compatibility stuff
 
@@ -2062,6 +2071,11 @@ def readQMin(QMinfilename):
     if line[0]:
         QMin['nooverlap']=[]
 
+    # write the dets files in the binary format of wfoverlap
+    line=getsh2Orcakey(sh2Orca,'binary_dets')
+    if line[0]:
+        QMin['binary_dets']=[]
+
 
     # TheoDORE settings
     if 'theodore' in QMin:
@@ -2618,6 +2632,24 @@ def divide_slots(ncpu,ntasks,scaling):
     #print nrounds,nslots,cpu_per_run
     return nrounds,nslots,cpu_per_run
 
+# =============================================================================================== #
+def schedule_jobs(QMin,jobs,timings):
+    # distributes the cores over the jobs of one jobset,
+    # using the runtimes measured in the previous steps if available (see scheduler.py), otherwise divide_slots
+    #   returns the number of slots which should be set in the Pool,
+    #   the number of cores for each job,
+    #   and the jobs in the order in which they should be submitted.
+    plan=scheduler.schedule(QMin['ncpu'],jobs,QMin['schedule_scaling'],timings)
+    if not plan:
+        nrounds,nslots,cpu_per_run=divide_slots(QMin['ncpu'],len(jobs),QMin['schedule_scaling'])
+        return nslots,dict(zip(jobs,cpu_per_run)),jobs
+    nslots,cpu_per_run,order,makespan=plan
+    if PRINT:
+        print 'Schedule from measured runtimes (predicted: %.1f s):' % (makespan)
+        for job in order:
+            print '  %-20s %i cores' % (job,cpu_per_run[job])
+    return nslots,cpu_per_run,order
+
 # =============================================================================================== #
 
 def generate_joblist(QMin):
@@ -2666,63 +2698,55 @@ def generate_joblist(QMin):
     #print jobgrad
     #sys.exit(74)
 
+    # the jobs share the contents of QMin, hence nested entries are replaced, not modified
     schedule=[]
     QMin['nslots_pool']=[]
 
+    # runtimes of the previous steps
+    timings=scheduler.load(QMin['savedir'])
+
     # add the master calculations
-    ntasks=0
-    for i in gradjob:
-        if 'master' in i:
-            ntasks+=1
-    nrounds,nslots,cpu_per_run=divide_slots(QMin['ncpu'],ntasks,QMin['schedule_scaling'])
+    jobs=[ i for i in sorted(gradjob) if 'master' in i ]
+    nslots,cpu_per_run,order=schedule_jobs(QMin,jobs,timings)
     QMin['nslots_pool'].append(nslots)
-    schedule.append({})
-    icount=0
-    for i in sorted(gradjob):
-        if 'master' in i:
-            QMin1=deepcopy(QMin)
-            QMin1['master']=True
-            QMin1['IJOB']=int(i.split('_')[1])
-            remove=['gradmap','ncpu']
+    schedule.append(OrderedDict())
+    for i in order:
+        QMin1=dict(QMin)
+        QMin1['master']=True
+        QMin1['IJOB']=int(i.split('_')[1])
+        remove=['gradmap','ncpu']
+        for r in remove:
+            QMin1=removekey(QMin1,r)
+        QMin1['gradmap']=list(gradjob[i])
+        QMin1['ncpu']=cpu_per_run[i]
+        if QMin['OrcaVersion']<(4,1):
+          if 3 in QMin['multmap'][-QMin1['IJOB']] and QMin['jobs'][QMin1['IJOB']]['restr']:
+            QMin1['states']=[1]+QMin['states'][1:]
+            QMin1['states_to_do']=[1]+QMin['states_to_do'][1:]
+        if QMin1['qmmm']:
+          QMin1['qmmm']=True
+        schedule[-1][i]=QMin1
+
+    # add the gradient calculations
+    jobs=[ i for i in sorted(gradjob) if 'grad' in i ]
+    if len(jobs)>0:
+        nslots,cpu_per_run,order=schedule_jobs(QMin,jobs,timings)
+        QMin['nslots_pool'].append(nslots)
+        schedule.append(OrderedDict())
+        for i in order:
+            QMin1=dict(QMin)
+            mult=list(gradjob[i])[0][0]
+            QMin1['IJOB']=QMin['multmap'][mult]
+            remove=['gradmap','ncpu','h','soc','dm','overlap','ion','always_guess','always_orb_init','init']
             for r in remove:
                 QMin1=removekey(QMin1,r)
             QMin1['gradmap']=list(gradjob[i])
-            QMin1['ncpu']=cpu_per_run[icount]
-            if QMin['OrcaVersion']<(4,1):
-              if 3 in QMin['multmap'][-QMin1['IJOB']] and QMin['jobs'][QMin1['IJOB']]['restr']:
-                QMin1['states'][0]=1
-                QMin1['states_to_do'][0]=1
+            QMin1['ncpu']=cpu_per_run[i]
+            QMin1['gradonly']=[]
             if QMin1['qmmm']:
               QMin1['qmmm']=True
-            icount+=1
             schedule[-1][i]=QMin1
 
-    # add the gradient calculations
-    ntasks=0
-    for i in gradjob:
-        if 'grad' in i:
-            ntasks+=1
-    if ntasks>0:
-        nrounds,nslots,cpu_per_run=divide_slots(QMin['ncpu'],ntasks,QMin['schedule_scaling'])
-        QMin['nslots_pool'].append(nslots)
-        schedule.append({})
-        icount=0
-        for i in gradjob:
-            if 'grad' in i:
-                QMin1=deepcopy(QMin)
-                mult=list(gradjob[i])[0][0]
-                QMin1['IJOB']=QMin['multmap'][mult]
-                remove=['gradmap','ncpu','h','soc','dm','overlap','ion','always_guess','always_orb_init','init']
-                for r in remove:
-                    QMin1=removekey(QMin1,r)
-                QMin1['gradmap']=list(gradjob[i])
-                QMin1['ncpu']=cpu_per_run[icount]
-                QMin1['gradonly']=[]
-                if QMin1['qmmm']:
-                  QMin1['qmmm']=True
-                icount+=1
-                schedule[-1][i]=QMin1
-
     return QMin,schedule
 
 
@@ -2744,17 +2768,24 @@ def runjobs(schedule,QMin):
         if not jobset:
             continue
         pool = Pool(processes=QMin['nslots_pool'][ijobset])
-        for job in jobset:
+        for ijob,job in enumerate(jobset):
+            if ijob>0 and QMin['delay']>0.:
+                time.sleep(QMin['delay'])
             QMin1=jobset[job]
             WORKDIR=os.path.join(QMin['scratchdir'],job)
 
-            errorcodes[job]=pool.apply_async(run_calc , [WORKDIR,QMin1])
-            time.sleep(QMin['delay'])
+            errorcodes[job]=pool.apply_async(scheduler.timed , [run_calc,WORKDIR,QMin1])
         pool.close()
         pool.join()
 
-    for i in errorcodes:
-        errorcodes[i]=errorcodes[i].get()
+    # wall times of the successful jobs, for the scheduling of the next steps
+    runtimes=[]
+    for jobset in schedule:
+        for job in jobset:
+            errorcodes[job],walltime=errorcodes[job].get()
+            if errorcodes[job]==0:
+                runtimes.append( (job,jobset[job]['ncpu'],walltime) )
+    scheduler.record(QMin['savedir'],runtimes)
     j=0
     string='Error Codes:\n'
     for i in errorcodes:
@@ -3277,6 +3308,69 @@ def saveMolden(WORKDIR,QMin):
 # ======================================================================= #
 def get_MO_from_gbw(filename,QMin):
 
+    job=QMin['IJOB']
+    restr=QMin['jobs'][job]['restr']
+
+    # read the MO coefficients directly from the gbw file, use orca_fragovl if the file layout is unknown
+    try:
+        data=gbw.read_gbw(filename)
+        MOs=data['mos']
+        if len(MOs)!=(2-restr):
+            raise ValueError('Wrong number of operators in %s!' % (filename))
+        check_gbw_layout(filename,data,QMin)
+        MOs=[as_lists(MO) for MO in MOs]
+    except ValueError, problem:
+        if DEBUG:
+            print '%s, using orca_fragovl.' % (problem)
+        MOs=get_MO_from_fragovl(filename,restr)
+    NAO=len(MOs[0][0])
+
+    NMO=0
+    for MO in MOs:
+        NMO+=len(MO)-QMin['frozcore']
+
+    # make string
+    string='''2mocoef
+header
+ 1
+MO-coefficients from Orca
+ 1
+ %i   %i
+ a
+mocoef
+(*)
+''' % (NAO,NMO)
+    form=block_format('% 6.12e ',NAO,3)
+    for MO in MOs:
+        string+=''.join([form % tuple(mo) for mo in MO[QMin['frozcore']:]])
+    string+='orbocc\n(*)\n'
+    string+=(block_format('% 6.12e ',NMO,3) % tuple([0.0 for i in range(NMO)]))[:-1]
+
+    return string
+
+# ======================================================================= #
+def check_gbw_layout(filename,data,QMin):
+    # the layout of the gbw file is not documented, hence the MOs read from it are checked for orthonormality
+    # with the AO overlap from orca_fragovl, once for each ORCA version, basis set size and number of operators
+    # (successful checks are noted in the savedir); raises ValueError if the check fails
+    key='%s %i %i\n' % ('.'.join([str(i) for i in QMin['OrcaVersion']]),data['nao'],len(data['mos']))
+    checkfile=os.path.join(QMin['savedir'],'gbw_layout')
+    if os.path.isfile(checkfile) and key in readfile(checkfile):
+        return
+    NAO,Smat=get_smat_from_gbw(filename)
+    if NAO!=data['nao']:
+        raise ValueError('Wrong number of basis functions in %s!' % (filename))
+    for MO in data['mos']:
+        error=gbw.orthonormality_error(MO,Smat)
+        if not error<1e-4:
+            raise ValueError('MOs in %s are not orthonormal (error %.2e), unknown gbw layout!' % (filename,error))
+    f=open(checkfile,'a')
+    f.write(key)
+    f.close()
+
+# ======================================================================= #
+def get_MO_from_fragovl(filename,restr):
+
     # run orca_fragovl
     string='orca_fragovl %s %s' % (filename,filename)
     try:
@@ -3295,9 +3389,6 @@ def get_MO_from_gbw(filename,QMin):
         NAO=int(line.split()[0])+1
         break
 
-    job=QMin['IJOB']
-    restr=QMin['jobs'][job]['restr']
-
     # find MO block
     iline=-1
     while True:
@@ -3315,89 +3406,36 @@ def get_MO_from_gbw(filename,QMin):
     npre=11
     ndigits=16
 
-    # get coefficients for alpha
-    NMO_A=NAO
-    MO_A=[ [ 0. for i in range(NAO) ] for j in range(NMO_A) ]
-    for imo in range(NMO_A):
-      jblock=imo/nblock
-      jcol =imo%nblock
-      for iao in range(NAO):
-        shift=max(0,len(str(iao))-3)
-        jline=iline + jblock*(NAO+1) + iao
-        line=data[jline]
-        val=float( line[npre+shift+jcol*ndigits : npre+shift+ndigits+jcol*ndigits] )
-        MO_A[imo][iao]=val
-    iline+=(NAO/nblock+1)*(NAO+1)
-
-    # coefficients for beta
-    if not restr:
-      NMO_B=NAO
-      MO_B=[ [ 0. for i in range(NAO) ] for j in range(NMO_B) ]
-      for imo in range(NMO_B):
-        jblock=imo/nblock
-        jcol =imo%nblock
+    # get coefficients for alpha (and beta), the columns are fixed-width
+    MOs=[]
+    for iop in range(2-restr):
+      MO=[ [] for j in range(NAO) ]
+      for jblock in range((NAO-1)/nblock+1):
+        ncol=min(nblock,NAO-jblock*nblock)
         for iao in range(NAO):
-          shift=max(0,len(str(iao))-3)
-          jline=iline + jblock*(NAO+1) + iao
-          line=data[jline]
-          val=float( line[npre+shift+jcol*ndigits : npre+shift+ndigits+jcol*ndigits] )
-          MO_B[imo][iao]=val
+          start=npre+max(0,len(str(iao))-3)
+          line=data[iline + jblock*(NAO+1) + iao]
+          for jcol in range(ncol):
+            MO[jblock*nblock+jcol].append(float( line[start+jcol*ndigits : start+(jcol+1)*ndigits] ))
+      MOs.append(MO)
+      iline+=(NAO/nblock+1)*(NAO+1)
 
+    return MOs
 
-    NMO=NMO_A      -  QMin['frozcore']
-    if restr:
-        NMO=NMO_A      -  QMin['frozcore']
-    else:
-        NMO=NMO_A+NMO_B-2*QMin['frozcore']
-
-    # make string
-    string='''2mocoef
-header
- 1
-MO-coefficients from Orca
- 1
- %i   %i
- a
-mocoef
-(*)
-''' % (NAO,NMO)
-    x=0
-    for imo,mo in enumerate(MO_A):
-        if imo<QMin['frozcore']:
-            continue
-        for c in mo:
-            if x>=3:
-                string+='\n'
-                x=0
-            string+='% 6.12e ' % c
-            x+=1
-        if x>0:
-            string+='\n'
-            x=0
-    if not restr:
-        x=0
-        for imo,mo in enumerate(MO_B):
-            if imo<QMin['frozcore']:
-                continue
-            for c in mo:
-                if x>=3:
-                    string+='\n'
-                    x=0
-                string+='% 6.12e ' % c
-                x+=1
-            if x>0:
-                string+='\n'
-                x=0
-    string+='orbocc\n(*)\n'
-    x=0
-    for i in range(NMO):
-        if x>=3:
-            string+='\n'
-            x=0
-        string+='% 6.12e ' % (0.0)
-        x+=1
+# ======================================================================= #
+def block_format(form,n,ncol):
+    # format string for n numbers in lines of ncol numbers, ending with a newline
+    lines=[form*ncol for i in range(n/ncol)]
+    if n%ncol>0:
+        lines.append(form*(n%ncol))
+    return '\n'.join(lines)+'\n'
 
-    return string
+# ======================================================================= #
+def as_lists(A):
+    # gbw arrays to nested lists, for the string formatting
+    if gbw.NONUMPY:
+        return A
+    return A.tolist()
 
 # ======================================================================= #
 def get_dets_from_cis(filename,QMin):
@@ -3501,36 +3539,21 @@ def get_dets_from_cis(filename,QMin):
                 key=tuple(occ_A[QMin['frozcore']:]+occ_B[QMin['frozcore']:])
             eigenvectors[mult].append( {key:1.0} )
         for istate in range(nstates_to_extract[mult-1]):
-            CCfile.read(40)
-            dets={}
-            for iocc in range(header[0],header[1]+1):
-              for ivirt in range(header[2],header[3]+1):
-                dets[ (iocc,ivirt,1) ]=struct.unpack('d', CCfile.read(8))[0]
-            if not restr:
-              for iocc in range(header[4],header[5]+1):
-                for ivirt in range(header[6],header[7]+1):
-                  dets[ (iocc,ivirt,2) ]=struct.unpack('d', CCfile.read(8))[0]
+            eig=read_cis_vector(CCfile,header,restr)
             if QMin['template']['no_tda']:
-              CCfile.read(40)
-              for iocc in range(header[0],header[1]+1):
-                for ivirt in range(header[2],header[3]+1):
-                  dets[ (iocc,ivirt,1) ]+=struct.unpack('d', CCfile.read(8))[0]
-                  dets[ (iocc,ivirt,1) ]/=2.
-              if not restr:
-                for iocc in range(header[4],header[5]+1):
-                  for ivirt in range(header[6],header[7]+1):
-                    dets[ (iocc,ivirt,2) ]+=struct.unpack('d', CCfile.read(8))[0]
-                    dets[ (iocc,ivirt,2) ]/=2.
+                eigl=read_cis_vector(CCfile,header,restr)
+                eig=[ (eig[i]+eigl[i])/2. for i in range(len(eig)) ]
 
-            #pprint.pprint(dets)
-            # truncate vectors
-            norm=0.
-            for k in sorted(dets,key=lambda x: dets[x]**2,reverse=True):
-                factor=1.
-                if norm>factor*QMin['wfthres']:
-                    del dets[k]
-                    continue
-                norm+=dets[k]**2
+            # truncate vectors, only the remaining elements are put into the dictionary
+            nvirt_A=header[3]-header[2]+1
+            nvirt_B=header[7]-header[6]+1
+            nexc_A=(header[1]-header[0]+1)*nvirt_A
+            dets={}
+            for i in determinants.truncate(eig,QMin['wfthres']):
+                if i<nexc_A:
+                    dets[ (header[0]+i/nvirt_A,header[2]+i%nvirt_A,1) ]=eig[i]
+                else:
+                    dets[ (header[4]+(i-nexc_A)/nvirt_B,header[6]+(i-nexc_A)%nvirt_B,2) ]=eig[i]
             #pprint.pprint(dets)
             # create strings and expand singlets
             dets2={}
@@ -3592,62 +3615,27 @@ def get_dets_from_cis(filename,QMin):
             eigenvectors[mult].append(dets3)
         # skip extra roots
         for istate in range(nstates_to_skip[mult-1]):
-            CCfile.read(40)
-            for iocc in range(header[0],header[1]+1):
-              for ivirt in range(header[2],header[3]+1):
-                CCfile.read(8)
-            if not restr:
-              for iocc in range(header[4],header[5]+1):
-                for ivirt in range(header[6],header[7]+1):
-                  CCfile.read(8)
+            read_cis_vector(CCfile,header,restr)
             if QMin['template']['no_tda']:
-              CCfile.read(40)
-              for iocc in range(header[0],header[1]+1):
-                for ivirt in range(header[2],header[3]+1):
-                  CCfile.read(8)
-              if not restr:
-                for iocc in range(header[4],header[5]+1):
-                  for ivirt in range(header[6],header[7]+1):
-                    CCfile.read(8)
+                read_cis_vector(CCfile,header,restr)
 
 
     strings={}
     for imult,mult in enumerate(mults):
         filename=os.path.join(QMin['savedir'],'dets.%i' % mult)
-        strings[filename]=format_ci_vectors(eigenvectors[mult])
+        strings[filename]=determinants.format_ci_vectors(eigenvectors[mult],'binary_dets' in QMin)
 
     return strings
 
 # ======================================================================= #
-def format_ci_vectors(ci_vectors):
-
-    # get nstates, norb and ndets
-    alldets=set()
-    for dets in ci_vectors:
-        for key in dets:
-            alldets.add(key)
-    ndets=len(alldets)
-    nstates=len(ci_vectors)
-    norb=len(next(iter(alldets)))
-
-    string='%i %i %i\n' % (nstates,norb,ndets)
-    for det in sorted(alldets,reverse=True):
-        for o in det:
-            if o==0:
-                string+='e'
-            elif o==1:
-                string+='a'
-            elif o==2:
-                string+='b'
-            elif o==3:
-                string+='d'
-        for istate in range(len(ci_vectors)):
-            if det in ci_vectors[istate]:
-                string+=' %11.7f ' % ci_vectors[istate][det]
-            else:
-                string+=' %11.7f ' % 0.
-        string+='\n'
-    return string
+def read_cis_vector(CCfile,header,restr):
+    # reads one vector from a .cis file: 40 bytes, then the alpha (and beta) amplitudes
+    # header contains the first and last occupied and virtual orbitals for alpha and beta
+    n=(header[1]-header[0]+1)*(header[3]-header[2]+1)
+    if not restr:
+        n+=(header[5]-header[4]+1)*(header[7]-header[6]+1)
+    CCfile.read(40)
+    return struct.unpack('%id' % (n), CCfile.read(8*n))
 
 # ======================================================================= #
 def saveAOmatrix(WORKDIR,QMin):
@@ -3659,10 +3647,8 @@ def saveAOmatrix(WORKDIR,QMin):
     NAO,Smat=get_smat_from_gbw(filename)
 
     string='%i %i\n' % (NAO,NAO)
-    for irow in range(NAO):
-        for icol in range(NAO):
-            string+='% .7e ' % (Smat[icol][irow])
-        string+='\n'
+    form='% .7e '*NAO+'\n'
+    string+=''.join([form % tuple(row) for row in zip(*Smat)])
     filename=os.path.join(QMin['savedir'],'AO_overl')
     writefile(filename,string)
     if PRINT:
@@ -3726,15 +3712,13 @@ def get_smat_from_gbw(file1, file2=''):
         NAO=int(line.split()[0])+1
         break
 
-    # read matrix
+    # read matrix, blocks of 6 columns with one header line and NAO lines "y S(x1,y) ... S(x6,y)"
     nblock=6
-    ao_ovl=[ [ 0. for i in range(NAO) ] for j in range(NAO) ]
-    for x in range(NAO):
-      for y in range(NAO):
-        block=x/nblock
-        xoffset=x%nblock+1
-        yoffset=block*(NAO+1)+y+10
-        ao_ovl[x][y]=float( out[yoffset].split()[xoffset])
+    ao_ovl=[]
+    for block in range((NAO-1)/nblock+1):
+      lines=out[block*(NAO+1)+10 : block*(NAO+1)+10+NAO]
+      rows=[ [ float(v) for v in line.split()[1:] ] for line in lines ]
+      ao_ovl.extend(zip(*rows))
 
     return NAO,ao_ovl
 
@@ -4042,7 +4026,8 @@ def run_wfoverlap(QMin,errorcodes):
 
     print '>>>>>>>>>>>>> Starting the WFOVERLAP job execution'
 
-    # do Dyson calculations
+    jobs=[]
+    # collect Dyson calculations
     if 'ion' in QMin:
         for ionpair in QMin['ionmap']:
             WORKDIR=os.path.join(QMin['scratchdir'],'Dyson_%i_%i_%i_%i' % ionpair)
@@ -4051,10 +4036,9 @@ def run_wfoverlap(QMin,errorcodes):
                    'det.b': 'dets.%i' % ionpair[2],
                    'mo.a':    'mos.%i' % ionpair[1],
                    'mo.b':    'mos.%i' % ionpair[3] }
-            setupWORKDIR_WF(WORKDIR,QMin,files)
-            errorcodes['Dyson_%i_%i_%i_%i' % ionpair]=runWFOVERLAP(WORKDIR,QMin['wfoverlap'],memory=QMin['memory'],ncpu=QMin['ncpu'])
+            jobs.append(('Dyson_%i_%i_%i_%i' % ionpair,WORKDIR,files))
 
-    # do overlap calculations
+    # collect overlap calculations
     if 'overlap' in QMin:
         get_Double_AOovl_gbw(QMin)
         for m in itmult(QMin['states']):
@@ -4065,8 +4049,23 @@ def run_wfoverlap(QMin,errorcodes):
                          'det.b': 'dets.%i' % m,
                          'mo.a':    'mos.%i.old' % job,
                          'mo.b':    'mos.%i' % job }
-            setupWORKDIR_WF(WORKDIR,QMin,files)
-            errorcodes['WFOVL_%i_%i' % (m,job)]=runWFOVERLAP(WORKDIR,QMin['wfoverlap'],memory=QMin['memory'],ncpu=QMin['ncpu'])
+            jobs.append(('WFOVL_%i_%i' % (m,job),WORKDIR,files))
+
+    # run all jobs at once, the cores are distributed with the same model as for the QM jobs
+    # the memory is shared among the simultaneously running jobs
+    if jobs:
+        nrounds,nslots,cpu_per_run=divide_slots(QMin['ncpu'],len(jobs),QMin['schedule_scaling'])
+        memory=max(1,QMin['memory']/nslots)
+        if PRINT or DEBUG:
+            print 'Running %i jobs in %i slots (%i rounds)\n' % (len(jobs),nslots,nrounds)
+        pool=Pool(processes=nslots)
+        for ijob,(name,WORKDIR,files) in enumerate(jobs):
+            setupWORKDIR_WF(WORKDIR,QMin,files,cpu_per_run[ijob])
+            errorcodes[name]=pool.apply_async(runWFOVERLAP,[WORKDIR,QMin['wfoverlap'],memory,cpu_per_run[ijob]])
+        pool.close()
+        pool.join()
+        for name,WORKDIR,files in jobs:
+            errorcodes[name]=errorcodes[name].get()
 
     # Error code handling
     j=0
@@ -4088,7 +4087,7 @@ def run_wfoverlap(QMin,errorcodes):
     return errorcodes
 
 # ======================================================================= #
-def setupWORKDIR_WF(WORKDIR,QMin,files):
+def setupWORKDIR_WF(WORKDIR,QMin,files,ncpu):
     # mkdir the WORKDIR, or clean it if it exists, then copy all necessary files from pwd and savedir
 
     # setup the directory
@@ -4107,7 +4106,7 @@ ao_read=0
     if 'ion' in QMin:
         if QMin['ndocc']>0:
             inputstring+='ndocc=%i\n' % (QMin['ndocc'])
-    if QMin['ncpu']>=8:
+    if ncpu>=8:
         inputstring+='force_direct_dets\n'
     filename=os.path.join(WORKDIR,'wfovl.inp')
     writefile(filename,inputstring)
@@ -4128,18 +4127,17 @@ ao_read=0
 
 # ======================================================================= #
 def runWFOVERLAP(WORKDIR,WFOVERLAP,memory=100,ncpu=1):
-    prevdir=os.getcwd()
-    os.chdir(WORKDIR)
     string=WFOVERLAP+' -m %i' % (memory)+' -f wfovl.inp'
     stdoutfile=open(os.path.join(WORKDIR,'wfovl.out'),'w')
     stderrfile=open(os.path.join(WORKDIR,'wfovl.err'),'w')
-    os.environ['OMP_NUM_THREADS']=str(ncpu)
+    env=dict(os.environ)
+    env['OMP_NUM_THREADS']=str(ncpu)
     if PRINT or DEBUG:
         starttime=datetime.datetime.now()
         sys.stdout.write('START:\t%s\t%s\t"%s"\n' % (shorten_DIR(WORKDIR),starttime,shorten_DIR(string)))
         sys.stdout.flush()
     try:
-        runerror=sp.call(string,shell=True,stdout=stdoutfile,stderr=stderrfile)
+        runerror=sp.call(string,shell=True,cwd=WORKDIR,env=env,stdout=stdoutfile,stderr=stderrfile)
     except OSError:
         print 'Call have had some serious problems:',OSError
         sys.exit(101)
@@ -4149,7 +4147,6 @@ def runWFOVERLAP(WORKDIR,WFOVERLAP,memory=100,ncpu=1):
         endtime=datetime.datetime.now()
         sys.stdout.write('FINISH:\t%s\t%s\tRuntime: %s\tError Code: %i\n' % (shorten_DIR(WORKDIR),endtime,endtime-starttime,runerror))
         sys.stdout.flush()
-    os.chdir(prevdir)
     return runerror
 
 
@@ -4179,10 +4176,8 @@ def get_Double_AOovl_gbw(QMin):
   ## Smat is already off-diagonal block matrix NAO*NAO
   ## we want the lower left quarter, but transposed
   string='%i %i\n' % (NAO,NAO)
-  for irow in range(0,NAO):
-      for icol in range(0,NAO):
-          string+='% .15e ' % (Smat[irow][icol])          # note the exchanged indices => transposition
-      string+='\n'
+  form='% .15e '*NAO+'\n'
+  string+=''.join([form % tuple(row) for row in Smat])
   filename=os.path.join(QMin['savedir'],'AO_overl.mixed')
   writefile(filename,string)
   return
@@ -5006,8 +5001,14 @@ def main():
     print datetime.datetime.now()
     print '#================ END ================#'
 
+# ======================================================================= #
+def reset_starttime():
+    # the persistent process (see interface_daemon) runs main() in a fork for each call
+    global starttime
+    starttime=datetime.datetime.now()
+
 if __name__ == '__main__':
-    main()
+    interface_daemon.run(main,reset_starttime)
 
 
 
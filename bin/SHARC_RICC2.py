@@ -92,6 +92,8 @@ import datetime
 from copy import deepcopy
 # gethostname routine
 from socket import gethostname
+# parallel calculations
+from multiprocessing import Pool
 # reading binary files
 import struct
 import copy
@@ -2705,6 +2707,19 @@ def readQMin(QMinfilename):
     print 'WARNING: Please set memory in RICC2.resources (in MB)! Using 100 MB default value!'
 
 
+  # parallel efficiency of wfoverlap, for the distribution of the cores over simultaneous jobs
+  QMin['schedule_scaling']=0.9
+  line=getsh2cc2key(sh2cc2,'schedule_scaling')
+  if line[0]:
+    try:
+      x=float(line[1])
+      if 0<x<=1.:
+        QMin['schedule_scaling']=x
+    except ValueError:
+      print '"schedule_scaling" does not evaluate to numerical value!'
+      sys.exit(112)
+
+
   # initial MO guess settings
   # if neither keyword is present, the interface will reuse MOs from savedir, or use the EHT guess
   line=getsh2cc2key(sh2cc2,'always_orb_init')
@@ -3295,12 +3310,12 @@ def gettasks(QMin):
       tasks.append(['cleanup',QMin['scratchdir']+'/AO_OVL'])
       tasks.append(['get_AO_OVL',QMin['scratchdir']+'/AO_OVL'])
 
-      for imult in range(len(QMin['states'])):
-        if QMin['states'][imult]==0:
-          continue
-        tasks.append(['cleanup',QMin['scratchdir']+'/OVERLAP'])
-        tasks.append(['wfoverlap',QMin['scratchdir']+'/OVERLAP',imult+1])
-        tasks.append(['get_wfovlout',QMin['scratchdir']+'/OVERLAP',imult+1])
+      # all multiplicities are run at once, each in its own subdirectory
+      mults=[imult+1 for imult in range(len(QMin['states'])) if QMin['states'][imult]!=0]
+      tasks.append(['cleanup',QMin['scratchdir']+'/OVERLAP'])
+      tasks.append(['wfoverlap',QMin['scratchdir']+'/OVERLAP',mults])
+      for mult in mults:
+        tasks.append(['get_wfovlout',QMin['scratchdir']+'/OVERLAP/%i' % (mult),mult])
 
   if 'backup' in QMin:
     tasks.append(['backupdata',QMin['backup']])
@@ -3465,11 +3480,9 @@ def writegeom(QMin):
     writefile(filename,string)
 
 # ======================================================================= #
-def runProgram(string,workdir,outfile,errfile=''):
-  prevdir=os.getcwd()
+def runProgram(string,workdir,outfile,errfile='',env=None):
   if DEBUG:
     print workdir
-  os.chdir(workdir)
   if PRINT or DEBUG:
     starttime=datetime.datetime.now()
     sys.stdout.write('%s\n\t%s' % (string,starttime))
@@ -3480,7 +3493,7 @@ def runProgram(string,workdir,outfile,errfile=''):
   else:
     stderrfile=sp.STDOUT
   try:
-    runerror=sp.call(string,shell=True,stdout=stdoutfile,stderr=stderrfile)
+    runerror=sp.call(string,shell=True,cwd=workdir,env=env,stdout=stdoutfile,stderr=stderrfile)
   except OSError:
     print 'Call have had some serious problems:',OSError
     sys.exit(96)
@@ -3490,7 +3503,6 @@ def runProgram(string,workdir,outfile,errfile=''):
   if PRINT or DEBUG:
     endtime=datetime.datetime.now()
     sys.stdout.write('\t%s\t\tRuntime: %s\t\tError Code: %i\n\n' % (endtime,endtime-starttime,runerror))
-  os.chdir(prevdir)
   return runerror
 
 # ======================================================================= #
@@ -3899,7 +3911,70 @@ def get_AO_OVL(path,QMin):
   writefile(filename,string)
 
 # ======================================================================= #
-def wfoverlap(QMin,scradir,mult):
+def parallel_speedup(N,scaling):
+  # computes the parallel speedup from Amdahls law
+  # with scaling being the fraction of parallelizable work and (1-scaling) being the serial part
+  return 1./((1-scaling)+scaling/N)
+
+def divide_slots(ncpu,ntasks,scaling):
+  # this routine figures out the optimal distribution of the tasks over the CPU cores
+  #   returns the number of rounds (how many jobs each CPU core will contribute to),
+  #   the number of slots which should be set in the Pool,
+  #   and the number of cores for each job.
+  minpar=1
+  ntasks_per_round=ncpu/minpar
+  if ncpu==1:
+    ntasks_per_round=1
+  ntasks_per_round=min(ntasks_per_round,ntasks)
+  optimal={}
+  for i in range(1,1+ntasks_per_round):
+    nrounds=int(math.ceil(float(ntasks)/i))
+    ncores=ncpu/i
+    optimal[i]=nrounds/parallel_speedup(ncores,scaling)
+  best=min(optimal,key=optimal.get)
+  nrounds=int(math.ceil(float(ntasks)/best))
+  ncores=ncpu/best
+
+  cpu_per_run=[0 for i in range(ntasks)]
+  if nrounds==1:
+    itask=0
+    for icpu in range(ncpu):
+      cpu_per_run[itask]+=1
+      itask+=1
+      if itask>=ntasks:
+        itask=0
+    nslots=ntasks
+  else:
+    for itask in range(ntasks):
+      cpu_per_run[itask]=ncores
+    nslots=ncpu/ncores
+  return nrounds,nslots,cpu_per_run
+
+# ======================================================================= #
+def wfoverlap(QMin,scradir,mults):
+  # run the wfoverlap jobs of all multiplicities at once, each in scradir/<mult>
+  # the cores are distributed with divide_slots, the memory is shared among the simultaneous jobs
+  if not mults:
+    return
+  nrounds,nslots,cpu_per_run=divide_slots(QMin['ncpu'],len(mults),QMin['schedule_scaling'])
+  memory=max(1,QMin['memory']/nslots)
+  pool=Pool(processes=nslots)
+  jobs=[]
+  for imult,mult in enumerate(mults):
+    workdir=os.path.join(scradir,'%i' % (mult))
+    mkdir(workdir)
+    setup_wfoverlap(QMin,workdir,mult)
+    string='%s -f wfovl.inp -m %i' % (QMin['wfoverlap'],memory)
+    env=dict(os.environ)
+    env['OMP_NUM_THREADS']=str(cpu_per_run[imult])
+    jobs.append(pool.apply_async(runProgram,[string,workdir,'wfovl.out','',env]))
+  pool.close()
+  pool.join()
+  for job in jobs:
+    job.get()
+
+# ======================================================================= #
+def setup_wfoverlap(QMin,scradir,mult):
   # link all input files for wfoverlap
   savedir=QMin['savedir']
   link( os.path.join(savedir,'ao_ovl'              ), os.path.join(scradir,'ao_ovl'), crucial=True, force=True)
@@ -3929,10 +4004,6 @@ b_mo_read=2
   string+='ncore=%i' % (icore)
   writefile(os.path.join(scradir,'wfovl.inp'),string)
 
-  # run wfoverlap
-  string='%s -f wfovl.inp -m %i' % (QMin['wfoverlap'],QMin['memory'])
-  runProgram(string,scradir,'wfovl.out')
-
 # ======================================================================= #
 def run_dscf(QMin):
   workdir=os.path.join(QMin['scratchdir'],'JOB')
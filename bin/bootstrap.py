@@ -60,6 +60,13 @@ try:
 except ImportError:
   NONUMPY=True
 
+# in-process fitting, otherwise every bootstrap sample is fitted by a gnuplot call
+try:
+  import scipy.optimize as spopt
+  NOSCIPY=False
+except ImportError:
+  NOSCIPY=True
+
 # =========================================================0
 # compatibility stuff
 
@@ -413,10 +420,14 @@ def get_general():
     line=question('RNG Seed: ',str,'!',False)
     if line=='!':
       random.seed()
+      if not NONUMPY:
+        numpy.random.seed()
       break
     try:
       rngseed=int(line)
       random.seed(rngseed)
+      if not NONUMPY:
+        numpy.random.seed(rngseed)
     except ValueError:
       print 'Please enter an integer or "!".'
       continue
@@ -435,19 +446,27 @@ def get_general():
     break
   INFOS['fitfile']=path
 
-  print '\nPlease provide the command to execute gnuplot.'
-  INFOS['gnuplot']=question('Command: ',str,'gnuplot')
+  # without numpy/scipy, gnuplot does the fitting
+  INFOS['inprocess']=not NONUMPY and not NOSCIPY
+  if not INFOS['inprocess']:
+    print '\nPlease provide the command to execute gnuplot.'
+    INFOS['gnuplot']=question('Command: ',str,'gnuplot')
+  else:
+    INFOS['gnuplot']='gnuplot'
 
-  #parallel runs       TODO: currently is very inefficient due to subprocess creation overhead
+  #parallel runs
   print centerstring('Parallel computation',60,'-')
-  print '\nbootstrap.py can run the fitting (which is done through Gnuplot) on multiple CPU).\n(however, the overhead is currently large, so speedup is limited)'
+  if INFOS['inprocess']:
+    print '\nbootstrap.py can run the fitting (which is done with SciPy) on multiple CPU).'
+  else:
+    print '\nbootstrap.py can run the fitting (which is done through Gnuplot) on multiple CPU).\n(however, the overhead is currently large, so speedup is limited)'
   INFOS['ncpu']=question('Number of CPUs to use: ',int,[1])[0]
   #INFOS['ncpu']=1
   # how many runs to do per cycle
   npercycle=int(math.sqrt(INFOS['nboot']))
   npercycle-=npercycle%INFOS['ncpu']
   INFOS['npercycle']=max(npercycle,INFOS['ncpu'])
-  if INFOS['ncpu']==1:
+  if INFOS['ncpu']==1 and not INFOS['inprocess']:
     INFOS['npercycle']=1
 
   return INFOS
@@ -503,9 +522,14 @@ def do_calc(INFOS):
         #print ifile,istep,istate
         pop_full[ifile][istep][istate]=float(s[istate+1])
 
-  # make temporary directories
-  tmproot=os.path.join(INFOS['bootstrap_dir'],'tmp')
-  mkdir(tmproot)
+  if INFOS['inprocess']:
+    # ensemble data as matrix (trajectories x steps*columns), the resampled means of a whole cycle
+    # are then one product with the matrix of resampling weights
+    pop_full=numpy.array(pop_full).reshape((INFOS['ntraj'],-1))
+  else:
+    # make temporary directories
+    tmproot=os.path.join(INFOS['bootstrap_dir'],'tmp')
+    mkdir(tmproot)
 
 
 
@@ -527,62 +551,70 @@ def do_calc(INFOS):
   prevdir=os.getcwd()
   while True:
     try:
-      #print datetime.datetime.now(), 'Starting cycle'
-      idone_step=0
-      indices=[ [ 0 for i in range(INFOS['ntraj']) ] for j in range(INFOS['npercycle']) ]
-      for icpu in range(INFOS['npercycle']):
-        idone_step+=1
-        idone+=1
-
-        # sample data
-        for itraj in range(INFOS['ntraj']):
-          r=random.randint(0,INFOS['ntraj']-1)
-          indices[icpu][itraj]=r
-        #print idone,indices[icpu]
-
-        if idone>=INFOS['nboot']:
-          break
-
-      #print datetime.datetime.now(), 'Finished randint'
-      #print idone,idone_step
-      #print indices
-
-      if INFOS['ncpu']>1:
+      if INFOS['inprocess']:
+        # multinomial resampling weights for all samples of this cycle
+        idone_step=min(INFOS['npercycle'],INFOS['nboot']-idone)
+        idone+=idone_step
+        weights=numpy.random.multinomial(INFOS['ntraj'],[1./INFOS['ntraj']]*INFOS['ntraj'],size=idone_step)
+        pops=numpy.dot(weights,pop_full)/INFOS['ntraj']
+        constants_step=fit_samples(pops,INFOS['dt'],INFOS['steps'],fit2,nactualcol,INFOS['ncpu'])
+      else:
+        #print datetime.datetime.now(), 'Starting cycle'
+        idone_step=0
+        indices=[ [ 0 for i in range(INFOS['ntraj']) ] for j in range(INFOS['npercycle']) ]
         for icpu in range(INFOS['npercycle']):
-          tmpdir=os.path.join(tmproot,'cpu_%i' % icpu)
+          idone_step+=1
+          idone+=1
+
+          # sample data
+          for itraj in range(INFOS['ntraj']):
+            r=random.randint(0,INFOS['ntraj']-1)
+            indices[icpu][itraj]=r
+          #print idone,indices[icpu]
+
+          if idone>=INFOS['nboot']:
+            break
+
+        #print datetime.datetime.now(), 'Finished randint'
+        #print idone,idone_step
+        #print indices
+
+        if INFOS['ncpu']>1:
+          for icpu in range(INFOS['npercycle']):
+            tmpdir=os.path.join(tmproot,'cpu_%i' % icpu)
+            mkdir(tmpdir)
+        else:
+          tmpdir=os.path.join(tmproot,'cpu_%i' % 0)
           mkdir(tmpdir)
-      else:
-        tmpdir=os.path.join(tmproot,'cpu_%i' % 0)
-        mkdir(tmpdir)
 
-      constants_step=[]
-      if INFOS['ncpu']>1:
-        pool = Pool(processes=INFOS['ncpu'])
-        try:
-          for icpu in range(idone_step):
-            directory=os.path.join(tmproot,'cpu_%i' % icpu)
-            constants=pool.apply_async(make_job , [pop_full,indices[icpu],INFOS['dt'],directory,fit2,INFOS['gnuplot'],idone+icpu-idone_step+1,nactualcol])
-            constants_step.append(constants)
-          pool.close()
-          pool.join()
-        except Exception, e:
-          pool.close()
-          pool.join()
-          os.chdir(prevdir)
-          raise KeyboardInterrupt
-        for i in range(len(constants_step)):
-          constants_step[i]=constants_step[i].get()
-      else:
-        try:
-          for icpu in range(idone_step):
-            directory=os.path.join(tmproot,'cpu_%i' % 0)
-            constants=make_job(pop_full,indices[icpu],INFOS['dt'],directory,fit2,INFOS['gnuplot'],idone+icpu-idone_step+1,nactualcol)
-            #print datetime.datetime.now(), constants
-            constants_step.append(constants)
-        except Exception, e:
-          os.chdir(prevdir)
-          raise KeyboardInterrupt
-      #print datetime.datetime.now(), 'Finished gnuplot'
+        constants_step=[]
+        if INFOS['ncpu']>1:
+          pool = Pool(processes=INFOS['ncpu'])
+          try:
+            for icpu in range(idone_step):
+              directory=os.path.join(tmproot,'cpu_%i' % icpu)
+              constants=pool.apply_async(make_job , [pop_full,indices[icpu],INFOS['dt'],directory,fit2,INFOS['gnuplot'],idone+icpu-idone_step+1,nactualcol])
+              constants_step.append(constants)
+            pool.close()
+            pool.join()
+          except Exception, e:
+            pool.close()
+            pool.join()
+            os.chdir(prevdir)
+            raise KeyboardInterrupt
+          for i in range(len(constants_step)):
+            constants_step[i]=constants_step[i].get()
+        else:
+          try:
+            for icpu in range(idone_step):
+              directory=os.path.join(tmproot,'cpu_%i' % 0)
+              constants=make_job(pop_full,indices[icpu],INFOS['dt'],directory,fit2,INFOS['gnuplot'],idone+icpu-idone_step+1,nactualcol)
+              #print datetime.datetime.now(), constants
+              constants_step.append(constants)
+          except Exception, e:
+            os.chdir(prevdir)
+            raise KeyboardInterrupt
+        #print datetime.datetime.now(), 'Finished gnuplot'
 
       for i in constants_step:
         constants_all.append(i)
@@ -613,6 +645,14 @@ def do_calc(INFOS):
     for key in i:
       allconsts.add(key)
 
+  # failed fits are kept as empty dictionaries and skipped in the analysis
+  nfailed=len([ i for i in constants_all if not i ])
+  if nfailed>0:
+    print '%i of %i samples could not be fitted and are ignored.' % (nfailed,len(constants_all))
+  if nfailed==len(constants_all):
+    print 'No successful fits, no analysis possible.'
+    return INFOS
+
 
   # final analysis
   print '\n>>>>>>>>>>>>> Finished the bootstrapping cycles ...'
@@ -699,8 +739,11 @@ def do_calc(INFOS):
   #write results to file
   string='\n\nFull data:\n\n'
   keylist=[]
-  for key in constants_all[0]:
-    keylist.append(key)
+  for c in constants_all:
+    if c:
+      for key in c:
+        keylist.append(key)
+      break
   string+='%10s ' % 'Sample'
   for key in keylist:
     string+='%12s ' % key
@@ -729,6 +772,150 @@ def do_calc(INFOS):
 
 class KeyboardInterruptError(Exception): pass
 
+# ======================================================================= #
+def split_toplevel(expr):
+  # returns the positions of the top-level "?" and its ":" in expr, or None
+  depth=0
+  iq=-1
+  nq=0
+  for i,c in enumerate(expr):
+    if c=='(':
+      depth+=1
+    elif c==')':
+      depth-=1
+    elif depth==0 and c=='?':
+      if iq<0:
+        iq=i
+      else:
+        nq+=1
+    elif depth==0 and c==':' and iq>=0:
+      if nq==0:
+        return iq,i
+      nq-=1
+  return None
+
+# ======================================================================= #
+def gnuplot_to_python(expr):
+  # translates a gnuplot expression (as written by make_fitscript.py) to python/numpy
+  expr=expr.strip()
+  # ternary operator "c ? a : b"
+  pos=split_toplevel(expr)
+  if pos:
+    return 'numpy.where(%s,%s,%s)' % (gnuplot_to_python(expr[:pos[0]]),
+                                      gnuplot_to_python(expr[pos[0]+1:pos[1]]),
+                                      gnuplot_to_python(expr[pos[1]+1:]))
+  # translate all parenthesized subexpressions
+  string=''
+  depth=0
+  for i,c in enumerate(expr):
+    if c=='(':
+      if depth==0:
+        start=i
+      depth+=1
+    elif c==')':
+      depth-=1
+      if depth==0:
+        string+='('+gnuplot_to_python(expr[start+1:i])+')'
+    elif depth==0:
+      string+=c
+  # columns of the data file and Fortran double precision numbers
+  string=re.sub(r'\$(\d+)',lambda m: '__col[%i]' % (int(m.group(1))-1),string)
+  string=re.sub(r'(?<![\w.])(\d+\.?\d*)[dD]([+-]?\d)',r'\1e\2',string)
+  return string
+
+# ======================================================================= #
+class FITMODEL:
+  '''Kinetic model of a gnuplot fitting script (from make_fitscript.py), evaluated with numpy.
+
+  Reads the function definitions, initial guesses, the "fit" command (fitting function,
+  data columns and fitted parameters) and the "print &&&" lines (reported constants).'''
+
+  def __init__(self,script):
+    self.namespace={'numpy':numpy,'exp':numpy.exp,'log':numpy.log,'sqrt':numpy.sqrt,
+                    'sin':numpy.sin,'cos':numpy.cos,'abs':numpy.abs}
+    self.guess={}
+    self.via=[]
+    self.using=None
+    self.report=[]
+    for line in script.replace('\\\n','').splitlines():
+      line=line.strip()
+      match=re.match(r'fit\s+(\w+)\(x\)\s+"[^"]*"\s+u\w*\s+1:\((.*)\)\s+via\s+([^#]*)',line)
+      if match:
+        self.function=match.group(1)
+        self.using=compile(gnuplot_to_python(match.group(2)),'<using>','eval')
+        self.via=[ i.strip() for i in match.group(3).split(',') if i.strip() ]
+        continue
+      match=re.match(r'print\s+"&&&\s*(\w+)\s*:\s*"\s*,(.*)',line)
+      if match:
+        self.report.append( (match.group(1),compile(gnuplot_to_python(match.group(2)),'<print>','eval')) )
+        continue
+      line=line.split('#')[0]
+      match=re.match(r'(\w+)\((\w+)\)\s*=(.*)',line)
+      if match:
+        self.namespace[match.group(1)]=eval('lambda %s: %s' % (match.group(2),gnuplot_to_python(match.group(3))),self.namespace)
+        continue
+      match=re.match(r'(\w+)\s*=(.*)',line)
+      if match:
+        self.guess[match.group(1)]=eval(gnuplot_to_python(match.group(2)),self.namespace)
+        self.namespace[match.group(1)]=self.guess[match.group(1)]
+    if self.using is None:
+      print 'Fitting script does not contain a "fit" command!'
+      sys.exit(1)
+
+  def target(self,columns):
+    # evaluates the "using" expression of the fit command for the data columns
+    return eval(self.using,self.namespace,{'__col':columns})*numpy.ones(len(columns[0]))
+
+  def __call__(self,x,*p):
+    for key,value in zip(self.via,p):
+      self.namespace[key]=value
+    return self.namespace[self.function](x)*numpy.ones(len(x))
+
+  def fit(self,x,y):
+    # least-squares fit from the initial guesses, returns the reported constants (only positive ones)
+    self.namespace.update(self.guess)
+    OPT=spopt.curve_fit(self,x,y,p0=[ self.guess[key] for key in self.via ])
+    self(x,*OPT[0])
+    constants={}
+    for key,code in self.report:
+      value=float(eval(code,self.namespace))
+      if value>0.:
+        constants[key]=value
+    return constants
+
+# ======================================================================= #
+def fit_job(fit2,pops,dt,steps,nactualcol):
+  # fits the resampled populations pops (samples x steps*columns), returns a list of constants
+  model=FITMODEL(fit2)
+  t=numpy.arange(nactualcol*steps)*dt
+  allconstants=[]
+  for pop in pops:
+    pop=pop.reshape((steps,-1))[numpy.arange(nactualcol*steps)%steps]
+    columns=[t]+list(pop.T)
+    try:
+      allconstants.append(model.fit(t,model.target(columns)))
+    except (RuntimeError,ValueError,FloatingPointError):
+      # no convergence, the sample is ignored
+      allconstants.append({})
+  return allconstants
+
+# ======================================================================= #
+def fit_samples(pops,dt,steps,fit2,nactualcol,ncpu):
+  # fits all samples of a cycle, in ncpu chunks
+  if ncpu>1:
+    pool = Pool(processes=ncpu)
+    results=[]
+    for icpu in range(ncpu):
+      results.append(pool.apply_async(fit_job , [fit2,pops[icpu::ncpu],dt,steps,nactualcol]))
+    pool.close()
+    pool.join()
+    allconstants=[]
+    for result in results:
+      allconstants.extend(result.get())
+  else:
+    allconstants=fit_job(fit2,pops,dt,steps,nactualcol)
+  return allconstants
+
 def make_job(pop_full,indices,dt,directory,fit2,gnuplot,idone,nactualcol):
   sys.tracebacklimit=0
   #signal.signal(signal.SIGINT, signal.SIG_IGN)
@@ -31,6 +31,10 @@ import itertools
 import numpy as np
 from optparse import OptionParser
 
+# shared modules in $SHARC/../lib
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.realpath(__file__)),'..','lib'))
+from qmout import QMOUT, FLAGS, as_lists
+
 
 
 def json_load_byteified(file_handle):
@@ -709,83 +713,20 @@ def readfile(filename):
   return out
 # ======================================================================= #
 def read_QMout(path,nstates,natom,request):
-  targets={'h':         {'flag': 1,
-                         'type': complex,
-                         'dim':  (nstates,nstates)},
-           'dm':        {'flag': 2,
-                         'type': complex,
-                         'dim':  (3,nstates,nstates)},
-           'grad':      {'flag': 3,
-                         'type': float,
-                         'dim':  (nstates,natom,3)},
-           'nacdr':      {'flag': 5,
-                         'type': float,
-                         'dim':  (nstates,nstates,natom,3)},
-            'overlap':   {'flag': 6,
-                          'type': complex,
-                          'dim':  (nstates,nstates)}
-          }
-
-  # read QM.out
-  lines=readfile(path)
+  try:
+    qmout=QMOUT(path)
+  except (IOError,OSError):
+    print 'File %s does not exist!' % (path)
+    sys.exit(12)
 
   # obtain all targets
   QMout={}
-  for t in targets:
+  for t in ['h','dm','grad','nacdr','overlap']:
     if t in request:
-      iline=-1
-      while True:
-        iline+=1
-        if iline>=len(lines):
-          print 'Could not find "%s" (flag "%i") in file %s!' % (t,targets[t]['flag'],path)
-          sys.exit(11)
-        line=lines[iline]
-        if '! %i' % (targets[t]['flag']) in line:
-          break
-      values=[]
-      # =========== single matrix
-      if len(targets[t]['dim'])==2:
-        iline+=1
-        for irow in range(targets[t]['dim'][0]):
-          iline+=1
-          line=lines[iline].split()
-          if targets[t]['type']==complex:
-            row=[ complex(float(line[2*i]),float(line[2*i+1])) for i in range(targets[t]['dim'][1]) ]
-          elif targets[t]['type']==float:
-            row=[ float(line[i]) for i in range(targets[t]['dim'][1]) ]
-          values.append(row)
-      # =========== list of matrices
-      elif len(targets[t]['dim'])==3:
-        for iblocks in range(targets[t]['dim'][0]):
-          iline+=1
-          block=[]
-          for irow in range(targets[t]['dim'][1]):
-            iline+=1
-            line=lines[iline].split()
-            if targets[t]['type']==complex:
-              row=[ complex(float(line[2*i]),float(line[2*i+1])) for i in range(targets[t]['dim'][2]) ]
-            elif targets[t]['type']==float:
-              row=[ float(line[i]) for i in range(targets[t]['dim'][2]) ]
-            block.append(row)
-          values.append(block)
-      # =========== matrix of matrices
-      elif len(targets[t]['dim'])==4:
-        for iblocks in range(targets[t]['dim'][0]):
-          sblock=[]
-          for jblocks in range(targets[t]['dim'][1]):
-            iline+=1
-            block=[]
-            for irow in range(targets[t]['dim'][2]):
-              iline+=1
-              line=lines[iline].split()
-              if targets[t]['type']==complex:
-                row=[ complex(float(line[2*i]),float(line[2*i+1])) for i in range(targets[t]['dim'][3]) ]
-              elif targets[t]['type']==float:
-                row=[ float(line[i]) for i in range(targets[t]['dim'][3]) ]
-              block.append(row)
-            sblock.append(block)
-          values.append(sblock)
-      QMout[t]=values
+      if not t in qmout:
+        print 'Could not find "%s" (flag "%i") in file %s!' % (t,FLAGS[t],path)
+        sys.exit(11)
+      QMout[t]=as_lists(qmout.get(t))
 
   #pprint.pprint(QMout)
   return QMout
@@ -1137,7 +1078,8 @@ def write_LVC_template(INFOS):
       path=os.path.join(INFOS['paths'][str(normal_mode) + 'p'] , 'QM.out')
       requests=['h', 'overlap']
       print path, requests
-      pos_H, pos_S = read_QMout(path , INFOS['nstates'], len(INFOS['atoms']), requests).values()
+      QMout = read_QMout(path , INFOS['nstates'], len(INFOS['atoms']), requests)
+      pos_H, pos_S = QMout['h'], QMout['overlap']
 
       # check diagonal of S & print warning
       INFOS['problematic_mults'] = check_overlap_diagonal(pos_S, INFOS['states'], normal_mode, 'p', INFOS['ignore_problematic_states'])
@@ -1156,7 +1098,8 @@ def write_LVC_template(INFOS):
         path=os.path.join(INFOS['paths'][str(normal_mode) + 'n'] , 'QM.out')
         requests=['h', 'overlap']
         print path, requests
-        neg_H, neg_S = read_QMout(path , INFOS['nstates'], len(INFOS['atoms']), requests).values()
+        QMout = read_QMout(path , INFOS['nstates'], len(INFOS['atoms']), requests)
+        neg_H, neg_S = QMout['h'], QMout['overlap']
 
         # check diagonal of S & print warning if wanted
         INFOS['problematic_mults'].update(check_overlap_diagonal(neg_S, INFOS['states'], normal_mode, 'n', INFOS['ignore_problematic_states']))
@@ -45,8 +45,11 @@ import time
 import colorsys
 import pprint
 
+# shared modules in $SHARC/../lib
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.realpath(__file__)),'..','lib'))
 try:
   import numpy
+  import convolution
   NONUMPY=False
 except ImportError:
   NONUMPY=True
@@ -312,33 +315,49 @@ def mkdir(DIR):
 # ======================================================================================================================
 # ======================================================================================================================
 # ======================================================================================================================
+# evs() are the vectorized versions of ev() for numpy arrays (see lib/convolution.py)
+# cutoff is the distance from x0 beyond which the function is negligible
 class gauss:
   def __init__(self,fwhm):
     self.fwhm=fwhm
     self.c=-4.*math.log(2.)/fwhm**2             # this factor needs to be evaluated only once
+    self.cutoff=5.*fwhm                         # exp(-100*log(2))
+    self.shift_invariant=True
   def ev(self,A,x0,x):
     return A*math.exp( self.c*(x-x0)**2)        # this routine does only the necessary calculations
+  def evs(self,A,x0,x):
+    return A*numpy.exp( self.c*(x-x0)**2)
 
 class lorentz:
   def __init__(self,fwhm):
     self.fwhm=fwhm
     self.c=0.25*fwhm**2
+    self.cutoff=None
+    self.shift_invariant=True
   def ev(self,A,x0,x):
     return A/( (x-x0)**2/self.c+1)
+  def evs(self,A,x0,x):
+    return A/( (x-x0)**2/self.c+1)
 
 class boxfunction:
   def __init__(self,fwhm):
     self.fwhm=fwhm
     self.w=0.5*fwhm
+    self.cutoff=self.w
+    self.shift_invariant=False                  # the window is cheaper and exact at the edges
   def ev(self,A,x0,x):
     if abs(x-x0)<self.w:
       return A
     else:
       return 0.
+  def evs(self,A,x0,x):
+    return numpy.where(numpy.abs(x-x0)<self.w,A,0.)
 
 class lognormal:
   def __init__(self,fwhm):
     self.fwhm=fwhm
+    self.cutoff=None
+    self.shift_invariant=False
   def ev(self,A,x0,x):
     if x<=0 or x0<=0:
       return 0.
@@ -347,6 +366,12 @@ class lognormal:
     # note that the function does not take a value of A at x0
     # instead, the function is normalized such that its maximum will have a value of A (at x<=x0)
     return A*x0/x*math.exp( -c/(4.*math.log(2.)) -math.log(2.)*(math.log(x)-math.log(x0))**2/c)
+  def evs(self,A,x0,x):
+    old=numpy.seterr(all='ignore')
+    c=(numpy.log( (self.fwhm+numpy.sqrt(self.fwhm**2+4.*x0**2))/(2.*x0)))**2
+    y=A*x0/x*numpy.exp( -c/(4.*math.log(2.)) -math.log(2.)*(numpy.log(x)-numpy.log(x0))**2/c)
+    numpy.seterr(**old)
+    return numpy.where((x>0)&(x0>0),y,0.)
 
 kernels={1: {'f': gauss,       'description': 'Gaussian function',          'factor':1.0},
          2: {'f': lorentz,     'description': 'Lorentzian function',        'factor':2.0},
@@ -371,6 +396,15 @@ class spectrum:
       return
     for i in range(self.npts+1):
       self.spec[i]+=self.f.ev(A,x0,self.en[i])
+  def add_peaks(self,A,x0):
+    # adds many peaks at once, NaN peaks are skipped
+    if NONUMPY:
+      for a,x in zip(A,x0):
+        if a==a and x==x:
+          self.add(a,x)
+    else:
+      spec=numpy.array(self.spec)+convolution.convolve(self.f,A,x0,self.en)
+      self.spec=spec.tolist()
 
 # ======================================================================================================================
 # ======================================================================================================================
@@ -712,11 +746,15 @@ def get_general():
   print '\n'+centerstring('Data columns',60,'-')+'\n'
   # get number of columns
   filename=allfiles[0]
-  testfile=readfile(filename)
-  for line in testfile:
-    if not '#' in line:
-      ncol=len(line.split())
-      break
+  if filename.endswith('.npy') and not NONUMPY:
+    # binary tables, e.g., from geo.py -n
+    ncol=numpy.load(filename).shape[1]
+  else:
+    testfile=readfile(filename)
+    for line in testfile:
+      if not '#' in line:
+        ncol=len(line.split())
+        break
   print 'Number of columns in the file:   %i' % (ncol)
   INFOS['ncol']=ncol
 
@@ -1087,12 +1125,12 @@ def collect_data(INFOS):
     sys.stdout.write('\r  Progress: ['+'='*done+' '*(width_bar-done)+'] %3i%%' % (done*100/width_bar))
     #print '  ... %s' % f
     data1[f]=[]
-    text=readfile(f)
+    if f.endswith('.npy') and not NONUMPY:
+      rows=numpy.load(f).tolist()
+    else:
+      rows=[ line.split() for line in readfile(f) if not '#' in line ]
     iline=-1
-    for line in text:
-      if '#' in line:
-        continue
-      s=line.split()
+    for s in rows:
       if len(s) < maxcol:
         continue
       iline+=1
@@ -1131,6 +1169,12 @@ def smoothing_xy( INFOS, data1 ):
     sys.stdout.write('\r  Progress: ['+'='*done+' '*(width_bar-done)+'] %3i%%' % (done*100/width_bar))
     sys.stdout.flush()
     #print '  ... %s' % key
+    if not NONUMPY and len(data1[key])>0:
+      # windowed kernel (or FFT for equidistant times), times are sorted in collect_data
+      T=numpy.array(data1[key],dtype=float)
+      T[:,1:]=convolution.smooth(f,T[:,0],T[:,1:])
+      data2[key]=T.tolist()
+      continue
     data2[key]=[]
     for T in data1[key]:
       t=T[0]
@@ -1151,6 +1195,57 @@ def smoothing_xy( INFOS, data1 ):
 
 # ===========================================
 def synchronize( INFOS, data1 ):
+  if NONUMPY:
+    data3=synchronize_nonumpy(INFOS,data1)
+  else:
+    # get all times
+    arrays=[ numpy.array(data1[key],dtype=float) for key in sorted(data1) ]
+    ncol=max( [ len(T[0]) for T in data1.values() if len(T)>0 ] )-1
+    times=numpy.unique(numpy.concatenate( [ T[:,0] for T in arrays if len(T)>0 ] ))
+    # align all trajectories on the common time axis, missing times are NaN
+    D=numpy.empty( (len(times),len(arrays),ncol) )
+    D.fill(float('NaN'))
+    for ik,T in enumerate(arrays):
+      if len(T)==0:
+        continue
+      index=numpy.searchsorted(times,T[:,0])
+      # the first of several data points at the same time counts
+      D[index[::-1],ik,:]=T[::-1,1:]
+    data3={'times':times.tolist(),
+           'data':[ [ tuple(X) for X in d ] for d in D.tolist() ]}
+    data3['tmin']=times[0]
+    data3['tmax']=times[-1]
+    # find extrema of data
+    nx=ncol/2
+    data3['xmin']=numpy.nanmin(D[:,:,:nx])
+    data3['xmax']=numpy.nanmax(D[:,:,:nx])
+    data3['ymin']=numpy.nanmin(D[:,:,nx:])
+    data3['ymax']=numpy.nanmax(D[:,:,nx:])
+  # remember which columns to print and make labels
+  mask=[]
+  labels=[]
+  for i in INFOS['colX']:
+    if i!=0:
+      mask.append(True)
+      labels.append('X Column %3i' % i)
+    else:
+      mask.append(False)
+  for i in INFOS['colY']:
+    if i!=0:
+      mask.append(True)
+      labels.append('Y Column %3i' % i)
+    else:
+      mask.append(False)
+  toprint=[]
+  labels=['Time']+labels*len(data1)
+  for traj in data1:
+    toprint.append(mask)
+  data3['toprint']=toprint
+  data3['labels']=labels
+  return data3
+
+# ===========================================
+def synchronize_nonumpy( INFOS, data1 ):
   # get all times
   times=set()
   for traj in data1:
@@ -1203,31 +1298,10 @@ def synchronize( INFOS, data1 ):
       xmax=max( [xmax]+list(X[:nx]) )
       ymin=min( [ymin]+list(X[nx:]) )
       ymax=max( [ymax]+list(X[nx:]) )
-  # remember which columns to print and make labels
-  mask=[]
-  labels=[]
-  for i in INFOS['colX']:
-    if i!=0:
-      mask.append(True)
-      labels.append('X Column %3i' % i)
-    else:
-      mask.append(False)
-  for i in INFOS['colY']:
-    if i!=0:
-      mask.append(True)
-      labels.append('Y Column %3i' % i)
-    else:
-      mask.append(False)
-  toprint=[]
-  labels=['Time']+labels*len(data1)
-  for traj in data1:
-    toprint.append(mask)
   data3['xmin']=xmin
   data3['xmax']=xmax
   data3['ymin']=ymin
   data3['ymax']=ymax
-  data3['toprint']=toprint
-  data3['labels']=labels
   return data3
 
 # ===========================================
@@ -1370,10 +1444,9 @@ def do_x_convolution(INFOS,data2):
     spec=[ spectrum(INFOS['convolute_X']['npoints']-1,xmin,xmax,1.0,1) for i in range(ny) ]
     for i in range(ny):
       spec[i].f=INFOS['convolute_X']['function']
-    for T in data2['data'][it1]:
-      for i in range(ny):
-        if T[ny+i]==T[ny+i] and T[i]==T[i]:
-          spec[i].add(T[ny+i],T[i])
+    T=zip(*data2['data'][it1])
+    for i in range(ny):
+      spec[i].add_peaks(T[ny+i],T[i])
     d=[]
     for ix in range(INFOS['convolute_X']['npoints']):
       d.append( [spec[i].spec[ix] for i in range(ny)] )
@@ -1411,6 +1484,31 @@ def do_t_convolution(INFOS,data3):
     tmin=tmin-INFOS['convolute_T']['xrange'][0]*width
     tmax=tmax+INFOS['convolute_T']['xrange'][0]*width
   # do convolution
+  if not NONUMPY:
+    # all x values and columns at once: data4 = K.data3
+    times=spectrum(INFOS['convolute_T']['npoints']-1,tmin,tmax,1.0,1).en
+    K=convolution.kernel_matrix(INFOS['convolute_T']['function'],data3['times'],times)
+    D=numpy.array(data3['data'],dtype=float)
+    data4=numpy.dot(K,D.reshape((D.shape[0],-1))).reshape((len(times),)+D.shape[1:]).tolist()
+  else:
+    data4=t_convolution_nonumpy(INFOS,data3,tmin,tmax)
+    times=data4.pop()
+  # make type3 dictionary:
+  data5={}
+  data5['data']=data4
+  data5['times']=times
+  data5['xvalues']=copy.copy(data3['xvalues'])
+  data5['labels']=data3['labels']
+  data5['tmin']=min(data5['times'])
+  data5['tmax']=max(data5['times'])
+  data5['xmin']=min(data5['xvalues'])
+  data5['xmax']=max(data5['xvalues'])
+  return data5
+
+# ===========================================
+def t_convolution_nonumpy(INFOS,data3,tmin,tmax):
+  # convolution for each x value and column separately
+  # the time grid is appended to the returned data
   allspec=[]
   for ix1,x1 in enumerate(data3['xvalues']):
     ny=len(data3['data'][0][ix1])
@@ -1433,17 +1531,8 @@ def do_t_convolution(INFOS,data3):
     for ix1,x1 in enumerate(data3['xvalues']):
       d.append( [allspec[ix1][i].spec[it1] for i in range(ny)] )
     data4.append(d)
-  # make type3 dictionary:
-  data5={}
-  data5['data']=data4
-  data5['times']=times
-  data5['xvalues']=copy.copy(data3['xvalues'])
-  data5['labels']=data3['labels']
-  data5['tmin']=min(data5['times'])
-  data5['tmax']=max(data5['times'])
-  data5['xmin']=min(data5['xvalues'])
-  data5['xmax']=max(data5['xvalues'])
-  return data5
+  data4.append(times)
+  return data4
 
 # ===========================================
 def integrate_T(INFOS,data3):
@@ -32,7 +32,6 @@ import re
 import os
 import stat
 import shutil
-import subprocess as sp
 import datetime
 import random
 from optparse import OptionParser
@@ -40,6 +39,8 @@ import readline
 import time
 import colorsys
 import pprint
+import json
+from multiprocessing import Pool
 
 try:
   import numpy
@@ -47,6 +48,10 @@ try:
 except ImportError:
   NONUMPY=True
 
+# shared modules in $SHARC/../lib
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.realpath(__file__)),'..','lib'))
+import data_extraction
+
 # =========================================================0
 # compatibility stuff
 
@@ -80,6 +85,19 @@ PI = math.pi
 version='2.1'
 versiondate=datetime.date(2019,9,1)
 
+# results of the checks are cached in each ensemble directory
+CACHE='diagnostics.cache'
+# files which are read by the checks
+CHECKED_FILES=['output.lis',
+               'output.log',
+               'output.dat',
+               'output.xyz',
+               'restart.ctrl',
+               'restart.traj',
+               'output_data/energy.out',
+               'output_data/coeff_diag.out'
+              ]
+
 
 IToMult={
          1: 'Singlet', 
@@ -470,7 +488,8 @@ def get_general():
     'hop_energy':1.0,
     'intruders':False,
     'always_update':False,
-    'extractor_mode':'default'
+    'extractor_mode':'default',
+    'ncpu':1
   }
   helptext={
     'normal_termination':'Checks for exit status of trajectory (RUNNING, CRASHED, FINISHED).',
@@ -484,7 +503,8 @@ def get_general():
     'hop_energy':'Maximum permissible change in active state energy difference during a surface hop (in eV).',
     'intruders':'Checks if intruder state messages in "output.log" refer to active state.',
     'always_update':'Run data_extractor.x for all trajectories, even if all files have up-to-date time stamps.',
-    'extractor_mode':'Option flag for data_extractor.x [possible: "xs", "s", "l", "xl","dont"]. Use "dont" to skip the extractor calls (gives incomplete diagnostics but is very fast)'
+    'extractor_mode':'Option flag for data_extractor.x [possible: "xs", "s", "l", "xl","dont"]. Use "dont" to skip the extractor calls (gives incomplete diagnostics but is very fast)',
+    'ncpu':'Number of data_extractor.x calls and trajectory checks running in parallel.'
   }
   if LD_dynamics:
     defaults['intruders']=True
@@ -572,240 +592,282 @@ Later, all floats x with binlist[i-1]<x<=binlist[i] will return i'''
 
 # ======================================================================================================================
 
-def look_for_files(filelist,path,s,trajectories):
+def look_for_files(filelist,path,s,traj):
       files=filelist
       s=s
       for ifile in files:
         f=os.path.join(path,ifile)
         s+=ifile[-4:]
         if os.path.isfile(f):
-          trajectories[path]['files'][ifile]=True
+          traj['files'][ifile]=True
           s+=' .. '
         else:
-          trajectories[path]['files'][ifile]=False
+          traj['files'][ifile]=False
           s+=' !! '
-      return s, trajectories
+      return s, traj
 
 # ======================================================================================================================
 
-def check_files(path,trajectories,INFOS):
+def check_files(path,traj,settings):
   # check if files are there
-  trajectories[path]['files']={}
+  traj['files']={}
   s='    Output files:     '
   files=['output.lis','output.log','output.dat','output.xyz']
-  s, trajectories = look_for_files(files,path,s,trajectories)
-  if all(trajectories[path]['files'].values()):
+  s, traj = look_for_files(files,path,s,traj)
+  if all(traj['files'].values()):
     s+='OK'
     missing = False
-    if INFOS['settings']['missing_output']:
-      print s
+    if settings['missing_output']:
+      traj['report'].append(s)
   else:
     s+='Files missing!'
-    trajectories[path]['maxsteps']=0
-    trajectories[path]['tana']=0.
+    traj['maxsteps']=0
+    traj['tana']=0.
     missing = True
-    print s
-    #continue
-  #print INFOS['settings']['missing_output']
+    traj['report'].append(s)
 
 
   # check for restart files
-  if INFOS['settings']['missing_restart']:
+  if settings['missing_restart']:
     files=['restart.ctrl','restart.traj']
     s='    Restart files:    '
-    s, trajectories = look_for_files(files,path,s,trajectories)
+    s, traj = look_for_files(files,path,s,traj)
     ls2=os.path.join(path,'restart')
     if not os.path.isdir(ls2) or len(os.listdir(ls2))==0:
       s+='restart/ !! '
-      trajectories[path]['files']['restart']=False
+      traj['files']['restart']=False
     else:
       s+='restart/ .. '
-      trajectories[path]['files']['restart']=True
-    if all(trajectories[path]['files'].values()):
+      traj['files']['restart']=True
+    if all(traj['files'].values()):
       s+='    OK'
     else:
       s+='    Restart might not be possible.'
-    if INFOS['settings']['missing_restart']:
-      print s
-  return trajectories, missing
+    if settings['missing_restart']:
+      traj['report'].append(s)
+  return traj, missing
 
 # ======================================================================================================================
 
-def check_runtime(path, trajectories,INFOS):
+def read_log(filename):
+  '''Reads output.log in one pass and collects the data for check_runtime, check_termination and check_intruders:
+- the print level
+- the first "Found nsteps=" line and the last "Entering timestep" line
+- the last 30 lines
+- the time stamps (2 lines below) of the first 10 and of the last "Entering timestep" line
+- the lines relevant for the intruder check (timesteps, restarts, intruder states)'''
+  log={'nlines':0,
+       'printlevel':None,
+       'nsteps':None,
+       'laststep':None,
+       'tail':[],
+       'stamps':[],
+       'laststamp':None,
+       'events':[]
+      }
+  pending=[]
+  nmatch=0
+  f=open(filename)
+  for line in f:
+    log['nlines']+=1
+    # time stamps, 2 lines below "Entering timestep"
+    waiting=[]
+    for n,imatch in pending:
+      if n>1:
+        waiting.append( (n-1,imatch) )
+        continue
+      if imatch<len(log['stamps']):
+        log['stamps'][imatch]=line
+      if imatch==nmatch-1:
+        log['laststamp']=line
+    pending=waiting
+    log['tail'].append(line)
+    if len(log['tail'])>30:
+      del log['tail'][0]
+    lower=line.lower()
+    if log['printlevel'] is None and 'Print level:' in line:
+      log['printlevel']=int(line.split()[-1])>=2
+    if log['nsteps'] is None and 'found nsteps=' in lower:
+      log['nsteps']=line
+    if 'entering timestep' in lower:
+      log['laststep']=line
+    if 'ntering timestep' in line:
+      if len(log['stamps'])<10:
+        log['stamps'].append(None)
+      pending.append( (2,nmatch) )
+      nmatch+=1
+      log['laststamp']=None
+      log['events'].append(line)
+    elif 'RESTART requested.' in line or 'State: ' in line:
+      log['events'].append(line)
+  f.close()
+  if log['printlevel'] is None:
+    log['printlevel']=False
+  return log
+
+# ======================================================================================================================
+
+def check_runtime(path,traj,settings,log):
   # get maximum run time
-  f=os.path.join(path,'output.log')
-  f=readfile(f)
-  if not check_printlevel(f):
-    pass
-  trajectories[path]['tana'] = 0
-  for line in reversed(f):
-    trajectories[path]['laststep']=0
-    trajectories[path]['maxsteps']=1
-    if 'entering timestep' in line.lower():
-      trajectories[path]['laststep']=int(line.split()[3])
-      break
-  for line in reversed(f):
-    if 'found nsteps=' in line.lower():
-      trajectories[path]['maxsteps']=int(line.split()[2])
-      trajectories[path]['dtstep']=float(line.split()[5])
+  if log['nlines']==0:
+    raise ValueError('Empty output.log')
+  traj['tana'] = 0
+  traj['laststep']=0
+  traj['maxsteps']=1
+  if log['laststep']:
+    traj['laststep']=int(log['laststep'].split()[3])
+  if log['nsteps']:
+    traj['maxsteps']=int(log['nsteps'].split()[2])
+    traj['dtstep']=float(log['nsteps'].split()[5])
   s='    Progress:         ['
-  progress=float(trajectories[path]['laststep'])/trajectories[path]['maxsteps']
-  s+='='*int(25*progress) + ' '*(25-int(25*progress))+']     %.1f of %.1f fs' % (trajectories[path]['laststep']*trajectories[path]['dtstep'], trajectories[path]['maxsteps']*trajectories[path]['dtstep'])
-  #s+='\n'
-  if INFOS['settings']['normal_termination']:
-    print s
-  return trajectories, f
+  progress=float(traj['laststep'])/traj['maxsteps']
+  s+='='*int(25*progress) + ' '*(25-int(25*progress))+']     %.1f of %.1f fs' % (traj['laststep']*traj['dtstep'], traj['maxsteps']*traj['dtstep'])
+  if settings['normal_termination']:
+    traj['report'].append(s)
+  return traj
 
 # ======================================================================================================================
 
-def check_termination(path, trajectories,INFOS,f):
+def parse_stamp(line):
+  check_old=line.split()
+  if check_old[0] == "Start":
+    return line.strip()[12:]
+  else:
+    return line.strip()
+
+def check_termination(path,traj,settings,log):
   # check for normal termination
-  trajectories[path]['terminated']=False
-  trajectories[path]['crashed']=False
-  trajectories[path]['stopped']=False
-  trajectories[path]['stuck']=False
-  for line in reversed(f[-30:]):
+  traj['terminated']=False
+  traj['crashed']=False
+  traj['stopped']=False
+  traj['stuck']=False
+  for line in log['tail']:
     if 'total wallclock time' in line.lower():
-      trajectories[path]['terminated']=True
+      traj['terminated']=True
     elif 'file stop detected' in line.lower():
-      trajectories[path]['stopped']=True
+      traj['stopped']=True
     elif 'qm call was not successful' in line.lower():
-      trajectories[path]['crashed']=True
+      traj['crashed']=True
   s='    Status:                                           '
-  if trajectories[path]['terminated']:
-    if trajectories[path]['crashed']:
+  if traj['terminated']:
+    if traj['crashed']:
       s+='CRASHED'
-    elif trajectories[path]['stopped']:
+    elif traj['stopped']:
       s+='FINISHED (stopped by user)'
     else:
       s+='FINISHED'
   else:
     #check how much time passed since last QM call and compare to average
     #calculation time. Label trajectory STUCK if too much time passed (5x).
-    #f = reversed(f)
-    timesteps = []
-    count = 0
-    countmax = min(10,trajectories[path]['laststep'])
-    for line in range(len(f)):
-      if 'ntering timestep' in f[line].lower():
-        check_old=f[line+2].split()
-        if check_old[0] == "Start":
-          timesteps.append(f[line+2].strip()[12:])
-        else:
-          timesteps.append(f[line+2].strip())
-        count += 1
-      if count == countmax: 
-        break
+    countmax = min(10,traj['laststep'])
+    timesteps = [ parse_stamp(line) for line in log['stamps'][:countmax] ]
+    count = len(timesteps)
     total = datetime.timedelta()
     for entry in range(len(timesteps)-2):
-      tstart = datetime.datetime.strptime(timesteps[entry+1], '%a %b %d %H:%M:%S %Y') 
+      tstart = datetime.datetime.strptime(timesteps[entry+1], '%a %b %d %H:%M:%S %Y')
       tend = datetime.datetime.strptime(timesteps[entry+2], '%a %b %d %H:%M:%S %Y')
       total += tend-tstart
-    for line in range(len(f)):
-      if 'ntering timestep' in f[-line].lower():
-        check_old=f[-line+2].split()
-        if check_old[0] == "Start":
-          tstart = datetime.datetime.strptime(f[-line+2].strip()[12:], '%a %b %d %H:%M:%S %Y')
-          break
-        else:
-          tstart = datetime.datetime.strptime(f[-line+2].strip(), '%a %b %d %H:%M:%S %Y')
-          break
+    tstart = datetime.datetime.strptime(parse_stamp(log['laststamp']), '%a %b %d %H:%M:%S %Y')
     tend=datetime.datetime.now()
     tdiff = tend-tstart
     stuck=False
     if 5*total/(count-2) < tdiff:
-      trajectories[path]['stuck']=True
+      traj['stuck']=True
       stuck = True
-    if stuck: 
+    if stuck:
       s+='STUCK (%s since last QM call)' % (str(tdiff)[:-7])
     else:
       s+='RUNNING'
-  if INFOS['settings']['normal_termination']:
-    print s
-  
-  return trajectories
+  if settings['normal_termination']:
+    traj['report'].append(s)
+
+  return traj
 
 # ======================================================================================================================
 
-def check_length(path,trajectories,filelength,filename):
-  #checks if the number of entries in a file corresponds to the number 
+def check_length(traj,filelength,filename):
+  #checks if the number of entries in a file corresponds to the number
   #of time steps in the output.log file
-  if filelength != trajectories[path]['laststep'] and filelength != trajectories[path]['laststep']+1:
+  if filelength != traj['laststep'] and filelength != traj['laststep']+1:
     return 'Wrong step nr in %s ' % (filename)
   else:
     return ''
 
 # ======================================================================================================================
 
-def check_printlevel(logdata):
-  for line in logdata:
-    if "Print level:" in line:
-      level=int(line.split()[-1])
-      if level<2:
-        return False
-      else:
-        return True
-  return False
-
-# ======================================================================================================================
-
-def check_consistency(path,trajectories,data,filename):
-  #checks if no timesteps are omitted in a given file
+def read_lis(path,traj):
+  '''Reads output.lis in one pass. Returns the lines as dict with the timestep as keys,
+the steps with surface hops, and the consistency check (problem and time up to which there are no missing steps).'''
+  lis = {}
+  hops = []
+  step = 0
   problem = ''
-  deltatime = float(trajectories[path]['dtstep'])
-  if filename == 'output.lis':
-    deltatime = 1
-  for line in data:
-    if not '#' in line:
-      x = line.split()
-      if float(x[0]) == 0.:
-        prevtime = 0
-        tana = 0
-      elif abs(float(x[0]) - deltatime - prevtime) <= 1e-9:
-        prevtime = float(x[0])
-        tana = prevtime
-        pass
-      else:
-        problem = 'Missing steps in %s' % (filename) #(int(prevtime/deltatime))
-        if filename == 'output.lis':
-          tana = float(prevtime*float(trajectories[path]['dtstep']))
-        else:
-          tana = float(prevtime)
-        break
-    
-  return problem, tana
+  tana = None
+  f=open(os.path.join(path,'output.lis'))
+  for line in f:
+    if '#' in line:
+      if 'Surface Hop' in line:
+        hops.append(step)
+      continue
+    x=line.split()
+    lis[float(x[0])]=x[1:]
+    step += 1
+    # checks if no timesteps are omitted
+    if problem:
+      continue
+    if float(x[0]) == 0.:
+      prevtime = 0
+      tana = 0
+    elif abs(float(x[0]) - 1 - prevtime) <= 1e-9:
+      prevtime = float(x[0])
+      tana = prevtime
+    else:
+      problem = 'Missing steps in output.lis'
+      tana = float(prevtime*float(traj['dtstep']))
+  f.close()
+  if tana is None:
+    raise ValueError('No steps in output.lis')
+  return lis, hops, problem, tana
 
 # ======================================================================================================================
 
-def check_energies(path,trajectories,INFOS,hops):
+def check_energies(path,traj,settings,hops):
   #look for large changes in the total, kinetic, and potential energy
-  # inbetween time steps. Check also if a large change in energy was observed 
+  # inbetween time steps. Check also if a large change in energy was observed
   #during a hop.
+  # Missing steps, number of steps and energies are checked in one pass.
   f=os.path.join(path,'output_data','energy.out')
   if os.path.isfile(f):
-    f=readfile(f)
-    try:
-      problem, tana_length = check_consistency(path,trajectories,f,'energy.out')
-    except:
-      print '\n    An error occured while trying to check energy.out for consistency.' 
-      trajectories[path]['error'] = True
-    if problem == '':
-      problem = check_length(path,trajectories,len(f)-3,'energy.out')
+    f=open(f)
+    nlines=0
+    problem_length=''
+    tana_length=None
+    problem=''
+    tana=0.
     for line in f:
+      nlines+=1
       if '#' in line:
         continue
       x=line.split()
       t=float(x[0])
       e=[ float(i) for i in x[1:] ]
+      if tana_length is None:
+        if t==0.:
+          prevtime = 0
+        elif abs(t - traj['dtstep'] - prevtime) <= 1e-9:
+          prevtime = t
+        else:
+          problem_length='Missing steps in energy.out'
+          tana_length=float(prevtime)
       if t==0.:
         eold=e
         etotmin=e[2]
         etotmax=e[2]
-      elif t > tana_length:
+      elif tana_length is not None and t > tana_length:
         tana = tana_length
         break
       hop = False
-      currstep = int(t/trajectories[path]['dtstep']) 
+      currstep = int(t/traj['dtstep'])
       if currstep in hops:
         hop = True
       ok=True
@@ -814,71 +876,84 @@ def check_energies(path,trajectories,INFOS,hops):
         etotmin=e[2]
       if etotmax<e[2]:
         etotmax=e[2]
-      if abs(etotmax-etotmin)>INFOS['settings']['etot_window']:
+      if abs(etotmax-etotmin)>settings['etot_window']:
         ok=False
         problem='Large fluctuation in Etot'
       if not hop:
-        if abs(e[0]-eold[0]) > INFOS['settings']['ekin_step']:
+        if abs(e[0]-eold[0]) > settings['ekin_step']:
           ok=False
           problem='Large step in Ekin'
-        if abs(e[1]-eold[1]) > INFOS['settings']['epot_step']:
+        if abs(e[1]-eold[1]) > settings['epot_step']:
           ok=False
           problem='Large step in Epot'
       else:
-        if abs(e[1]-eold[1]) > INFOS['settings']['hop_energy']:
+        if abs(e[1]-eold[1]) > settings['hop_energy']:
           ok=False
           problem='Large dE during hop'
-      if abs(e[2]-eold[2]) > INFOS['settings']['etot_step']:
+      if abs(e[2]-eold[2]) > settings['etot_step']:
         ok=False
         problem='Large step in Etot'
       if not ok:
         break
       eold=e
-    if len(f) <= 3:
-      tana = 0. 
+    if nlines <= 3:
+      nlines+=len(f.readlines())
+    f.close()
+    if problem == '':
+      problem = problem_length
+    if problem == '':
+      problem = check_length(traj,nlines-3,'energy.out')
+    if nlines <= 3:
+      tana = 0.
       problem='Empty energy.out file'
-    trajectories[path]['tana']=tana
-    trajectories[path]['problem']=problem
+    traj['tana']=tana
+    traj['problem']=problem
     s='    Energy:           ' + problem + ' '*(32-len(problem))
     if problem:
       s+='at %.2f fs' % tana
     else:
       s+='OK'
-    print s
+    traj['report'].append(s)
   else:
     problem='"energy.out" missing'
     s='    Energy:           ' + problem + ' '*(32-len(problem))+'!!'
-    trajectories[path]['tana']=0.
-    trajectories[path]['problem']=problem
-    print s
-  return trajectories
+    traj['tana']=0.
+    traj['problem']=problem
+    traj['report'].append(s)
+  return traj
 
 # ======================================================================================================================
 
-def check_populations(path,trajectories,INFOS):
+def check_populations(path,traj,settings):
   #look for large changes in the total population inbetween time steps
+  # Missing steps, number of steps and populations are checked in one pass.
   f=os.path.join(path,'output_data','coeff_diag.out')
   if os.path.isfile(f):
-    f=readfile(f)
-    tana = 0
+    f=open(f)
+    nlines=0
+    problem_length=''
+    tana_length=None
     problem=''
-    try:
-      problem, tana_length = check_consistency(path,trajectories,f,'coeff_diag.out')
-    except:
-      print '\n    An error occured while trying to check coeff_diag.out for consistency.'
-      trajectories[path]['error'] = True
-    if problem == '':
-      problem = check_length(path,trajectories,len(f)-3,'coeff_diag.out')
+    tana=0
     for line in f:
+      nlines+=1
       if '#' in line:
         continue
       x=line.split()
       t=float(x[0])
       pop=float(x[1])
+      if tana_length is None:
+        if t==0.:
+          prevtime = 0
+        elif abs(t - traj['dtstep'] - prevtime) <= 1e-9:
+          prevtime = t
+        else:
+          problem_length='Missing steps in coeff_diag.out'
+          tana_length=float(prevtime)
       if t==0.:
         popmin=pop
         popmax=pop
-      elif t > tana_length:
+      elif tana_length is not None and t > tana_length:
         tana = tana_length
         break
       ok=True
@@ -887,51 +962,54 @@ def check_populations(path,trajectories,INFOS):
         popmin=pop
       if popmax<pop:
         popmax=pop
-      if abs(popmax-popmin)>INFOS['settings']['pop_window']:
+      if abs(popmax-popmin)>settings['pop_window']:
         ok=False
         problem='Fluctuation in Population'
       if not ok:
         break
-    if len(f) <= 3:
-      tana = 0. 
+    if nlines <= 3:
+      nlines+=len(f.readlines())
+    f.close()
+    if problem == '':
+      problem = problem_length
+    if problem == '':
+      problem = check_length(traj,nlines-3,'coeff_diag.out')
+    if nlines <= 3:
+      tana = 0.
       problem='Empty coeff_diag.out file'
-    trajectories[path]['tana']=min(tana,trajectories[path]['tana'])
-    trajectories[path]['problem']=problem
+    traj['tana']=min(tana,traj['tana'])
+    traj['problem']=problem
     s='    Population:       ' + problem + ' '*(32-len(problem))
     if problem:
       s+='at %.2f fs' % tana
     else:
       s+='OK'
-    print s
+    traj['report'].append(s)
   else:
     problem='"coeff_diag.out" missing'
     s='    Population:       ' + problem + ' '*(32-len(problem))+'!!'
-    trajectories[path]['tana']=0.
-    trajectories[path]['problem']=problem
-    print s
-  return trajectories
+    traj['tana']=0.
+    traj['problem']=problem
+    traj['report'].append(s)
+  return traj
 
 # ======================================================================================================================
 
-def check_intruders(path,trajectories,INFOS,lis,tana,problem_length):
+def check_intruders(path,traj,settings,log,lis,tana,problem_length):
   # control for intruder states by comparing detected intruder states in the
   #output.log  to active states in output.lis
-  if INFOS['settings']['intruders']:
-    f=os.path.join(path,'output.log')
-    f=readfile(f)
+  if settings['intruders']:
     ok=True
     problem=''
-    notpossible=False
-    if not check_printlevel(f):
-      notpossible=True
+    notpossible=not log['printlevel']
     prevstep=0
-    for line in f:
+    for line in log['events']:
       if 'ntering timestep' in line:
         tstep=int(line.split()[3])
         if tstep == 0:
           prevstep = 0
         elif tstep - 1 != prevstep:
-          tana = prevstep * trajectories[path]['dtstep']
+          tana = prevstep * traj['dtstep']
           problem = 'Missing steps in output.log'
           break
         prevstep = tstep
@@ -948,7 +1026,7 @@ def check_intruders(path,trajectories,INFOS,lis,tana,problem_length):
           if state==intruder:
             problem='Intruder state found'
             ok=False
-            tana=tstep*trajectories[path]['dtstep']
+            tana=tstep*traj['dtstep']
         else:
           problem='Intruder state found (cannot determine time step)'
           ok=False
@@ -956,15 +1034,186 @@ def check_intruders(path,trajectories,INFOS,lis,tana,problem_length):
         if not ok:
           break
     else:
-      tana = trajectories[path]['laststep']*trajectories[path]['dtstep']
-    trajectories[path]['tana']=min(tana,trajectories[path]['tana'])
+      tana = traj['laststep']*traj['dtstep']
+    traj['tana']=min(tana,traj['tana'])
     s='    Intruder states:  ' + problem + ' '*(32-len(problem))
-    trajectories[path]['problem']=problem
+    traj['problem']=problem
     if problem:
       s+='at %.2f fs' % tana
     else:
       s+='OK'
-    print s
+    traj['report'].append(s)
+  return traj
+
+# ======================================================================================================================
+
+def check_trajectory(path,settings):
+  '''Runs all checks for one trajectory, reading each file once.
+Returns the results, the lines to print are in the list "report".
+The status of the data extractor is inserted later at position "extractor_line" (see extractor_report).'''
+  traj={'error':False, 'filelength':'', 'report':[]}
+  report=traj['report']
+  report.append(centerstring(' '+path+' ',80,'~')+'\n')
+
+  try:
+    traj, missing = check_files(path,traj,settings)
+  except:
+    report.append('\n    An error occured while trying to look for the files.\n')
+    traj['error'] = True
+    return traj
+  if missing:
+    return traj
+
+  try:
+    log = read_log(os.path.join(path,'output.log'))
+    traj = check_runtime(path,traj,settings,log)
+  except:
+    report.append('\n    An error occured while trying to extract the runtime.\n \
+   Files may be corrupted.\n')
+    traj['error'] = True
+    return traj
+
+  try:
+    traj = check_termination(path,traj,settings,log)
+  except:
+    report.append('\n    An error occured while trying to extract the status.\n \
+   Files may be corrupted.\n')
+    traj['error'] = True
+    return traj
+
+  # data extractor (already run before)
+  traj['extractor_line']=len(report)
+
+  try:
+    lis, hops, problem, tana = read_lis(path,traj)
+  except:
+    report.append('\n    An error occured while trying to check output.lis for consistency.')
+    traj['error'] = True
+    lis, hops, problem, tana = {}, [], '', 0.
+  if problem == '':
+    problem = check_length(traj,len(lis),'output.lis')
+  try:
+    traj = check_energies(path,traj,settings,hops)
+  except:
+    report.append('\n    An error occured while trying to extract the energies.\n \
+   Files may be corrupted.\n')
+    traj['error'] = True
+  try:
+    traj = check_populations(path,traj,settings)
+  except:
+    report.append('\n    An error occured while trying to extract the populations.\n \
+   Files may be corrupted.\n')
+    traj['error'] = True
+  try:
+    traj = check_intruders(path,traj,settings,log,lis,tana,problem)
+  except:
+    report.append('\n    An error occured while trying to extract possible intruder states.\n \
+   Files may be corrupted.\n')
+    traj['error'] = True
+
+  if traj['filelength'] != '':
+    report.append(traj['filelength'])
+  report.append('\n\n')
+  return traj
+
+# ======================================================================================================================
+
+def file_stamps(path):
+  '''Size and modification time of all files read by check_trajectory.'''
+  stamps={}
+  for f in CHECKED_FILES:
+    filename=os.path.join(path,f)
+    if os.path.exists(filename):
+      stamps[f]=[os.path.getsize(filename),os.path.getmtime(filename)]
+    else:
+      stamps[f]=None
+  restart=os.path.join(path,'restart')
+  stamps['restart/']=os.path.isdir(restart) and len(os.listdir(restart))>0
+  return stamps
+
+def read_cache(idir):
+  try:
+    f=open(os.path.join(idir,CACHE))
+    cache=json.load(f)
+    f.close()
+  except (IOError, ValueError):
+    cache={}
+  return cache
+
+def write_cache(idir,cache):
+  filename=os.path.join(idir,CACHE)
+  try:
+    f=open(filename+'.tmp','w')
+    json.dump(cache,f)
+    f.close()
+    os.rename(filename+'.tmp',filename)
+  except (IOError, OSError):
+    pass
+
+def extractor_report(traj,extracted):
+  '''Returns a copy of the results with the status of the data extractor in the report.'''
+  traj=dict(traj)
+  traj['report']=list(traj['report'])
+  if extracted!=None and 'extractor_line' in traj:
+    if extracted==0:
+      line='    Data extractor...                                 OK'
+    else:
+      line='    Data extractor...                                 FAILED (exit code %i)' % (extracted)
+    traj['report'].insert(traj['extractor_line'],line)
+  return traj
+
+def check_trajectories(paths,settings,extracted,ncpu=1):
+  '''Runs check_trajectory for all paths on ncpu processes.
+
+The results are stored in a cache file in each ensemble directory and are reused as long as
+the files of the trajectory, the settings and the success of the extractor are unchanged.
+The status of the extractor of the current run is not cached, but added to the reports afterwards.
+Trajectories which are still running are always checked again.'''
+  settings=json.loads(json.dumps(settings))
+  key=dict( [ (i,settings[i]) for i in settings if not i in ['ncpu','always_update','extractor_mode'] ] )
+  # an up-to-date extraction (None) and a successful one (0) give the same files
+  def failed(path):
+    return extracted[path] not in [None,0]
+  caches={}
+  stamps={}
+  trajectories={}
+  todo=[]
+  for path in paths:
+    idir,itraj=os.path.split(os.path.normpath(path))
+    if idir not in caches:
+      caches[idir]=read_cache(idir)
+    stamps[path]=file_stamps(path)
+    entry=caches[idir].get(itraj)
+    if entry and entry['stamps']==stamps[path] and entry['settings']==key and entry.get('extract_failed')==failed(path):
+      trajectories[path]=entry['result']
+    else:
+      todo.append(path)
+  print 'Checking %i of %i trajectories on %i CPUs (%i unchanged) ...\n' % (len(todo),len(paths),ncpu,len(paths)-len(todo))
+
+  if ncpu>1 and len(todo)>1:
+    pool=Pool(processes=ncpu)
+    results={}
+    for path in todo:
+      results[path]=pool.apply_async(check_trajectory,[path,settings])
+    pool.close()
+    pool.join()
+    for path in todo:
+      trajectories[path]=results[path].get()
+  else:
+    for path in todo:
+      trajectories[path]=check_trajectory(path,settings)
+
+  # only finished trajectories can be reused, the status of running ones depends on the time
+  for path in todo:
+    idir,itraj=os.path.split(os.path.normpath(path))
+    if trajectories[path].get('terminated',True):
+      caches[idir][itraj]={'stamps':stamps[path], 'settings':key, 'extract_failed':failed(path), 'result':trajectories[path]}
+    elif itraj in caches[idir]:
+      del caches[idir][itraj]
+  for idir in caches:
+    write_cache(idir,caches[idir])
+  for path in paths:
+    trajectories[path]=extractor_report(trajectories[path],extracted[path])
   return trajectories
 
 # ======================================================================================================================
@@ -977,149 +1226,40 @@ def do_calc(INFOS):
   if sharcpath==None:
     print 'Please set $SHARC to the directory containing the SHARC executables!'
     sys.exit(1)
-  cwd=os.getcwd()
 
-  # go through directories
-  trajectories={}
-  ntraj=0
-  print 'Checking the directories...'
+  # run the data extractor for all trajectories which need an update
+  paths=[]
   for idir in INFOS['paths']:
-    ls=os.listdir(idir)
-    ls.sort()
-    for itraj in ls:
-      if not 'TRAJ_' in itraj:
-        continue
-      path=os.path.join(idir,itraj)
-      trajectories[path]={}
-      print centerstring(' '+path+' ',80,'~')+'\n'
-      trajectories[path]['error'] = False
-      trajectories[path]['filelength'] = ''
-
-      try:
-        trajectories, missing = check_files(path,trajectories,INFOS)
-      except:
-        print '\n    An error occured while trying to look for the files.\n'
-        trajectories[path]['error'] = True
-        continue
-      if missing:
-        continue
-
-      try:
-        trajectories, f = check_runtime(path, trajectories,INFOS)
-      except:
-        print '\n    An error occured while trying to extract the runtime.\n \
-   Files may be corrupted.\n'
-        trajectories[path]['error'] = True
-        continue
-
-      try:
-        trajectories = check_termination(path, trajectories,INFOS,f)
-      except:
-        print '\n    An error occured while trying to extract the status.\n \
-   Files may be corrupted.\n'
-        trajectories[path]['error'] = True   
-        continue
- 
-      # run data extractor
-      update=False
-      if not os.path.isfile(os.path.join(path,'output_data','expec.out')):
-        update=True
-      if not update:
-        time_dat=os.path.getmtime(os.path.join(path,'output.dat'))
-        try:
-          time_expec=os.path.getmtime(os.path.join(path,'output_data','expec.out'))
-          if time_dat > time_expec:
-            update=True
-          time_expec=os.path.getmtime(os.path.join(path,'output_data','energy.out'))
-          if time_dat > time_expec:
-            update=True
-          time_expec=os.path.getmtime(os.path.join(path,'output_data','coeff_diag.out'))
-          if time_dat > time_expec:
-            update=True
-        except OSError:
-          update=True
-      if INFOS['settings']['always_update']:
-        update=True
-        print 'update is true'
-
-      # run extractor
-      if update:
-        sys.stdout.write('    Data extractor...                                 ')
-        sys.stdout.flush()
-        os.chdir(path)
-        mapping={'default':'-s',
-                 'small':'-s',
-                 'large':'-l',
-                 'extralarge':'-xl',
-                 'extrasmall':'-xs',
-                 's':'-s',
-                 'xs':'-xs',
-                 'l':'-l',
-                 'xl':'-xl'
-                }
-        if 'dont' in INFOS['settings']['extractor_mode'].lower():
-          os.chdir(cwd)
-          sys.stdout.write('SKIPPED\n')
-        else:
-          opt=mapping[ INFOS['settings']['extractor_mode'].lower() ]
-          if os.path.isfile('output.dat.nc'):
-            opt+=' -xyz '
-            io=sp.call('. $SHARC/sharcvars.sh;'+sharcpath+'/data_extractor_NetCDF.x %s output.dat > /dev/null 2> /dev/null' % opt ,shell=True)
-          else:
-            io=sp.call(sharcpath+'/data_extractor.x %s output.dat > /dev/null 2> /dev/null' % opt ,shell=True)
-          if io!=0:
-            print 'WARNING: extractor call failed for %s! Exit code %i' % (path,io)
-          os.chdir(cwd)
-          sys.stdout.write('OK\n')
-      else:
-        pass
-
-      #save output.lis as dict with timestep as keys
-      lis = {}
-      f=os.path.join(path,'output.lis')
-      f=readfile(f)
-      hops = []
-      step = 0
-      for line in f:
-        if '#' in line:
-          if 'Surface Hop' in line:
-            hops.append(step)
-          continue
-        x=line.split()
-        lis[float(x[0])]=x[1:]
-        step += 1
-      try:
-        problem, tana = check_consistency(path,trajectories,f,'output.lis')
-      except:
-        print '\n    An error occured while trying to check output.lis for consistency.'
-        trajectories[path]['error'] = True 
-      if problem == '':
-        problem = check_length(path,trajectories,len(lis),'output.lis')
-      try:
-        trajectories = check_energies(path,trajectories,INFOS,hops)
-      except:
-        print '\n    An error occured while trying to extract the energies.\n \
-   Files may be corrupted.\n'
-        trajectories[path]['error'] = True   
-      try:
-        trajectories = check_populations(path,trajectories,INFOS)
-      except:
-        print '\n    An error occured while trying to extract the populations.\n \
-   Files may be corrupted.\n'
-        trajectories[path]['error'] = True   
-      try:
-        trajectories = check_intruders(path,trajectories,INFOS,lis,tana,problem)
-      except:
-        print '\n    An error occured while trying to extract possible intruder states.\n \
-   Files may be corrupted.\n'
-        trajectories[path]['error'] = True   
-
-
-      #sys.stdout.write(s)
-
-      if  trajectories[path]['filelength'] != '':
-        print trajectories[path]['filelength']
-      print '\n\n'
+    for itraj in sorted(os.listdir(idir)):
+      if 'TRAJ_' in itraj:
+        paths.append(os.path.join(idir,itraj))
+  if 'dont' in INFOS['settings']['extractor_mode'].lower():
+    extracted=dict( [ (path,None) for path in paths ] )
+  else:
+    mapping={'default':'-s',
+             'small':'-s',
+             'large':'-l',
+             'extralarge':'-xl',
+             'extrasmall':'-xs',
+             's':'-s',
+             'xs':'-xs',
+             'l':'-l',
+             'xl':'-xl'
+            }
+    opt=mapping[ INFOS['settings']['extractor_mode'].lower() ]
+    extracted=data_extraction.run_extractors(paths,sharcpath,options=opt,
+                                             checkfiles=['expec.out','energy.out','coeff_diag.out'],
+                                             always=INFOS['settings']['always_update'],
+                                             ncpu=max(1,int(INFOS['settings']['ncpu'])),
+                                             netcdf_options='-xyz',netcdf_env=True)
+    print ''
+
+  # check the trajectories
+  print 'Checking the directories...'
+  trajectories=check_trajectories(paths,INFOS['settings'],extracted,ncpu=max(1,int(INFOS['settings']['ncpu'])))
+  for path in paths:
+    for line in trajectories[path]['report']:
+      print line
 
 
 
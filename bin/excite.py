@@ -45,14 +45,20 @@ import datetime
 from optparse import OptionParser
 import readline
 import time
+from multiprocessing import Pool, cpu_count
 
 try:
   import numpy
   NONUMPY=False
 except ImportError:
-  import subprocess as sp
   NONUMPY=True
 
+# shared modules in $SHARC/../lib
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.realpath(__file__)),'..','lib'))
+import eigensolver
+from initconds import ATOM, STATE, INITCOND, INITCONDS, write_initconds
+from qmout import QMOUT, as_lists
+
 # =========================================================0
 # compatibility stuff
 
@@ -81,185 +87,8 @@ version='2.1'
 versionneeded=[0.2, 1.0, 2.0, 2.1, float(version)]
 versiondate=datetime.date(2019,9,1)
 
-# ======================================================================================================================
-# ======================================================================================================================
-# ======================================================================================================================
-
-def try_read(l,index,typefunc,default):
-  try:
-    if typefunc==bool:
-      return 'True'==l[index]
-    else:
-      return typefunc(l[index])
-  except IndexError:
-    return typefunc(default)
-  except ValueError:
-    print 'Could not initialize object!'
-    quit(1)
-
-# ======================================================================================================================
-
-class ATOM:
-  def __init__(self,symb='??',num=0.,coord=[0.,0.,0.],m=0.,veloc=[0.,0.,0.]):
-    self.symb  = symb
-    self.num   = num
-    self.coord = coord
-    self.mass  = m
-    self.veloc = veloc
-    self.Ekin=0.5*self.mass * sum( [ self.veloc[i]**2 for i in range(3) ] )
-
-  def init_from_str(self,initstring=''):
-    f=initstring.split()
-    self.symb  =   try_read(f,0,str,  '??')
-    self.num   =   try_read(f,1,float,0.)
-    self.coord = [ try_read(f,i,float,0.) for i in range(2,5) ]
-    self.mass  =   try_read(f,5,float,0.)*U_TO_AMU
-    self.veloc = [ try_read(f,i,float,0.) for i in range(6,9) ]
-    self.Ekin=0.5*self.mass * sum( [ self.veloc[i]**2 for i in range(3) ] )
-
-  def __str__(self):
-    s ='%2s % 5.1f '               % (self.symb, self.num)
-    s+='% 12.8f % 12.8f % 12.8f '  % tuple(self.coord)
-    s+='% 12.8f '                  % (self.mass/U_TO_AMU)
-    s+='% 12.8f % 12.8f % 12.8f'   % tuple(self.veloc)
-    return s
-
-  def EKIN(self):
-    self.Ekin=0.5*self.mass * sum( [ self.veloc[i]**2 for i in range(3) ] )
-    return self.Ekin
-
-  def geomstring(self):
-    s='  %2s % 5.1f % 12.8f % 12.8f % 12.8f % 12.8f' % (self.symb,self.num,self.coord[0],self.coord[1],self.coord[2],self.mass/U_TO_AMU)
-    return s
-
-  def velocstring(self):
-    s=' '*11+'% 12.8f % 12.8f % 12.8f' % tuple(self.veloc)
-    return s
-
-# ======================================================================================================================
-
-class STATE:
-  def __init__(self,i=0,e=0.,eref=0.,dip=[0.,0.,0.]):
-    self.i       = i
-    self.e       = e.real
-    self.eref    = eref.real
-    self.dip     = dip
-    self.Excited = False
-    self.Eexc    = self.e-self.eref
-    self.Fosc    = (2./3.*self.Eexc*sum( [i*i.conjugate() for i in self.dip] ) ).real
-    if self.Eexc==0.:
-      self.Prob  = 0.
-    else:
-      self.Prob  = self.Fosc/self.Eexc**2
-
-  def init_from_str(self,initstring):
-    f=initstring.split()
-    self.i       =   try_read(f,0,int,  0 )
-    self.e       =   try_read(f,1,float,0.)
-    self.eref    =   try_read(f,2,float,0.)
-    self.dip     = [ complex( try_read(f,i,float,0.),try_read(f,i+1,float,0.) ) for i in [3,5,7] ]
-    self.Excited =   try_read(f,11,bool, False)
-    self.Eexc    = self.e-self.eref
-    self.Fosc    = (2./3.*self.Eexc*sum( [i*i.conjugate() for i in self.dip] ) ).real
-    if self.Eexc==0.:
-      self.Prob  = 0.
-    else:
-      self.Prob  = self.Fosc/self.Eexc**2
-
-  def __str__(self):
-    s ='%03i % 18.10f % 18.10f ' % (self.i,self.e,self.eref)
-    for i in range(3):
-      s+='% 12.8f % 12.8f ' % (self.dip[i].real,self.dip[i].imag)
-    s+='% 12.8f % 12.8f %s' % (self.Eexc*HARTREE_TO_EV,self.Fosc,self.Excited)
-    return s
-
-  def Excite(self,max_Prob,erange):
-    try:
-      Prob=self.Prob/max_Prob
-    except ZeroDivisionError:
-      Prob=-1.
-    if not (erange[0] <= self.Eexc <= erange[1]):
-      Prob=-1.
-    self.Excited=(random.random() < Prob)
-
-# ======================================================================================================================
-
-class INITCOND:
-  def __init__(self,atomlist=[],eref=0.,epot_harm=0.):
-    self.atomlist=atomlist
-    self.eref=eref
-    self.Epot_harm=epot_harm
-    self.natom=len(atomlist)
-    self.Ekin=sum( [atom.Ekin for atom in self.atomlist] )
-    self.statelist=[]
-    self.nstate=0
-    self.Epot=epot_harm
-
-  def addstates(self,statelist):
-    self.statelist=statelist
-    self.nstate=len(statelist)
-    self.Epot=self.statelist[0].e-self.eref
-
-  def init_from_file(self,f,eref,index):
-    while True: 
-      line=f.readline()
-      #if 'Index     %i' % (index) in line:
-      if re.search('Index\s+%i' % (index),line):
-        break
-      if line=='\n':
-        continue
-      if line=='':
-        print 'Initial condition %i not found in file %s' % (index,f.name)
-        quit(1)
-    f.readline()        # skip one line, where "Atoms" stands
-    atomlist=[]
-    while True:
-      line=f.readline()
-      if 'States' in line:
-        break
-      atom=ATOM()
-      atom.init_from_str(line)
-      atomlist.append(atom)
-    statelist=[]
-    while True:
-      line=f.readline()
-      if 'Ekin' in line:
-        break
-      state=STATE()
-      state.init_from_str(line)
-      statelist.append(state)
-    epot_harm=0.
-    while not line=='\n' and not line=='':
-      line=f.readline()
-      if 'epot_harm' in line.lower():
-        epot_harm=float(line.split()[1])
-        break
-    self.atomlist=atomlist
-    self.eref=eref
-    self.Epot_harm=epot_harm
-    self.natom=len(atomlist)
-    self.Ekin=sum( [atom.Ekin for atom in self.atomlist] )
-    self.statelist=statelist
-    self.nstate=len(statelist)
-    if self.nstate>0:
-      self.Epot=self.statelist[0].e-self.eref
-    else:
-      self.Epot=epot_harm
-
-  def __str__(self):
-    s='Atoms\n'
-    for atom in self.atomlist:
-      s+=str(atom)+'\n'
-    s+='States\n'
-    for state in self.statelist:
-      s+=str(state)+'\n'
-    s+='Ekin      % 16.12f a.u.\n' % (self.Ekin)
-    s+='Epot_harm % 16.12f a.u.\n' % (self.Epot_harm)
-    s+='Epot      % 16.12f a.u.\n' % (self.Epot)
-    s+='Etot_harm % 16.12f a.u.\n' % (self.Epot_harm+self.Ekin)
-    s+='Etot      % 16.12f a.u.\n' % (self.Epot+self.Ekin)
-    s+='\n\n'
-    return s
+# cache of the parsed QM.out files in the ICONDS directory
+QMOUT_CACHE='QMout.cache.npz'
 
 # ======================================================================================================================
 # ======================================================================================================================
@@ -455,132 +284,125 @@ def question(question,typefunc,default=None,autocomplete=True,ranges=False):
 # ======================================================================================================================
 # ======================================================================================================================
 
-def read_matrix(qmout,i,filename):
-  line=qmout[i].split()
-  try:
-    n1=int(line[0])
-    n2=int(line[1])
-  except ValueError:
-    print 'Could not read number of states of matrix in %s' % (filename)
-    return None
-  if not n1==n2:
-    print 'Non-square matrix in %s!' % (filename)
-    return None
-  i+=1
-  A=[]
-  try:
-    for irow in range(n1):
-      line=qmout[i].split()
-      a=[]
-      for icol in range(n1):
-        re=float(line[0+2*icol])
-        im=float(line[1+2*icol])
-        a.append(complex(re,im))
-      A.append(a)
-      i+=1
-  except (ValueError,IndexError):
-    print 'Matrix malformatted in %s' % (filename)
-    return None
-  return A
-
-# =======================================
-
-def find_flag(qmout,flag,filename):
-  i=0
-  try:
-    while not '! %i' % (flag) in qmout[i]:
-      i+=1
-  except IndexError:
-    print 'No matrix with flag %i in %s!' % (flag,filename)
-    return None
-  return i
-
-# =======================================
-
 def extractQMout(filename,readP=False,readS=False):
   '''Takes the path to a QM.out file and returns the Hamiltonian, the Dipole matrices and the property matrix'''
   try:
-    qmoutf=open(filename,'r')
-    qmout=qmoutf.readlines()
-    qmoutf.close()
-  except IOError:
+    qmout=QMOUT(filename)
+  except (IOError,OSError):
     print 'Could not find %s!' % (filename)
     return None,None,None,None
 
-  i=find_flag(qmout,1,filename)
-  if i==None:
+  try:
+    if not 'h' in qmout:
+      print 'No matrix with flag 1 in %s!' % (filename)
+      return None,None,None,None
+    H=as_lists(qmout.get('h'))
+
+    if not 'dm' in qmout:
+      print 'No matrix with flag 2 in %s!' % (filename)
+      DM=None
+    else:
+      DM=as_lists(qmout.get('dm'))
+
+    if readP:
+      if not 'prop' in qmout:
+        print 'No matrix with flag 11 in %s!' % (filename)
+        return H,DM,None,None
+      P=as_lists(qmout.get('prop'))
+    else:
+      P=None
+
+    if readS:
+      if not 'overlap' in qmout:
+        print 'No matrix with flag 6 in %s!' % (filename)
+        return H,DM,P,None
+      S=as_lists(qmout.get('overlap'))
+    else:
+      S=None
+  except ValueError:
+    print 'Matrix malformatted in %s' % (filename)
     return None,None,None,None
-  H=read_matrix(qmout,i+1,filename)
 
-  i=find_flag(qmout,2,filename)
-  if i==None:
-    DM=None
-  else:
-    #return H,None,None
-    DM=[]
-    for idir in range(3):
-      DM.append(read_matrix(qmout,i+1,filename))
-      if DM[-1]==None:
-        DM=None
-        break
-      i+=len(DM[-1])+1
+  return H,DM,P,S
 
-  if readP:
-    i=find_flag(qmout,11,filename)
-    if i==None:
-      return H,DM,None,None
-    P=read_matrix(qmout,i+1,filename)
-  else:
-    P=None
+# =======================================
 
-  if readS:
-    i=find_flag(qmout,6,filename)
-    if i==None:
-      return H,DM,P,None
-    S=read_matrix(qmout,i+1,filename)
-  else:
-    S=None
+def extractQMouts(filenames,readP=False,readS=False):
+  '''Runs extractQMout for a list of files (one job of the process pool in get_QMout).'''
+  return [ extractQMout(filename,readP,readS) for filename in filenames ]
 
-  return H,DM,P,S
+# =======================================
 
-# ======================================================================================================================
+def read_QMout_cache(iconddir):
+  '''Reads the matrices of the QM.out files stored by write_QMout_cache.
 
-class diagonalizer:
-  def __init__(self):
-    exe=os.getenv('SHARC')
-    exe=os.path.expanduser(os.path.expandvars(exe))+'/diagonalizer.x'
-    if not os.path.isfile(exe):
-      print 'SHARC auxilliary diagonalizer not found at %s!' % (exe)
-      sys.exit(1)
-    self.exe=exe
-  def eigh(self,H):
-    STDIN='C %i %i\nTitle\n' % (len(H),len(H))
-    for x in H:
-      for y in x:
-        STDIN+='%20.13f %20.13f ' % (y.real,y.imag)
-      STDIN+='\n'
-    proc=sp.Popen(self.exe,stdin=sp.PIPE,stdout=sp.PIPE)
-    STDOUT=proc.communicate(input=STDIN)[0].split('\n')
-    shift=1
-    for ix in range(len(H)):
-      line=STDOUT[shift+ix].split()
-      for iy in range(len(H)):
-        H[ix][iy]=complex(float(line[0+2*iy]),float(line[1+2*iy]))
-    U=[ [ 0. for i in range(len(H)) ] for j in range(len(H)) ]
-    shift=2+len(H)
-    for ix in range(len(H)):
-      line=STDOUT[shift+ix].split()
-      for iy in range(len(H)):
-        U[ix][iy]=complex(float(line[0+2*iy]),float(line[1+2*iy]))
-    return H,U
+  Returns a dictionary icond -> (mtime,H,DM,P,S), which is empty if there is no cache.'''
+  try:
+    npz=numpy.load(os.path.join(iconddir,QMOUT_CACHE))
+    data=dict( [ (key,npz[key]) for key in npz.files ] )
+    npz.close()
+  except (IOError,ValueError,KeyError):
+    return {}
+  cache={}
+  for k,icond in enumerate(data['icond']):
+    n=data['nstate'][k]
+    H=data['H'][k,:n,:n].tolist()
+    DM,P,S=None,None,None
+    if data['hasDM'][k]:
+      DM=data['DM'][k,:,:n,:n].tolist()
+    if data['hasP'][k]:
+      P=data['P'][k,:n,:n].tolist()
+    if data['hasS'][k]:
+      S=data['S'][k,:n,:n].tolist()
+    cache[int(icond)]=(data['mtime'][k],H,DM,P,S)
+  return cache
+
+# =======================================
+
+def write_QMout_cache(iconddir,cache):
+  '''Stores the matrices of all QM.out files as one set of arrays in ICONDS/QMout.cache.npz (skipped if not writable).'''
+  iconds=sorted(cache)
+  ncond=len(iconds)
+  nstate=numpy.array( [ len(cache[icond][1]) for icond in iconds ],dtype=int)
+  n=max( [0]+list(nstate) )
+  data={'icond':  numpy.array(iconds,dtype=int),
+        'mtime':  numpy.array( [ cache[icond][0] for icond in iconds ] ),
+        'nstate': nstate,
+        'H':      numpy.zeros((ncond,n,n),dtype=complex),
+        'DM':     numpy.zeros((ncond,3,n,n),dtype=complex),
+        'P':      numpy.zeros((ncond,n,n),dtype=complex),
+        'S':      numpy.zeros((ncond,n,n),dtype=complex),
+        'hasDM':  numpy.zeros(ncond,dtype=bool),
+        'hasP':   numpy.zeros(ncond,dtype=bool),
+        'hasS':   numpy.zeros(ncond,dtype=bool)}
+  for k,icond in enumerate(iconds):
+    mtime,H,DM,P,S=cache[icond]
+    m=nstate[k]
+    data['H'][k,:m,:m]=H
+    for key,A in [('DM',DM),('P',P),('S',S)]:
+      if A is not None:
+        data['has'+key][k]=True
+        data[key][k,...,:m,:m]=A
+  filename=os.path.join(iconddir,QMOUT_CACHE)
+  try:
+    f=open(filename+'.tmp','wb')
+    numpy.savez(f,**data)
+    f.close()
+    os.rename(filename+'.tmp',filename)
+  except (IOError,OSError):
+    pass
 
 # ======================================================================================================================
 
-def transform(H,DM,P):
-  '''transforms the H and DM matrices in the representation where H is diagonal.'''
+def transform(H,DM,P,eig=None,U=None):
+  '''transforms the H and DM matrices in the representation where H is diagonal.
+
+  eig and U can be passed if H was already diagonalized (see get_QMout).'''
 
+  if U is None:
+    eig,U=eigensolver.eigh(H)
   if NONUMPY:
-    H,U=diagon.eigh(H)
+    H=[ [ complex(eig[i] if i==j else 0.) for j in range(len(H)) ] for i in range(len(H)) ]
     UDMU=[ [ [ 0. for i in range(len(H)) ] for j in range(len(H)) ] for k in range(3) ]
     for xyz in range(3):
       temp=[ [ 0. for i in range(len(H)) ] for j in range(len(H)) ]
@@ -607,7 +429,6 @@ def transform(H,DM,P):
             P[a][b]+=temp[a][i]*U[i][b]
 
   else:
-    eig,U=numpy.linalg.eigh(H)
     Ucon=[ [ 0. for i in range(len(H)) ] for j in range(len(H)) ]
     for ix in range(len(U)):
       for iy in range(len(U)):
@@ -1024,14 +845,14 @@ def get_initconds(INFOS):
         INFOS['eref']=float(line.split()[1])
         break
 
+  initconds=INITCONDS(INFOS['initf'].name,INFOS['eref'])
   initlist=[]
   width_bar=50
   for icond in range(1,INFOS['ninit']+1):
-    initcond=INITCOND()
-    initcond.init_from_file(INFOS['initf'],INFOS['eref'],icond)
-    initlist.append(initcond)
+    initlist.append(initconds.get(icond))
     done=width_bar*(icond)/INFOS['ninit']
     sys.stdout.write('\r  Progress: ['+'='*done+' '*(width_bar-done)+'] %3i%%' % (done*100/width_bar))
+  initconds.close()
   print '\nNumber of initial conditions in file:       %5i' % (INFOS['ninit'])
   return initlist
 
@@ -1057,24 +878,69 @@ def get_QMout(INFOS,initlist):
 
   print '\nReading QM.out data ...'
   if NONUMPY and  INFOS['diag']:
-    print 'NUMPY not found, will use external SHARC diagonalizer...'
-    global diagon
-    diagon=diagonalizer()
-  ncond=0
+    print 'NUMPY not found, will use (slow) Python diagonalizer...'
   initstate=INFOS['initstate']
   width_bar=50
+
+  # matrices of unchanged QM.out files are taken from the cache
+  if NONUMPY:
+    cache={}
+  else:
+    cache=read_QMout_cache(INFOS['iconddir'])
+  results={}
+  todo=[]
   for icond in range(1,INFOS['ninit']+1):
     # look for a QM.out file
     qmfilename=INFOS['iconddir']+'/ICOND_%05i/QM.out' % (icond)
-    done=width_bar*(icond)/INFOS['ninit']
-    sys.stdout.write('\r  Progress: ['+'='*done+' '*(width_bar-done)+'] %3i%%' % (done*100/width_bar))
     if not os.path.isfile(qmfilename):
       #print 'No QM.out for ICOND_%05i!' % (icond)
       continue
-    ncond+=1
-    H,DM,P,Smat=extractQMout(qmfilename,INFOS['ion'],INFOS['diabatize'])
+    mtime=os.path.getmtime(qmfilename)
+    if icond in cache:
+      t,H,DM,P,Smat=cache[icond]
+      if t==mtime and (P is not None or not INFOS['ion']) and (Smat is not None or not INFOS['diabatize']):
+        results[icond]=(H,DM,P,Smat)
+        continue
+    todo.append( (icond,qmfilename,mtime) )
+  if results:
+    print 'Matrices of %i QM.out files taken from %s' % (len(results),os.path.join(INFOS['iconddir'],QMOUT_CACHE))
+
+  # parse the other files in parallel, in chunks of files
+  ncpu=max(1,min(INFOS['ncpu'],len(todo)))
+  nchunk=max(1,len(todo)/(4*ncpu))
+  chunks=[ todo[i:i+nchunk] for i in range(0,len(todo),nchunk) ]
+  if ncpu>1:
+    pool=Pool(processes=ncpu)
+    jobs=[ pool.apply_async(extractQMouts,[ [ qmfilename for (icond,qmfilename,mtime) in chunk ],INFOS['ion'],INFOS['diabatize'] ]) for chunk in chunks ]
+    pool.close()
+  ndone=0
+  for ichunk,chunk in enumerate(chunks):
+    if ncpu>1:
+      matrices=jobs[ichunk].get()
+    else:
+      matrices=extractQMouts( [ qmfilename for (icond,qmfilename,mtime) in chunk ],INFOS['ion'],INFOS['diabatize'])
+    for (icond,qmfilename,mtime),(H,DM,P,Smat) in zip(chunk,matrices):
+      if H is None:
+        continue
+      results[icond]=(H,DM,P,Smat)
+      cache[icond]=(mtime,H,DM,P,Smat)
+    ndone+=len(chunk)
+    done=width_bar*ndone/len(todo)
+    sys.stdout.write('\r  Progress: ['+'='*done+' '*(width_bar-done)+'] %3i%%' % (done*100/width_bar))
+  if ncpu>1:
+    pool.join()
+  if todo and not NONUMPY:
+    write_QMout_cache(INFOS['iconddir'],cache)
+  qmouts=[ (icond,)+results[icond] for icond in sorted(results) ]
+  ncond=len(qmouts)
+
+  # diagonalize all Hamiltonians at once
+  if INFOS['diag']:
+    eighs=eigensolver.eigh_batch( [ H for (icond,H,DM,P,Smat) in qmouts ] )
+
+  for iqm,(icond,H,DM,P,Smat) in enumerate(qmouts):
     if INFOS['diag']:
-      H,DM,P=transform(H,DM,P)
+      H,DM,P=transform(H,DM,P,*eighs[iqm])
     if INFOS['diabatize']:
       thres=0.5
       #string=''
@@ -1224,27 +1090,15 @@ def writeoutput(initlist,INFOS):
 
   print 'Writing output to %s ...' % (outfilename)
 
-  string='''SHARC Initial conditions file, version %s   <Excited>
-Ninit     %i
-Natom     %i
-Repr      %s
-Eref      %18.10f
-Eharm     %18.10f
-''' % (version,INFOS['ninit'],INFOS['natom'],INFOS['repr'],INFOS['eref'],INFOS['eharm'])
-  if INFOS['states']:
-    string+='States    '
-    for n in INFOS['states']:
-      string+='%i ' % (n)
-  string+='\n\n\nEquilibrium\n'
-
-  for atom in INFOS['equi']:
-    string+=str(atom)+'\n'
-  string+='\n\n'
-
-  for i,icond in enumerate(initlist):
-    string+= 'Index     %i\n%s' % (i+1, str(icond))
-  outf.write(string)
-  outf.close()
+  header={'excited': True,
+          'ninit':   INFOS['ninit'],
+          'natom':   INFOS['natom'],
+          'repr':    INFOS['repr'],
+          'eref':    INFOS['eref'],
+          'eharm':   INFOS['eharm'],
+          'states':  INFOS['states'],
+          'equi':    INFOS['equi']}
+  write_initconds(outf,header,version,enumerate(initlist,1))
 
 # ======================================================================================================================
 # ======================================================================================================================
@@ -1263,14 +1117,15 @@ information to determine which initial conditions are bright enough for a dynami
   parser = OptionParser(usage=usage, description=description)
   #parser.add_option('--no-excitation', dest='E', action='store_true',default=False,help="Sets all excitations to false.")
   #parser.add_option('--ground-state-only', dest='G', action='store_true',default=False,help="Selects the ground state of all initial conditions, and no excited states (e.g., for dynamics with laser excitation).")
-  #(options, args) = parser.parse_args()
+  parser.add_option('-j', dest='ncpu', type=int, nargs=1, default=cpu_count(), help="Number of processes for reading the QM.out files (default: number of CPUs)")
+  (options, args) = parser.parse_args()
 
   displaywelcome()
   open_keystrokes()
 
 
   #INFOS={'do_excitations': not options.E, 'ground_state_only': options.G}
-  INFOS={}
+  INFOS={'ncpu': options.ncpu}
   INFOS=get_infos(INFOS)
 
   print '\n\n'+centerstring('Full input',60,'#')+'\n'
@@ -33,6 +33,15 @@ import re
 import datetime
 from optparse import OptionParser
 
+# shared modules in $SHARC/../lib
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.realpath(__file__)),'..','lib'))
+try:
+  import numpy
+  import internal_coordinates
+  NONUMPY=False
+except ImportError:
+  NONUMPY=True
+
 # =========================================================0
 # compatibility stuff
 
@@ -674,6 +683,87 @@ def calculate(g,req,comm):
         comm=' '*(f-14+comment_bonus)+'<EMPTY_STRING>'
       s+=commentstring % (comm[0:f+comment_bonus].strip())
   return s
+
+def to_angle(a):
+  if Radians:
+    return a
+  else:
+    return a/deg2rad
+
+def calculate_all(G,comments,req):
+  '''Calculates all requested internal coordinates for all geometries at once.
+
+G is an array (nframe,natom,3), comments the comment lines of the geometries.
+Returns the columns of the table as a list of (prefix,format,values) and an array (nframe,ncolumn) 
+with the numbers (NaN for the text columns).'''
+  comment_bonus=50
+  formatstring='%%%i.%if ' % (f,p)
+  stringstring='%%%is ' % (f)
+  commentstring='%%%is ' % (f+comment_bonus)
+  nframe=len(G)
+  lengthfactor=[1.,ang2bohr][bool(Bohrs)]
+  nans=numpy.zeros(nframe)+numpy.nan
+  columns=[]
+  numbers=[]
+  def add(values,fmt=formatstring,prefix=''):
+    if fmt==formatstring:
+      numbers.append(values)
+      values=values.tolist()
+    else:
+      numbers.append(nans)
+    columns.append( (prefix,fmt,values) )
+  def undefined(values,name):
+    n=numpy.sum(numpy.isnan(values))
+    if n>0:
+      sys.stderr.write('Undefined %s angle in %i geometries!\n' % (name,n))
+  for r in req:
+    atoms=[ G[:,i-1] for i in r[1:] ]
+    if r[0]=='x':
+      add(atoms[0][:,0]*lengthfactor)
+    elif r[0]=='y':
+      add(atoms[0][:,1]*lengthfactor)
+    elif r[0]=='z':
+      add(atoms[0][:,2]*lengthfactor)
+    elif r[0]=='r':
+      add(internal_coordinates.distance(*atoms)*lengthfactor)
+    elif r[0]=='a':
+      add(to_angle(internal_coordinates.bond_angle(*atoms)))
+    elif r[0]=='p':
+      a=internal_coordinates.pyramidalization(*atoms)
+      undefined(a,'pyramidalization')
+      add(to_angle(a))
+    elif r[0]=='q':
+      add(to_angle(internal_coordinates.pyramidalization_bisector(*atoms)))
+    elif r[0]=='d':
+      a=internal_coordinates.dihedral(*atoms)
+      undefined(a,'dihedral')
+      add(to_angle(a))
+    elif r[0]=='5':
+      q,ph=internal_coordinates.cremer_pople5(G[:,[i-1 for i in r[1:]]])
+      ph=numpy.abs(ph)
+      add(q*lengthfactor)
+      add(to_angle(ph))
+      add([ '$'+i+'$' for i in internal_coordinates.boeyens5(ph/deg2rad,BOEYENS_5) ],stringstring)
+    elif r[0]=='6':
+      Q,ph,th=internal_coordinates.cremer_pople6(G[:,[i-1 for i in r[1:]]])
+      add(Q*lengthfactor)
+      add(to_angle(ph))
+      add(to_angle(th))
+      add([ '$'+i+'$' for i in internal_coordinates.boeyens6(ph/deg2rad,th/deg2rad,BOEYENS_6) ],stringstring)
+    elif r[0] in 'ijkl':
+      n=len(r[1:])/2
+      a=internal_coordinates.ring_angle(G[:,[i-1 for i in r[1:1+n]]],G[:,[i-1 for i in r[1+n:]]])
+      add(to_angle(a),prefix=' '*{'i':1, 'j':max(26,f)-20+1, 'k':max(32,f)-20+1, 'l':max(38,f)-20+1}[r[0]])
+    elif r[0]=='c':
+      text=[]
+      for comm in comments:
+        if comm[0:f+comment_bonus].strip()=='':
+          comm=' '*(f-14+comment_bonus)+'<EMPTY_STRING>'
+        text.append(comm[0:f+comment_bonus].strip())
+      add(text,commentstring)
+  if numbers:
+    return columns,numpy.array(numbers).T
+  return columns,numpy.zeros((nframe,0))
 # ================================================================= #
 
 def main():
@@ -752,6 +842,7 @@ J. Cryst. Mol. Struct., 1977, 8, 317-320.
   parser.add_option('-g', dest='g', type="string", nargs=1, default="output.xyz",help="geometry file in xyz format (default=output.xyz)")
   parser.add_option('-t', dest='t', type=float, nargs=1, default=1.0,help="timestep between successive geometries is fs (default=1.0 fs)")
   parser.add_option('-T', dest='T', type=int, nargs=1, default=0,help="start counting the timesteps at T (default=0)")
+  parser.add_option('-n', dest='n', type="string", nargs=1, default="",help="also write the table as binary numpy array (.npy) to this file, with NaN for the text columns")
   (options, args) = parser.parse_args()
   global p,f,Bohrs,Radians
   if options.f>=20:
@@ -805,6 +896,8 @@ J. Cryst. Mol. Struct., 1977, 8, 317-320.
 
   line=0
   t=0
+  geoms=[]
+  comments=[]
   while line<len(geo):
     try:
       n=int(geo[line].split()[0])
@@ -829,13 +922,28 @@ J. Cryst. Mol. Struct., 1977, 8, 317-320.
     except ValueError:
       sys.stderr.write('ERROR: Error while reading geometry! Line= %i\n' % (line) )
       sys.exit(1)
-
-    formatstring='%%%i.%if ' % (f,p)
-    s=calculate(g,req,comm)
-    print formatstring % ((t+Tshift)*dt) +s
+    if NONUMPY:
+      formatstring='%%%i.%if ' % (f,p)
+      s=calculate(g,req,comm)
+      print formatstring % ((t+Tshift)*dt) +s
+    else:
+      geoms.append(g)
+      comments.append(comm)
     t+=1
     sys.stderr.write('\rNumber of geometries: % 6i' % (t))
 
+  if not NONUMPY:
+    # all geometries at once
+    formatstring='%%%i.%if ' % (f,p)
+    times=[ (i+Tshift)*dt for i in range(t) ]
+    columns,numbers=calculate_all(numpy.array(geoms,dtype=float).reshape((t,natom,3)),comments,req)
+    for i in range(t):
+      print formatstring % (times[i]) + ''.join( [ prefix + fmt % (values[i]) for (prefix,fmt,values) in columns ] )
+    if options.n:
+      numpy.save(options.n,numpy.hstack( (numpy.array(times).reshape((t,1)),numbers) ))
+  elif options.n:
+    sys.stderr.write('\nWARNING: numpy not available, cannot write %s!' % (options.n))
+
   sys.stderr.write('\nFINISHED!\n\n')
   sys.exit(0)
 
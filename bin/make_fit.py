@@ -50,10 +50,11 @@ import datetime
 from optparse import OptionParser
 import readline
 import colorsys
-import random
+# parallel bootstrap fits
+from multiprocessing import Pool
 
 import numpy as np
-import scipy.integrate as spint
+import scipy.linalg as splin
 import scipy.optimize as spopt
 
 try:
@@ -809,6 +810,26 @@ Using the bootstrap data instead additionally allows for realistic error estimat
 
     print
     INFOS['write_bootstrap_fits']=question('Do you want to write fitting curves for all bootstrap cycles?',bool,False)
+
+    # Random number seed
+    print '\nPlease enter a random number generator seed (type "!" to initialize the RNG from the system time).'
+    while True:
+      line=question('RNG Seed: ',str,'!',False)
+      if line=='!':
+        INFOS['rngseed']=None
+        break
+      try:
+        INFOS['rngseed']=int(line)
+      except ValueError:
+        print 'Please enter an integer or "!".'
+        continue
+      break
+
+    # parallel fits and early stopping
+    print '\nThe bootstrap samples can be fitted on multiple CPUs.'
+    INFOS['ncpu']=question('Number of CPUs to use: ',int,[1])[0]
+    print '\nBootstrapping can stop before all samples are fitted, once the mean and standard deviation\nof all constants change by less than a given fraction (relative) after each batch of samples.'
+    INFOS['bootstrap_conv']=question('Convergence threshold (0 to always fit all samples): ',float,[0.])[0]
   else:
     print '''Please specify the path to the population data file (as generated by populations.py).\n'''
     while True:
@@ -1055,6 +1076,13 @@ end               Finish initial condition input
 # ======================================================================================================================
 
 class globalfunction():
+  '''Populations of a first-order kinetic model, summed according to the groups in sumdefs.
+
+  The rate equations dy/dt=R.y have constant coefficients, hence y(t)=V.exp(w*t).V^-1.y0 with the
+  eigendecomposition R=V.diag(w).V^-1, which is evaluated for all time points at once.
+  The decomposition is cached for the last parameters, and call_array and jacobian
+  (the analytic derivatives with respect to rates and initial populations) share it.
+  Defective rate matrices (e.g., consecutive reactions with equal rates) are treated with expm.'''
 
   # ------------------------------------------------
   def __init__(self,nspecies, ratedefs, initialdefs, sumdefs, Tarray, p0, y0):
@@ -1069,6 +1097,10 @@ class globalfunction():
           print 'Illegal summation definition: %s' % (ratedefs)
           sys.exit(1)
     self.sumdefs=sumdefs
+    self.summatrix=np.zeros((len(sumdefs),self.nspecies))
+    for istate,j in enumerate(sumdefs):
+      for i in j:
+        self.summatrix[istate][i]+=1.
 
     # check the rate definitions
     for j in ratedefs:
@@ -1082,6 +1114,15 @@ class globalfunction():
     self.ratedefs=ratedefs
     self.nrates=len(ratedefs)
 
+    # derivatives of the rate matrix with respect to the rates
+    self.drates=[]
+    for ind1 in ratedefs:
+      dR=np.zeros((self.nspecies,self.nspecies))
+      for ind in ind1:
+        dR[ind[1]][ind[0]]+=1.
+        dR[ind[0]][ind[0]]-=1.
+      self.drates.append(dR)
+
     # make initial rate matrix
     if not len(p0)==self.nrates:
       print 'Initial parameters must have same length as rate definitions!'
@@ -1108,157 +1149,204 @@ class globalfunction():
     self.T=Tarray
     self.tmax=max(Tarray)
 
-    # fill dictionary with function values
-    self.vals={0.: self.y}
-    self.fill_vals(self.T)
+    # cached eigendecomposition
+    self.decomposition=None
 
   # ------------------------------------------------
   def set_ratematrix(self,p):
 
-    self.p=p
-    ratematrix=[ [ 0. for i in range(self.nspecies) ] for j in range(self.nspecies) ]
-    for i,ind1 in enumerate(self.ratedefs):
-      for ind in ind1:
-        ratematrix[ind[1]][ind[0]]+=p[i]
-        ratematrix[ind[0]][ind[0]]-=p[i]
-    self.rates=np.array(ratematrix)
+    self.p=list(p)
+    self.rates=np.zeros((self.nspecies,self.nspecies))
+    for i,dR in enumerate(self.drates):
+      self.rates+=p[i]*dR
+    self.decomposition=None
 
   # ------------------------------------------------
   def set_initvector(self,y):
 
-    self.y=[ 0. for i in range(self.nspecies) ]
+    self.y0=list(y)
+    self.y=np.zeros(self.nspecies)
     for i,ind in enumerate(self.initdefs):
-      self.y[ind]=self.y0[i]
+      self.y[ind]=y[i]
 
   # ------------------------------------------------
-  def fun(self,t,y):
-    return np.dot(self.rates,y)
+  def set_params(self,params):
+    # updates rates and initial populations from the fit parameters
+    p1=list(params[:self.nrates])
+    if self.ninit>0 and len(params)>=self.nrates+self.ninit:
+      y1=list(params[-self.ninit:])
+    else:
+      y1=self.y0
+    if not y1==self.y0:
+      self.set_initvector(y1)
+    if not p1==self.p:
+      self.set_ratematrix(p1)
 
   # ------------------------------------------------
-  def fill_vals(self,T):
+  def decompose(self):
+    # eigendecomposition of the rate matrix, None if the rate matrix is (nearly) defective
+    if self.decomposition is None:
+      w,V=np.linalg.eig(self.rates)
+      if np.linalg.cond(V)<1e8:
+        self.decomposition=(w,V,np.linalg.inv(V))
+      else:
+        self.decomposition=False
+    return self.decomposition
 
-    # initialize Runge-Kutta
-    RK=spint.RK45(self.fun,0.,self.y,self.tmax+0.1)
+  # ------------------------------------------------
+  def split_times(self,T):
+    # time points of the concatenated groups -> group index, unique times and their positions
+    T=np.asarray(T,dtype=float)
+    state=(T//self.tmax).astype(int)
+    times,index=np.unique(T%self.tmax,return_inverse=True)
+    return state,times,index
 
-    # perform initial step
-    RK.step()
-    interpol=RK.dense_output()
+  # ------------------------------------------------
+  def populations(self,times):
+    # all species at all times, shape (ntimes,nspecies)
+    decomposition=self.decompose()
+    if decomposition:
+      w,V,Vinv=decomposition
+      c=np.dot(Vinv,self.y)
+      return np.dot(np.exp(np.outer(times,w))*c,V.T).real
+    return np.array([ np.dot(splin.expm(self.rates*t),self.y) for t in times ])
 
-    # perform the steps in order
-    for it,t in enumerate(sorted(T)):
-      if t in self.vals:
-        continue
-      while True:
-        if not interpol.t_min<=t<interpol.t_max:
-          try:
-            RK.step()
-            interpol=RK.dense_output()
-          except RuntimeError:
-            if not t==self.tmax:
-              print 'Error 1'
-              sys.exit(1)
-            else:
-              break
-        else:
-          break
-      y=interpol(t)
-      self.vals[t]=y
+  # ------------------------------------------------
+  def derivatives(self,times):
+    # derivatives of all species at all times with respect to rates and initial populations,
+    # shape (nrates+ninit,ntimes,nspecies)
+    decomposition=self.decompose()
+    out=[]
+    if decomposition:
+      w,V,Vinv=decomposition
+      c=np.dot(Vinv,self.y)
+      E=np.exp(np.outer(times,w))
+      # dy/dp = V.[ G*Phi ].c  with G=V^-1.dR/dp.V and
+      # Phi_lm(t)=(exp(w_l*t)-exp(w_m*t))/(w_l-w_m), or t*exp(w_l*t) for w_l=w_m
+      d=w[:,None]-w[None,:]
+      degenerate=np.abs(d)<=1e-12*max(1.,np.max(np.abs(w)))
+      d[degenerate]=1.
+      Phi=E[:,None,:]*np.where(degenerate,times[:,None,None]+0.*d,np.expm1(np.multiply.outer(times,d))/d)
+      for dR in self.drates:
+        G=np.dot(Vinv,np.dot(dR,V))
+        out.append(np.dot(np.einsum('tlm,lm->tl',Phi,G*c[None,:]),V.T).real)
+      for ind in self.initdefs:
+        out.append(np.dot(E*Vinv[:,ind],V.T).real)
+    else:
+      for dR in self.drates:
+        out.append(np.array([ np.dot(splin.expm_frechet(self.rates*t,dR*t,compute_expm=False),self.y) for t in times ]))
+      for ind in self.initdefs:
+        out.append(np.array([ splin.expm(self.rates*t)[:,ind] for t in times ]))
+    return np.array(out)
 
   # ------------------------------------------------
   def __call__(self,t,*params):
-    # check for modified parameters and reinitialize
-    p1=list(params[:self.nrates])
-    if len(params)>=self.nrates+self.ninit:
-      y1=list(params[-self.ninit:])
-    else:
-      y1=self.y0
-    if not y1==self.y0 or not p1==self.p:
-      if not y1==self.y0:
-        self.set_initvector(y1)
-      if not p1==self.p:
-        self.set_ratematrix(p1)
-      self.vals={0.: self.y}
-      self.fill_vals(self.T)
-    # evaluate
-    state=int(t//self.tmax)
-    tnew=t%self.tmax
-    if not tnew in self.vals:
-      self.fill_vals([tnew])
-    s=0.
-    for i in self.sumdefs[state]:
-      s+=self.vals[tnew][i]
-    return s
+    return self.call_array([t],*params)[0]
 
   # ------------------------------------------------
   def call_array(self,T,*params):
-    # print parameters
-    #string='Parameters: '
-    #for i in list(params):
-      #string+='%12.9f  ' % i
-    #string+='\n'
-    #sys.stderr.write(string)
-    # check for modified parameters and reinitialize
-    p1=list(params[:self.nrates])
-    if len(params)>=self.nrates+self.ninit:
-      y1=list(params[-self.ninit:])
-    else:
-      y1=self.y0
-    if not y1==self.y0 or not p1==self.p:
-      if not y1==self.y0:
-        self.set_initvector(y1)
-      if not p1==self.p:
-        self.set_ratematrix(p1)
-      self.vals={0.: self.y}
-      self.fill_vals(self.T)
-    # evaluate
-    missingT=[]
-    for t in T:
-      state=int(t//self.tmax)
-      tnew=t%self.tmax
-      if not tnew in self.vals:
-        missingT.append(tnew)
-    if missingT:
-      self.fill_vals(missingT)
-    output=[]
-    for t in T:
-      state=int(t//self.tmax)
-      tnew=t%self.tmax
-      s=0.
-      for i in self.sumdefs[state]:
-        s+=self.vals[tnew][i]
-      output.append(s)
-    return output
+    self.set_params(params)
+    state,times,index=self.split_times(T)
+    Y=self.populations(times)[index]
+    return np.sum(self.summatrix[state]*Y,axis=1)
 
+  # ------------------------------------------------
+  def jacobian(self,T,*params):
+    # derivatives of call_array with respect to the fit parameters, shape (len(T),len(params))
+    self.set_params(params)
+    state,times,index=self.split_times(T)
+    dY=self.derivatives(times)[:,index,:]
+    J=np.sum(self.summatrix[state][None,:,:]*dY,axis=2).T
+    return J[:,:len(params)] if len(params)<self.nrates+self.ninit else J
+
+# ======================================================================================================================
 # ======================================================================================================================
 # ======================================================================================================================
+
+def group_populations(INFOS):
+  # dense array (trajectories x groups*steps) of the summed columns of each group,
+  # in the order of the concatenated fitting data
+  data=np.array(INFOS['data'],dtype=float)[:,:-1,:]
+  G=[ np.sum(data[:,:,[ col-1 for col in cols ]],axis=2) for cols in INFOS['columns_groups'] ]
+  return np.concatenate(G,axis=1)
+
 # ======================================================================================================================
 
-def create_bootstrap_data(Tdata1, RNGarray, INFOS):
+def create_bootstrap_data(Tdata1, weights, INFOS):
+  # weights (samples x trajectories) gives how often each trajectory is contained in each sample
+  if not 'grouped_data' in INFOS:
+    INFOS['grouped_data']=group_populations(INFOS)
+  A=INFOS['grouped_data']
 
   # get the fitting data
   nsteps=len(Tdata1)-1
-  Tdata=[ 0. for i in range(nsteps*INFOS['ngroups']) ]
-  Y1=[ 0. for i in range(nsteps*INFOS['ngroups']) ]
-  Y2=[ 0. for i in range(nsteps*INFOS['ngroups']) ]
-  for igroup in range(INFOS['ngroups']):
-    cols=INFOS['columns_groups'][igroup]
-    for istep in range(nsteps):
-      for itraj in RNGarray:
-        s=0.
-        for col in cols:
-          s+=INFOS['data'][itraj][istep][col-1]
-        Y1[istep+igroup*nsteps]+=s
-        Y2[istep+igroup*nsteps]+=s**2
-      Tdata[istep+igroup*nsteps]=Tdata1[istep]+igroup*INFOS['maxtime']
-
-  Ydata=[ Y1[i]/INFOS['ntraj'] for i in range(nsteps*INFOS['ngroups']) ]
-  Yerr =[ math.sqrt(Y2[i]/INFOS['ntraj']-Ydata[i]**2) for i in range(nsteps*INFOS['ngroups']) ]
-  for i in range(nsteps*INFOS['ngroups']):
-    if Yerr[i]==0:
-      Yerr[i]=0.001
+  Tdata=[ Tdata1[istep]+igroup*INFOS['maxtime'] for igroup in range(INFOS['ngroups']) for istep in range(nsteps) ]
+  weights=np.asarray(weights,dtype=float)
+  Ydata=np.dot(weights,A)/INFOS['ntraj']
+  Yerr=np.sqrt(np.maximum(np.dot(weights,A**2)/INFOS['ntraj']-Ydata**2,0.))
+  Yerr[Yerr==0.]=0.001
 
   return Tdata, Ydata, Yerr
 
+# ======================================================================================================================
+
+def draw_bootstrap_weights(RNG, nsamples, ntraj):
+  # multinomial resampling: counts of each trajectory in nsamples samples of size ntraj
+  return RNG.multinomial(ntraj, [1./ntraj]*ntraj, size=nsamples)
+
+# ======================================================================================================================
+
+def bootstrap_fit_job(Fargs, Tdata, Ysamples, bounds, opt_init, write_fits):
+  # fits a batch of bootstrap samples, returns (parameters, variances, fitted curve) or None for each
+  F=globalfunction(*Fargs)
+  p0=list(Fargs[5])
+  y0=list(Fargs[6])
+  results=[]
+  for Ydata in Ysamples:
+    try:
+      if opt_init:
+        OPT=spopt.curve_fit(F.call_array,Tdata,Ydata,p0=p0+y0,jac=F.jacobian,bounds=bounds)
+      else:
+        OPT=spopt.curve_fit(F.call_array,Tdata,Ydata,p0=p0,   jac=F.jacobian,bounds=bounds)
+    except (RuntimeError,ValueError):
+      results.append(None)
+      continue
+    Yfit=None
+    if write_fits:
+      Yfit=F.call_array(Tdata,*OPT[0])
+    results.append( (OPT[0],np.diag(OPT[1]),Yfit) )
+  return results
+
+# ======================================================================================================================
+
+class running_stats:
+  '''Running mean and standard deviation (Welford), updated for each fitted sample'''
+  def __init__(self,keys):
+    self.n=0
+    self.mean=dict( (key,0.) for key in keys )
+    self.m2=dict( (key,0.) for key in keys )
+  def add(self,R):
+    self.n+=1
+    for key in self.mean:
+      delta=R[key]-self.mean[key]
+      self.mean[key]+=delta/self.n
+      self.m2[key]+=delta*(R[key]-self.mean[key])
+  def stdev(self,key):
+    if self.n<2:
+      return 0.
+    return math.sqrt(self.m2[key]/(self.n-1))
+  def snapshot(self):
+    return dict( (key,(self.mean[key],self.stdev(key))) for key in self.mean )
+  def converged(self,previous,thres):
+    # relative change of all means and standard deviations since the previous snapshot
+    if previous is None or self.n<3:
+      return False
+    for key in self.mean:
+      m,s=previous[key]
+      if abs(self.mean[key]-m)>thres*abs(self.mean[key]) or abs(self.stdev(key)-s)>thres*self.stdev(key):
+        return False
+    return True
+
 # ======================================================================================================================
 # ======================================================================================================================
 # ======================================================================================================================
@@ -1298,8 +1386,10 @@ def make_fit(INFOS):
         print 'Time data inconsistent!'
         sys.exit(1)
 
-    RNGarray = [ i for i in range(INFOS['ntraj']) ]
-    Tdata, Ydata, Yerr = create_bootstrap_data(Tdata1, RNGarray, INFOS)
+    weights=np.ones((1,INFOS['ntraj']))
+    Tdata, Ydata, Yerr = create_bootstrap_data(Tdata1, weights, INFOS)
+    Ydata=Ydata[0]
+    Yerr=Yerr[0]
     Yerr_absol=True
 
     # TODO: Could use the actual Yerr, but in some cases this gives very bad fits, so we deactivate it here:
@@ -1339,9 +1429,9 @@ def make_fit(INFOS):
   print '\n'+centerstring(' Iterations ',40,'-')+'\n'
   # get optimal parameters
   if INFOS['opt_init']:
-    OPT=spopt.curve_fit(F.call_array,Tdata,Ydata,p0=p0+y0,bounds=bounds,sigma=Yerr,absolute_sigma=Yerr_absol,verbose=2)
+    OPT=spopt.curve_fit(F.call_array,Tdata,Ydata,p0=p0+y0,jac=F.jacobian,bounds=bounds,sigma=Yerr,absolute_sigma=Yerr_absol,verbose=2)
   else:
-    OPT=spopt.curve_fit(F.call_array,Tdata,Ydata,p0=p0,   bounds=bounds,sigma=Yerr,absolute_sigma=Yerr_absol,verbose=2)
+    OPT=spopt.curve_fit(F.call_array,Tdata,Ydata,p0=p0,   jac=F.jacobian,bounds=bounds,sigma=Yerr,absolute_sigma=Yerr_absol,verbose=2)
   popt=OPT[0].tolist()
   OPT_orig=deepcopy(OPT)
   #print popt
@@ -1387,8 +1477,9 @@ data to this script (bootstrapping data can be prepared with populations.py).'''
 
   # print function values and data together
   string=''
+  Yfit=F.call_array(Tdata,*popt)
   for it,T in enumerate(Tdata):
-    string+='%12.9f %12.9f %12.9f' % (T,Ydata[it],F(T,*popt))
+    string+='%12.9f %12.9f %12.9f' % (T,Ydata[it],Yfit[it])
     if Yerr:
       string+='   %12.9f' % (Yerr[it])
     string+='\n'
@@ -1407,7 +1498,6 @@ data to this script (bootstrapping data can be prepared with populations.py).'''
   # ------------------------------------------------
 
   if INFOS['do_bootstrap']:
-    verbose=False
     print '\n'+centerstring(' Bootstrapping ',60,'#')+'\n'
     if INFOS['write_bootstrap_fits']:
       print 'Writing individual results to %s/fit_results_%%i.txt ...\n' % (INFOS['popfile'])
@@ -1417,91 +1507,88 @@ data to this script (bootstrapping data can be prepared with populations.py).'''
       y0=popt[INFOS['nrates']:]
     else:
       y0=INFOS['y0']
-    F=globalfunction(INFOS['nspec'], INFOS['rates'], INFOS['initial'], INFOS['summation'], Tdata1, p0, y0)
+    Fargs=(INFOS['nspec'], INFOS['rates'], INFOS['initial'], INFOS['summation'], Tdata1, p0, y0)
 
+    # samples are drawn and fitted in batches, the statistics are checked after each batch
+    RNG=np.random.RandomState(INFOS['rngseed'])
+    ncpu=max(1,INFOS['ncpu'])
+    nbatch=max(4*ncpu,int(math.sqrt(INFOS['bootstrap_cycles'])))
     results=[]
-    if not verbose:
-      string=' Cycle '
-      for i in const_names:
-        string+='%12s ' % i
-      string+=' Time'
-      print string
+    stats=running_stats(const_names)
+    previous=None
+    string=' Cycle '
+    for i in const_names:
+      string+='%12s ' % i
+    string+=' Time'
+    print string
     begintime=datetime.datetime.now()
-    for iboot in range(INFOS['bootstrap_cycles']):
-      try:
-        if verbose:
-          print '\n'+centerstring(' Cycle %i '%(iboot+1),30,'.')+'\n'
-          verb=2
+    iboot=0
+    if ncpu>1:
+      pool=Pool(processes=ncpu)
+    try:
+      while iboot<INFOS['bootstrap_cycles']:
+        nsamples=min(nbatch,INFOS['bootstrap_cycles']-iboot)
+        weights=draw_bootstrap_weights(RNG,nsamples,INFOS['ntraj'])
+        Tdata, Ysamples, Yerr = create_bootstrap_data(Tdata1, weights, INFOS)
+        if ncpu>1:
+          jobs=[ pool.apply_async(bootstrap_fit_job,[Fargs,Tdata,Ysamples[icpu::ncpu],bounds,INFOS['opt_init'],INFOS['write_bootstrap_fits']]) for icpu in range(ncpu) ]
+          fits=[None]*nsamples
+          for icpu,job in enumerate(jobs):
+            fits[icpu::ncpu]=job.get()
         else:
-          verb=0
-        RNGarray= [ random.randint(0,INFOS['ntraj']-1) for i in range(INFOS['ntraj']) ]
-        Tdata, Ydata, Yerr = create_bootstrap_data(Tdata1, RNGarray, INFOS)
-        Yerr=None
-        Yerr_absol=False
-        y1=deepcopy(y0)
-        p1=deepcopy(p0)
-        if INFOS['opt_init']:
-          OPT=spopt.curve_fit(F.call_array,Tdata,Ydata,p0=p1+y1,bounds=bounds,sigma=Yerr,absolute_sigma=Yerr_absol,verbose=verb)
-        else:
-          OPT=spopt.curve_fit(F.call_array,Tdata,Ydata,p0=p1,   bounds=bounds,sigma=Yerr,absolute_sigma=Yerr_absol,verbose=verb)
-        pboot=OPT[0].tolist()
-
-        if verbose:
-          print 
-        R={}
-        string='%6i ' % (iboot+1)
-        for i in range(INFOS['nrates']):
-          name=INFOS['ratemap'][i]
-          t=1./OPT[0][i]
-          dt=np.sqrt(OPT[1][i][i])/OPT[0][i]**2
-          perc=dt/t*100.
-          if verbose:
-            print 'time constant ( %-12s ): %12.4f fs +/- %12.4f fs (%7.2f %%)'%(name,t,dt,perc)
-          else:
+          fits=bootstrap_fit_job(Fargs,Tdata,Ysamples,bounds,INFOS['opt_init'],INFOS['write_bootstrap_fits'])
+
+        deltatime=(datetime.datetime.now()-begintime)/nsamples
+        begintime=datetime.datetime.now()
+        for isample,fit in enumerate(fits):
+          iboot+=1
+          if fit is None:
+            print '%6i  no convergence, sample skipped' % (iboot)
+            continue
+          pboot,var,Yfit=fit
+          R={}
+          string='%6i ' % (iboot)
+          for i in range(INFOS['nrates']):
+            name=INFOS['ratemap'][i]
+            t=1./pboot[i]
             string+='%12.4f ' % (t)
-          R[name]=t
-        for i in range(INFOS['ninitial']):
-          name=INFOS['specmap'][INFOS['initial'][i]]
-          if INFOS['opt_init']:
-            ind=i+INFOS['nrates']
-            t=OPT[0][ind]
-            dt=np.sqrt(OPT[1][ind][ind])
-            perc=dt/t*100.
-            if verbose:
-              print 'initial pop   ( %-12s ): %12.4f    +/- %12.4f    (%7.2f %%)'%(name,t,dt,perc)
-            else:
-              string+='%12.4f ' % (t)
-          else:
-            t=y0[i]
-            if verbose:
-              print 'initial pop   ( %-12s ): %12.4f' % (name,t)
+            R[name]=t
+          for i in range(INFOS['ninitial']):
+            name=INFOS['specmap'][INFOS['initial'][i]]
+            if INFOS['opt_init']:
+              t=pboot[i+INFOS['nrates']]
             else:
-              string+='%12.4f ' % (t)
-          R[name]=t
-        results.append(R)
-        deltatime=datetime.datetime.now()-begintime
-        begintime=datetime.datetime.now()
-        if not verbose:
+              t=y0[i]
+            string+='%12.4f ' % (t)
+            R[name]=t
+          results.append(R)
+          stats.add(R)
           string+=' %s' % deltatime
           print string
-        else:
-          print 'Time: ',deltatime
-
-        if INFOS['write_bootstrap_fits']:
-          string=''
-          for it,T in enumerate(Tdata):
-            string+='%12.9f %12.9f %12.9f' % (T,Ydata[it],F(T,*pboot))
-            if Yerr:
-              string+='   %12.9f' % (Yerr[it])
-            string+='\n'
-          filename=os.path.join(INFOS['popfile'],'fit_results_%i.txt' % iboot)
-          writefile(filename,string)
+
+          if INFOS['write_bootstrap_fits']:
+            string=''
+            for it,T in enumerate(Tdata):
+              string+='%12.9f %12.9f %12.9f' % (T,Ysamples[isample][it],Yfit[it])
+              string+='\n'
+            filename=os.path.join(INFOS['popfile'],'fit_results_%i.txt' % (iboot-1))
+            writefile(filename,string)
 
         sys.stdout.flush()
-      except KeyboardInterrupt:
-        print 'Aborted, going to final analysis...'
-        time.sleep(0.5)
-        break
+        if INFOS['bootstrap_conv']>0.:
+          if stats.converged(previous,INFOS['bootstrap_conv']):
+            print 'Converged after %i samples.' % (iboot)
+            break
+          previous=stats.snapshot()
+    except KeyboardInterrupt:
+      print 'Aborted, going to final analysis...'
+      if ncpu>1:
+        pool.terminate()
+        ncpu=1
+      time.sleep(0.5)
+    if ncpu>1:
+      pool.close()
+      pool.join()
 
 
     # final analysis
@@ -36,7 +36,6 @@ import re
 import os
 import stat
 import shutil
-import subprocess as sp
 import datetime
 import random
 from optparse import OptionParser
@@ -51,6 +50,10 @@ try:
 except ImportError:
   NONUMPY=True
 
+# shared modules in $SHARC/../lib
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.realpath(__file__)),'..','lib'))
+import data_extraction
+
 # =========================================================0
 # compatibility stuff
 
@@ -530,13 +533,17 @@ It can also compute diabatic populations:
     run_extractor=question('Run data_extractor.x?',bool,True)
     if run_extractor:
       run_full=not question('Run data_extractor.x only if output.dat newer than output_data/',bool,True)
+      ncpu=question('Number of CPUs for data_extractor.x:',int,[1])[0]
     else:
       run_full=False
+      ncpu=1
   else:
     run_extractor=False
     run_full=False
+    ncpu=1
   INFOS['run_extractor']=run_extractor
   INFOS['run_extractor_full']=run_full
+  INFOS['ncpu']=max(1,ncpu)
 
 
 
@@ -618,6 +625,252 @@ It can also compute diabatic populations:
 # ======================================================================================================================
 # ======================================================================================================================
 
+def read_table(filename):
+  '''Returns the numbers in a text file (e.g., output.lis or output_data/coeff_MCH.out) as 2D array, skipping comment lines.
+
+The array is cached in filename.npy, which is only rebuilt if the text file is newer than the cache.
+A last incomplete line (e.g., of a running trajectory) is ignored.'''
+
+  cachefile=filename+'.npy'
+  if os.path.isfile(cachefile) and os.path.getmtime(cachefile)>=os.path.getmtime(filename):
+    try:
+      return numpy.load(cachefile)
+    except (IOError,ValueError):
+      pass
+  rows=[]
+  ncol=0
+  f=open(filename)
+  for line in f:
+    if line[0]=='#':
+      continue
+    s=line.split()
+    if ncol==0:
+      ncol=len(s)
+    if len(s)!=ncol:
+      break
+    rows.append( [ float(x) for x in s ] )
+  f.close()
+  table=numpy.array(rows,dtype=float).reshape((len(rows),ncol))
+  try:
+    cf=open(cachefile,'wb')
+    numpy.save(cf,table)
+    cf.close()
+  except IOError:
+    # e.g., no write permission, just do not cache
+    pass
+  return table
+
+# ======================================================================================================================
+
+def get_populations(INFOS,files,dt,nsteps,nstates):
+  '''Computes the populations from the cached tables of the text files (see read_table).
+
+Returns the summed populations (nsteps x nstates), the populations of each trajectory (only if needed for bootstrapping), 
+the number of trajectories per step, the shortest and longest trajectory and the number of trajectories.'''
+
+  mode=INFOS['mode']
+  width=60
+  ntraj=len(files)
+  pop=numpy.zeros((nsteps,nstates))
+  pop_full=[]
+  traj_per_step=numpy.zeros(nsteps)
+  shortest=9999999.
+  longest=0.
+  if mode in [3,9,13,15]:
+    # matrix summing up the multiplet components
+    summap=numpy.zeros((INFOS['nmstates'],nstates))
+    for i in range(INFOS['nmstates']):
+      summap[i,INFOS['statemap'][i+1][3]-1]=1.
+    nmtonstate=numpy.argmax(summap,axis=1)
+  if mode in [4,5,6]:
+    binlist=numpy.array(INFOS['histo'].binlist)
+
+  for ifile in files:
+    table=read_table(ifile)
+    # trajectories longer than maxtime count as nsteps long
+    if len(table)>nsteps:
+      t=nsteps
+      table=table[:nsteps]
+    else:
+      t=len(table)-1
+    traj_per_step[:t+1]+=1
+    if dt*t<shortest:
+      shortest=dt*t
+    if dt*t>longest:
+      longest=dt*t
+    if t==-1:
+      print '%s' % (ifile)+' '*(width-len(ifile))+'%i\tZero Timesteps found!' % (t)
+      ntraj-=1
+      if INFOS['bootstrap']:
+        pop_full.append(numpy.zeros((nsteps,nstates)))
+      continue
+    else:
+      print '%s' % (ifile)+' '*(width-len(ifile))+'%i' % (t)
+
+    # population vectors of all time steps
+    if mode in [1,2,3,4,5,6]:
+      if mode==1:
+        state=table[:,2].astype(int)-1
+      elif mode==2:
+        state=table[:,3].astype(int)-1
+      elif mode==3:
+        state=nmtonstate[table[:,3].astype(int)-1]
+      elif mode==4:
+        state=numpy.searchsorted(binlist,table[:,9])
+      elif mode==5:
+        state=numpy.searchsorted(binlist,table[:,8])
+      elif mode==6:
+        state=numpy.searchsorted(binlist,table[:,1])
+      vec=numpy.zeros((len(table),nstates))
+      vec[numpy.arange(len(table)),state]=1.
+    elif mode in [7,8,20]:
+      vec=table[:,2:2+2*nstates:2]**2+table[:,3:3+2*nstates:2]**2
+    elif mode in [12,14,21,22]:
+      vec=table[:,2:2+nstates]
+    elif mode in [13,15]:
+      vec=numpy.dot(table[:,2:2+INFOS['nmstates']],summap)
+    elif mode==9:
+      nm=INFOS['nmstates']
+      vec=numpy.dot(table[:,2:2+2*nm:2]**2+table[:,3:3+2*nm:2]**2,summap)
+
+    # shorter trajectories are continued with their last values
+    pop[:len(vec)]+=vec
+    pop[len(vec):]+=vec[-1]
+    if INFOS['bootstrap']:
+      traj_pop=numpy.empty((nsteps,nstates))
+      traj_pop[:len(vec)]=vec
+      traj_pop[len(vec):]=vec[-1]
+      pop_full.append(traj_pop)
+
+  return pop,pop_full,traj_per_step,shortest,longest,ntraj
+
+# ======================================================================================================================
+
+def get_populations_nonumpy(INFOS,files,dt,nsteps,nstates):
+  '''Computes the populations by parsing the text files line by line (used without numpy and for modes 10 and 11).
+
+Returns the same as get_populations.'''
+
+  ntraj=len(files)
+  width=60
+  pop_full=[ [ [0. for j in range(nstates) ] for i in range(nsteps) ] for ifile in files ]
+  traj_per_step=[ 0. for i in range(nsteps) ]
+  shortest=9999999.
+  longest=0.
+  for fileindex,ifile in enumerate(files):
+    if INFOS['mode'] in [10,11]:
+      output_current=output_dat(ifile)
+      istep=-1
+      for istep,U,state_diag in output_current:
+        #print istep,state_diag
+        vec2=[ U[i][state_diag-1] for i in range(len(U)) ]
+        vec=[ 0. for i in range(nstates)]
+        if INFOS['mode'] in [10]:
+          for i in range(nstates):
+            vec[i]=vec2[i].real**2+vec2[i].imag**2
+        elif INFOS['mode'] in [11]:
+          for i in range(INFOS['nmstates']):
+            state=INFOS['statemap'][i+1][3]-1
+            vec[state]+=vec2[i].real**2+vec2[i].imag**2
+        for istate in range(nstates):
+          pop_full[fileindex][istep][istate]+=vec[istate]
+      for itt in range(istep+1):
+        traj_per_step[itt]+=1
+      if dt*istep<shortest:
+        shortest=dt*istep
+      if dt*istep>longest:
+        longest=dt*istep
+      if istep==-1:
+        print '%s' % (ifile)+' '*(width-len(ifile))+' %i\tZero Timesteps found!' % (t)
+        ntraj-=1
+        continue
+      else:
+        print '%s' % (ifile)+' '*(width-len(ifile))+' %i' % (istep)
+      while istep+1<nsteps:
+        istep+=1
+        if INFOS['mode'] in [10,11]:
+          for i in range(nstates):
+            pop_full[fileindex][istep][i]+=vec[i]
+    else:
+      lisf=open(ifile)
+      t=-1
+      for line in lisf:
+        if line[0]=='#':
+          continue
+        f=line.split()
+        t+=1
+        if t>=nsteps:
+          break
+
+        if INFOS['mode'] in [1,2,3,4,5,6]:
+          if INFOS['mode']==1:
+            state=int(f[2])-1
+          elif INFOS['mode']==2:
+            state=int(f[3])-1
+          elif INFOS['mode']==3:
+            state=int(f[3])
+            # state in nm scheme to state in n scheme
+            state=INFOS['statemap'][state][3]-1
+          elif INFOS['mode']==4:
+            state=INFOS['histo'].put(float(f[9]))
+          elif INFOS['mode']==5:
+            state=INFOS['histo'].put(float(f[8]))
+          elif INFOS['mode']==6:
+            state=INFOS['histo'].put(float(f[1]))
+          pop_full[fileindex][t][state]+=1
+        elif INFOS['mode'] in [7,8,9,12,13,14,15,20,21,22]:
+          vec=[ 0. for i in range(nstates)]
+          if INFOS['mode'] in [7,8,20]:
+            for i in range(nstates):
+              vec[i]=float(f[2+2*i])**2+float(f[3+2*i])**2
+          if INFOS['mode'] in [12,14,21,22]:
+            for i in range(nstates):
+              vec[i]=float(f[2+i])
+          if INFOS['mode'] in [13,15]:
+            for i in range(INFOS['nmstates']):
+              state=INFOS['statemap'][i+1][3]-1
+              vec[state]+=float(f[2+i])
+          if INFOS['mode']==9:
+            for i in range(INFOS['nmstates']):
+              state=INFOS['statemap'][i+1][3]-1
+              #imult,istate,ims=IstateToMultState(i+1,INFOS['states'])
+              #state=MultStateToIstate(imult,istate,INFOS['states'])-1
+              vec[state]+=float(f[2+2*i])**2+float(f[3+2*i])**2
+          for i in range(nstates):
+            pop_full[fileindex][t][i]+=vec[i]
+      lisf.close()
+      for itt in range(t+1):
+        if itt<len(traj_per_step):
+          traj_per_step[itt]+=1
+      if dt*t<shortest:
+        shortest=dt*t
+      if dt*t>longest:
+        longest=dt*t
+      if t==-1:
+        print '%s' % (ifile)+' '*(width-len(ifile))+'%i\tZero Timesteps found!' % (t)
+        ntraj-=1
+        continue
+      else:
+        print '%s' % (ifile)+' '*(width-len(ifile))+'%i' % (t)
+      while t+1<nsteps:
+        t+=1
+        if INFOS['mode'] in [1,2,3,4,5,6]:
+          pop_full[fileindex][t][state]+=1
+        elif INFOS['mode'] in [7,8,9,12,13,14,15,20,21,22]:
+          for i in range(nstates):
+            pop_full[fileindex][t][i]+=vec[i]
+
+  # make pop array
+  pop=[ [0. for j in range(nstates) ] for i in range(nsteps) ]        # first index is time, second is state
+  for fileindex,ifile in enumerate(files):
+    for i in range(nsteps):
+      for j in range(nstates):
+        pop[i][j]+=pop_full[fileindex][i][j]
+
+  return pop,pop_full,traj_per_step,shortest,longest,ntraj
+
+# ======================================================================================================================
+
 def do_calc(INFOS):
 
   forbidden=['crashed','running','dead','dont_analyze']
@@ -630,40 +883,16 @@ def do_calc(INFOS):
     if sharcpath==None:
       print 'Please set $SHARC to the directory containing the SHARC executables!'
       sys.exit(1)
-    else:
-      if not os.path.isfile(sharcpath+'/data_extractor.x'):
-        print '$SHARC does not contain data_extractor.x!'
-        sys.exit(1)
-      else:
-        cwd=os.getcwd()
-        for idir in INFOS['paths']:
-          ls=os.listdir(idir)
-          for itraj in ls:
-            if not 'TRAJ_' in itraj:
-              continue
-            path=idir+'/'+itraj
-            print path
-            # check whether output_data/expec.out is newer than output.dat
-            update=False
-            if not os.path.isfile(path+'/output_data/expec.out'):
-              update=True
-            if not update:
-              time_dat=os.path.getmtime(path+'/output.dat')
-              time_expec=os.path.getmtime(path+'/output_data/expec.out')
-              if time_dat > time_expec or INFOS['run_extractor_full']:
-                update=True
-            if update:
-              os.chdir(path)
-              if os.path.isfile('output.dat.nc'):
-                io=sp.call(sharcpath+'/data_extractor_NetCDF.x -xs output.dat > /dev/null 2> /dev/null',shell=True)
-              else:
-                io=sp.call(sharcpath+'/data_extractor.x -xs output.dat > /dev/null 2> /dev/null',shell=True)
-              if io!=0:
-                print 'WARNING: extractor call failed for %s! Exit code %i' % (path,io)
-              os.chdir(cwd)
-            else:
-              pass
-    print 'Extraction finished!\n'
+    if not os.path.isfile(sharcpath+'/data_extractor.x'):
+      print '$SHARC does not contain data_extractor.x!'
+      sys.exit(1)
+    paths=[]
+    for idir in INFOS['paths']:
+      for itraj in sorted(os.listdir(idir)):
+        if 'TRAJ_' in itraj:
+          paths.append(idir+'/'+itraj)
+    data_extraction.run_extractors(paths,sharcpath,options='-xs',always=INFOS['run_extractor_full'],ncpu=INFOS['ncpu'])
+    print ''
 
   width=30
   # prepare the list of output.lis files
@@ -808,126 +1037,16 @@ def do_calc(INFOS):
   INFOS['nstates']=nstates
 
   # get populations
-  width=60
-  pop_full=[ [ [0. for j in range(nstates) ] for i in range(nsteps) ] for ifile in files ]
-  traj_per_step=[ 0. for i in range(nsteps) ]
-  shortest=9999999.
-  longest=0.
-  for fileindex,ifile in enumerate(files):
-    if INFOS['mode'] in [10,11]:
-      output_current=output_dat(ifile)
-      istep=-1
-      for istep,U,state_diag in output_current:
-        #print istep,state_diag
-        vec2=[ U[i][state_diag-1] for i in range(len(U)) ]
-        vec=[ 0. for i in range(nstates)]
-        if INFOS['mode'] in [10]:
-          for i in range(nstates):
-            vec[i]=vec2[i].real**2+vec2[i].imag**2
-        elif INFOS['mode'] in [11]:
-          for i in range(INFOS['nmstates']):
-            state=INFOS['statemap'][i+1][3]-1
-            vec[state]+=vec2[i].real**2+vec2[i].imag**2
-        for istate in range(nstates):
-          pop_full[fileindex][istep][istate]+=vec[istate]
-      for itt in range(istep+1):
-        traj_per_step[itt]+=1
-      if dt*istep<shortest:
-        shortest=dt*istep
-      if dt*istep>longest:
-        longest=dt*istep
-      if istep==-1:
-        print '%s' % (ifile)+' '*(width-len(ifile))+' %i\tZero Timesteps found!' % (t)
-        ntraj-=1
-        continue
-      else:
-        print '%s' % (ifile)+' '*(width-len(ifile))+' %i' % (istep)
-      while istep+1<nsteps:
-        istep+=1
-        if INFOS['mode'] in [10,11]:
-          for i in range(nstates):
-            pop_full[fileindex][istep][i]+=vec[i]
-    else:
-      lisf=open(ifile)
-      t=-1
-      for line in lisf:
-        if line[0]=='#':
-          continue
-        f=line.split()
-        t+=1
-        if t>=nsteps:
-          break
-
-        if INFOS['mode'] in [1,2,3,4,5,6]:
-          if INFOS['mode']==1:
-            state=int(f[2])-1
-          elif INFOS['mode']==2:
-            state=int(f[3])-1
-          elif INFOS['mode']==3:
-            state=int(f[3])
-            # state in nm scheme to state in n scheme
-            state=INFOS['statemap'][state][3]-1
-          elif INFOS['mode']==4:
-            state=INFOS['histo'].put(float(f[9]))
-          elif INFOS['mode']==5:
-            state=INFOS['histo'].put(float(f[8]))
-          elif INFOS['mode']==6:
-            state=INFOS['histo'].put(float(f[1]))
-          pop_full[fileindex][t][state]+=1
-        elif INFOS['mode'] in [7,8,9,12,13,14,15,20,21,22]:
-          vec=[ 0. for i in range(nstates)]
-          if INFOS['mode'] in [7,8,20]:
-            for i in range(nstates):
-              vec[i]=float(f[2+2*i])**2+float(f[3+2*i])**2
-          if INFOS['mode'] in [12,14,21,22]:
-            for i in range(nstates):
-              vec[i]=float(f[2+i])
-          if INFOS['mode'] in [13,15]:
-            for i in range(INFOS['nmstates']):
-              state=INFOS['statemap'][i+1][3]-1
-              vec[state]+=float(f[2+i])
-          if INFOS['mode']==9:
-            for i in range(INFOS['nmstates']):
-              state=INFOS['statemap'][i+1][3]-1
-              #imult,istate,ims=IstateToMultState(i+1,INFOS['states'])
-              #state=MultStateToIstate(imult,istate,INFOS['states'])-1
-              vec[state]+=float(f[2+2*i])**2+float(f[3+2*i])**2
-          for i in range(nstates):
-            pop_full[fileindex][t][i]+=vec[i]
-      lisf.close()
-      for itt in range(t+1):
-        if itt<len(traj_per_step):
-          traj_per_step[itt]+=1
-      if dt*t<shortest:
-        shortest=dt*t
-      if dt*t>longest:
-        longest=dt*t
-      if t==-1:
-        print '%s' % (ifile)+' '*(width-len(ifile))+'%i\tZero Timesteps found!' % (t)
-        ntraj-=1
-        continue
-      else:
-        print '%s' % (ifile)+' '*(width-len(ifile))+'%i' % (t)
-      while t+1<nsteps:
-        t+=1
-        if INFOS['mode'] in [1,2,3,4,5,6]:
-          pop_full[fileindex][t][state]+=1
-        elif INFOS['mode'] in [7,8,9,12,13,14,15,20,21,22]:
-          for i in range(nstates):
-            pop_full[fileindex][t][i]+=vec[i]
+  if NONUMPY or INFOS['mode'] in [10,11]:
+    pop,pop_full,traj_per_step,shortest,longest,ntraj=get_populations_nonumpy(INFOS,files,dt,nsteps,nstates)
+  else:
+    pop,pop_full,traj_per_step,shortest,longest,ntraj=get_populations(INFOS,files,dt,nsteps,nstates)
   print 'Shortest trajectory: %f' % (shortest)
   print 'Longest trajectory: %f' % (longest)
   print 'Number of trajectories: %i' % (ntraj)
   INFOS['shortest']=shortest
   INFOS['longest']=longest
 
-  # make pop array
-  pop=[ [0. for j in range(nstates) ] for i in range(nsteps) ]        # first index is time, second is state
-  for fileindex,ifile in enumerate(files):
-    for i in range(nsteps):
-      for j in range(nstates):
-        pop[i][j]+=pop_full[fileindex][i][j]
-
   # write populations
   s='#Mode: %i\n' % INFOS['mode']
   s+='#%15i ' % (1)
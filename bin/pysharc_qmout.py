@@ -21,122 +21,34 @@ import pprint
 
 from sharc.pysharc.interface import SHARC_INTERFACE
 
+# shared modules in $SHARC/../lib
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.realpath(__file__)),'..','lib'))
+from qmout import QMOUT, FLAGS, as_lists
+
 # ******************************
 #
 # Helper functions
 #
 # ******************************
 
-# QMout targets
-
-
-def check_keys(lines, targets):
-    keys = []
-    for line in lines:
-        for t in targets:
-            if targets[t]['line'] in line: keys.append(t)
-    return keys 
 # ======================================================================= #
-def readfile(filename):
+def read_QMout(path,nstates,natom,request=None):
   try:
-    f=open(filename)
-    out=f.readlines()
-    f.close()
-  except IOError:
-    print('File %s does not exist!' % filename)
+    qmout=QMOUT(path)
+  except (IOError,OSError):
+    print('File %s does not exist!' % path)
     sys.exit(12)
-  return out
-# ======================================================================= #
-def read_QMout(path,nstates,natom,request=None):
-  targets={'h':     {  'flag' : 1,
-                         'type' : complex,
-                         'dim'  :  (nstates,nstates),
-                         'line' : '! 1 Hamiltonian Matrix',
-                      },
-           'dm':      {  'flag' : 2,
-                         'type' : complex,
-                         'dim'  :  (3,nstates,nstates),
-                         'line' : '! 2 Dipole Moment Matrices',
-                      },
-           'grad':    {  'flag' : 3,
-                         'type' : float,
-                         'dim'  :  (nstates,natom,3),
-                         'line' : '! 3 Gradient Vectors',
-                      },
-           'nacdr':   {  'flag': 5,
-                         'type': float,
-                         'dim' :  (nstates,nstates,natom,3),
-                         'line': 'Not Implemented!',
-                      },
-           'overlap':   {  'flag': 6,
-                         'type': complex,
-                         'dim' :  (nstates,nstates),
-                         'line': '! 6 Overlap matrix',
-                          },
-
-           }
-  # read QM.out
-  lines=readfile(path)
   if request is None:
-    request = check_keys(lines, targets)
+    request = [ t for t in ['h','dm','grad','overlap'] if t in qmout ]
 
   # obtain all targets
   QMout={}
-  for t in targets:
+  for t in ['h','dm','grad','nacdr','overlap']:
     if t in request:
-      iline=-1
-      while True:
-        iline+=1
-        if iline>=len(lines):
-          print('Could not find target %s with flag %i in file %s!' % (t,targets[t]['flag'],path))
-          sys.exit(11)
-        line=lines[iline]
-        if '! %i' % (targets[t]['flag']) in line:
-          break
-      values=[]
-      # =========== single matrix
-      if len(targets[t]['dim'])==2:
-        iline+=1
-        for irow in range(targets[t]['dim'][0]):
-          iline+=1
-          line=lines[iline].split()
-          if targets[t]['type']==complex:
-            row=[ complex(float(line[2*i]),float(line[2*i+1])) for i in range(targets[t]['dim'][1]) ]
-          elif targets[t]['type']==float:
-            row=[ float(line[i]) for i in range(targets[t]['dim'][1]) ]
-          values.append(row)
-      # =========== list of matrices
-      elif len(targets[t]['dim'])==3:
-        for iblocks in range(targets[t]['dim'][0]):
-          iline+=1
-          block=[]
-          for irow in range(targets[t]['dim'][1]):
-            iline+=1
-            line=lines[iline].split()
-            if targets[t]['type']==complex:
-              row=[ complex(float(line[2*i]),float(line[2*i+1])) for i in range(targets[t]['dim'][2]) ]
-            elif targets[t]['type']==float:
-              row=[ float(line[i]) for i in range(targets[t]['dim'][2]) ]
-            block.append(row)
-          values.append(block)
-      # =========== matrix of matrices
-      elif len(targets[t]['dim'])==4:
-        for iblocks in range(targets[t]['dim'][0]):
-          sblock=[]
-          for jblocks in range(targets[t]['dim'][1]):
-            iline+=1
-            block=[]
-            for irow in range(targets[t]['dim'][2]):
-              iline+=1
-              line=lines[iline].split()
-              if targets[t]['type']==complex:
-                row=[ complex(float(line[2*i]),float(line[2*i+1])) for i in range(targets[t]['dim'][3]) ]
-              elif targets[t]['type']==float:
-                row=[ float(line[i]) for i in range(targets[t]['dim'][3]) ]
-              block.append(row)
-            sblock.append(block)
-          values.append(sblock)
-      QMout[t]=values
+      if not t in qmout:
+        print('Could not find target %s with flag %i in file %s!' % (t,FLAGS[t],path))
+        sys.exit(11)
+      QMout[t]=as_lists(qmout.get(t))
 
   #pprint.pprint(QMout)
   return QMout
@@ -45,6 +45,10 @@ import time
 from socket import gethostname
 import ast
 
+# shared modules in $SHARC/../lib
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.realpath(__file__)),'..','lib'))
+from initconds import ATOM, STATE, INITCOND, INITCONDS
+
 # =========================================================0
 # compatibility stuff
 
@@ -291,186 +295,6 @@ HoppingSchemes={
 # ======================================================================================================================
 # ======================================================================================================================
 
-def try_read(l,index,typefunc,default):
-  try:
-    if typefunc==bool:
-      return 'True'==l[index]
-    else:
-      return typefunc(l[index])
-  except IndexError:
-    return typefunc(default)
-  except ValueError:
-    print 'Could not initialize object!'
-    quit(1)
-
-# ======================================================================================================================
-
-class ATOM:
-  def __init__(self,symb='??',num=0.,coord=[0.,0.,0.],m=0.,veloc=[0.,0.,0.]):
-    self.symb  = symb
-    self.num   = num
-    self.coord = coord
-    self.mass  = m
-    self.veloc = veloc
-    self.Ekin=0.5*self.mass * sum( [ self.veloc[i]**2 for i in range(3) ] )
-
-  def init_from_str(self,initstring=''):
-    f=initstring.split()
-    self.symb  =   try_read(f,0,str,  '??')
-    self.num   =   try_read(f,1,float,0.)
-    self.coord = [ try_read(f,i,float,0.) for i in range(2,5) ]
-    self.mass  =   try_read(f,5,float,0.)*U_TO_AMU
-    self.veloc = [ try_read(f,i,float,0.) for i in range(6,9) ]
-    self.Ekin=0.5*self.mass * sum( [ self.veloc[i]**2 for i in range(3) ] )
-
-  def __str__(self):
-    s ='%2s % 5.1f '               % (self.symb, self.num)
-    s+='% 12.8f % 12.8f % 12.8f '  % tuple(self.coord)
-    s+='% 12.8f '                  % (self.mass/U_TO_AMU)
-    s+='% 12.8f % 12.8f % 12.8f'   % tuple(self.veloc)
-    return s
-
-  def EKIN(self):
-    self.Ekin=0.5*self.mass * sum( [ self.veloc[i]**2 for i in range(3) ] )
-    return self.Ekin
-
-  def geomstring(self):
-    s='  %2s % 5.1f % 12.8f % 12.8f % 12.8f % 12.8f' % (self.symb,self.num,self.coord[0],self.coord[1],self.coord[2],self.mass/U_TO_AMU)
-    return s
-
-  def velocstring(self):
-    s=' '*11+'% 12.8f % 12.8f % 12.8f' % tuple(self.veloc)
-    return s
-
-# ======================================================================================================================
-
-class STATE:
-  def __init__(self,i=0,e=0.,eref=0.,dip=[0.,0.,0.]):
-    self.i       = i
-    self.e       = e.real
-    self.eref    = eref.real
-    self.dip     = dip
-    self.Excited = False
-    self.Eexc    = self.e-self.eref
-    self.Fosc    = (2./3.*self.Eexc*sum( [i*i.conjugate() for i in self.dip] ) ).real
-    if self.Eexc==0.:
-      self.Prob  = 0.
-    else:
-      self.Prob  = self.Fosc/self.Eexc**2
-
-  def init_from_str(self,initstring):
-    f=initstring.split()
-    self.i       =   try_read(f,0,int,  0 )
-    self.e       =   try_read(f,1,float,0.)
-    self.eref    =   try_read(f,2,float,0.)
-    self.dip     = [ complex( try_read(f,i,float,0.),try_read(f,i+1,float,0.) ) for i in [3,5,7] ]
-    self.Excited =   try_read(f,11,bool, False)
-    self.Eexc    = self.e-self.eref
-    self.Fosc    = (2./3.*self.Eexc*sum( [i*i.conjugate() for i in self.dip] ) ).real
-    if self.Eexc==0.:
-      self.Prob  = 0.
-    else:
-      self.Prob  = self.Fosc/self.Eexc**2
-
-  def __str__(self):
-    s ='%03i % 18.10f % 18.10f ' % (self.i,self.e,self.eref)
-    for i in range(3):
-      s+='% 12.8f % 12.8f ' % (self.dip[i].real,self.dip[i].imag)
-    s+='% 12.8f % 12.8f %s' % (self.Eexc*HARTREE_TO_EV,self.Fosc,self.Excited)
-    return s
-
-  def Excite(self,max_Prob,erange):
-    try:
-      Prob=self.Prob/max_Prob
-    except ZeroDivisionError:
-      Prob=-1.
-    if not (erange[0] <= self.Eexc <= erange[1]):
-      Prob=-1.
-    self.Excited=(random.random() < Prob)
-
-# ======================================================================================================================
-
-class INITCOND:
-  def __init__(self,atomlist=[],eref=0.,epot_harm=0.):
-    self.atomlist=atomlist
-    self.eref=eref
-    self.Epot_harm=epot_harm
-    self.natom=len(atomlist)
-    self.Ekin=sum( [atom.Ekin for atom in self.atomlist] )
-    self.statelist=[]
-    self.nstate=0
-    self.Epot=epot_harm
-
-  def addstates(self,statelist):
-    self.statelist=statelist
-    self.nstate=len(statelist)
-    self.Epot=self.statelist[0].e-self.eref
-
-  def init_from_file(self,f,eref,index):
-    while True:
-      line=f.readline()
-      #if 'Index     %i' % (index) in line:
-      if re.search('Index\s+%i' % (index),line):
-        break
-      if line=='\n':
-        continue
-      if line=='':
-        print 'Initial condition %i not found in file %s' % (index,f.name)
-        quit(1)
-    f.readline()        # skip one line, where "Atoms" stands
-    atomlist=[]
-    while True:
-      line=f.readline()
-      if 'States' in line:
-        break
-      atom=ATOM()
-      atom.init_from_str(line)
-      atomlist.append(atom)
-    statelist=[]
-    while True:
-      line=f.readline()
-      if 'Ekin' in line:
-        break
-      state=STATE()
-      state.init_from_str(line)
-      statelist.append(state)
-    epot_harm=0.
-    while not line=='\n' and not line=='':
-      line=f.readline()
-      if 'epot_harm' in line.lower():
-        epot_harm=float(line.split()[1])
-        break
-    self.atomlist=atomlist
-    self.eref=eref
-    self.Epot_harm=epot_harm
-    self.natom=len(atomlist)
-    self.Ekin=sum( [atom.Ekin for atom in self.atomlist] )
-    self.statelist=statelist
-    self.nstate=len(statelist)
-    if self.nstate>0:
-      self.Epot=self.statelist[0].e-self.eref
-    else:
-      self.Epot=epot_harm
-
-  def __str__(self):
-    s='Atoms\n'
-    for atom in self.atomlist:
-      s+=str(atom)+'\n'
-    s+='States\n'
-    for state in self.statelist:
-      s+=str(state)+'\n'
-    s+='Ekin      % 16.12f a.u.\n' % (self.Ekin)
-    s+='Epot_harm % 16.12f a.u.\n' % (self.Epot_harm)
-    s+='Epot      % 16.12f a.u.\n' % (self.Epot)
-    s+='Etot_harm % 16.12f a.u.\n' % (self.Epot_harm+self.Ekin)
-    s+='Etot      % 16.12f a.u.\n' % (self.Epot+self.Ekin)
-    s+='\n\n'
-    return s
-
-# ======================================================================================================================
-# ======================================================================================================================
-# ======================================================================================================================
-
 def check_initcond_version(string,must_be_excited=False):
   if not 'sharc initial conditions file' in string.lower():
     return False
@@ -687,7 +511,7 @@ class init_string:
 
 # ======================================================================================================================
 
-def analyze_initconds(initlist,INFOS):
+def analyze_initconds(excited,INFOS):
   if INFOS['show_content']:
     print 'Contents of the initconds file:'
     print '''\nLegend:
@@ -704,12 +528,12 @@ def analyze_initconds(initlist,INFOS):
     display.reset()
     n_hasexc.append(0)
     n_issel.append(0)
-    for i in initlist:
-      if len(i.statelist)<state+1:
+    for flags in excited:
+      if len(flags)<state+1:
         display.add('?')
       else:
         n_hasexc[-1]+=1
-        if i.statelist[state].Excited:
+        if flags[state]:
           display.add('#')
           n_issel[-1]+=1
         else:
@@ -730,16 +554,18 @@ def analyze_initconds(initlist,INFOS):
 def get_initconds(INFOS):
   ''''''
 
-  INFOS['initf'].seek(0)                 # rewind the initf file
-  initlist=[]
+  # conditions are only read when their trajectories are set up, here only the selection flags are needed
+  initconds=INITCONDS(INFOS['initf'].name,INFOS['eref'])
   for icond in range(1,INFOS['ninit']+1):
-    initcond=INITCOND()
-    initcond.init_from_file(INFOS['initf'],INFOS['eref'],icond)
-    initlist.append(initcond)
+    if not icond in initconds:
+      print 'Initial condition %i not found in file %s' % (icond,INFOS['initf'].name)
+      quit(1)
+  excited=initconds.excited()[:INFOS['ninit']]
   print 'Number of initial conditions in file:       %5i' % (INFOS['ninit'])
 
-  INFOS['initlist']=initlist
-  INFOS['n_issel']=analyze_initconds(initlist,INFOS)
+  INFOS['initconds']=initconds
+  INFOS['excited']=excited
+  INFOS['n_issel']=analyze_initconds(excited,INFOS)
   return INFOS
 
 # ======================================================================================================================
@@ -986,12 +812,12 @@ from the initconds.excited files as provided by excite.py.
       print 'Please enter an integer between %i and %i.' % (1,INFOS['ninit'])
       continue
     nsetupable=0
-    for i,initcond in enumerate(INFOS['initlist']):
+    for i,flags in enumerate(INFOS['excited']):
       if i+1<firstindex:
         continue
       for state in set(setupstates):
         try:
-          nsetupable+=initcond.statelist[state-1].Excited
+          nsetupable+=flags[state-1]
         except IndexError:
           break
     print '\nThere can be %i trajector%s set up, starting in %i states.' % (nsetupable,['y','ies'][nsetupable!=1],len(INFOS['setupstates']))
@@ -4505,15 +4331,15 @@ def setup_all(INFOS):
   idone=0
   finished=False
 
-  initlist=INFOS['initlist']
+  excited=INFOS['excited']
 
   for icond in range(INFOS['firstindex'],INFOS['ninit']+1):
 
     for istate in INFOS['setupstates']:
 
-      if len(initlist[icond-1].statelist)<istate:
+      if len(excited[icond-1])<istate:
         continue
-      if not initlist[icond-1].statelist[istate-1].Excited:
+      if not excited[icond-1][istate-1]:
         continue
 
       idone+=1
@@ -4527,7 +4353,7 @@ def setup_all(INFOS):
         print 'Skipping initial condition %i %i!' % (istate, icond)
         continue
 
-      writeSHARCinput(INFOS,initlist[icond-1],dirname,istate)
+      writeSHARCinput(INFOS,INFOS['initconds'].get(icond),dirname,istate)
       io=make_directory(dirname+'/QM')
       io+=make_directory(dirname+'/restart')
       if io!=0:
@@ -4601,7 +4427,7 @@ This interactive program prepares SHARC dynamics calculations.
 
   print '\n'+centerstring('Full input',60,'#')+'\n'
   for item in INFOS:
-    if not 'initlist' in item:
+    if not item in ['initconds','excited']:
       print item, ' '*(25-len(item)), INFOS[item]
   print ''
   setup=question('Do you want to setup the specified calculations?',bool,True)
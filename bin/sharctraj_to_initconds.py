@@ -38,6 +38,12 @@ import datetime
 import re
 from optparse import OptionParser
 import os
+from multiprocessing import cpu_count
+
+# shared modules in $SHARC/../lib
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.realpath(__file__)),'..','lib'))
+from initconds import ATOM, STATE, INITCOND
+from outputdat import index_files, extract_steps
 
 starttime=datetime.datetime.now()
 # =========================================================
@@ -382,181 +388,6 @@ def writefile(filename,content):
 # ======================================================================================================================
 
 
-def try_read(l,index,typefunc,default):
-  try:
-    if typefunc==bool:
-      return 'True'==l[index]
-    else:
-      return typefunc(l[index])
-  except IndexError:
-    return typefunc(default)
-  except ValueError:
-    print 'Could not initialize object!'
-    quit(1)
-
-# ======================================================================================================================
-
-class ATOM:
-  def __init__(self,symb='??',num=0.,coord=[0.,0.,0.],m=0.,veloc=[0.,0.,0.]):
-    self.symb  = symb
-    self.num   = num
-    self.coord = coord
-    self.mass  = m
-    self.veloc = veloc
-    self.Ekin=0.5*self.mass * sum( [ self.veloc[i]**2 for i in range(3) ] )
-
-  def init_from_str(self,initstring=''):
-    f=initstring.split()
-    self.symb  =   try_read(f,0,str,  '??')
-    self.num   =   try_read(f,1,float,0.)
-    self.coord = [ try_read(f,i,float,0.) for i in range(2,5) ]
-    self.mass  =   try_read(f,5,float,0.)*U_TO_AMU
-    self.veloc = [ try_read(f,i,float,0.) for i in range(6,9) ]
-    self.Ekin=0.5*self.mass * sum( [ self.veloc[i]**2 for i in range(3) ] )
-
-  def __str__(self):
-    s ='%2s % 5.1f '               % (self.symb, self.num)
-    s+='% 12.8f % 12.8f % 12.8f '  % tuple(self.coord)
-    s+='% 12.8f '                  % (self.mass/U_TO_AMU)
-    s+='% 12.8f % 12.8f % 12.8f'   % tuple(self.veloc)
-    return s
-
-  def EKIN(self):
-    self.Ekin=0.5*self.mass * sum( [ self.veloc[i]**2 for i in range(3) ] )
-    return self.Ekin
-
-  def geomstring(self):
-    s='  %2s % 5.1f % 12.8f % 12.8f % 12.8f % 12.8f' % (self.symb,self.num,self.coord[0],self.coord[1],self.coord[2],self.mass/U_TO_AMU)
-    return s
-
-  def velocstring(self):
-    s=' '*11+'% 12.8f % 12.8f % 12.8f' % tuple(self.veloc)
-    return s
-
-# ======================================================================================================================
-
-class STATE:
-  def __init__(self,i=0,e=0.,eref=0.,dip=[0.,0.,0.]):
-    self.i       = i
-    self.e       = e.real
-    self.eref    = eref.real
-    self.dip     = dip
-    self.Excited = False
-    self.Eexc    = self.e-self.eref
-    self.Fosc    = (2./3.*self.Eexc*sum( [i*i.conjugate() for i in self.dip] ) ).real
-    if self.Eexc==0.:
-      self.Prob  = 0.
-    else:
-      self.Prob  = self.Fosc/self.Eexc**2
-
-  def init_from_str(self,initstring):
-    f=initstring.split()
-    self.i       =   try_read(f,0,int,  0 )
-    self.e       =   try_read(f,1,float,0.)
-    self.eref    =   try_read(f,2,float,0.)
-    self.dip     = [ complex( try_read(f,i,float,0.),try_read(f,i+1,float,0.) ) for i in [3,5,7] ]
-    self.Excited =   try_read(f,11,bool, False)
-    self.Eexc    = self.e-self.eref
-    self.Fosc    = (2./3.*self.Eexc*sum( [i*i.conjugate() for i in self.dip] ) ).real
-    if self.Eexc==0.:
-      self.Prob  = 0.
-    else:
-      self.Prob  = self.Fosc/self.Eexc**2
-
-  def __str__(self):
-    s ='%03i % 18.10f % 18.10f ' % (self.i,self.e,self.eref)
-    for i in range(3):
-      s+='% 12.8f % 12.8f ' % (self.dip[i].real,self.dip[i].imag)
-    s+='% 12.8f % 12.8f %s' % (self.Eexc*HARTREE_TO_EV,self.Fosc,self.Excited)
-    return s
-
-  def Excite(self,max_Prob,erange):
-    try:
-      Prob=self.Prob/max_Prob
-    except ZeroDivisionError:
-      Prob=-1.
-    if not (erange[0] <= self.Eexc <= erange[1]):
-      Prob=-1.
-    self.Excited=(random.random() < Prob)
-
-# ======================================================================================================================
-
-class INITCOND:
-  def __init__(self,atomlist=[],eref=0.,epot_harm=0.):
-    self.atomlist=atomlist
-    self.eref=eref
-    self.Epot_harm=epot_harm
-    self.natom=len(atomlist)
-    self.Ekin=sum( [atom.Ekin for atom in self.atomlist] )
-    self.statelist=[]
-    self.nstate=0
-    self.Epot=epot_harm
-
-  def addstates(self,statelist):
-    self.statelist=statelist
-    self.nstate=len(statelist)
-    self.Epot=self.statelist[0].e-self.eref
-
-  def init_from_file(self,f,eref,index):
-    while True: 
-      line=f.readline()
-      #if 'Index     %i' % (index) in line:
-      if re.search('Index\s+%i' % (index),line):
-        break
-    f.readline()        # skip one line, where "Atoms" stands
-    atomlist=[]
-    while True:
-      line=f.readline()
-      if 'States' in line:
-        break
-      atom=ATOM()
-      atom.init_from_str(line)
-      atomlist.append(atom)
-    statelist=[]
-    while True:
-      line=f.readline()
-      if 'Ekin' in line:
-        break
-      state=STATE()
-      state.init_from_str(line)
-      statelist.append(state)
-    while not line=='\n' and not line=='':
-      line=f.readline()
-      if 'epot_harm' in line.lower():
-        epot_harm=float(line.split()[1])
-        break
-    self.atomlist=atomlist
-    self.eref=eref
-    self.Epot_harm=epot_harm
-    self.natom=len(atomlist)
-    self.Ekin=sum( [atom.Ekin for atom in self.atomlist] )
-    self.statelist=statelist
-    self.nstate=len(statelist)
-    if self.nstate>0:
-      self.Epot=self.statelist[0].e-self.eref
-    else:
-      self.Epot=epot_harm
-
-  def __str__(self):
-    s='Atoms\n'
-    for atom in self.atomlist:
-      s+=str(atom)+'\n'
-    s+='States\n'
-    for state in self.statelist:
-      s+=str(state)+'\n'
-    s+='Ekin      % 16.12f a.u.\n' % (self.Ekin)
-    s+='Epot_harm % 16.12f a.u.\n' % (self.Epot_harm)
-    s+='Epot      % 16.12f a.u.\n' % (self.Epot)
-    s+='Etot_harm % 16.12f a.u.\n' % (self.Epot_harm+self.Ekin)
-    s+='Etot      % 16.12f a.u.\n' % (self.Epot+self.Ekin)
-    s+='\n\n'
-    return s
-
-
-# ======================================================================================================================
-# ======================================================================================================================
-# ======================================================================================================================
-
 def get_center_of_mass(molecule):
     """This function returns a list containing the center of mass
 of a molecule."""
@@ -767,123 +598,14 @@ def remove_rotations(ic):
       #print 'No default mass for atom %s' % (symb)
       #sys.exit(1)
 
-def check_output_dat(data):
-  inf={}
-  line=data[0].lower()
-  if 'sharc_version' in line:
-    inf['version']=float( line.split()[-1] )
-  else:
-    inf['version']=1.0
-
-  integers=['maxmult',
-            'natom',
-            'calc_overlap',
-            'laser',
-            'nsteps',
-            'nsubsteps',
-            'write_overlap',
-            'write_grad',
-            'write_nacdr',
-            'write_property1d',
-            'write_property2d',
-            'n_property1d',
-            'n_property2d'
-            ]
-  floats=  ['dtstep',
-            'ezero'
-            ]
-  special= ['nstates_m']
-
-  if inf['version']==1.0:
-    stopstring='! 0 step'
-    ilines=0
-    labeli=-1
-    datai=0
-  else:
-    stopstring='******'
-    ilines=-1
-    labeli=0
-    datai=-1
-
-  while True:
-    ilines+=1
-    line=data[ilines].lower()
-    if stopstring in line:
-      break
-    s=line.split()
-    label=s[labeli]
-    if label in integers:
-      inf[label]=int(s[datai])
-    elif label in floats:
-      inf[label]=float(s[datai])
-    elif label in special:
-      if label=='nstates_m':
-        if inf['version']==1.0:
-          inf[label]=[ int(i) for i in s[0:-2] ]
-        else:
-          inf[label]=[ int(i) for i in s[1:-1] ]
-    else:
-      continue
-
-  if inf['version']==1.0:
-    ilines-=1
-  else:
-    inf['atomic_numbers']=[]
-    inf['elements']=[]
-    inf['masses']=[]
-    ilines+=2
-    for i in range(inf['natom']):
-      inf['atomic_numbers'].append( int(float(data[ilines])) )
-      ilines+=1
-    ilines+=1
-    for i in range(inf['natom']):
-      inf['elements'].append( data[ilines].strip() )
-      ilines+=1
-    ilines+=1
-    for i in range(inf['natom']):
-      inf['masses'].append( float(data[ilines]) )
-      ilines+=1
-
-  nmax=-1
-  while True:
-    ilines+=1
-    if ilines>=len(data):
-      break
-    line=data[ilines]
-    if '! 0 Step' in line:
-      nmax=int(data[ilines+1])
-  inf['nmax']=nmax
-
-  return inf
-
-# ======================================================================================================================
-def get_atoms_step(data,step,inf):
-  if inf['version']==1.0:
-    print 'WARNING: trajectory data is in old format. Skipping...'
-    return []
-  ilines=-1
-  while True:
-    ilines+=1
-    line=data[ilines]
-    if '! 0 Step' in data[ilines] and int(data[ilines+1])==step:
-      break
-  while True:
-    ilines+=1
-    line=data[ilines]
-    if '! 11 Geometry' in line:
-      break
+def get_atoms_step(inf,geom,veloc):
   atomlist=[]
   for iatom in range(inf['natom']):
     symb=inf['elements'][iatom]
     num=inf['atomic_numbers'][iatom]
-    s=data[ilines+1+iatom].split()
-    xyz=[ float(i) for i in s ]
-    s=data[ilines+2+inf['natom']+iatom].split()
-    vel=[ float(i) for i in s ]
     mass=inf['masses'][iatom]
-    atomlist.append( ATOM(symb,num,xyz,mass,vel) )
+    atomlist.append( ATOM(symb,num,geom[iatom],mass,veloc[iatom]) )
     atomlist[-1].EKIN()
-
   return atomlist
 
 # ======================================================================================================================
@@ -934,39 +656,51 @@ def get_coords(INFOS):
   filelist=[filelist[0]]+filelist
   #print filelist
 
-  # initialize arrays
-  ic_list=[]
-  igeom=0
+  # index the files (the first file is used twice, as reference and as initial condition)
+  if INFOS['debug']:
+    print '%-40s'%'  indexing ...',datetime.datetime.now()-starttime
+  unique=[]
+  for filename in filelist:
+    if not filename in unique:
+      unique.append(filename)
+  headers=dict(zip(unique,index_files(unique,INFOS['ncpu'])))
 
-  # go through the data
+  # choose the steps
+  chosen=[]
   for filename in filelist:
-    if INFOS['debug']:
-      print '%-40s'%'  reading ...',datetime.datetime.now()-starttime
-    data=readfile(filename)
-    if INFOS['debug']:
-      print '%-40s'%'  header ...',datetime.datetime.now()-starttime
-    inf=check_output_dat(data)
+    inf,n=headers[filename]
     if inf['version']==1.0:
-      print '(skipping version 1.0 file)'
+      chosen.append( (filename,None,'(skipping version 1.0 file)') )
       continue
-
-    # choose the step:
     a=INFOS['step'][0]
     b=INFOS['step'][1]
-    n=inf['nmax']
     if a<0:
       a=n+1+a
     if b<0:
       b=n+1+b
     if not (0<=a<=b<=n):
-      print '(skipping, problems in steps: 0<=%i<=%i<=%i)' % (a,b,n)
+      chosen.append( (filename,None,'(skipping, problems in steps: 0<=%i<=%i<=%i)' % (a,b,n)) )
       continue
-    step=random.randint( a,b )
+    chosen.append( (filename,random.randint( a,b ),'') )
+
+  # read the geometries and velocities
+  if INFOS['debug']:
+    print '%-40s'%'  get steps ...',datetime.datetime.now()-starttime
+  jobs=[ (filename,sorted(set( [ step for (f,step,message) in chosen if f==filename and step is not None ] ))) for filename in unique ]
+  data=dict(zip(unique,extract_steps(jobs,INFOS['ncpu'])))
 
-    # get the atoms
-    if INFOS['debug']:
-      print '%-40s'%'  get step ...',datetime.datetime.now()-starttime
-    atomlist=get_atoms_step(data,step,inf)
+  # initialize arrays
+  ic_list=[]
+  igeom=0
+
+  # go through the data
+  for filename,step,message in chosen:
+    if step is None:
+      print message
+      continue
+    inf,n=headers[filename]
+    geom,veloc=data[filename][step]
+    atomlist=get_atoms_step(inf,geom,veloc)
 
     igeom+=1
     if not INFOS['KTR']:
@@ -977,7 +711,7 @@ def get_coords(INFOS):
       remove_rotations(atomlist)
       if INFOS['debug']:
         print '%-40s'%'  Done',datetime.datetime.now()-starttime
-    sys.stdout.write('Structure % 5i: %s  Step: % 5i/% 5i  ' % (igeom-1,filelist[igeom-1],step,inf['nmax']))
+    sys.stdout.write('Structure % 5i: %s  Step: % 5i/% 5i  ' % (igeom-1,filename,step,n))
     if igeom==1:
       sys.stdout.write('(Reference geometry)')
       molecule=INITCOND(atomlist,inf['ezero'],0.)
@@ -1065,6 +799,7 @@ The data is then transformed and written to initconds format.
   parser.add_option('--keep_trans_rot', dest='KTR', action='store_true',help="Keep translational and rotational components")
   #parser.add_option('--use_eq_geom',    dest='UEG', action='store_true',help="For all samples, use the equilibrium geometry (only sample velocities)")
   parser.add_option('--use_zero_veloc', dest='UZV', action='store_true',help="For all samples, set velocities to zero")
+  parser.add_option('-j', dest='ncpu', type=int, nargs=1, default=cpu_count(), help="Number of processes for reading the output.dat files (default: number of CPUs)")
   parser.add_option('--debug', dest='debug', action='store_true',help="Show timings")
   parser.add_option('--give_TRAJ_paths', dest='TRAJ', action='store_true',help="Allows specifying directly the TRAJ_..... directories to use (default: automatically recurses into all subdirectories)")
 
@@ -1083,6 +818,7 @@ The data is then transformed and written to initconds format.
   INFOS['UZV']=options.UZV
   INFOS['debug']=options.debug
   INFOS['TRAJ_']=options.TRAJ
+  INFOS['ncpu']=options.ncpu
   random.seed(options.r)
 
   
@@ -34,12 +34,23 @@ import math
 import cmath
 import random
 import sys
+import os
 import datetime
 from optparse import OptionParser
 import colorsys
 import re
 import pprint
 
+# shared modules in $SHARC/../lib
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.realpath(__file__)),'..','lib'))
+try:
+  import numpy
+  import convolution
+  NONUMPY=False
+except ImportError:
+  NONUMPY=True
+from initconds import ATOM, STATE, INITCOND, INITCONDS
+
 
 # =========================================================0
 # compatibility stuff
@@ -95,26 +106,38 @@ IToMult={
 
 # =========================================================0
 
+# evs() are the vectorized versions of ev() for numpy arrays (see lib/convolution.py)
+# cutoff is the distance from x0 beyond which the function is negligible
 class gauss:
   def __init__(self,fwhm):
     self.c=-4.*math.log(2.)/fwhm**2             # this factor needs to be evaluated only once
     self.f=fwhm
     self.norm=self.f/2.*math.sqrt(math.pi/math.log(2.))
+    self.cutoff=5.*fwhm                         # exp(-100*log(2))
+    self.shift_invariant=True
   def ev(self,A,x0,x):
     return A*math.exp( self.c*(x-x0)**2)        # this routine does only the necessary calculations
+  def evs(self,A,x0,x):
+    return A*numpy.exp( self.c*(x-x0)**2)
 
 class lorentz:
   def __init__(self,fwhm):
     self.f=fwhm
     self.c=0.25*fwhm**2
     self.norm=math.pi*self.f/2.
+    self.cutoff=None
+    self.shift_invariant=True
   def ev(self,A,x0,x):
     return A/( (x-x0)**2/self.c+1)
+  def evs(self,A,x0,x):
+    return A/( (x-x0)**2/self.c+1)
 
 class lognormal:
   def __init__(self,fwhm):
     self.f=fwhm
     self.norm=1.       # TODO: currently not implemented 
+    self.cutoff=None
+    self.shift_invariant=False
   def ev(self,A,x0,x):
     if x<=0 or x0<=0:
       return 0.
@@ -123,6 +146,12 @@ class lognormal:
     # note that the function does not take a value of A at x0
     # instead, the function is normalized such that its maximum will have a value of A (at x<=x0)
     return A*x0/x*math.exp( -c/(4.*math.log(2.)) -math.log(2.)*(math.log(x)-math.log(x0))**2/c)
+  def evs(self,A,x0,x):
+    old=numpy.seterr(all='ignore')
+    c=(numpy.log( (self.f+numpy.sqrt(self.f**2+4.*x0**2))/(2.*x0)))**2
+    y=A*x0/x*numpy.exp( -c/(4.*math.log(2.)) -math.log(2.)*(numpy.log(x)-numpy.log(x0))**2/c)
+    numpy.seterr(**old)
+    return numpy.where((x>0)&(x0>0),y,0.)
 
 class spectrum:
   def __init__(self,npts,emin,emax,fwhm,lineshape):
@@ -141,189 +170,19 @@ class spectrum:
       return
     for i in range(self.npts+1):
       self.spec[i]+=self.f.ev(A,x0,self.en[i])
-
-# ======================================================================================================================
-# ======================================================================================================================
-# ======================================================================================================================
-
-
-def try_read(l,index,typefunc,default):
-  try:
-    if typefunc==bool:
-      return 'True'==l[index]
+  def add_peaks(self,A,x0):
+    # adds many peaks at once
+    if NONUMPY:
+      for a,x in zip(A,x0):
+        self.add(a,x)
     else:
-      return typefunc(l[index])
-  except IndexError:
-    return typefunc(default)
-  except ValueError:
-    print 'Could not initialize object!'
-    quit(1)
+      spec=numpy.array(self.spec)+convolution.convolve(self.f,A,x0,self.en)
+      self.spec=spec.tolist()
 
 # ======================================================================================================================
-
-class ATOM:
-  def __init__(self,symb='??',num=0.,coord=[0.,0.,0.],m=0.,veloc=[0.,0.,0.]):
-    self.symb  = symb
-    self.num   = num
-    self.coord = coord
-    self.mass  = m
-    self.veloc = veloc
-    self.Ekin=0.5*self.mass * sum( [ self.veloc[i]**2 for i in range(3) ] )
-
-  def init_from_str(self,initstring=''):
-    f=initstring.split()
-    self.symb  =   try_read(f,0,str,  '??')
-    self.num   =   try_read(f,1,float,0.)
-    self.coord = [ try_read(f,i,float,0.) for i in range(2,5) ]
-    self.mass  =   try_read(f,5,float,0.)*U_TO_AMU
-    self.veloc = [ try_read(f,i,float,0.) for i in range(6,9) ]
-    self.Ekin=0.5*self.mass * sum( [ self.veloc[i]**2 for i in range(3) ] )
-
-  def __str__(self):
-    s ='%2s % 5.1f '               % (self.symb, self.num)
-    s+='% 12.8f % 12.8f % 12.8f '  % tuple(self.coord)
-    s+='% 12.8f '                  % (self.mass/U_TO_AMU)
-    s+='% 12.8f % 12.8f % 12.8f'   % tuple(self.veloc)
-    return s
-
-  def EKIN(self):
-    self.Ekin=0.5*self.mass * sum( [ self.veloc[i]**2 for i in range(3) ] )
-    return self.Ekin
-
-  def geomstring(self):
-    s='  %2s % 5.1f % 12.8f % 12.8f % 12.8f % 12.8f' % (self.symb,self.num,self.coord[0],self.coord[1],self.coord[2],self.mass/U_TO_AMU)
-    return s
-
-  def velocstring(self):
-    s=' '*11+'% 12.8f % 12.8f % 12.8f' % tuple(self.veloc)
-    return s
-
 # ======================================================================================================================
-
-class STATE:
-  def __init__(self,i=0,e=0.,eref=0.,dip=[0.,0.,0.]):
-    self.i       = i
-    self.e       = e.real
-    self.eref    = eref.real
-    self.dip     = dip
-    self.Excited = False
-    self.Eexc    = self.e-self.eref
-    self.Fosc    = (2./3.*self.Eexc*sum( [i*i.conjugate() for i in self.dip] ) ).real
-    if self.Eexc==0.:
-      self.Prob  = 0.
-    else:
-      self.Prob  = self.Fosc/self.Eexc**2
-
-  def init_from_str(self,initstring):
-    f=initstring.split()
-    self.i       =   try_read(f,0,int,  0 )
-    self.e       =   try_read(f,1,float,0.)
-    self.eref    =   try_read(f,2,float,0.)
-    self.dip     = [ complex( try_read(f,i,float,0.),try_read(f,i+1,float,0.) ) for i in [3,5,7] ]
-    self.Excited =   try_read(f,11,bool, False)
-    self.Eexc    = self.e-self.eref
-    self.Fosc    = (2./3.*self.Eexc*sum( [i*i.conjugate() for i in self.dip] ) ).real
-    if self.Eexc==0.:
-      self.Prob  = 0.
-    else:
-      self.Prob  = self.Fosc/self.Eexc**2
-
-  def __str__(self):
-    s ='%03i % 18.10f % 18.10f ' % (self.i,self.e,self.eref)
-    for i in range(3):
-      s+='% 12.8f % 12.8f ' % (self.dip[i].real,self.dip[i].imag)
-    s+='% 12.8f % 12.8f %s' % (self.Eexc*HARTREE_TO_EV,self.Fosc,self.Excited)
-    return s
-
-  def Excite(self,max_Prob,erange):
-    try:
-      Prob=self.Prob/max_Prob
-    except ZeroDivisionError:
-      Prob=-1.
-    if not (erange[0] <= self.Eexc <= erange[1]):
-      Prob=-1.
-    self.Excited=(random.random() < Prob)
-
 # ======================================================================================================================
 
-class INITCOND:
-  def __init__(self,atomlist=[],eref=0.,epot_harm=0.):
-    self.atomlist=atomlist
-    self.eref=eref
-    self.Epot_harm=epot_harm
-    self.natom=len(atomlist)
-    self.Ekin=sum( [atom.Ekin for atom in self.atomlist] )
-    self.statelist=[]
-    self.nstate=0
-    self.Epot=epot_harm
-
-  def addstates(self,statelist):
-    self.statelist=statelist
-    self.nstate=len(statelist)
-    self.Epot=self.statelist[0].e-self.eref
-
-  def init_from_file(self,f,eref,index):
-    while True: 
-      line=f.readline()
-      #if 'Index     %i' % (index) in line:
-      if re.search('Index\s+%i' % (index),line):
-        break
-      if line=='\n':
-        continue
-      if line=='':
-        print 'Initial condition %i not found in file %s' % (index,f.name)
-        quit(1)
-    f.readline()        # skip one line, where "Atoms" stands
-    atomlist=[]
-    while True:
-      line=f.readline()
-      if 'States' in line:
-        break
-      atom=ATOM()
-      atom.init_from_str(line)
-      atomlist.append(atom)
-    statelist=[]
-    while True:
-      line=f.readline()
-      if 'Ekin' in line:
-        break
-      state=STATE()
-      state.init_from_str(line)
-      statelist.append(state)
-    epot_harm=0.
-    while not line=='\n' and not line=='':
-      line=f.readline()
-      if 'epot_harm' in line.lower():
-        epot_harm=float(line.split()[1])
-        break
-    self.atomlist=atomlist
-    self.eref=eref
-    self.Epot_harm=epot_harm
-    self.natom=len(atomlist)
-    self.Ekin=sum( [atom.Ekin for atom in self.atomlist] )
-    self.statelist=statelist
-    self.nstate=len(statelist)
-    if self.nstate>0:
-      self.Epot=self.statelist[0].e-self.eref
-    else:
-      self.Epot=epot_harm
-
-  def __str__(self):
-    s='Atoms\n'
-    for atom in self.atomlist:
-      s+=str(atom)+'\n'
-    s+='States\n'
-    for state in self.statelist:
-      s+=str(state)+'\n'
-    s+='Ekin      % 16.12f a.u.\n' % (self.Ekin)
-    s+='Epot_harm % 16.12f a.u.\n' % (self.Epot_harm)
-    s+='Epot      % 16.12f a.u.\n' % (self.Epot)
-    s+='Etot_harm % 16.12f a.u.\n' % (self.Epot_harm+self.Ekin)
-    s+='Etot      % 16.12f a.u.\n' % (self.Epot+self.Ekin)
-    s+='\n\n'
-    return s
-
-# ======================================================================================================================
 
 def check_initcond_version(string,must_be_excited=False):
   if not 'sharc initial conditions file' in string.lower():
@@ -412,11 +271,16 @@ def get_initconds(INFOS):
   imax=INFOS['irange'][1]-INFOS['irange'][0]+1
   done=0
 
-  statelist=[]
+  initf.close()
+  initconds=INITCONDS(INFOS['filename'],INFOS['eref'])
   for icond in range(INFOS['irange'][0],INFOS['irange'][1]+1):
+    if not icond in initconds:
+      print 'Initial condition %i not found in file %s' % (icond,INFOS['filename'])
+      quit(1)
+
+  statelist=[]
+  for icond,initcond in initconds.iterate(INFOS['irange'][0],INFOS['irange'][1]):
     # get list of excited states
-    initcond=INITCOND()
-    initcond.init_from_file(initf,INFOS['eref'],icond)
     if len(initcond.statelist)==0:
       continue
     for i,state in enumerate(initcond.statelist):
@@ -455,6 +319,8 @@ def make_spectra(statelist,INFOS):
   done=0
 
   for istate,states in enumerate(statelist):
+    A=[]
+    x0=[]
     for icond,cond in enumerate(states):
       idone+=1
       if done<idone*width/imax:
@@ -464,9 +330,11 @@ def make_spectra(statelist,INFOS):
 
       if not INFOS['selected'] or cond.Excited:
         if INFOS['dos_switch']:
-          speclist[istate].add(1.,cond.Eexc)
+          A.append(1.)
         else:
-          speclist[istate].add(cond.Fosc,cond.Eexc)
+          A.append(cond.Fosc)
+        x0.append(cond.Eexc)
+    speclist[istate].add_peaks(A,x0)
   sys.stdout.write('\n')
 
   return speclist
@@ -503,14 +371,18 @@ def make_spectra_bootstrap(statelist,INFOS):
       use.append(admiss[r])
     #print use
     spec=spectrum(INFOS['npts'],INFOS['erange'][0],INFOS['erange'][1],INFOS['fwhm'],INFOS['lineshape'])
+    A=[]
+    x0=[]
     for istate,states in enumerate(statelist):
       for icond in use:
         cond=states[icond]
         if not INFOS['selected'] or cond.Excited:
           if INFOS['dos_switch']:
-            spec.add(1.,cond.Eexc)
+            A.append(1.)
           else:
-            spec.add(cond.Fosc,cond.Eexc)
+            A.append(cond.Fosc)
+          x0.append(cond.Eexc)
+    spec.add_peaks(A,x0)
     allspec.append(spec)
     idone+=1
     if done<idone*width/imax:
@@ -36,13 +36,16 @@ import re
 import os
 import stat
 import shutil
-import subprocess as sp
 import datetime
 import random
 from optparse import OptionParser
 import readline
 import time
 
+# shared modules in $SHARC/../lib
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.realpath(__file__)),'..','lib'))
+import data_extraction
+
 # =========================================================0
 # compatibility stuff
 
@@ -504,25 +507,16 @@ def do_calc(INFOS):
     if sharcpath==None:
       print 'Please set $SHARC to the directory containing the SHARC executables!'
       sys.exit(1)
-    else:
-      if not os.path.isfile(sharcpath+'/data_extractor.x'):
-        print '$SHARC does not contain data_extractor.x!'
-        sys.exit(1)
-      else:
-        cwd=os.getcwd()
-        for idir in INFOS['paths']:
-          ls=os.listdir(idir)
-          for itraj in ls:
-            if not 'TRAJ_' in itraj:
-              continue
-            path=idir+'/'+itraj
-            print path
-            os.chdir(path)
-            io=sp.call(sharcpath+'/data_extractor.x output.dat > /dev/null 2> /dev/null',shell=True)
-            if io!=0:
-              print 'WARNING: extractor call failed for %s!' % (path)
-            os.chdir(cwd)
-    print 'Extraction finished!\n'
+    if not os.path.isfile(sharcpath+'/data_extractor.x'):
+      print '$SHARC does not contain data_extractor.x!'
+      sys.exit(1)
+    paths=[]
+    for idir in INFOS['paths']:
+      for itraj in sorted(os.listdir(idir)):
+        if 'TRAJ_' in itraj:
+          paths.append(idir+'/'+itraj)
+    data_extraction.run_extractors(paths,sharcpath,always=True)
+    print ''
 
   width=30
   # prepare the list of output.lis files
@@ -38,6 +38,11 @@ import datetime
 from optparse import OptionParser
 import re
 import time
+import os
+
+# shared modules in $SHARC/../lib
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.realpath(__file__)),'..','lib'))
+from initconds import ATOM, STATE, INITCOND
 
 # =========================================================0
 # compatibility stuff
@@ -354,180 +359,6 @@ LOW_FREQ = 10.0 # threshold in cm^-1 for ignoring rotational and translational l
 # ======================================================================================================================
 
 
-def try_read(l,index,typefunc,default):
-  try:
-    if typefunc==bool:
-      return 'True'==l[index]
-    else:
-      return typefunc(l[index])
-  except IndexError:
-    return typefunc(default)
-  except ValueError:
-    print 'Could not initialize object!'
-    quit(1)
-
-# ======================================================================================================================
-
-class ATOM:
-  def __init__(self,symb='??',num=0.,coord=[0.,0.,0.],m=0.,veloc=[0.,0.,0.]):
-    self.symb  = symb
-    self.num   = num
-    self.coord = coord
-    self.mass  = m
-    self.veloc = veloc
-    self.Ekin=0.5*self.mass * sum( [ self.veloc[i]**2 for i in range(3) ] )
-
-  def init_from_str(self,initstring=''):
-    f=initstring.split()
-    self.symb  =   try_read(f,0,str,  '??')
-    self.num   =   try_read(f,1,float,0.)
-    self.coord = [ try_read(f,i,float,0.) for i in range(2,5) ]
-    self.mass  =   try_read(f,5,float,0.)*U_TO_AMU
-    self.veloc = [ try_read(f,i,float,0.) for i in range(6,9) ]
-    self.Ekin=0.5*self.mass * sum( [ self.veloc[i]**2 for i in range(3) ] )
-
-  def __str__(self):
-    s ='%2s % 5.1f '               % (self.symb, self.num)
-    s+='% 12.8f % 12.8f % 12.8f '  % tuple(self.coord)
-    s+='% 12.8f '                  % (self.mass/U_TO_AMU)
-    s+='% 12.8f % 12.8f % 12.8f'   % tuple(self.veloc)
-    return s
-
-  def EKIN(self):
-    self.Ekin=0.5*self.mass * sum( [ self.veloc[i]**2 for i in range(3) ] )
-    return self.Ekin
-
-  def geomstring(self):
-    s='  %2s % 5.1f % 12.8f % 12.8f % 12.8f % 12.8f' % (self.symb,self.num,self.coord[0],self.coord[1],self.coord[2],self.mass/U_TO_AMU)
-    return s
-
-  def velocstring(self):
-    s=' '*11+'% 12.8f % 12.8f % 12.8f' % tuple(self.veloc)
-    return s
-
-# ======================================================================================================================
-
-class STATE:
-  def __init__(self,i=0,e=0.,eref=0.,dip=[0.,0.,0.]):
-    self.i       = i
-    self.e       = e.real
-    self.eref    = eref.real
-    self.dip     = dip
-    self.Excited = False
-    self.Eexc    = self.e-self.eref
-    self.Fosc    = (2./3.*self.Eexc*sum( [i*i.conjugate() for i in self.dip] ) ).real
-    if self.Eexc==0.:
-      self.Prob  = 0.
-    else:
-      self.Prob  = self.Fosc/self.Eexc**2
-
-  def init_from_str(self,initstring):
-    f=initstring.split()
-    self.i       =   try_read(f,0,int,  0 )
-    self.e       =   try_read(f,1,float,0.)
-    self.eref    =   try_read(f,2,float,0.)
-    self.dip     = [ complex( try_read(f,i,float,0.),try_read(f,i+1,float,0.) ) for i in [3,5,7] ]
-    self.Excited =   try_read(f,11,bool, False)
-    self.Eexc    = self.e-self.eref
-    self.Fosc    = (2./3.*self.Eexc*sum( [i*i.conjugate() for i in self.dip] ) ).real
-    if self.Eexc==0.:
-      self.Prob  = 0.
-    else:
-      self.Prob  = self.Fosc/self.Eexc**2
-
-  def __str__(self):
-    s ='%03i % 18.10f % 18.10f ' % (self.i,self.e,self.eref)
-    for i in range(3):
-      s+='% 12.8f % 12.8f ' % (self.dip[i].real,self.dip[i].imag)
-    s+='% 12.8f % 12.8f %s' % (self.Eexc*HARTREE_TO_EV,self.Fosc,self.Excited)
-    return s
-
-  def Excite(self,max_Prob,erange):
-    try:
-      Prob=self.Prob/max_Prob
-    except ZeroDivisionError:
-      Prob=-1.
-    if not (erange[0] <= self.Eexc <= erange[1]):
-      Prob=-1.
-    self.Excited=(random.random() < Prob)
-
-# ======================================================================================================================
-
-class INITCOND:
-  def __init__(self,atomlist=[],eref=0.,epot_harm=0.):
-    self.atomlist=atomlist
-    self.eref=eref
-    self.Epot_harm=epot_harm
-    self.natom=len(atomlist)
-    self.Ekin=sum( [atom.Ekin for atom in self.atomlist] )
-    self.statelist=[]
-    self.nstate=0
-    self.Epot=epot_harm
-
-  def addstates(self,statelist):
-    self.statelist=statelist
-    self.nstate=len(statelist)
-    self.Epot=self.statelist[0].e-self.eref
-
-  def init_from_file(self,f,eref,index):
-    while True:
-      line=f.readline()
-      #if 'Index     %i' % (index) in line:
-      if re.search('Index\s+%i' % (index),line):
-        break
-    f.readline()        # skip one line, where "Atoms" stands
-    atomlist=[]
-    while True:
-      line=f.readline()
-      if 'States' in line:
-        break
-      atom=ATOM()
-      atom.init_from_str(line)
-      atomlist.append(atom)
-    statelist=[]
-    while True:
-      line=f.readline()
-      if 'Ekin' in line:
-        break
-      state=STATE()
-      state.init_from_str(line)
-      statelist.append(state)
-    while not line=='\n' and not line=='':
-      line=f.readline()
-      if 'epot_harm' in line.lower():
-        epot_harm=float(line.split()[1])
-        break
-    self.atomlist=atomlist
-    self.eref=eref
-    self.Epot_harm=epot_harm
-    self.natom=len(atomlist)
-    self.Ekin=sum( [atom.Ekin for atom in self.atomlist] )
-    self.statelist=statelist
-    self.nstate=len(statelist)
-    if self.nstate>0:
-      self.Epot=self.statelist[0].e-self.eref
-    else:
-      self.Epot=epot_harm
-
-  def __str__(self):
-    s='Atoms\n'
-    for atom in self.atomlist:
-      s+=str(atom)+'\n'
-    s+='States\n'
-    for state in self.statelist:
-      s+=str(state)+'\n'
-    s+='Ekin      % 16.12f a.u.\n' % (self.Ekin)
-    s+='Epot_harm % 16.12f a.u.\n' % (self.Epot_harm)
-    s+='Epot      % 16.12f a.u.\n' % (self.Epot)
-    s+='Etot_harm % 16.12f a.u.\n' % (self.Epot_harm+self.Ekin)
-    s+='Etot      % 16.12f a.u.\n' % (self.Epot+self.Ekin)
-    s+='\n\n'
-    return s
-
-
-# ======================================================================================================================
-# ======================================================================================================================
-# ======================================================================================================================
 def ask_for_masses():
   print '''
 Option -m used, please enter non-default masses:
@@ -1216,6 +1047,127 @@ Method is based on L. Sun, W. L. Hase J. Chem. Phys. 133, 044313
   ic = INITCOND(atomlist,0.,Epot)
   return ic
 
+# ======================================================================================================================
+
+def state_probabilities(mode):
+  """This function returns the cumulative Boltzmann probabilities of the
+vibrational states of a mode, as used in determine_state."""
+  thresh=0.9999
+  freq = mode['freq']/CM_TO_HARTREE
+  exponent = freq/(0.695035*temperature)  # factor for conversion cm-1 to K
+  if exponent > 800:
+    exponent = 600
+    print '''The partition function is too close to zero due to very low temperature or very high frequency! It was set to %e''' % (math.exp(-exponent/2.) /\
+ ( 1. - math.exp(-exponent) ))
+  partition_function = math.exp(-exponent/2.) / \
+                       ( 1. - math.exp(-exponent) )
+  prob=[]
+  sum_p=0.
+  while sum_p < thresh:
+    prob.append( math.exp(-exponent*(len(prob)+1./2.))/partition_function )
+    sum_p += prob[-1]
+  return numpy.cumsum(prob)
+
+def laguerre_array(n, x):
+  """Laguerre polynomials L_n(x) for arrays of orders n and arguments x
+(upward recurrence, equivalent to ana_laguerre)."""
+  L0 = numpy.ones(x.shape)
+  L1 = 1. - x
+  result = numpy.where(n==0, L0, L1)
+  for k in range(1, int(numpy.max(n))):
+    L0, L1 = L1, ((2*k+1-x)*L1 - k*L0)/(k+1)
+    result = numpy.where(n==k+1, L1, result)
+  return result
+
+def sample_wigner_QP(modes, amount):
+  """This function samples the dimensionless Q and P of all modes for
+amount initial conditions at once (arrays of shape (amount,nmodes)).
+The ground state Wigner function exp(-Q**2-P**2) is sampled directly as
+Gaussian distribution (restricted to [-5,+5] like in sample_initial_condition).
+For finite temperature, the vibrational states and Q/P are drawn by rejection
+sampling as in sample_initial_condition, but for all conditions at once."""
+  nmodes = len(modes)
+  Q = numpy.zeros((amount, nmodes))
+  P = numpy.zeros((amount, nmodes))
+  for imode, mode in enumerate(modes):
+    if temperature == 0:
+      for X in (Q, P):
+        todo = numpy.arange(amount)
+        while len(todo) > 0:
+          X[todo, imode] = numpy.random.normal(0., math.sqrt(0.5), len(todo))
+          todo = todo[numpy.abs(X[todo, imode]) > 5.0]
+      continue
+    cumprob = state_probabilities(mode)
+    todo = numpy.arange(amount)
+    warned = False
+    while len(todo) > 0:
+      # draw state, Q, P for all conditions which are not yet accepted
+      ntodo = len(todo)
+      n = numpy.searchsorted(cumprob, numpy.random.random(ntodo)*cumprob[-1])
+      if high_temp:
+        reject = n > 500
+      else:
+        reject = numpy.zeros(ntodo, dtype=bool)
+        if numpy.any(n > 500) and not warned:
+          warned = True
+          print 'The calculated excited vibrational state for this normal mode exceeds the limit of the calculation.\nThe harmonic approximation is not valid for high vibrational states of low-frequency normal modes. The vibrational state was set to 500. If you want to discard these states instead (due to oversampling of state nr 500), use the -T option.'
+        n = numpy.minimum(n, 500)
+      random_Q = numpy.random.random(ntodo)*10.0 - 5.0
+      random_P = numpy.random.random(ntodo)*10.0 - 5.0
+      rhosquare = 2.0 * (random_P**2 + random_Q**2)
+      W = (-1.0)**n * laguerre_array(n, rhosquare) * numpy.exp(-rhosquare/2.0)
+      accept = (~reject) & (W >= 0.) & (W <= 1.) & (W > numpy.random.random(ntodo))
+      Q[todo[accept], imode] = random_Q[accept]
+      P[todo[accept], imode] = random_P[accept]
+      todo = todo[~accept]
+  return Q, P
+
+def sample_initial_conditions(molecule, modes, amount):
+  """This function samples amount initial conditions at once. Returns the
+coordinates and velocities (arrays of shape (amount,natom,3)) and the
+harmonic potential energies. Same procedure as sample_initial_condition:
+the normal mode displacements are applied as one matrix product, and the
+center of mass, translations and rotations are treated for all conditions together."""
+  natom = len(molecule)
+  mass = numpy.array([ atom.mass for atom in molecule ])
+  eq = numpy.array([ atom.coord for atom in molecule ])
+  freq = numpy.array([ mode['freq'] for mode in modes ])
+  # unweighted normal modes, shape (nmodes,3*natom)
+  move = numpy.array([ mode['move'] for mode in modes ]) / numpy.sqrt(mass)[None, :, None]
+  move = move.reshape((len(modes), 3*natom))
+
+  Q, P = sample_wigner_QP(modes, amount)
+  Q /= numpy.sqrt(freq)
+  P *= numpy.sqrt(freq)
+  Epot = numpy.sum(0.5 * freq**2 * Q**2, axis=1)
+  coord = numpy.zeros((amount, natom, 3)) + eq
+  veloc = numpy.zeros((amount, natom, 3))
+  if not UEG:
+    coord += numpy.dot(Q, move).reshape((amount, natom, 3))
+  if not UZV:
+    veloc += numpy.dot(P, move).reshape((amount, natom, 3))
+
+  if not KTR:
+    # restore center of mass and remove translations
+    com_eq = numpy.dot(mass, eq) / numpy.sum(mass)
+    com = numpy.einsum('a,iax->ix', mass, coord) / numpy.sum(mass)
+    coord += (com_eq - com)[:, None, :]
+    v_com = numpy.einsum('a,iax->ix', mass, veloc) / numpy.sum(mass)
+    veloc -= v_com[:, None, :]
+    # remove rotations: omega = I^-1 L, v -= omega x r
+    r = coord - com_eq[None, None, :]
+    I = numpy.einsum('a,iax,iax->i', mass, r, r)[:, None, None] * numpy.eye(3)[None, :, :] \
+        - numpy.einsum('a,iax,iay->ixy', mass, r, r)
+    L = numpy.einsum('a,iax->ix', mass, numpy.cross(r, veloc))
+    ok = numpy.linalg.det(I) > 0.01
+    if not numpy.all(ok):
+      print 'WARNING: moment of inertia tensor is not invertible'
+    if numpy.any(ok):
+      omega = numpy.linalg.solve(I[ok], L[ok][:, :, None])[:, :, 0]
+      veloc[ok] -= numpy.cross(omega[:, None, :], r[ok])
+  return coord, veloc, Epot
+
+
 # ======================================================================================================================
 # ======================================================================================================================
 # ======================================================================================================================
@@ -1255,8 +1207,13 @@ Method is based on L. Sun, W. L. Hase J. Chem. Phys. 133, 044313
 
 def create_initial_conditions_string(molecule, modes, ic_list, eref=0.0):
   """This function converts an list of initial conditions into a string."""
-  ninit=len(ic_list)
-  natom=ic_list[0].natom
+  string=initial_conditions_header(molecule, modes, len(ic_list), ic_list[0].natom, eref)
+  for i, ic in enumerate(ic_list):
+    string += 'Index     %i\n%s' % (i+1, str(ic))
+  return string
+
+def initial_conditions_header(molecule, modes, ninit, natom, eref=0.0):
+  """This function returns the header of an initial conditions file."""
   representation='None'
   #eref
   eharm=0.
@@ -1275,13 +1232,63 @@ Equilibrium
   for atom in molecule:
     string+=str(atom)+'\n'
   string+='\n\n'
-
-  for i, ic in enumerate(ic_list):
-    string += 'Index     %i\n%s' % (i+1, str(ic))
   return string
 
 # ======================================================================================================================
 
+def write_initial_conditions(filename, molecule, modes, amount, xyzfile=None):
+  """This function samples 'amount' initial conditions in chunks with
+sample_initial_conditions and writes each chunk to the initconds file
+(and optionally the xyz file) directly, in the same format as
+create_initial_conditions_string and make_dyn_file."""
+  print 'Sampling initial conditions'
+  natom = len(molecule)
+  mass = numpy.array([ atom.mass for atom in molecule ])
+  atomstrings = [ '%2s % 5.1f ' % (atom.symb, atom.num) for atom in molecule ]
+  massstrings = [ '% 12.8f ' % (atom.mass/U_TO_AMU) for atom in molecule ]
+  outfile = open(filename, 'w')
+  outfile.write(initial_conditions_header(molecule, modes, amount, natom))
+  if xyzfile:
+    xyz = open(xyzfile, 'w')
+  chunk = max(1, 100000/natom)
+  width = 50
+  for start in range(0, amount, chunk):
+    n = min(chunk, amount-start)
+    coord, veloc, Epot = sample_initial_conditions(molecule, modes, n)
+    Ekin = 0.5 * numpy.sum(mass[None, :] * numpy.sum(veloc**2, axis=2), axis=1)
+    coord = coord.tolist()
+    veloc = veloc.tolist()
+    string = []
+    for i in range(n):
+      string.append('Index     %i\nAtoms\n' % (start+i+1))
+      for iatom in range(natom):
+        string.append(atomstrings[iatom] + '% 12.8f % 12.8f % 12.8f ' % tuple(coord[i][iatom]) +
+                      massstrings[iatom] + '% 12.8f % 12.8f % 12.8f\n' % tuple(veloc[i][iatom]))
+      string.append('States\n')
+      string.append('Ekin      % 16.12f a.u.\n' % (Ekin[i]))
+      string.append('Epot_harm % 16.12f a.u.\n' % (Epot[i]))
+      string.append('Epot      % 16.12f a.u.\n' % (Epot[i]))
+      string.append('Etot_harm % 16.12f a.u.\n' % (Epot[i]+Ekin[i]))
+      string.append('Etot      % 16.12f a.u.\n' % (Epot[i]+Ekin[i]))
+      string.append('\n\n')
+    outfile.write(''.join(string))
+    if xyzfile:
+      string = []
+      for i in range(n):
+        string.append('%i\n%i\n' % (natom, start+i))
+        for iatom, atom in enumerate(molecule):
+          string.append('%s %f %f %f\n' % ((atom.symb,) + tuple( [ x/ANG_TO_BOHR for x in coord[i][iatom] ] )))
+      xyz.write(''.join(string))
+    done = (start+n)*width/amount
+    sys.stdout.write('\rProgress: ['+'='*done+' '*(width-done)+'] %3i%%' % (done*100/width))
+    sys.stdout.flush()
+  print '\n'
+  outfile.close()
+  if xyzfile:
+    xyz.close()
+
+# ======================================================================================================================
+
 
 def create_initial_conditions_list(amount, molecule, modes):
     """This function creates 'amount' initial conditions from the
@@ -1472,6 +1479,13 @@ Temperature                  = %f''' % (filename, outfile, options.n, options.r,
 
   if options.lvc:
       lvc_input(molecule, modes)
+  elif np:
+      # batched sampling, the output is written in chunks
+      numpy.random.seed(options.r)
+      xyzfile = None
+      if options.X:
+        xyzfile = options.o+'.xyz'
+      write_initial_conditions(outfile, molecule, modes, amount, xyzfile)
   else:
       #print 'Generating %i initial conditions' % amount
       ic_list = create_initial_conditions_list(amount, molecule, modes)
@@ -1481,7 +1495,7 @@ Temperature                  = %f''' % (filename, outfile, options.n, options.r,
       outfile.write(outstring)
       outfile.close()
 
-  if options.X and not options.lvc:
+  if options.X and not options.lvc and not np:
     make_dyn_file(ic_list,options.o+'.xyz')
 
   # save the shell command
@@ -0,0 +1,161 @@
+"""
+version 1.0
+description: Vectorized convolution of line spectra with lineshape kernels.
+    A line spectrum is given by amplitudes A and positions x0, the result is
+    sum_i kernel(A_i,x0_i,x) on a grid x.
+    The kernels are the lineshape classes in spectrum.py and data_collector.py, which provide:
+      evs(A,x0,x)       vectorized (broadcasting) version of ev(A,x0,x)
+      cutoff            distance beyond which the kernel is negligible (None: no cutoff)
+      shift_invariant   True if the kernel only depends on x-x0
+"""
+
+import numpy
+
+# maximum number of kernel evaluations per block
+BLOCKSIZE = 2**20
+
+
+def is_uniform(grid):
+    """
+    Checks whether the grid points are equally spaced.
+    """
+    if len(grid) < 3:
+        return False
+    d = numpy.diff(grid)
+    return d[0] > 0. and numpy.allclose(d, d[0], rtol=1e-9, atol=0.)
+
+
+def convolve(kernel, A, x0, grid):
+    """
+    Adds all peaks (amplitudes A at positions x0) to the grid in one operation.
+
+    Peaks with zero or undefined (NaN) amplitude or position are skipped.
+    Kernels with a cutoff are only evaluated within the cutoff around each peak.
+    If the grid is uniform and all peaks are located on grid points, shift-invariant
+    kernels are applied by FFT.
+    """
+    grid = numpy.asarray(grid, dtype=float)
+    A = numpy.asarray(A, dtype=float).ravel()
+    x0 = numpy.asarray(x0, dtype=float).ravel()
+    keep = (A != 0.) & (A == A) & (x0 == x0)
+    A = A[keep]
+    x0 = x0[keep]
+    if len(A) == 0:
+        return numpy.zeros(len(grid))
+    if getattr(kernel, 'shift_invariant', False) and is_uniform(grid):
+        spec = convolve_fft(kernel, A, x0, grid)
+        if spec is not None:
+            return spec
+    cutoff = getattr(kernel, 'cutoff', None)
+    if cutoff is None:
+        return convolve_dense(kernel, A, x0, grid)
+    return convolve_window(kernel, A, x0, grid, cutoff)
+
+
+def convolve_dense(kernel, A, x0, grid):
+    """
+    Evaluates all peaks on all grid points, in blocks of peaks.
+    """
+    spec = numpy.zeros(len(grid))
+    nblock = max(1, BLOCKSIZE // len(grid))
+    for i in range(0, len(A), nblock):
+        spec += numpy.sum(kernel.evs(A[i:i + nblock, None], x0[i:i + nblock, None], grid[None, :]), axis=0)
+    return spec
+
+
+def convolve_window(kernel, A, x0, grid, cutoff):
+    """
+    Evaluates each peak only on the grid points within cutoff (grid must be sorted).
+    """
+    spec = numpy.zeros(len(grid))
+    lo = numpy.searchsorted(grid, x0 - cutoff, side='left')
+    hi = numpy.searchsorted(grid, x0 + cutoff, side='right')
+    nwin = int(numpy.max(hi - lo))
+    if nwin == 0:
+        return spec
+    nblock = max(1, BLOCKSIZE // nwin)
+    for i in range(0, len(A), nblock):
+        index = lo[i:i + nblock, None] + numpy.arange(nwin)[None, :]
+        inside = index < hi[i:i + nblock, None]
+        index = numpy.minimum(index, len(grid) - 1)
+        values = kernel.evs(A[i:i + nblock, None], x0[i:i + nblock, None], grid[index])
+        spec += numpy.bincount(index[inside], weights=values[inside], minlength=len(grid))
+    return spec
+
+
+def convolve_fft(kernel, A, x0, grid):
+    """
+    FFT convolution for peaks located on the points of a uniform grid.
+    Returns None if the peaks are not on the grid.
+    """
+    dx = grid[1] - grid[0]
+    pos = (x0 - grid[0]) / dx
+    k = numpy.round(pos).astype(int)
+    if numpy.any(numpy.abs(pos - k) > 1e-6):
+        return None
+    # peaks outside of the grid still contribute
+    kmin = min(numpy.min(k), 0)
+    kmax = max(numpy.max(k), len(grid) - 1)
+    L = kmax - kmin + 1
+    signal = numpy.bincount(k - kmin, weights=A, minlength=L)
+    offsets = numpy.arange(-(L - 1), L) * dx
+    kern = kernel.evs(1., 0., offsets)
+    cutoff = getattr(kernel, 'cutoff', None)
+    if cutoff is not None:
+        kern[numpy.abs(offsets) > cutoff] = 0.
+    nfft = 1
+    while nfft < 3 * L - 2:
+        nfft *= 2
+    conv = numpy.fft.irfft(numpy.fft.rfft(signal, nfft) * numpy.fft.rfft(kern, nfft), nfft)
+    start = (L - 1) - kmin
+    return conv[start:start + len(grid)]
+
+
+def kernel_matrix(kernel, x0, grid):
+    """
+    Returns the matrix K[ig,ip]=kernel(1,x0[ip],grid[ig]).
+
+    The convolution of many sets of amplitudes at the same positions
+    (e.g., all columns of a time series) is then a single product K.A.
+    """
+    grid = numpy.asarray(grid, dtype=float)
+    x0 = numpy.asarray(x0, dtype=float)
+    K = kernel.evs(1., x0[None, :], grid[:, None])
+    cutoff = getattr(kernel, 'cutoff', None)
+    if cutoff is not None:
+        K[numpy.abs(grid[:, None] - x0[None, :]) > cutoff] = 0.
+    return K
+
+
+def smooth(kernel, x, Y):
+    """
+    Kernel smoothing of the columns of Y given at the sorted points x:
+      out[i] = sum_j w_ij*Y[j] / sum_j w_ij,  with w_ij=kernel(1,x[i],x[j]) and only w_ij>0
+
+    Uniform grids with shift-invariant kernels are done by FFT, otherwise
+    only the points within the kernel cutoff around each x[i] are evaluated.
+    """
+    x = numpy.asarray(x, dtype=float)
+    Y = numpy.asarray(Y, dtype=float).reshape((len(x), -1))
+    if getattr(kernel, 'shift_invariant', False) and is_uniform(x):
+        norm = convolve_fft(kernel, numpy.ones(len(x)), x, x)
+        out = numpy.array([ convolve_fft(kernel, Y[:, i], x, x) for i in range(Y.shape[1]) ]).T
+        return out / norm[:, None]
+    cutoff = getattr(kernel, 'cutoff', None)
+    if cutoff is None:
+        lo = numpy.zeros(len(x), dtype=int)
+        hi = numpy.zeros(len(x), dtype=int) + len(x)
+    else:
+        lo = numpy.searchsorted(x, x - cutoff, side='left')
+        hi = numpy.searchsorted(x, x + cutoff, side='right')
+    nwin = int(numpy.max(hi - lo))
+    out = numpy.zeros(Y.shape)
+    nblock = max(1, BLOCKSIZE // (nwin * Y.shape[1]))
+    for i in range(0, len(x), nblock):
+        index = lo[i:i + nblock, None] + numpy.arange(nwin)[None, :]
+        inside = index < hi[i:i + nblock, None]
+        index = numpy.minimum(index, len(x) - 1)
+        w = kernel.evs(1., x[i:i + nblock, None], x[index])
+        w[~inside | ~(w > 0.)] = 0.
+        out[i:i + nblock] = numpy.einsum('ij,ijk->ik', w, Y[index]) / numpy.sum(w, axis=1)[:, None]
+    return out
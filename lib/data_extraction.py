@@ -0,0 +1,178 @@
+"""
+version 1.0
+description: Runs data_extractor.x (or data_extractor_NetCDF.x) for many trajectories in parallel.
+    A trajectory is only extracted if output.dat is newer than the requested files in output_data/.
+    The results are recorded in a manifest file in each ensemble directory (the directory containing
+    the TRAJ_XXXXX directories), so that later runs do not need to check up-to-date trajectories again.
+"""
+
+import os
+import time
+import json
+import subprocess as sp
+from multiprocessing import Pool
+
+MANIFEST = 'data_extractor.manifest'
+
+
+def datafile(path):
+    """
+    Returns the output.dat (or output.dat.nc) file of a trajectory, or None.
+    """
+    for name in ['output.dat', 'output.dat.nc']:
+        filename = os.path.join(path, name)
+        if os.path.isfile(filename):
+            return filename
+    return None
+
+
+def read_manifest(idir):
+    """
+    Reads the manifest of the ensemble directory idir, returns {} if there is none.
+    """
+    try:
+        f = open(os.path.join(idir, MANIFEST))
+        manifest = json.load(f)
+        f.close()
+    except (IOError, ValueError):
+        manifest = {}
+    return manifest
+
+
+def write_manifest(idir, manifest):
+    """
+    Writes the manifest of the ensemble directory idir (silently skipped if not writable).
+    """
+    filename = os.path.join(idir, MANIFEST)
+    try:
+        f = open(filename + '.tmp', 'w')
+        json.dump(manifest, f, indent=1, sort_keys=True)
+        f.close()
+        os.rename(filename + '.tmp', filename)
+    except (IOError, OSError):
+        pass
+
+
+def needs_update(path, checkfiles=['expec.out'], options='', manifest={}):
+    """
+    Checks whether the files in output_data/ are older than output.dat.
+
+    If the manifest shows a successful extraction with the same options
+    of the current output.dat and the files still exist, their times are not checked again.
+    """
+    dat = datafile(path)
+    if dat is None:
+        return False
+    time_dat = os.path.getmtime(dat)
+    entry = manifest.get(os.path.basename(os.path.normpath(path)))
+    if entry and entry['exitcode'] == 0 and entry['options'] == options and entry['time_dat'] == time_dat \
+            and all([ i in entry['files'] and os.path.isfile(os.path.join(path, 'output_data', i)) for i in checkfiles ]):
+        return False
+    for i in checkfiles:
+        try:
+            if time_dat > os.path.getmtime(os.path.join(path, 'output_data', i)):
+                return True
+        except OSError:
+            return True
+    return False
+
+
+def extractor_command(sharcpath, path, options='', netcdf_options='', netcdf_env=False):
+    """
+    Returns the shell command to run the extractor in path.
+    """
+    if os.path.isfile(os.path.join(path, 'output.dat.nc')):
+        command = '%s/data_extractor_NetCDF.x %s %s output.dat' % (sharcpath, options, netcdf_options)
+        if netcdf_env:
+            command = '. %s/sharcvars.sh;' % (sharcpath) + command
+    else:
+        command = '%s/data_extractor.x %s output.dat' % (sharcpath, options)
+    return command
+
+
+def run_extractor(path, command):
+    """
+    Runs the command in path (without changing the working directory of the calling process).
+    Returns the exit code and the runtime.
+    """
+    starttime = time.time()
+    devnull = open(os.devnull, 'w')
+    try:
+        io = sp.call(command, shell=True, cwd=path, stdout=devnull, stderr=devnull)
+    except OSError:
+        io = -1
+    devnull.close()
+    return io, time.time() - starttime
+
+
+def run_extractors(paths, sharcpath, options='', checkfiles=['expec.out'], always=False, ncpu=1,
+                   netcdf_options='', netcdf_env=False, verbose=True):
+    """
+    Runs the extractor for all trajectory directories in paths which need an update.
+
+    Returns a dictionary with the exit code for each path (None if the trajectory was up to date
+    or has no output.dat).
+    """
+    manifests = {}
+    for path in paths:
+        idir = os.path.dirname(os.path.normpath(path))
+        if idir not in manifests:
+            manifests[idir] = read_manifest(idir)
+
+    # find the trajectories which need an update
+    results = {}
+    jobs = []
+    time_dat = {}
+    for path in paths:
+        idir = os.path.dirname(os.path.normpath(path))
+        results[path] = None
+        if datafile(path) is None:
+            continue
+        if always or needs_update(path, checkfiles, options, manifests[idir]):
+            jobs.append(path)
+            time_dat[path] = os.path.getmtime(datafile(path))
+    if verbose:
+        print 'Running data_extractor for %i of %i trajectories on %i CPUs ...' % (len(jobs), len(paths), ncpu)
+
+    # run the extractors
+    starttime = time.time()
+    runs = {}
+    if ncpu > 1 and len(jobs) > 1:
+        # start with the largest files for better load balancing
+        jobs.sort(key=lambda path: os.path.getsize(datafile(path)), reverse=True)
+        pool = Pool(processes=ncpu)
+        for path in jobs:
+            command = extractor_command(sharcpath, path, options, netcdf_options, netcdf_env)
+            runs[path] = pool.apply_async(run_extractor, [path, command])
+        pool.close()
+        pool.join()
+        for path in jobs:
+            runs[path] = runs[path].get()
+    else:
+        for path in jobs:
+            command = extractor_command(sharcpath, path, options, netcdf_options, netcdf_env)
+            runs[path] = run_extractor(path, command)
+
+    # update the manifests
+    jobs = [ path for path in paths if path in runs ]
+    for path in jobs:
+        io, runtime = runs[path]
+        results[path] = io
+        if verbose:
+            if io == 0:
+                print '%-50s OK (%.1f s)' % (path, runtime)
+            else:
+                print 'WARNING: extractor call failed for %s! Exit code %i' % (path, io)
+        idir = os.path.dirname(os.path.normpath(path))
+        manifests[idir][os.path.basename(os.path.normpath(path))] = {
+            'time_dat': time_dat[path],
+            'exitcode': io,
+            'options': options,
+            'files': list(checkfiles),
+            'runtime': runtime
+        }
+    for idir in manifests:
+        write_manifest(idir, manifests[idir])
+    if verbose:
+        print 'Extraction finished in %.1f s!' % (time.time() - starttime)
+    return results
@@ -0,0 +1,193 @@
+"""
+version 1.0
+description: Determinant lists and CI vectors for wfoverlap.
+    Determinants are given as occupation tuples (0: empty, 1: alpha, 2: beta, 3: doubly occupied).
+    They are packed into integers with 2 bits per orbital (first orbital in the highest bits), hence
+    sorting the packed determinants gives the same order as sorting the tuples.
+    The CI vectors of all states are stored as a list of packed determinants and one coefficient
+    matrix (ndet,nstate), which is written to the dets file of wfoverlap in one go.
+
+    The dets file can also be written in a binary format, which is read by wfoverlap.x
+    (native byte order, integers 4-byte, reals 8-byte):
+      header:   8 bytes "WFODETS" + zero byte
+                int     version (1)
+                int     nstate
+                int     norb
+                int     ndet
+      ndet times:
+                norb bytes      determinant string (e, a, b, d)
+                real            coefficients(nstate)
+"""
+
+import sys
+import struct
+import binascii
+try:
+    import numpy
+    NONUMPY = False
+except ImportError:
+    NONUMPY = True
+
+STEPS = 'eabd'
+
+BINARY_MAGIC = b'WFODETS\x00'
+BINARY_VERSION = 1
+
+# occupation numbers (bytes 0-3) to base-4 digits
+if sys.version_info[0] == 2:
+    import string
+    PACK_TABLE = string.maketrans('\x00\x01\x02\x03', '0123')
+else:
+    PACK_TABLE = bytes.maketrans(b'\x00\x01\x02\x03', b'0123')
+
+# step strings of the 4 orbitals in one byte of a packed determinant
+BYTE_STEPS = [''.join([STEPS[(i >> shift) & 3] for shift in (6, 4, 2, 0)]) for i in range(256)]
+
+
+def pack(det):
+    """
+    Packs an occupation tuple into an integer.
+    """
+    return int(bytes(bytearray(det)).translate(PACK_TABLE), 4)
+
+
+def unpack(x, norb):
+    """
+    Step string (e, a, b, d) of a packed determinant with norb orbitals.
+    """
+    nbyte = (norb + 3) // 4
+    raw = bytearray(binascii.unhexlify('%0*x' % (2 * nbyte, x)))
+    return ''.join([BYTE_STEPS[i] for i in raw])[4 * nbyte - norb:]
+
+
+def truncate(coefs, threshold):
+    """
+    Returns the indices of the coefficients which are kept if the squared coefficients are summed up
+    in descending order until the sum exceeds threshold (the coefficient exceeding it is still kept).
+    """
+    if NONUMPY:
+        order = sorted(range(len(coefs)), key=lambda i: -coefs[i]**2)
+        norm = 0.
+        for n, i in enumerate(order):
+            if norm > threshold:
+                return order[:n]
+            norm += coefs[i]**2
+        return order
+    c2 = numpy.asarray(coefs, dtype=float)**2
+    order = numpy.argsort(-c2, kind='mergesort')
+    if threshold < 0.:
+        return []
+    norm = numpy.cumsum(c2[order])
+    return order[:numpy.searchsorted(norm, threshold, side='right') + 1].tolist()
+
+
+class CIVECTORS:
+    """
+    CI vectors of several states in a common list of determinants:
+      civec.norb, civec.nstate
+      civec.dets            packed determinants, in descending order
+      civec.coefs           coefficients (ndet,nstate), numpy array or nested lists
+      civec.ndocc           number of doubly occupied orbitals written in front of each determinant
+      civec.nvirt           number of empty orbitals written after each determinant
+    """
+
+    def __init__(self, norb, nstate, dets, coefs, ndocc=0, nvirt=0):
+        self.norb = norb
+        self.nstate = nstate
+        self.dets = dets
+        self.coefs = coefs
+        self.ndocc = ndocc
+        self.nvirt = nvirt
+
+    def strings(self):
+        pre = 'd' * self.ndocc
+        post = 'e' * self.nvirt
+        return [pre + unpack(det, self.norb) + post for det in self.dets]
+
+    def rows(self):
+        if NONUMPY:
+            return self.coefs
+        return numpy.asarray(self.coefs).tolist()
+
+    def text(self, form=' %11.7f '):
+        """
+        The dets file in the ASCII format of wfoverlap, each coefficient formatted with form.
+        """
+        line = '%s' + form * self.nstate + '\n'
+        string = '%i %i %i\n' % (self.nstate, self.ndocc + self.norb + self.nvirt, len(self.dets))
+        string += ''.join([line % ((det,) + tuple(row)) for det, row in zip(self.strings(), self.rows())])
+        return string
+
+    def binary(self):
+        """
+        The dets file in the binary format (see above).
+        """
+        norb = self.ndocc + self.norb + self.nvirt
+        string = BINARY_MAGIC + struct.pack('=4i', BINARY_VERSION, self.nstate, norb, len(self.dets))
+        dets = [det.encode() for det in self.strings()]
+        if NONUMPY:
+            record = struct.Struct('=%is%id' % (norb, self.nstate))
+            return string + b''.join([record.pack(det, *row) for det, row in zip(dets, self.coefs)])
+        record = numpy.dtype([('det', 'S%i' % (norb)), ('coefs', '=f8', (self.nstate,))])
+        data = numpy.zeros(len(dets), dtype=record)
+        data['det'] = dets
+        data['coefs'] = numpy.asarray(self.coefs, dtype=float).reshape((len(dets), self.nstate))
+        return string + data.tobytes()
+
+
+def from_states(ci_vectors):
+    """
+    CIVECTORS from a list with one dictionary (occupation tuple -> coefficient) per state.
+    """
+    norb = 0
+    for dets in ci_vectors:
+        for det in dets:
+            norb = len(det)
+            break
+        if norb:
+            break
+    nstate = len(ci_vectors)
+    packed = [[(pack(det), c) for det, c in dets.items()] for dets in ci_vectors]
+    alldets = set()
+    for dets in packed:
+        alldets.update([det for det, c in dets])
+    alldets = sorted(alldets, reverse=True)
+    index = dict([(det, i) for i, det in enumerate(alldets)])
+    if NONUMPY:
+        coefs = [[0. for istate in range(nstate)] for det in alldets]
+        for istate, dets in enumerate(packed):
+            for det, c in dets:
+                coefs[index[det]][istate] = c
+    else:
+        coefs = numpy.zeros((len(alldets), nstate))
+        for istate, dets in enumerate(packed):
+            if dets:
+                coefs[[index[det] for det, c in dets], istate] = [c for det, c in dets]
+    return CIVECTORS(norb, nstate, alldets, coefs)
+
+
+def from_table(ci_vectors, ndocc=0, nvirt=0):
+    """
+    CIVECTORS from a dictionary occupation tuple -> list of the coefficients of all states.
+    """
+    norb = 0
+    nstate = 0
+    for det in ci_vectors:
+        norb = len(det)
+        nstate = len(ci_vectors[det])
+        break
+    packed = sorted([(pack(det), det) for det in ci_vectors], reverse=True)
+    coefs = [ci_vectors[det] for p, det in packed]
+    if not NONUMPY:
+        coefs = numpy.array(coefs, dtype=float).reshape((len(packed), nstate))
+    return CIVECTORS(norb, nstate, [p for p, det in packed], coefs, ndocc, nvirt)
+
+
+def format_ci_vectors(ci_vectors, binary=False):
+    """
+    Contents of the dets file for a list with one dictionary (occupation tuple -> coefficient) per state.
+    """
+    civec = from_states(ci_vectors)
+    if binary:
+        return civec.binary()
+    return civec.text()
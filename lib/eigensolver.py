@@ -0,0 +1,99 @@
+"""
+version 1.0
+description: In-process diagonalization of Hermitian matrices.
+    Uses numpy.linalg.eigh if numpy is available, otherwise a cyclic Jacobi
+    method in pure Python (replaces the external diagonalizer.x).
+    Many matrices can be diagonalized at once with eigh_batch.
+"""
+
+import math
+try:
+    import numpy
+    NONUMPY = False
+except ImportError:
+    NONUMPY = True
+
+
+def jacobi_eigh(H, thresh=1e-15, maxsweep=100):
+    """
+    Diagonalizes the Hermitian matrix H (nested lists) with the cyclic Jacobi method.
+    Returns the eigenvalues in ascending order and the matrix U of eigenvectors (columns),
+    such that U^H.H.U is diagonal.
+    """
+    n = len(H)
+    A = [ [ complex(H[i][j]) for j in range(n) ] for i in range(n) ]
+    U = [ [ complex(float(i == j)) for j in range(n) ] for i in range(n) ]
+    norm = sum( [ abs(A[i][j])**2 for i in range(n) for j in range(n) ] )
+
+    for sweep in range(maxsweep):
+        off = sum( [ abs(A[i][j])**2 for i in range(n) for j in range(n) if i != j ] )
+        if off <= thresh**2 * norm:
+            break
+        for p in range(n - 1):
+            for q in range(p + 1, n):
+                apq = abs(A[p][q])
+                if apq == 0.:
+                    continue
+                # the phase g makes the (p,q) element real, then a real rotation zeroes it
+                g = A[p][q] / apq
+                tau = (A[q][q].real - A[p][p].real) / (2. * apq)
+                if tau >= 0.:
+                    t = 1. / (tau + math.sqrt(1. + tau**2))
+                else:
+                    t = -1. / (-tau + math.sqrt(1. + tau**2))
+                c = 1. / math.sqrt(1. + t**2)
+                s = t * c
+                gc = g.conjugate()
+                # A <- A.V and U <- U.V, with V[:,p]=c*e_p-s*g^*e_q, V[:,q]=s*e_p+c*g^*e_q
+                for M in (A, U):
+                    for k in range(n):
+                        mkp = M[k][p]
+                        mkq = M[k][q]
+                        M[k][p] = c * mkp - s * gc * mkq
+                        M[k][q] = s * mkp + c * gc * mkq
+                # A <- V^H.A
+                for k in range(n):
+                    apk = A[p][k]
+                    aqk = A[q][k]
+                    A[p][k] = c * apk - s * g * aqk
+                    A[q][k] = s * apk + c * g * aqk
+                A[p][q] = complex(0.)
+                A[q][p] = complex(0.)
+                A[p][p] = complex(A[p][p].real)
+                A[q][q] = complex(A[q][q].real)
+
+    # sort like numpy.linalg.eigh
+    order = sorted(range(n), key=lambda i: A[i][i].real)
+    eig = [ A[i][i].real for i in order ]
+    U = [ [ U[k][i] for i in order ] for k in range(n) ]
+    return eig, U
+
+
+def eigh(H):
+    """
+    Eigenvalues (ascending) and eigenvectors (columns of U) of the Hermitian matrix H.
+    Returns numpy arrays if numpy is available, otherwise lists.
+    """
+    if NONUMPY:
+        return jacobi_eigh(H)
+    return numpy.linalg.eigh(H)
+
+
+def eigh_batch(Hs):
+    """
+    Diagonalizes a list of Hermitian matrices.
+    With numpy, all matrices of the same size are diagonalized in one stacked call.
+    Returns a list of (eigenvalues, U) tuples in the order of Hs.
+    """
+    if NONUMPY:
+        return [ jacobi_eigh(H) for H in Hs ]
+    groups = {}
+    for i, H in enumerate(Hs):
+        groups.setdefault(len(H), []).append(i)
+    results = [None] * len(Hs)
+    for n in groups:
+        index = groups[n]
+        eigs, Us = numpy.linalg.eigh(numpy.array([ Hs[i] for i in index ]))
+        for k, i in enumerate(index):
+            results[i] = (eigs[k], Us[k])
+    return results
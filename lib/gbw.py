@@ -0,0 +1,106 @@
+"""
+version 1.0
+description: Reader for the orbitals in ORCA .gbw files.
+    The file starts with five 8-byte pointers: internal data, geometry, basis set,
+    orbitals and ECP data. The orbital section contains (little-endian, int 4-byte,
+    double 8-byte):
+      int     number of operators (1: restricted, 2: unrestricted)
+      int     dimension (number of basis functions)
+      per operator:
+        double  coefficients(dimension*dimension), AO index running slowest
+        double  occupations(dimension)
+        double  energies(dimension)
+        int     irreps(dimension)
+        int     cores(dimension)
+    The layout is not documented by ORCA, hence it is checked against the file size and
+    a ValueError is raised if it does not fit (callers can then use orca_fragovl instead).
+    Since the size check cannot detect e.g. a different order of the coefficients, callers
+    should also check the orbitals for orthonormality with the AO overlap (orthonormality_error).
+    Returns numpy arrays if numpy is available, otherwise nested lists.
+"""
+
+import os
+import sys
+import array
+import struct
+try:
+    import numpy
+    NONUMPY = False
+except ImportError:
+    NONUMPY = True
+
+POINTER_ORBITALS = 24
+
+
+def read_doubles(f, n):
+    raw = f.read(8 * n)
+    if len(raw) != 8 * n:
+        raise ValueError('Unexpected end of file in %s!' % (f.name))
+    if not NONUMPY:
+        return numpy.frombuffer(raw, dtype='<f8').astype(float)
+    values = array.array('d')
+    if hasattr(values, 'frombytes'):
+        values.frombytes(raw)
+    else:
+        values.fromstring(raw)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return list(values)
+
+
+def read_gbw(filename):
+    """
+    Reads the orbitals of a .gbw file. Returns a dictionary with:
+      nao            number of basis functions
+      mos            list (one entry per operator) of MO coefficients (nmo,nao), one MO per row
+      occupations    list (one entry per operator) of occupations (nmo)
+      energies       list (one entry per operator) of orbital energies (nmo) in hartree
+    """
+    size = os.path.getsize(filename)
+    if size < POINTER_ORBITALS + 8:
+        raise ValueError('%s is too short for a gbw file!' % (filename))
+    f = open(filename, 'rb')
+    try:
+        f.seek(POINTER_ORBITALS)
+        offset = struct.unpack('<q', f.read(8))[0]
+        if not 0 < offset <= size - 8:
+            raise ValueError('Invalid orbital pointer in %s!' % (filename))
+        f.seek(offset)
+        nop, nao = struct.unpack('<2i', f.read(8))
+        if nop not in [1, 2] or nao <= 0 or offset + 8 + nop * nao * (8 * nao + 24) > size:
+            raise ValueError('Unknown orbital layout in %s!' % (filename))
+        gbw = {'nao': nao, 'mos': [], 'occupations': [], 'energies': []}
+        for iop in range(nop):
+            coeff = read_doubles(f, nao * nao)
+            if NONUMPY:
+                mos = [coeff[imo::nao] for imo in range(nao)]
+            else:
+                mos = coeff.reshape((nao, nao)).T.copy()
+            gbw['mos'].append(mos)
+            gbw['occupations'].append(read_doubles(f, nao))
+            gbw['energies'].append(read_doubles(f, nao))
+            # irreps and cores
+            f.seek(8 * nao, 1)
+    finally:
+        f.close()
+    return gbw
+
+
+def orthonormality_error(mos, S, nsample=10):
+    """
+    Largest deviation of C S C^T from the unit matrix, for the MO coefficients C (nmo,nao)
+    and the AO overlap S (nao,nao). Without numpy, only nsample evenly spaced MOs are checked.
+    """
+    if not NONUMPY:
+        C = numpy.asarray(mos, dtype=float)
+        D = numpy.dot(numpy.dot(C, numpy.asarray(S, dtype=float)), C.T)
+        return numpy.max(numpy.abs(D - numpy.identity(len(C))))
+    nmo = len(mos)
+    sample = sorted(set([i * (nmo - 1) // max(1, nsample - 1) for i in range(nsample)]))
+    SC = [[sum([Sij * cj for Sij, cj in zip(row, mos[i])]) for row in S] for i in sample]
+    error = 0.
+    for i in sample:
+        for b, j in enumerate(sample):
+            x = sum([ci * scj for ci, scj in zip(mos[i], SC[b])])
+            error = max(error, abs(x - (i == j)))
+    return error
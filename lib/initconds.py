@@ -0,0 +1,541 @@
+"""
+version 1.0
+description: Reading and writing of SHARC initial conditions files.
+    Contains the ATOM, STATE and INITCOND classes used by the initconds tools.
+    INITCONDS gives random access to the conditions of a file through a byte-offset
+    index of the "Index" lines, which is built on first read and cached in <file>.index.
+    Conditions are only parsed when they are requested.
+    With numpy, the geometries, velocities and state data of all conditions can be
+    stored as arrays in a binary sidecar file <file>.npz.
+"""
+
+import os
+import re
+import json
+import mmap
+import random
+try:
+    import numpy
+    NONUMPY = False
+except ImportError:
+    NONUMPY = True
+
+HARTREE_TO_EV = 27.211396132    # conversion factor from Hartree to eV
+U_TO_AMU = 1. / 5.4857990943e-4   # conversion from g/mol to amu
+
+INDEX_SUFFIX = '.index'
+SIDECAR_SUFFIX = '.npz'
+
+
+# ======================================================================================================================
+
+def try_read(l, index, typefunc, default):
+    try:
+        if typefunc == bool:
+            return 'True' == l[index]
+        else:
+            return typefunc(l[index])
+    except IndexError:
+        return typefunc(default)
+    except ValueError:
+        print 'Could not initialize object!'
+        quit(1)
+
+# ======================================================================================================================
+
+
+class ATOM:
+    def __init__(self, symb='??', num=0., coord=[0., 0., 0.], m=0., veloc=[0., 0., 0.]):
+        self.symb = symb
+        self.num = num
+        self.coord = coord
+        self.mass = m
+        self.veloc = veloc
+        self.Ekin = 0.5 * self.mass * sum([self.veloc[i]**2 for i in range(3)])
+
+    def init_from_str(self, initstring=''):
+        f = initstring.split()
+        self.symb = try_read(f, 0, str, '??')
+        self.num = try_read(f, 1, float, 0.)
+        self.coord = [try_read(f, i, float, 0.) for i in range(2, 5)]
+        self.mass = try_read(f, 5, float, 0.) * U_TO_AMU
+        self.veloc = [try_read(f, i, float, 0.) for i in range(6, 9)]
+        self.Ekin = 0.5 * self.mass * sum([self.veloc[i]**2 for i in range(3)])
+
+    def __str__(self):
+        s = '%2s % 5.1f ' % (self.symb, self.num)
+        s += '% 12.8f % 12.8f % 12.8f ' % tuple(self.coord)
+        s += '% 12.8f ' % (self.mass / U_TO_AMU)
+        s += '% 12.8f % 12.8f % 12.8f' % tuple(self.veloc)
+        return s
+
+    def EKIN(self):
+        self.Ekin = 0.5 * self.mass * sum([self.veloc[i]**2 for i in range(3)])
+        return self.Ekin
+
+    def geomstring(self):
+        s = '  %2s % 5.1f % 12.8f % 12.8f % 12.8f % 12.8f' % (self.symb, self.num, self.coord[0], self.coord[1], self.coord[2], self.mass / U_TO_AMU)
+        return s
+
+    def velocstring(self):
+        s = ' ' * 11 + '% 12.8f % 12.8f % 12.8f' % tuple(self.veloc)
+        return s
+
+# ======================================================================================================================
+
+
+class STATE:
+    def __init__(self, i=0, e=0., eref=0., dip=[0., 0., 0.]):
+        self.i = i
+        self.e = e.real
+        self.eref = eref.real
+        self.dip = dip
+        self.Excited = False
+        self.Eexc = self.e - self.eref
+        self.Fosc = (2. / 3. * self.Eexc * sum([i * i.conjugate() for i in self.dip])).real
+        if self.Eexc == 0.:
+            self.Prob = 0.
+        else:
+            self.Prob = self.Fosc / self.Eexc**2
+
+    def init_from_str(self, initstring):
+        f = initstring.split()
+        self.i = try_read(f, 0, int, 0)
+        self.e = try_read(f, 1, float, 0.)
+        self.eref = try_read(f, 2, float, 0.)
+        self.dip = [complex(try_read(f, i, float, 0.), try_read(f, i + 1, float, 0.)) for i in [3, 5, 7]]
+        self.Excited = try_read(f, 11, bool, False)
+        self.Eexc = self.e - self.eref
+        self.Fosc = (2. / 3. * self.Eexc * sum([i * i.conjugate() for i in self.dip])).real
+        if self.Eexc == 0.:
+            self.Prob = 0.
+        else:
+            self.Prob = self.Fosc / self.Eexc**2
+
+    def __str__(self):
+        s = '%03i % 18.10f % 18.10f ' % (self.i, self.e, self.eref)
+        for i in range(3):
+            s += '% 12.8f % 12.8f ' % (self.dip[i].real, self.dip[i].imag)
+        s += '% 12.8f % 12.8f %s' % (self.Eexc * HARTREE_TO_EV, self.Fosc, self.Excited)
+        return s
+
+    def Excite(self, max_Prob, erange):
+        try:
+            Prob = self.Prob / max_Prob
+        except ZeroDivisionError:
+            Prob = -1.
+        if not (erange[0] <= self.Eexc <= erange[1]):
+            Prob = -1.
+        self.Excited = (random.random() < Prob)
+
+# ======================================================================================================================
+
+
+class INITCOND:
+    def __init__(self, atomlist=[], eref=0., epot_harm=0.):
+        self.atomlist = atomlist
+        self.eref = eref
+        self.Epot_harm = epot_harm
+        self.natom = len(atomlist)
+        self.Ekin = sum([atom.Ekin for atom in self.atomlist])
+        self.statelist = []
+        self.nstate = 0
+        self.Epot = epot_harm
+
+    def addstates(self, statelist):
+        self.statelist = statelist
+        self.nstate = len(statelist)
+        self.Epot = self.statelist[0].e - self.eref
+
+    def init_from_file(self, f, eref, index):
+        while True:
+            line = f.readline()
+            if re.search('Index\s+%i' % (index), line):
+                break
+            if line == '\n':
+                continue
+            if line == '':
+                print 'Initial condition %i not found in file %s' % (index, f.name)
+                quit(1)
+        f.readline()        # skip one line, where "Atoms" stands
+        atomlist = []
+        while True:
+            line = f.readline()
+            if 'States' in line:
+                break
+            atom = ATOM()
+            atom.init_from_str(line)
+            atomlist.append(atom)
+        statelist = []
+        while True:
+            line = f.readline()
+            if 'Ekin' in line:
+                break
+            state = STATE()
+            state.init_from_str(line)
+            statelist.append(state)
+        epot_harm = 0.
+        while not line == '\n' and not line == '':
+            line = f.readline()
+            if 'epot_harm' in line.lower():
+                epot_harm = float(line.split()[1])
+                break
+        self.atomlist = atomlist
+        self.eref = eref
+        self.Epot_harm = epot_harm
+        self.natom = len(atomlist)
+        self.Ekin = sum([atom.Ekin for atom in self.atomlist])
+        self.statelist = statelist
+        self.nstate = len(statelist)
+        if self.nstate > 0:
+            self.Epot = self.statelist[0].e - self.eref
+        else:
+            self.Epot = epot_harm
+
+    def __str__(self):
+        s = 'Atoms\n'
+        for atom in self.atomlist:
+            s += str(atom) + '\n'
+        s += 'States\n'
+        for state in self.statelist:
+            s += str(state) + '\n'
+        s += 'Ekin      % 16.12f a.u.\n' % (self.Ekin)
+        s += 'Epot_harm % 16.12f a.u.\n' % (self.Epot_harm)
+        s += 'Epot      % 16.12f a.u.\n' % (self.Epot)
+        s += 'Etot_harm % 16.12f a.u.\n' % (self.Epot_harm + self.Ekin)
+        s += 'Etot      % 16.12f a.u.\n' % (self.Epot + self.Ekin)
+        s += '\n\n'
+        return s
+
+# ======================================================================================================================
+
+
+def read_header(f):
+    """
+    Reads the header of an initconds file from the open file f (up to the equilibrium geometry).
+
+    Returns a dictionary with the keys version, excited, ninit, natom, repr, temp, eref, eharm,
+    states and equi (list of ATOM). Keys which are not in the file are None.
+    Returns None if f is not an initconds file.
+    """
+    f.seek(0)
+    line = f.readline()
+    if 'sharc initial conditions file' not in line.lower():
+        return None
+    header = {'version': None, 'excited': 'excited' in line.lower(), 'ninit': None, 'natom': None,
+              'repr': None, 'temp': None, 'eref': None, 'eharm': None, 'states': None, 'equi': []}
+    s = line.split()
+    for i, field in enumerate(s):
+        if 'version' in field.lower():
+            header['version'] = try_read(s, i + 1, float, 0.)
+    keys = {'ninit': int, 'natom': int, 'repr': str, 'temp': float, 'eref': float, 'eharm': float}
+    while True:
+        line = f.readline()
+        if line == '' or 'Equilibrium' in line:
+            break
+        s = line.split()
+        if len(s) < 2:
+            continue
+        key = s[0].lower()
+        if key in keys:
+            header[key] = try_read(s, 1, keys[key], 0)
+        elif key == 'states':
+            header['states'] = [int(i) for i in s[1:]]
+    if line != '':
+        for i in range(header['natom'] or 0):
+            atom = ATOM()
+            atom.init_from_str(f.readline())
+            header['equi'].append(atom)
+    return header
+
+
+def header_string(header, version):
+    """
+    Returns the header of an initconds file (see read_header) written by a program of the given version.
+    """
+    string = 'SHARC Initial conditions file, version %s' % (version)
+    if header.get('excited'):
+        string += '   <Excited>'
+    string += '\n'
+    string += 'Ninit     %i\n' % (header['ninit'])
+    string += 'Natom     %i\n' % (header['natom'])
+    string += 'Repr      %s\n' % (header['repr'])
+    if header.get('temp') is not None:
+        string += 'Temp      %18.10f\n' % (header['temp'])
+    string += 'Eref      %18.10f\n' % (header['eref'])
+    string += 'Eharm     %18.10f\n' % (header['eharm'])
+    if header.get('states'):
+        string += 'States    '
+        for n in header['states']:
+            string += '%i ' % (n)
+    # same blank lines as the files of excite.py
+    string += '\n\n\nEquilibrium\n'
+    for atom in header['equi']:
+        string += str(atom) + '\n'
+    string += '\n\n'
+    return string
+
+# ======================================================================================================================
+
+
+def file_stamp(filename):
+    """
+    Size and modification time of a file, used to check whether cached data is still valid.
+    """
+    return [os.path.getsize(filename), os.path.getmtime(filename)]
+
+
+def build_index(filename):
+    """
+    Scans the file for "Index" lines and returns a list of (index, byte offset) pairs.
+    """
+    f = open(filename, 'rb')
+    if os.path.getsize(filename) == 0:
+        f.close()
+        return []
+    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    index = [(int(match.group(1)), match.start()) for match in re.finditer(r'(?m)^Index\s+(\d+)', data)]
+    data.close()
+    f.close()
+    return index
+
+
+def read_index(filename):
+    """
+    Returns the cached index of filename, or None if there is none or it is outdated.
+    """
+    try:
+        f = open(filename + INDEX_SUFFIX)
+        cache = json.load(f)
+        f.close()
+    except (IOError, ValueError):
+        return None
+    if cache.get('stamp') != file_stamp(filename):
+        return None
+    return [tuple(i) for i in cache['index']]
+
+
+def write_index(filename, index):
+    """
+    Writes the index cache of filename (silently skipped if not writable).
+    """
+    try:
+        f = open(filename + INDEX_SUFFIX + '.tmp', 'w')
+        json.dump({'stamp': file_stamp(filename), 'index': index}, f)
+        f.close()
+        os.rename(filename + INDEX_SUFFIX + '.tmp', filename + INDEX_SUFFIX)
+    except (IOError, OSError):
+        pass
+
+
+def get_index(filename):
+    """
+    Returns the index of filename, from the cache if possible.
+    """
+    index = read_index(filename)
+    if index is None:
+        index = build_index(filename)
+        write_index(filename, index)
+    return index
+
+# ======================================================================================================================
+
+
+class INITCONDS:
+    """
+    Indexed access to the conditions of an initconds file.
+
+    Conditions are addressed by their number in the file (as in "Index N"):
+      len(initconds), icond in initconds, initconds.get(icond)
+    and can be read sequentially with initconds.iterate(first, last).
+    """
+
+    def __init__(self, filename, eref=None):
+        self.filename = filename
+        self.f = open(filename)
+        self.header = read_header(self.f)
+        if self.header is None:
+            print 'File %s does not contain initial conditions!' % (filename)
+            quit(1)
+        if eref is None:
+            eref = self.header['eref'] or 0.
+        self.eref = eref
+        self.index = get_index(filename)
+        self.offsets = dict(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, icond):
+        return icond in self.offsets
+
+    def close(self):
+        self.f.close()
+
+    def get(self, icond):
+        """
+        Reads condition icond from the file.
+        """
+        if icond not in self.offsets:
+            print 'Initial condition %i not found in file %s' % (icond, self.filename)
+            quit(1)
+        self.f.seek(self.offsets[icond])
+        initcond = INITCOND()
+        initcond.init_from_file(self.f, self.eref, icond)
+        return initcond
+
+    def iterate(self, first=None, last=None):
+        """
+        Yields (icond, INITCOND) for all conditions between first and last (in the order of the file),
+        reading the file sequentially from the first of them.
+        """
+        inrange = [(icond, offset) for (icond, offset) in self.index
+                   if (first is None or icond >= first) and (last is None or icond <= last)]
+        if not inrange:
+            return
+        self.f.seek(inrange[0][1])
+        for icond, offset in inrange:
+            if self.f.tell() != offset:
+                self.f.seek(offset)
+            initcond = INITCOND()
+            initcond.init_from_file(self.f, self.eref, icond)
+            yield icond, initcond
+
+    def __iter__(self):
+        for icond, initcond in self.iterate():
+            yield initcond
+
+    def excited(self):
+        """
+        Returns a list of the Excited flags of the states of each condition.
+        """
+        if not NONUMPY:
+            data = self.arrays()
+            return [list(data['excited'][i, :data['nstate'][i]]) for i in range(len(data['index']))]
+        return [[state.Excited for state in initcond.statelist] for initcond in self]
+
+    def arrays(self):
+        """
+        Returns the binary sidecar data of the file (see read_arrays), creating the sidecar if necessary.
+        """
+        data = read_sidecar(self.filename)
+        if data is None:
+            data = read_arrays(self.filename, self.index, self.header['natom'])
+            write_sidecar(self.filename, data)
+        return data
+
+# ======================================================================================================================
+
+
+def read_arrays(filename, index, natom):
+    """
+    Parses all conditions of the file into numpy arrays:
+      index (ncond)               condition numbers
+      coord, veloc (ncond,natom,3)
+      epot_harm (ncond)
+      nstate (ncond)              number of states of each condition
+      e, eref (ncond,nmax)        state energies, padded with NaN
+      dip (ncond,nmax,3)          complex transition dipole moments
+      excited (ncond,nmax)        Excited flags
+    """
+    ncond = len(index)
+    coord = numpy.zeros((ncond, natom, 3))
+    veloc = numpy.zeros((ncond, natom, 3))
+    epot_harm = numpy.zeros(ncond)
+    statedata = []
+    f = open(filename)
+    for i, (icond, offset) in enumerate(index):
+        f.seek(offset)
+        f.readline()        # Index
+        f.readline()        # Atoms
+        atoms = []
+        while True:
+            line = f.readline()
+            if 'States' in line or line == '':
+                break
+            atoms.append(line.split()[2:9])
+        if len(atoms) != natom:
+            print 'Initial condition %i in file %s has %i instead of %i atoms!' % (icond, filename, len(atoms), natom)
+            quit(1)
+        if natom > 0:
+            atoms = numpy.array(atoms, dtype=float)
+            coord[i] = atoms[:, 0:3]
+            veloc[i] = atoms[:, 4:7]
+        states = []
+        while True:
+            line = f.readline()
+            if 'Ekin' in line or line == '':
+                break
+            states.append(line.split())
+        statedata.append(states)
+        while not line == '\n' and not line == '':
+            line = f.readline()
+            if 'epot_harm' in line.lower():
+                epot_harm[i] = float(line.split()[1])
+                break
+    f.close()
+
+    nstate = numpy.array([len(states) for states in statedata], dtype=int)
+    nmax = max([0] + list(nstate))
+    e = numpy.zeros((ncond, nmax)) + numpy.nan
+    eref = numpy.zeros((ncond, nmax)) + numpy.nan
+    dip = numpy.zeros((ncond, nmax, 3), dtype=complex)
+    excited = numpy.zeros((ncond, nmax), dtype=bool)
+    for i, states in enumerate(statedata):
+        for j, s in enumerate(states):
+            e[i, j] = try_read(s, 1, float, 0.)
+            eref[i, j] = try_read(s, 2, float, 0.)
+            dip[i, j] = [complex(try_read(s, k, float, 0.), try_read(s, k + 1, float, 0.)) for k in [3, 5, 7]]
+            excited[i, j] = try_read(s, 11, bool, False)
+    return {'index': numpy.array([icond for (icond, offset) in index], dtype=int),
+            'coord': coord, 'veloc': veloc, 'epot_harm': epot_harm,
+            'nstate': nstate, 'e': e, 'eref': eref, 'dip': dip, 'excited': excited}
+
+
+def read_sidecar(filename):
+    """
+    Returns the arrays of the binary sidecar of filename, or None if there is none or it is outdated.
+    """
+    if NONUMPY:
+        return None
+    try:
+        npz = numpy.load(filename + SIDECAR_SUFFIX)
+        data = dict([(key, npz[key]) for key in npz.files])
+        npz.close()
+    except (IOError, ValueError, KeyError):
+        return None
+    if 'stamp' not in data or list(data.pop('stamp')) != file_stamp(filename):
+        return None
+    return data
+
+
+def write_sidecar(filename, data):
+    """
+    Writes the arrays to the binary sidecar of filename (silently skipped if not writable).
+    """
+    arrays = dict(data)
+    arrays['stamp'] = numpy.array(file_stamp(filename))
+    try:
+        f = open(filename + SIDECAR_SUFFIX + '.tmp', 'wb')
+        numpy.savez(f, **arrays)
+        f.close()
+        os.rename(filename + SIDECAR_SUFFIX + '.tmp', filename + SIDECAR_SUFFIX)
+    except (IOError, OSError):
+        pass
+
+# ======================================================================================================================
+
+
+def write_initconds(f, header, version, conditions):
+    """
+    Writes an initconds file to the open file f and closes it.
+    conditions is a list (or iterator) of (icond, INITCOND).
+    The index of the new file is written along the way.
+    """
+    f.write(header_string(header, version))
+    index = []
+    for icond, initcond in conditions:
+        index.append((icond, f.tell()))
+        f.write('Index     %i\n%s' % (icond, str(initcond)))
+    f.close()
+    write_index(f.name, index)
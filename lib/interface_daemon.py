@@ -0,0 +1,287 @@
+"""
+version 1.0
+description: Persistent process for the interfaces, which saves the start-up of the Python interpreter
+    (imports of numpy, the interface module and the shared modules) in every time step.
+    If the environment variable SHARC_INTERFACE_DAEMON is set to a positive number, the first call of an
+    interface starts a daemon in the background, which listens on a UNIX socket in the current directory
+    (the QM directory of the trajectory, e.g. ".SHARC_ORCA.py.socket").
+    Every following call (e.g., from runQM.sh) only sends its command line, working directory and environment
+    to the daemon, which forks a child running the main function of the interface. The output of the child
+    is relayed to the stdout/stderr of the calling process, which exits with the exit code of the child.
+    Since each call runs in a fresh fork, the interface starts from the same state as a new process
+    (globals, pools, scratch handling), only the imported modules are already loaded.
+    The daemon exits if it did not receive a request for SHARC_INTERFACE_DAEMON seconds or if its socket file
+    is removed.
+    Protocol: the request is one line of JSON, the answer a sequence of frames (channel, length, data) with
+    channel 1: stdout, 2: stderr, 0: exit code (4-byte int, last frame).
+"""
+
+import os
+import sys
+import json
+import time
+import errno
+import select
+import socket
+import struct
+import traceback
+
+ENVIRONMENT = 'SHARC_INTERFACE_DAEMON'
+
+FRAME = struct.Struct('!BI')
+EXITCODE = struct.Struct('!i')
+EXIT = 0
+STDOUT = 1
+STDERR = 2
+
+# interval for checking the socket file while idle
+POLL = 10.
+
+
+def get_timeout():
+    value = os.getenv(ENVIRONMENT)
+    if not value:
+        return None
+    try:
+        timeout = float(value)
+    except ValueError:
+        print('%s=%s does not evaluate to a numerical value!' % (ENVIRONMENT, value))
+        sys.exit(1)
+    if timeout <= 0.:
+        return None
+    return timeout
+
+
+def socket_name():
+    # relative path, since the length of socket paths is limited
+    return '.%s.socket' % (os.path.basename(sys.argv[0]))
+
+
+def native(x):
+    # JSON gives unicode strings in Python 2
+    if sys.version_info[0] == 2:
+        return x.encode('utf-8')
+    return x
+
+
+def writeall(fd, data):
+    while data:
+        n = os.write(fd, data)
+        data = data[n:]
+
+
+def run(main, setup=None):
+    """
+    Runs main() directly, or through the daemon if SHARC_INTERFACE_DAEMON is set.
+    setup() is called before each call of main() in the daemon, to reinitialize global variables
+    which are set at import time (e.g., the start time of the interface).
+    """
+    timeout = get_timeout()
+    if not timeout:
+        main()
+        return
+    name = socket_name()
+    code = request(name)
+    if code is None:
+        if os.path.exists(name):
+            # left over from a daemon which does not run anymore
+            os.remove(name)
+        try:
+            start(main, setup, name, timeout)
+        except socket.error:
+            main()
+            return
+        code = request(name)
+        if code is None:
+            print('Could not connect to the interface daemon at %s!' % (name))
+            sys.exit(1)
+    sys.exit(code)
+
+
+def request(name):
+    """
+    Sends the call to the daemon and relays its output. Returns the exit code, or None if no daemon is listening.
+    """
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(name)
+    except socket.error:
+        s.close()
+        return None
+    message = {'argv': sys.argv, 'cwd': os.getcwd(), 'environ': dict(os.environ)}
+    sys.stdout.flush()
+    sys.stderr.flush()
+    try:
+        s.sendall((json.dumps(message) + '\n').encode('utf-8'))
+        f = s.makefile('rb')
+        while True:
+            header = f.read(FRAME.size)
+            if len(header) < FRAME.size:
+                sys.stderr.write('Lost connection to the interface daemon at %s!\n' % (name))
+                return 1
+            channel, length = FRAME.unpack(header)
+            data = f.read(length)
+            if channel == EXIT:
+                return EXITCODE.unpack(data)[0]
+            writeall(channel, data)
+    finally:
+        s.close()
+
+
+def start(main, setup, name, timeout):
+    """
+    Binds the socket and forks the daemon. The socket is bound before the fork,
+    hence the first request is queued until the daemon accepts it.
+    """
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(name)
+    os.chmod(name, 0o600)
+    listener.listen(1)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.setsid()
+            devnull = os.open(os.devnull, os.O_RDWR)
+            for fd in [0, 1, 2]:
+                os.dup2(devnull, fd)
+            os.close(devnull)
+            serve(listener, main, setup, name, timeout)
+        finally:
+            os._exit(0)
+    listener.close()
+
+
+def serve(listener, main, setup, name, timeout):
+    inode = os.stat(name).st_ino
+    listener.settimeout(min(POLL, timeout))
+    last = time.time()
+    while True:
+        try:
+            conn, address = listener.accept()
+        except socket.timeout:
+            conn = None
+        if conn:
+            conn.settimeout(None)
+            try:
+                handle(conn, listener, main, setup)
+            except Exception:
+                traceback.print_exc()
+            conn.close()
+            last = time.time()
+        try:
+            if os.stat(name).st_ino != inode:
+                # another daemon took over
+                return
+        except OSError:
+            return
+        if time.time() - last > timeout:
+            break
+    os.remove(name)
+
+
+def handle(conn, listener, main, setup):
+    data = b''
+    while not data.endswith(b'\n'):
+        chunk = conn.recv(65536)
+        if not chunk:
+            return
+        data += chunk
+    message = json.loads(data.decode('utf-8'))
+    out_r, out_w = os.pipe()
+    err_r, err_w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            listener.close()
+            conn.close()
+            os.close(out_r)
+            os.close(err_r)
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(out_w, 1)
+            os.dup2(err_w, 2)
+            os.close(out_w)
+            os.close(err_w)
+            os.chdir(native(message['cwd']))
+            os.environ.clear()
+            for key, value in message['environ'].items():
+                os.environ[native(key)] = native(value)
+            sys.argv = [native(arg) for arg in message['argv']]
+            code = call(main, setup)
+        finally:
+            os._exit(code)
+    os.close(out_w)
+    os.close(err_w)
+    relay(conn, pid, {out_r: STDOUT, err_r: STDERR})
+
+
+def call(main, setup):
+    try:
+        if setup:
+            setup()
+        main()
+        code = 0
+    except SystemExit as e:
+        if e.code is None:
+            code = 0
+        elif isinstance(e.code, int):
+            code = e.code
+        else:
+            sys.stderr.write('%s\n' % (e.code))
+            code = 1
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    sys.stdout.flush()
+    sys.stderr.flush()
+    return code
+
+
+def relay(conn, pid, fds):
+    """
+    Sends the output of the child to the client until the child has finished.
+    If the client is gone, the child still runs to completion.
+    """
+    connected = [True]
+
+    def send(channel, data):
+        if connected[0]:
+            try:
+                conn.sendall(FRAME.pack(channel, len(data)) + data)
+            except socket.error:
+                connected[0] = False
+
+    status = None
+    while fds:
+        try:
+            ready = select.select(list(fds), [], [], 1.)[0]
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                continue
+            raise
+        for fd in ready:
+            data = os.read(fd, 65536)
+            if data:
+                send(fds[fd], data)
+            else:
+                os.close(fd)
+                del fds[fd]
+        if status is None:
+            p, s = os.waitpid(pid, os.WNOHANG)
+            if p:
+                status = s
+        elif not ready:
+            # orphaned grandchildren may keep the pipes open
+            break
+    for fd in fds:
+        os.close(fd)
+    if status is None:
+        status = os.waitpid(pid, 0)[1]
+    if os.WIFSIGNALED(status):
+        code = 128 + os.WTERMSIG(status)
+    else:
+        code = os.WEXITSTATUS(status)
+    send(EXIT, EXITCODE.pack(code))
@@ -0,0 +1,180 @@
+"""
+version 1.0
+description: Vectorized internal coordinates for whole trajectories.
+    All functions take the positions of the involved atoms for all frames, i.e., arrays
+    of shape (nframe,3) (rings: (nframe,N,3)), and return one value per frame.
+    Angles are returned in radians. Undefined angles (e.g., dihedrals with collinear atoms) are NaN.
+    The definitions are the same as in geo.py.
+"""
+
+import math
+import numpy
+
+
+def dot(a, b):
+    return a[..., 0] * b[..., 0] + a[..., 1] * b[..., 1] + a[..., 2] * b[..., 2]
+
+
+def cross(a, b):
+    c = numpy.empty(numpy.broadcast(a, b).shape)
+    c[..., 0] = a[..., 1] * b[..., 2] - a[..., 2] * b[..., 1]
+    c[..., 1] = a[..., 2] * b[..., 0] - a[..., 0] * b[..., 2]
+    c[..., 2] = a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0]
+    return c
+
+
+def norm(a):
+    return numpy.sqrt(dot(a, a))
+
+
+def iszero(a):
+    return numpy.all(a == 0., axis=-1)
+
+
+def angle(a, b):
+    """
+    Angle between the vectors a and b.
+    """
+    old = numpy.seterr(invalid='ignore', divide='ignore')
+    x = dot(a, b) / (norm(a) * norm(b))
+    numpy.seterr(**old)
+    return numpy.arccos(numpy.clip(x, -1., 1.))
+
+
+def distance(a, b):
+    """
+    Bond distance between atoms a and b.
+    """
+    return norm(b - a)
+
+
+def bond_angle(a, b, c):
+    """
+    Bond angle of a-b and b-c.
+    """
+    return angle(a - b, c - b)
+
+
+def dihedral(a, b, c, d):
+    """
+    Dihedral angle between the a-b-c and b-c-d planes.
+    """
+    r1 = b - a
+    r2 = c - b
+    r3 = d - c
+    q1 = cross(r1, r2)
+    q2 = cross(r2, r3)
+    Q = cross(q1, q2)
+    sign = numpy.where(iszero(Q) | (angle(Q, r2) < math.pi / 2.), 1., -1.)
+    return numpy.where(iszero(q1) | iszero(q2), numpy.nan, angle(q1, q2) * sign)
+
+
+def pyramidalization(a, b, c, d):
+    """
+    Pyramidalization angle between the a-b bond and the b-c-d plane.
+    """
+    q1 = cross(c - b, d - b)
+    return numpy.where(iszero(q1), numpy.nan, math.pi / 2. - angle(q1, a - b))
+
+
+def pyramidalization_bisector(a, b, c, d):
+    """
+    Angle between the a-b bond and the average of the b-c and b-d bonds,
+    with the sign of the pyramidalization angle.
+    """
+    phi = math.pi - angle(a - b, (d + c) / 2. - b)
+    return numpy.where(pyramidalization(a, b, c, d) < 0., -phi, phi)
+
+
+def ring_normal(ring):
+    """
+    Normal vector of the mean plane of the ring atoms (nframe,N,3).
+    """
+    N = ring.shape[1]
+    r1 = numpy.zeros(ring.shape[:1] + (3,))
+    r2 = numpy.zeros(ring.shape[:1] + (3,))
+    for j in range(N):
+        r1 += math.sin(2. * math.pi * j / N) * ring[:, j]
+    for j in range(N):
+        r2 += math.cos(2. * math.pi * j / N) * ring[:, j]
+    n = cross(r1, r2)
+    return n / numpy.sqrt(dot(n, n))[:, None]
+
+
+def ring_z(ring):
+    """
+    Displacements of the ring atoms (nframe,N,3) from their mean plane, shape (nframe,N).
+    """
+    N = ring.shape[1]
+    center = numpy.zeros(ring.shape[:1] + (3,))
+    for j in range(N):
+        center += ring[:, j] / N
+    ring = ring - center[:, None, :]
+    n = ring_normal(ring)
+    return dot(ring, n[:, None, :])
+
+
+def cremer_pople5(ring):
+    """
+    Cremer-Pople parameters q and phi (in [0,2pi)) of 5-membered rings (nframe,5,3).
+    """
+    z = ring_z(ring)
+    j = numpy.arange(5)
+    h1 = numpy.dot(z, numpy.cos(4. * math.pi * j / 5.)) * math.sqrt(2. / 5.)
+    h2 = -numpy.dot(z, numpy.sin(4. * math.pi * j / 5.)) * math.sqrt(2. / 5.)
+    ph = numpy.arctan2(h2, h1)
+    ph = numpy.where(ph < 0., 2. * math.pi + ph, ph)
+    return numpy.sqrt(h1**2 + h2**2), ph
+
+
+def cremer_pople6(ring):
+    """
+    Cremer-Pople parameters Q, phi and theta of 6-membered rings (nframe,6,3).
+    """
+    z = ring_z(ring)
+    j = numpy.arange(6)
+    h1 = numpy.dot(z, numpy.cos(4. * math.pi * j / 6.)) * math.sqrt(2. / 6.)
+    h2 = -numpy.dot(z, numpy.sin(4. * math.pi * j / 6.)) * math.sqrt(2. / 6.)
+    ph = numpy.arctan2(h2, h1) + math.pi
+    ph = numpy.where(ph < 0., 2. * math.pi + ph, ph)
+    q2 = numpy.sqrt(h1**2 + h2**2)
+    q3 = numpy.dot(z, (-1.)**j) / math.sqrt(6.)
+    return numpy.sqrt(q2**2 + q3**2), ph, numpy.arctan2(q3, q2) + math.pi / 2.
+
+
+def ring_angle(ring1, ring2):
+    """
+    Angle between the normal vectors of two rings (nframe,N,3).
+    """
+    return angle(ring_normal(ring1), ring_normal(ring2))
+
+
+def boeyens5(ph, symbols):
+    """
+    Classification symbols of 5-membered rings, for phi in degrees.
+    symbols is a dictionary phi -> symbol, the closest one is chosen.
+    """
+    items = list(symbols.items())
+    ref = numpy.array([i[0] for i in items])
+    ph = numpy.asarray(ph)[:, None]
+    d = numpy.minimum((ref - ph) % 360., (ph - ref) % 360.)
+    return [items[i][1] for i in numpy.argmin(d, axis=1)]
+
+
+def boeyens6(ph, th, symbols):
+    """
+    Boeyens symbols of 6-membered rings, for phi and theta in degrees.
+    symbols is a dictionary (phi,theta) -> symbol, the closest one on the sphere is chosen.
+    """
+    items = list(symbols.items())
+    ref = numpy.array([i[0] for i in items])
+
+    def longitude(phi):
+        return numpy.radians(numpy.where(phi > 180., phi - 360., phi))
+    phi1 = longitude(ref[:, 0])[None, :]
+    theta1 = numpy.radians(90. - ref[:, 1])[None, :]
+    phi2 = longitude(numpy.asarray(ph))[:, None]
+    theta2 = numpy.radians(90. - numpy.asarray(th))[:, None]
+    x = numpy.sin(theta1) * numpy.sin(theta2) + numpy.cos(theta1) * numpy.cos(theta2) * numpy.cos(numpy.abs(phi2 - phi1))
+    d = numpy.arccos(numpy.clip(x, -1., 1.))
+    return [items[i][1] for i in numpy.argmin(d, axis=1)]
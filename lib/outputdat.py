@@ -0,0 +1,273 @@
+"""
+version 1.0
+description: Random-access reader for SHARC output.dat files.
+    The file is scanned once for the "! <flag>" lines, which gives the byte offsets of all
+    step blocks ("! 0 Step") and of all sections within each step (e.g. "! 11 Geometry").
+    The index is stored next to the file (output.dat.index) and reused as long as the file
+    is unchanged. If the file has only grown (running trajectory), only the new part is scanned.
+    Geometries and velocities of arbitrary steps are then read by seeking to the section.
+"""
+
+import os
+import re
+import json
+import mmap
+from multiprocessing import Pool
+
+INDEX_SUFFIX = '.index'
+INDEX_VERSION = 1
+
+# section line, for "! 0 Step" the next line contains the step number
+SECTION_RE = re.compile(br'^![ \t]*(\d+)\b[^\n]*\n(?:[ \t]*(\d+)[ \t]*$)?', re.M)
+
+INTEGERS = ['maxmult',
+            'natom',
+            'calc_overlap',
+            'laser',
+            'nsteps',
+            'nsubsteps',
+            'write_overlap',
+            'write_grad',
+            'write_nacdr',
+            'write_property1d',
+            'write_property2d',
+            'n_property1d',
+            'n_property2d'
+            ]
+FLOATS = ['dtstep',
+          'ezero'
+          ]
+
+
+def file_stamp(filename):
+    """
+    Size and modification time of a file, used to check whether the index is still valid.
+    """
+    return [os.path.getsize(filename), os.path.getmtime(filename)]
+
+
+def scan(filename, start=0):
+    """
+    Scans the file from byte offset start and returns a list of steps [step, offset, sections],
+    where sections is a list of [flag, offset] pairs of the sections of this step.
+    """
+    size = os.path.getsize(filename)
+    if size <= start:
+        return []
+    f = open(filename, 'rb')
+    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    steps = []
+    for match in SECTION_RE.finditer(data, start):
+        flag = int(match.group(1))
+        if flag == 0:
+            if match.group(2) is None:
+                # incomplete step at the end of the file
+                break
+            steps.append([int(match.group(2)), match.start(), []])
+        elif steps:
+            steps[-1][2].append([flag, match.start()])
+    data.close()
+    f.close()
+    return steps
+
+
+def read_index(filename):
+    """
+    Returns the stored index of filename, or None if there is none.
+    """
+    try:
+        f = open(filename + INDEX_SUFFIX)
+        index = json.load(f)
+        f.close()
+    except (IOError, ValueError):
+        return None
+    if index.get('version') != INDEX_VERSION:
+        return None
+    return index
+
+
+def write_index(filename, index):
+    """
+    Writes the index of filename (silently skipped if not writable).
+    """
+    try:
+        f = open(filename + INDEX_SUFFIX + '.tmp', 'w')
+        json.dump(index, f)
+        f.close()
+        os.rename(filename + INDEX_SUFFIX + '.tmp', filename + INDEX_SUFFIX)
+    except (IOError, OSError):
+        pass
+
+
+def get_index(filename):
+    """
+    Returns the index of filename (see scan), using and updating the stored index.
+    """
+    stamp = file_stamp(filename)
+    index = read_index(filename)
+    if index is not None and index['stamp'] == stamp:
+        return index['steps']
+    if index is not None and index['steps'] and index['stamp'][0] < stamp[0]:
+        # the file has grown, rescan from the last (possibly incomplete) step
+        steps = index['steps'][:-1] + scan(filename, index['steps'][-1][1])
+    else:
+        steps = scan(filename)
+    write_index(filename, {'version': INDEX_VERSION, 'stamp': stamp, 'steps': steps})
+    return steps
+
+
+def read_header(filename):
+    """
+    Reads the settings and the header arrays (atomic numbers, elements, masses) of an output.dat file.
+    """
+    f = open(filename)
+    data = []
+    for line in f:
+        if '! 0 Step' in line:
+            break
+        data.append(line)
+    f.close()
+
+    inf = {}
+    line = data[0].lower()
+    if 'sharc_version' in line:
+        inf['version'] = float(line.split()[-1])
+    else:
+        inf['version'] = 1.0
+    if inf['version'] == 1.0:
+        labeli = -1
+        datai = 0
+    else:
+        labeli = 0
+        datai = -1
+
+    iline = 0
+    for iline, line in enumerate(data):
+        line = line.lower()
+        if '******' in line:
+            break
+        s = line.split()
+        if not s:
+            continue
+        label = s[labeli]
+        if label in INTEGERS:
+            inf[label] = int(s[datai])
+        elif label in FLOATS:
+            inf[label] = float(s[datai])
+        elif label == 'nstates_m':
+            if inf['version'] == 1.0:
+                inf[label] = [int(i) for i in s[0:-2]]
+            else:
+                inf[label] = [int(i) for i in s[1:-1]]
+
+    if inf['version'] != 1.0:
+        natom = inf['natom']
+        iline += 2
+        inf['atomic_numbers'] = [int(float(data[iline + i])) for i in range(natom)]
+        iline += natom + 1
+        inf['elements'] = [data[iline + i].strip() for i in range(natom)]
+        iline += natom + 1
+        inf['masses'] = [float(data[iline + i]) for i in range(natom)]
+    return inf
+
+
+class OUTPUTDAT:
+    """
+    Indexed output.dat file:
+      outputdat.header            settings and header arrays (see read_header)
+      outputdat.steps             list of the step numbers
+      step in outputdat
+      outputdat.geometry(step)    list of natom [x,y,z] in a.u.
+      outputdat.velocities(step)
+    If a step number occurs several times, the first occurrence is used.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.header = read_header(filename)
+        self.index = get_index(filename)
+        self.steps = [step[0] for step in self.index]
+        self.position = {}
+        for i, step in enumerate(self.steps):
+            if step not in self.position:
+                self.position[step] = i
+
+    def __contains__(self, step):
+        return step in self.position
+
+    def nmax(self):
+        """
+        Number of the last step in the file (-1 if there is none).
+        """
+        if not self.steps:
+            return -1
+        return self.steps[-1]
+
+    def section(self, step, flag, nlines, n=0):
+        """
+        Returns the nlines lines following the n-th section with the given flag in the given step.
+        """
+        if step not in self.position:
+            raise KeyError('Step %i not in %s!' % (step, self.filename))
+        offsets = [offset for (i, offset) in self.index[self.position[step]][2] if i == flag]
+        if len(offsets) <= n:
+            raise KeyError('Section %i not found in step %i of %s!' % (flag, step, self.filename))
+        f = open(self.filename)
+        f.seek(offsets[n])
+        f.readline()
+        lines = [f.readline() for i in range(nlines)]
+        f.close()
+        return lines
+
+    def vectors(self, step, flag):
+        return [[float(x) for x in line.split()] for line in self.section(step, flag, self.header['natom'])]
+
+    def geometry(self, step):
+        return self.vectors(step, 11)
+
+    def velocities(self, step):
+        return self.vectors(step, 12)
+
+
+def index_file(filename):
+    """
+    Builds (or updates) the index of a file and returns its header and the last step.
+    """
+    outputdat = OUTPUTDAT(filename)
+    return outputdat.header, outputdat.nmax()
+
+
+def read_steps(filename, steps):
+    """
+    Returns a dictionary step -> (geometry, velocities) for the given steps of a file.
+    """
+    outputdat = OUTPUTDAT(filename)
+    return dict([(step, (outputdat.geometry(step), outputdat.velocities(step))) for step in steps])
+
+
+def run(function, arglist, ncpu=1):
+    """
+    Calls function for each argument tuple in arglist, on ncpu processes, and returns the results in order.
+    """
+    if ncpu <= 1 or len(arglist) <= 1:
+        return [function(*args) for args in arglist]
+    pool = Pool(processes=min(ncpu, len(arglist)))
+    results = [pool.apply_async(function, args) for args in arglist]
+    pool.close()
+    pool.join()
+    return [result.get() for result in results]
+
+
+def index_files(filenames, ncpu=1):
+    """
+    Indexes several files in parallel, returns a list of (header, last step).
+    """
+    return run(index_file, [(filename,) for filename in filenames], ncpu)
+
+
+def extract_steps(jobs, ncpu=1):
+    """
+    Reads geometries and velocities of several files in parallel.
+    jobs is a list of (filename, list of steps), returns a list of dictionaries (see read_steps).
+    """
+    return run(read_steps, [(filename, steps) for (filename, steps) in jobs], ncpu)
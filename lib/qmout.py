@@ -0,0 +1,390 @@
+"""
+version 1.0
+description: Reader for QM.out files.
+    The file is scanned once for the "! <flag>" lines which start each section.
+    Sections are only read and converted when they are requested, with one bulk
+    conversion of all numbers of a section.
+    Returns numpy arrays if numpy is available, otherwise nested lists.
+
+    QM.out files can also be written in a binary format (write_binary), which is
+    read transparently by QMOUT. All numbers are little-endian, integers are
+    4-byte, reals 8-byte IEEE doubles, complex numbers pairs of reals (real, imaginary):
+      header:   8 bytes "SHQMOUT" + zero byte
+                int     version (1)
+                int     nmstates
+                int     natom
+                int     nsection
+      nsection times:
+                int     flag (as in the text format, see FLAGS)
+                int     type (1: real, 2: complex)
+                int     ndim
+                int     nlabel
+                int     dims(ndim)
+                nlabel times: int length, followed by length bytes of text
+                data    prod(dims) real or complex numbers, last index running fastest
+    The arrays have the shapes given in QMOUT.get. In Fortran, the file can be read
+    with access='stream' into arrays with the reversed dimensions, e.g. the Hamiltonian
+    into complex*16 H(nmstates,nmstates), which gives the transposed matrix.
+"""
+
+import os
+import re
+import sys
+import math
+import mmap
+import array
+import struct
+try:
+    import numpy
+    NONUMPY = False
+except ImportError:
+    NONUMPY = True
+
+# flags of the QM.out sections
+FLAGS = {'h': 1,
+         'dm': 2,
+         'grad': 3,
+         'nacdt': 4,
+         'nacdr': 5,
+         'overlap': 6,
+         'phases': 7,
+         'runtime': 8,
+         'angular': 9,
+         'prop': 11,
+         'dmdr': 12,
+         'socdr': 13,
+         'propmat': 20,
+         'propvec': 21}
+
+# complex-valued sections
+COMPLEX = [1, 2, 4, 6, 7, 9, 11, 13, 20]
+
+BINARY_MAGIC = b'SHQMOUT\x00'
+BINARY_VERSION = 1
+
+# line starting a section
+SECTION_RE = re.compile(br'^!\s*(\d+)\b', re.M)
+# dimension lines in front of each block, e.g. "5 5" or "3 3 ! m1 1 s1 1 ms1 0"
+BLOCKHEADER_RE = re.compile(r'^[ \t]*\d+(?:[ \t]+\d+)*[ \t]*(?:!.*)?$', re.M)
+COMMENT_RE = re.compile(r'!.*$', re.M)
+
+
+def index_sections(filename):
+    """
+    Scans the file once and returns a dictionary flag -> (start, end) with the byte offsets
+    of the first section of each flag.
+    """
+    size = os.path.getsize(filename)
+    if size == 0:
+        return {}
+    f = open(filename, 'rb')
+    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    starts = [(int(match.group(1)), match.start()) for match in SECTION_RE.finditer(data)]
+    data.close()
+    f.close()
+    sections = {}
+    for i, (flag, start) in enumerate(starts):
+        if flag in sections:
+            continue
+        if i + 1 < len(starts):
+            end = starts[i + 1][1]
+        else:
+            end = size
+        sections[flag] = (start, end)
+    return sections
+
+
+def isqrt(n):
+    return int(round(math.sqrt(n)))
+
+
+def block_layout(flag, nblock):
+    """
+    Arrangement of the blocks of a section (the dimensions in front of the block dimensions).
+    """
+    if flag in [2, 9]:
+        return (3,)
+    if flag == 3:
+        return (nblock,)
+    if flag in [5, 13]:
+        n = isqrt(nblock)
+        return (n, n)
+    if flag == 12:
+        n = isqrt(nblock // 3)
+        return (n, n, 3)
+    if flag == 20:
+        return (nblock,)
+    return ()
+
+
+def reshape(values, shape):
+    """
+    Nested lists of the given shape from a flat list (used without numpy).
+    """
+    if len(shape) == 1:
+        return list(values)
+    size = len(values) // shape[0]
+    return [reshape(values[i * size:(i + 1) * size], shape[1:]) for i in range(shape[0])]
+
+
+def convert(text, shape, iscomplex):
+    """
+    Converts all numbers in text at once and arranges them in an array of the given shape.
+    """
+    if NONUMPY:
+        values = [float(x) for x in text.split()]
+        if iscomplex:
+            values = [complex(values[2 * i], values[2 * i + 1]) for i in range(len(values) // 2)]
+        return reshape(values, shape)
+    values = numpy.array(text.split(), dtype=float)
+    if iscomplex:
+        values = values[0::2] + 1j * values[1::2]
+    return values.reshape(shape)
+
+
+def as_lists(A):
+    """
+    Converts an array to nested lists (for code which works on lists).
+    """
+    if NONUMPY:
+        return A
+    return numpy.asarray(A).tolist()
+
+
+def parse_labels(lines):
+    """
+    Splits the body of a property section (flags 20 and 21) into the labels and the remaining lines.
+    """
+    lines = [line for line in lines if line.strip()]
+    nprop = int(lines[0].split()[0])
+    return [line.strip() for line in lines[2:2 + nprop]], lines[2 + nprop:]
+
+
+def parse_section(flag, text):
+    """
+    Converts the text of one section (including its "! <flag>" line).
+    Property sections (flags 20 and 21) return a tuple (labels, values).
+    """
+    body = text.split('\n', 1)[1] if '\n' in text else ''
+    labels = None
+    if flag in [20, 21]:
+        labels, lines = parse_labels(body.split('\n'))
+        body = '\n'.join(lines)
+    headers = [[int(i) for i in COMMENT_RE.sub('', line).split()] for line in BLOCKHEADER_RE.findall(body)]
+    data = COMMENT_RE.sub('', BLOCKHEADER_RE.sub('', body))
+    if flag == 8:
+        shape = (-1,)
+    elif flag == 21:
+        shape = (len(labels), -1)
+    elif headers:
+        shape = block_layout(flag, len(headers)) + tuple(headers[0])
+    else:
+        shape = (-1,)
+    if NONUMPY and -1 in shape:
+        n = len(data.split()) // (1 + (flag in COMPLEX))
+        for i in shape:
+            if i != -1:
+                n //= i
+        shape = tuple([n if i == -1 else i for i in shape])
+    values = convert(data, shape, flag in COMPLEX)
+    if flag == 8:
+        values = values[0]
+    if labels is not None:
+        return labels, values
+    return values
+
+
+class QMOUT:
+    """
+    Sections of a QM.out file, addressed by their keys in FLAGS (e.g. 'h', 'dm', 'grad'):
+      'h' in qmout, qmout.get('h'), qmout.read(['h', 'dm'])
+    Only the requested sections are read from the file, each of them on first request.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        f = open(filename, 'rb')
+        self.binary = f.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+        if self.binary:
+            self.sections = index_binary(f)
+        f.close()
+        if not self.binary:
+            self.sections = index_sections(filename)
+        self.values = {}
+
+    def section_text(self, flag):
+        start, end = self.sections[flag]
+        f = open(self.filename, 'rb')
+        f.seek(start)
+        text = f.read(end - start)
+        f.close()
+        if not isinstance(text, str):
+            text = text.decode()
+        return text
+
+    def __contains__(self, key):
+        return FLAGS[key] in self.sections
+
+    def keys(self):
+        return [key for key in FLAGS if key in self]
+
+    def get(self, key):
+        """
+        Returns the values of a section:
+          h, overlap, prop, nacdt    (nmstates,nmstates) complex
+          dm, angular                (3,nmstates,nmstates) complex
+          grad                       (nmstates,natom,3)
+          nacdr                      (nmstates,nmstates,natom,3)
+          dmdr                       (nmstates,nmstates,3,natom,3)
+          socdr                      (nmstates,nmstates,natom,3) complex
+          phases                     (nmstates) complex
+          runtime                    float
+          propmat                    (labels, (nprop,nmstates,nmstates) complex)
+          propvec                    (labels, (nprop,nmstates))
+        """
+        if key not in self.values:
+            flag = FLAGS[key]
+            if flag not in self.sections:
+                raise KeyError('No section with flag %i (%s) in %s!' % (flag, key, self.filename))
+            if self.binary:
+                self.values[key] = read_binary_section(self.filename, flag, self.sections[flag])
+            else:
+                self.values[key] = parse_section(flag, self.section_text(flag))
+        return self.values[key]
+
+    def read(self, keys=None):
+        """
+        Returns a dictionary with the requested sections (default: all sections in the file).
+        """
+        if keys is None:
+            keys = self.keys()
+        return dict([(key, self.get(key)) for key in keys])
+
+
+def read_QMout(filename, keys=None):
+    """
+    Reads the requested sections of a QM.out file (see QMOUT.get).
+    """
+    return QMOUT(filename).read(keys)
+
+
+# ======================================================================================================================
+
+
+def unpack(f, n):
+    return struct.unpack('<%ii' % (n), f.read(4 * n))
+
+
+def index_binary(f):
+    """
+    Reads the section headers of a binary QM.out file (f positioned after the magic bytes).
+    Returns a dictionary flag -> (offset of data, shape, labels).
+    """
+    version, nmstates, natom, nsection = unpack(f, 4)
+    sections = {}
+    for isection in range(nsection):
+        flag, dtype, ndim, nlabel = unpack(f, 4)
+        shape = unpack(f, ndim)
+        labels = []
+        for ilabel in range(nlabel):
+            length = unpack(f, 1)[0]
+            labels.append(str(f.read(length).decode()))
+        offset = f.tell()
+        size = 8 * dtype
+        for i in shape:
+            size *= i
+        f.seek(size, 1)
+        if flag not in sections:
+            sections[flag] = (offset, tuple(shape), labels)
+    return sections
+
+
+def read_binary_section(filename, flag, section):
+    """
+    Reads the data of one section of a binary QM.out file.
+    """
+    offset, shape, labels = section
+    count = 1 + (flag in COMPLEX)
+    for i in shape:
+        count *= i
+    f = open(filename, 'rb')
+    f.seek(offset)
+    raw = f.read(8 * count)
+    f.close()
+    if NONUMPY:
+        values = array.array('d')
+        if hasattr(values, 'frombytes'):
+            values.frombytes(raw)
+        else:
+            values.fromstring(raw)
+        if sys.byteorder == 'big':
+            values.byteswap()
+        values = list(values)
+        if flag in COMPLEX:
+            values = [complex(values[2 * i], values[2 * i + 1]) for i in range(len(values) // 2)]
+        values = reshape(values, shape)
+    else:
+        values = numpy.frombuffer(raw, dtype='<f8').astype(float)
+        if flag in COMPLEX:
+            values = values[0::2] + 1j * values[1::2]
+        values = values.reshape(shape)
+    if flag == 8:
+        values = values[0]
+    if flag in [20, 21]:
+        return labels, values
+    return values
+
+
+def flatten(values):
+    """
+    Shape and flat list of nested lists (used without numpy).
+    """
+    if not isinstance(values, (list, tuple)):
+        return (), [values]
+    shape = None
+    flat = []
+    for v in values:
+        shape, f = flatten(v)
+        flat.extend(f)
+    return (len(values),) + (shape or ()), flat
+
+
+def write_binary(filename, QMout, nmstates, natom):
+    """
+    Writes a binary QM.out file.
+    QMout is a dictionary with keys from FLAGS and values (arrays or nested lists) in the
+    shapes of QMOUT.get, propmat and propvec as tuples (labels, values).
+    """
+    string = BINARY_MAGIC + struct.pack('<4i', BINARY_VERSION, nmstates, natom, len(QMout))
+    for key in sorted(QMout, key=lambda key: FLAGS[key]):
+        flag = FLAGS[key]
+        values = QMout[key]
+        labels = []
+        if flag in [20, 21]:
+            labels, values = values
+        if flag == 8:
+            values = [values]
+        if NONUMPY:
+            shape, flat = flatten(values)
+            if flag in COMPLEX:
+                flat = [x for c in flat for x in (complex(c).real, complex(c).imag)]
+            data = array.array('d', [float(x) for x in flat])
+            if sys.byteorder == 'big':
+                data.byteswap()
+            if hasattr(data, 'tobytes'):
+                data = data.tobytes()
+            else:
+                data = data.tostring()
+        else:
+            A = numpy.asarray(values, dtype=[float, complex][flag in COMPLEX])
+            shape = A.shape
+            data = A.astype(['<f8', '<c16'][flag in COMPLEX]).tobytes()
+        string += struct.pack('<4i', flag, 1 + (flag in COMPLEX), len(shape), len(labels))
+        string += struct.pack('<%ii' % (len(shape)), *shape)
+        for label in labels:
+            label = label.encode()
+            string += struct.pack('<i', len(label)) + label
+        string += data
+    f = open(filename, 'wb')
+    f.write(string)
+    f.close()
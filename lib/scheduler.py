@@ -0,0 +1,157 @@
+"""
+version 1.0
+description: Distribution of the CPU cores over the jobs of a jobset, using the runtimes measured in previous steps.
+    The interfaces record the wall time and number of cores of each successful job in the file job_timings
+    in the savedir (one line "jobname ncpu walltime" per job and step, the last HISTORY entries per job are kept).
+    For each job, the runtime on n cores is modelled as t(n)=a+b/n (Amdahls law with t(1)=a+b and scaling b/(a+b)),
+    fitted by least squares to the recorded timings. If a job was only run with one core count, the static
+    schedule_scaling is used for the split into a and b. Jobs without recorded timings get the average model of
+    the other jobs.
+    Two kinds of schedules are compared by their predicted makespan:
+      all jobs at once, with the cores given one by one to the job with the longest predicted runtime
+      the same number of cores for each job and fewer Pool slots than jobs, with the jobs submitted
+      longest-processing-time-first (the Pool then starts each job on the next free slot)
+"""
+
+import os
+import time
+
+TIMINGSFILE = 'job_timings'
+HISTORY = 10
+
+
+def timed(function, *args):
+    """
+    Calls function(*args) and returns the result together with the wall time in seconds
+    (wrapper for Pool.apply_async).
+    """
+    start = time.time()
+    result = function(*args)
+    return result, time.time() - start
+
+
+def load(savedir):
+    """
+    Returns the recorded timings as dictionary jobname -> list of (ncpu,walltime).
+    """
+    timings = {}
+    filename = os.path.join(savedir, TIMINGSFILE)
+    if not os.path.isfile(filename):
+        return timings
+    f = open(filename)
+    for line in f:
+        s = line.split()
+        if len(s) != 3 or s[0].startswith('#'):
+            continue
+        try:
+            ncpu = int(s[1])
+            walltime = float(s[2])
+        except ValueError:
+            continue
+        if ncpu > 0 and walltime > 0.:
+            timings.setdefault(s[0], []).append((ncpu, walltime))
+    f.close()
+    return timings
+
+
+def record(savedir, new):
+    """
+    Adds the new timings (list of (jobname,ncpu,walltime)) to the file in savedir.
+    """
+    if not new or not os.path.isdir(savedir):
+        return
+    timings = load(savedir)
+    for job, ncpu, walltime in new:
+        if ncpu > 0 and walltime > 0.:
+            timings.setdefault(job, []).append((ncpu, walltime))
+    string = '# jobname  ncpu  walltime/s\n'
+    for job in sorted(timings):
+        timings[job] = timings[job][-HISTORY:]
+        for ncpu, walltime in timings[job]:
+            string += '%s %i %.3f\n' % (job, ncpu, walltime)
+    filename = os.path.join(savedir, TIMINGSFILE)
+    f = open(filename + '.tmp', 'w')
+    f.write(string)
+    f.close()
+    os.rename(filename + '.tmp', filename)
+
+
+def fit(entries, scaling):
+    """
+    Fits t(n)=a+b/n to a list of (ncpu,walltime). Returns (a,b).
+    """
+    n = float(len(entries))
+    if len(set([ncpu for ncpu, walltime in entries])) == 1:
+        ncpu = entries[0][0]
+        t1 = sum([walltime for c, walltime in entries]) / n / ((1. - scaling) + scaling / ncpu)
+        return t1 * (1. - scaling), t1 * scaling
+    x = [1. / ncpu for ncpu, walltime in entries]
+    y = [walltime for ncpu, walltime in entries]
+    xm = sum(x) / n
+    ym = sum(y) / n
+    b = sum([(xi - xm) * (yi - ym) for xi, yi in zip(x, y)]) / sum([(xi - xm)**2 for xi in x])
+    a = ym - b * xm
+    if a < 0.:
+        a = 0.
+        b = sum([xi * yi for xi, yi in zip(x, y)]) / sum([xi**2 for xi in x])
+    elif b < 0.:
+        a = ym
+        b = 0.
+    return a, b
+
+
+def runtime(model, ncpu):
+    return model[0] + model[1] / ncpu
+
+
+def lpt_makespan(times, nslots):
+    """
+    Makespan of list scheduling of the jobs (in the given order) on nslots equivalent slots.
+    """
+    slots = [0.] * nslots
+    for t in times:
+        i = slots.index(min(slots))
+        slots[i] += t
+    return max(slots)
+
+
+def schedule(ncpu, jobs, scaling, timings):
+    """
+    Returns (nslots,cpu_per_job,order,makespan) for the list of jobnames, with cpu_per_job a dictionary
+    and order the jobs in order of submission. Returns None if there are no timings for any of the jobs.
+    """
+    known = [job for job in jobs if job in timings]
+    if not known:
+        return None
+    models = {}
+    for job in known:
+        models[job] = fit(timings[job], scaling)
+    default = (sum([models[job][0] for job in known]) / len(known),
+               sum([models[job][1] for job in known]) / len(known))
+    for job in jobs:
+        if job not in models:
+            models[job] = default
+
+    best = None
+    # all jobs at once
+    if len(jobs) <= ncpu:
+        cpu = dict([(job, 1) for job in jobs])
+        for icpu in range(ncpu - len(jobs)):
+            job = max(jobs, key=lambda j: runtime(models[j], cpu[j]))
+            cpu[job] += 1
+        makespan = max([runtime(models[job], cpu[job]) for job in jobs])
+        best = (len(jobs), cpu, makespan)
+    # same cores for all jobs, several rounds
+    for i in range(1, min(len(jobs), ncpu) + 1):
+        ncores = ncpu // i
+        nslots = ncpu // ncores
+        if nslots >= len(jobs):
+            continue
+        times = sorted([runtime(models[job], ncores) for job in jobs], reverse=True)
+        makespan = lpt_makespan(times, nslots)
+        if not best or makespan < best[2]:
+            best = (nslots, dict([(job, ncores) for job in jobs]), makespan)
+
+    nslots, cpu, makespan = best
+    order = sorted(jobs, key=lambda job: -runtime(models[job], cpu[job]))
+    return nslots, cpu, order, makespan
@@ -39,11 +39,13 @@ from __future__ import print_function
 import shutil
 import sys
 import os
+import hashlib
 
 import numpy
 import numpy as np
 
 from sharc.pysharc.interface import SHARC_INTERFACE
+from sharc.pysharc.batch import SHARC_BATCH
 
 # ******************************
 #
@@ -152,126 +154,184 @@ def transform(A, U):
     return np.dot(np.array(U).T, np.dot(A, U))
 
 # =========================================================
-def getQMout(QMin,SH2LVC):
-    '''Calculates the MCH Hamiltonian, SOC matrix ,overlap matrix, gradients, DM'''
-  
-    QMout={}
+def setup_lvc_arrays(SH2LVC, states):
+    '''Precomputes all geometry-independent arrays of the LVC model.
+
+    Adds to SH2LVC:
+    'sqOm'  : square roots of the frequencies, zero for vanishing modes (3N)
+    'W'     : transformation from dimensionless normal mode derivatives 
+              to Cartesian gradients (3N x 3N)
+    'H0'    : list over multiplicities of diagonal epsilon matrices (n x n)
+    'dHQ'   : list over multiplicities of kappa/lambda matrices 
+              in normal mode coordinates (3N x n x n)
+    'dHcart': list over multiplicities of kappa/lambda matrices 
+              in Cartesian coordinates (3N x n x n)
+    '''
+    Om = SH2LVC['Om']
+    r3N = len(Om)
+    SH2LVC['sqOm'] = np.where(np.abs(Om) > 1.e-8, np.sqrt(np.abs(Om)), 0.)
+    SH2LVC['W'] = SH2LVC['sqOm'][:,None] * SH2LVC['V'].T * SH2LVC['Ms'][None,:]
+    H0 = [ np.zeros((n, n)) for n in states ]
+    dHQ = [ np.zeros((r3N, n, n)) for n in states ]
+    for imult, istate, val in SH2LVC['epsilon']:
+        H0[imult][istate, istate] += val
+    for imult, istate, i, val in SH2LVC['kappa']:
+        dHQ[imult][i, istate, istate] += val
+    for imult, istate, jstate, i, val in SH2LVC['lambda']:
+        dHQ[imult][i, istate, jstate] += val
+        dHQ[imult][i, jstate, istate] += val
+    SH2LVC['H0'] = H0
+    SH2LVC['dHQ'] = dHQ
+    SH2LVC['dHcart'] = [ np.tensordot(SH2LVC['W'], dH, axes=(0, 0)) for dH in dHQ ]
+
+# =========================================================
+def lvc_cachefile(fname, v0file):
+    '''Returns the path of the binary parameter cache for the template fname.
+
+    The cache is keyed by the content hash of the template and the V0 file.'''
+    h = hashlib.sha1()
+    for filename in [fname, v0file]:
+        try:
+            with open(filename, 'rb') as f:
+                h.update(f.read())
+        except IOError:
+            return None
+    return os.path.join(os.path.dirname(fname), 'LVC.cache.%s.npz' % h.hexdigest())
+
+# =========================================================
+def write_lvc_cache(cachefile, SH2LVC):
+    '''Writes all geometry-independent LVC arrays to a .npz file.
+
+    The file is written under a temporary name and renamed, so that 
+    concurrent trajectories never read a partial cache.'''
+    arrays = {}
+    for key in ['labels', 'CEq', 'Ms', 'Om', 'V', 'W', 'dipole', 'soc']:
+        arrays[key] = np.asarray(SH2LVC[key])
+    for key in ['H0', 'dHQ', 'dHcart']:
+        for imult, a in enumerate(SH2LVC[key]):
+            arrays['%s_%i' % (key, imult)] = a
+    tmpfile = '%s.%i.tmp' % (cachefile, os.getpid())
+    try:
+        with open(tmpfile, 'wb') as f:
+            np.savez(f, **arrays)
+        os.rename(tmpfile, cachefile)
+    except (IOError, OSError):
+        print('WARNING: Could not write LVC parameter cache %s!' % cachefile)
+
+# =========================================================
+def read_lvc_cache(cachefile, states):
+    '''Reads the geometry-independent LVC arrays written by write_lvc_cache'''
+    SH2LVC = {}
+    with np.load(cachefile) as data:
+        for key in ['CEq', 'Ms', 'Om', 'V', 'W', 'dipole', 'soc']:
+            SH2LVC[key] = data[key]
+        SH2LVC['labels'] = [ str(l) for l in data['labels'] ]
+        for key in ['H0', 'dHQ', 'dHcart']:
+            SH2LVC[key] = [ data['%s_%i' % (key, imult)] for imult in range(len(states)) ]
+    return SH2LVC
+
+# =========================================================
+def load_U(savedir, name='U'):
+    '''Loads a transformation matrix from savedir, 
+    either binary (name.npy) or as text (name.out) from older versions. 
+    Returns None if neither file exists.'''
+    fname = os.path.join(savedir, name + '.npy')
+    if os.path.isfile(fname):
+        return np.load(fname)
+    fname = os.path.join(savedir, name + '.out')
+    if os.path.isfile(fname):
+        return np.loadtxt(fname, ndmin=2)
+    return None
+
+# =========================================================
+def getQMout(QMin, SH2LVC, storage):
+    '''Calculates the MCH Hamiltonian, SOC matrix ,overlap matrix, gradients, DM
+
+    storage holds the U and Uold matrices of the trajectory'''
+    return getQMouts([QMin], SH2LVC, [storage])[0]
+
+# =========================================================
+def getQMouts(QMins, SH2LVC, storages):
+    '''Calculates QMout for several geometries in one vectorized call
+
+    SH2LVC['H'] and SH2LVC['gradV0'] are stacked over the geometries
+    (see SHARC_LVC.build_lvc_hamiltonian), QMins and storages hold the 
+    requests and the U/Uold matrices of each trajectory.
+
+    Each multiplicity block is diagonalized once and the derivative matrices 
+    of all 3N Cartesian coordinates are transformed in one batched product.
+    The results are then replicated over the Ms components.'''
   
-    nmult = len(QMin['states'])
-    r3N = range(3*QMin['natom'])
+    states = QMins[0]['states']
+    nmstates = QMins[0]['nmstates']
+    natom = QMins[0]['natom']
+    r3N = 3*natom
+    ngeo = len(QMins)
+    donac = any( 'nacdr' in QMin for QMin in QMins )
   
     # Diagonalize Hamiltonian and expand to the full ms-basis
-    U  = [[ 0. for i in range(QMin['nmstates']) ] for j in range(QMin['nmstates']) ]
-    Hd = [[ 0. for i in range(QMin['nmstates']) ] for j in range(QMin['nmstates']) ]
-    dHfull = [[[ 0. for i in range(QMin['nmstates']) ] for j in range(QMin['nmstates']) ] for iQ in r3N]
+    U  = np.zeros((ngeo, nmstates, nmstates))
+    Hd = np.zeros((ngeo, nmstates))
+    grad = np.zeros((ngeo, nmstates, r3N))
+    if donac:
+        nacdr = np.zeros((ngeo, nmstates, nmstates, r3N))
     offs = 0
-    for imult in range(nmult):
-        dim = QMin['states'][imult]
-        if not dim == 0:
-            Hdtmp,Utmp=diagonalize(SH2LVC['H'][imult])
-            for ms in range(imult+1):
-                for i in range(dim):
-                    Hd[i+offs][i+offs] = Hdtmp[i]
-                    U[i+offs][offs:offs+dim] = Utmp[i]
-                    for iQ in r3N:
-                        dHfull[iQ][i+offs][offs:offs+dim] = SH2LVC['dH'][iQ][imult][i]
-                offs += dim
-#  print "QMout1: CPU time: % .3f s, wall time: %.3f s"%(time.clock() - tc, time.time() - tt)
-  
-    # Transform the gradients to the MCH basis
-    dE = [[[0. for iQ in range(3*QMin['natom'])] for istate in range(QMin['nmstates'])] for jstate in range(QMin['nmstates'])]
-    for iQ in r3N:
-        dEmat = transform(dHfull[iQ], U)
-        for istate in range(QMin['nmstates']):
-            for jstate in range(QMin['nmstates']):
-                dE[istate][jstate][iQ] = dEmat[istate][jstate]
-  #  print "QMout2: CPU time: % .3f s, wall time: %.3f s"%(time.clock() - tc, time.time() - tt)
-  
-    # Convert the gradient to Cartesian coordinates
-    #   -> It would be more efficent to do this only for unique Ms values
-    VOdE = [0. for i in r3N]
-    grad = []
-    for istate in range(QMin['nmstates']):
-        OdE = [0. for iQ in r3N]
-        for iQ in r3N:
-            if abs(SH2LVC['Om'][iQ]) > 1.e-8:
-                OdE[iQ] = dE[istate][istate][iQ] * SH2LVC['Om'][iQ]**0.5
-        VOdE = numpy.dot(SH2LVC['V'], OdE)
-  
-        grad.append([])
-        for iat in range(QMin['natom']):
-            grad[-1].append([VOdE[3*iat] * SH2LVC['Ms'][3*iat], VOdE[3*iat+1] * SH2LVC['Ms'][3*iat+1], VOdE[3*iat+2] * SH2LVC['Ms'][3*iat+2]])
-  #  print "QMout3: CPU time: % .3f s, wall time: %.3f s"%(time.clock() - tc, time.time() - tt)
-  
-    if 'nacdr' in QMin:
-        nonac = [ [0., 0., 0.] for iat in range(QMin['natom'])]
-        QMout['nacdr'] = [[ nonac for istate in range(QMin['nmstates'])] for jstate in range(QMin['nmstates'])]
-        istate =- 1
-        for imult,ist,ims in itnmstates(QMin['states']):
-            istate += 1
-  
-            jstate =- 1
-            for jmult,jst,jms in itnmstates(QMin['states']):
-                jstate += 1
-  
-                if imult == jmult and ims == jms and istate < jstate:
-                    OdE = [0. for iQ in r3N]
-                    for iQ in r3N:
-                        if abs(SH2LVC['Om'][iQ]) > 1.e-8:
-                            OdE[iQ] = dE[istate][jstate][iQ] * SH2LVC['Om'][iQ]**0.5
-                    VOdE = numpy.dot(SH2LVC['V'], OdE)
-  
-                    deriv = []
-                    for iat in range(QMin['natom']):
-                        deriv.append([VOdE[3*iat] * SH2LVC['Ms'][3*iat], VOdE[3*iat+1] * SH2LVC['Ms'][3*iat+1], VOdE[3*iat+2] * SH2LVC['Ms'][3*iat+2]])
-  
-                    Einv = (Hd[jstate][jstate] - Hd[istate][istate]) ** (-1.)
-  
-                    QMout['nacdr'][istate][jstate] = [ [ c * Einv for c in d] for d in deriv]
-                    QMout['nacdr'][jstate][istate] = [ [-c * Einv for c in d] for d in deriv]
-  
-    # transform dipole matrices
-    dipole=[]
-    for idir in range(3):
-        Dmatrix=transform(SH2LVC['dipole'][idir+1],U).tolist()
-        dipole.append(Dmatrix)
-  
-    # get overlap matrix
-    if 'overlap' in QMin:
-        Uoldfile=os.path.join(QMin['savedir'],'Uold.out')
-        if 'init' in QMin:
-            overlap = [ [ float(i==j) for i in range(QMin['nmstates']) ] for j in range(QMin['nmstates']) ]
-        else:
-            Uold = [[float(v) for v in line.split()] for line in open(Uoldfile, 'r').readlines()]
-            overlap = numpy.dot(numpy.array(Uold).T,U)
-        QMout['overlap']=overlap
-  
+    for imult, dim in enumerate(states):
+        if dim == 0:
+            continue
+        Hdtmp, Utmp = np.linalg.eigh(SH2LVC['H'][imult])
+        # all Cartesian derivative matrices in the MCH basis
+        dE = np.matmul(Utmp.transpose(0, 2, 1)[:,None], np.matmul(SH2LVC['dHcart'][imult][None], Utmp[:,None]))
+        dE += SH2LVC['gradV0'][:,:,None,None] * np.eye(dim)
+        dE = dE.transpose(0, 2, 3, 1)
+        if donac:
+            dEn = Hdtmp[:,None,:] - Hdtmp[:,:,None]
+            dEn[:, np.arange(dim), np.arange(dim)] = np.inf
+            nac = dE / dEn[:,:,:,None]
+        for ms in range(imult+1):
+            block = slice(offs, offs+dim)
+            Hd[:, block] = Hdtmp
+            U[:, block, block] = Utmp
+            grad[:, block] = dE[:, np.arange(dim), np.arange(dim)]
+            if donac:
+                nacdr[:, block, block] = nac
+            offs += dim
   
-    Ufile=os.path.join(QMin['savedir'],'U.out')
-    f = open(Ufile, 'w')
-    for line in U:
-        for c in line:
-            f.write(str(c) + ' ')
-        f.write('\n')
-    f.close()
+    # transform dipole and SOC matrices
+    UT = U.transpose(0, 2, 1)
+    dipole = np.matmul(UT[:,None], np.matmul(SH2LVC['dipole'][None], U[:,None]))
+    SO = np.matmul(UT, np.matmul(SH2LVC['soc'][None], U))
+    SO[:, np.arange(nmstates), np.arange(nmstates)] = 0.
+
+    QMouts = []
+    for igeo, (QMin, storage) in enumerate(zip(QMins, storages)):
+        QMout = {}
+        QMout['grad'] = grad[igeo].reshape(nmstates, natom, 3).tolist()
+        if 'nacdr' in QMin:
+            QMout['nacdr'] = nacdr[igeo].reshape(nmstates, nmstates, natom, 3).tolist()
+        QMout['dm'] = dipole[igeo].tolist()
   
-    # transform SOC matrix
-    SO=transform(SH2LVC['soc'],U)
-    for i in range(QMin['nmstates']):
-        SO[i][i]=complex(0.,0.)
-    Hfull=[ [ Hd[i][j]+SO[i][j] for i in range(QMin['nmstates']) ] for j in range(QMin['nmstates']) ]
+        # get overlap matrix
+        if 'overlap' in QMin:
+            if 'init' in QMin:
+                overlap = np.eye(nmstates)
+            else:
+                Uold = storage.get('Uold')
+                if Uold is None:
+                    Uold = load_U(QMin['savedir'], 'Uold')
+                overlap = np.dot(Uold.T, U[igeo])
+            QMout['overlap'] = overlap.tolist()
   
-    # assign QMout elements
-    QMout['h']=Hfull
-    QMout['dm']=dipole
-    QMout['grad']=grad
-    #QMout['dmdr']=dmdr
-    QMout['runtime']=0.
+        # keep U in memory and in savedir (for restarts)
+        storage['U'] = U[igeo]
+        np.save(os.path.join(QMin['savedir'],'U.npy'), U[igeo])
   
-    #pprint.pprint(QMout,width=192)
+        QMout['h'] = (np.diag(Hd[igeo]) + SO[igeo]).T.tolist()
+        #QMout['dmdr']=dmdr
+        QMout['runtime']=0.
+        QMouts.append(QMout)
   
-    return QMout
-
+    return QMouts
 
 class SHARC_LVC(SHARC_INTERFACE):
     """
@@ -298,9 +358,20 @@ class SHARC_LVC(SHARC_INTERFACE):
         """
         QMin = self.parseTasks(tasks)
         self.build_lvc_hamiltonian(Crd)
-        QMout = getQMout(QMin, self.storage['SH2LVC'])
+        QMout = getQMout(QMin, self.storage['SH2LVC'], self.storage)
         return QMout
 
+    def do_qm_jobs(self, trajectories, tasks, Crds):
+        """
+
+        Batched version of do_qm_job, evaluates the LVC model 
+        for all trajectories in one vectorized call
+
+        """
+        QMins = [ traj.parseTasks(t) for traj, t in zip(trajectories, tasks) ]
+        self.build_lvc_hamiltonian(Crds)
+        return getQMouts(QMins, self.storage['SH2LVC'], [ traj.storage for traj in trajectories ])
+
 
     def parseTasks(self, tasks):
         """
@@ -332,12 +403,13 @@ class SHARC_LVC(SHARC_INTERFACE):
         if 'init' in QMin:
             checkscratch(QMin['savedir'])
         if not 'init' in QMin and not 'samestep' in QMin and not 'restart' in QMin:
-            fromfile=os.path.join(QMin['savedir'],'U.out')
-            if not os.path.isfile(fromfile):
-                print('ERROR: savedir does not contain U.out! Maybe you need to add "init" to QM.in.')
-                sys.exit(1)
-            tofile=os.path.join(QMin['savedir'],'Uold.out')
-            shutil.copy(fromfile,tofile)
+            if not 'U' in self.storage:
+                self.storage['U'] = load_U(QMin['savedir'], 'U')
+                if self.storage['U'] is None:
+                    print('ERROR: savedir does not contain U.out! Maybe you need to add "init" to QM.in.')
+                    sys.exit(1)
+            self.storage['Uold'] = self.storage['U']
+            np.save(os.path.join(QMin['savedir'],'Uold.npy'), self.storage['Uold'])
 
         for key in ['grad', 'nacdr']:
             if tasks[key].strip() != "":
@@ -349,11 +421,11 @@ class SHARC_LVC(SHARC_INTERFACE):
     def compute_displacement(self, Crd):
         """
         Compute the difference between the Vectors
-        """
 
-        disp =  [ (Crd[i][j] - self.storage['SH2LVC']['CEq'][i*3+j])
-                    for i in range(self.NAtoms) for j in range(3) ]
-        return disp
+        Crd is either a single geometry (NAtoms x 3) or a stack of 
+        geometries (N x NAtoms x 3), the displacement has shape N x 3*NAtoms
+        """
+        return np.asarray(Crd, dtype=float).reshape(-1, 3*self.NAtoms) - self.storage['SH2LVC']['CEq']
 
 
     def readParameter(self, fname, *args, **kwargs):
@@ -382,7 +454,13 @@ class SHARC_LVC(SHARC_INTERFACE):
         f.close()
 
         self.storage['V0'] = sh2lvc[0].strip()
-        SH2LVC = self.read_V0(fname=os.path.join(os.path.dirname(fname),self.storage['V0']))
+        v0file = os.path.join(os.path.dirname(fname),self.storage['V0'])
+        # use the binary parameter cache, if it was already built for this template
+        cachefile = lvc_cachefile(fname, v0file)
+        if cachefile and os.path.isfile(cachefile):
+            self.storage['SH2LVC'] = read_lvc_cache(cachefile, self.states['states'])
+            return
+        SH2LVC = self.read_V0(fname=v0file)
         # read EPSILON
         tmp = find_lines(1, 'epsilon',sh2lvc)
         eps = []
@@ -415,12 +493,15 @@ class SHARC_LVC(SHARC_INTERFACE):
         SH2LVC['lambda'] = lam
         # read DIPOLE
         nmstates = self.states['nmstates']
-        SH2LVC['dipole'] = {}
-        SH2LVC['dipole'][1]= read_LVC_mat(nmstates, 'DMX', sh2lvc)
-        SH2LVC['dipole'][2]= read_LVC_mat(nmstates, 'DMY', sh2lvc)
-        SH2LVC['dipole'][3]= read_LVC_mat(nmstates, 'DMZ', sh2lvc)
+        SH2LVC['dipole'] = np.array([ read_LVC_mat(nmstates, 'DMX', sh2lvc),
+                                      read_LVC_mat(nmstates, 'DMY', sh2lvc),
+                                      read_LVC_mat(nmstates, 'DMZ', sh2lvc) ])
         # obtain the SOC matrix
-        SH2LVC['soc'] = read_LVC_mat(nmstates, 'SOC', sh2lvc)
+        SH2LVC['soc'] = np.array(read_LVC_mat(nmstates, 'SOC', sh2lvc))
+        # precompute the geometry-independent arrays
+        setup_lvc_arrays(SH2LVC, self.states['states'])
+        if cachefile:
+            write_lvc_cache(cachefile, SH2LVC)
         #  save SH2LVC
         self.storage['SH2LVC'] = SH2LVC
         return
@@ -430,61 +511,26 @@ class SHARC_LVC(SHARC_INTERFACE):
         does everything that was before done by **read_SH2LVC**
         except fileio  etc. everything there should be already
         done by readParameter?
+
+        The diabatic Hamiltonian of each multiplicity is built from the
+        precomputed epsilon and kappa/lambda arrays, together with the
+        Cartesian gradient of the ground state potential.
+        Both are stacked over the geometries in Crd.
         """
-        states = self.states['states']
-        nmult = len(states)
-        r3N = range(3*self.NAtoms)
         # get access to SH2LVC
         SH2LVC = self.storage['SH2LVC']
         Om = SH2LVC['Om']
         # compute displacement compared to reference structure
         disp = self.compute_displacement(Crd)
         # Transform the coordinates to dimensionless mass-weighted normal modes
-        MR = [SH2LVC['Ms'][i] * disp[i] for i in r3N]
-        MRV = [ sum(MR[j] * SH2LVC['V'][j][i] for j in r3N) for i in r3N]
-        Q =  [MRV[i] * Om[i]**0.5 for i in r3N]
+        Q = np.dot(SH2LVC['Ms'] * disp, SH2LVC['V']) * np.sqrt(Om)
         # Compute the ground state potential and gradient
-        V0 = sum(0.5 * Om[i] * Q[i]*Q[i] for i in r3N)
-        HMCH =  [[[
-                    V0 if istate == jstate else 0.
-                       for istate in range(states[imult])]
-                       for jstate in range(states[imult])]
-                       for imult in range(nmult)]
-        #l
-        dHMCH = [[[[
-          Om[i] * Q[i] if istate == jstate else 0.
-                       for istate in range(states[imult])]
-                       for jstate in range(states[imult])]
-                       for imult in range(nmult)]
-                       for i in r3N]
-        # Add the vertical energies (epsilon)
-        # Enter in separate lines as:
-        # <n_epsilon>
-        # <mult> <state> <epsilon>
-        # <mult> <state> <epsilon>
-        for imult, istate, val in SH2LVC['epsilon']:
-            HMCH[imult][istate][istate] += val
-        # Add the intrastate LVC constants (kappa)
-        # Enter in separate lines as:
-        # <n_kappa>
-        # <mult> <state> <mode> <kappa>
-        # <mult> <state> <mode> <kappa>
-        for imult, istate, i, val  in SH2LVC['kappa']:
-            HMCH[imult][istate][istate]  += val * Q[i]
-            dHMCH[i][imult][istate][istate] += val
-        # Add the interstate LVC constants (lambda)
-        # Enter in separate lines as:
-        # <n_lambda>
-        # <mult> <state1> <state2> <mode> <lambda>
-        # <mult> <state1> <state2> <mode> <lambda>
-        for imult, istate, jstate, i, val  in SH2LVC['lambda']:
-            HMCH[imult][istate][jstate]  += val * Q[i]
-            HMCH[imult][jstate][istate]  += val * Q[i]
-            dHMCH[i][imult][istate][jstate] += val
-            dHMCH[i][imult][jstate][istate] += val
-        # save HMCH and dHMCH
-        SH2LVC['H'] = HMCH
-        SH2LVC['dH'] = dHMCH
+        V0 = 0.5 * np.sum(Om * Q * Q, axis=1)
+        SH2LVC['gradV0'] = np.dot(Om * Q, SH2LVC['W'])
+        # Add the vertical energies (epsilon) and 
+        # the intra- and interstate LVC constants (kappa, lambda)
+        SH2LVC['H'] = [ H0 + V0[:,None,None] * np.eye(len(H0)) + np.tensordot(Q, dHQ, axes=1)
+                        for H0, dHQ in zip(SH2LVC['H0'], SH2LVC['dHQ']) ]
 
     def read_V0(self, fname='V0.txt'):
         """"
@@ -508,26 +554,29 @@ class SHARC_LVC(SHARC_INTERFACE):
 
         U_TO_AMU = 1.0/self.constants['au2u']
 
-        SH2LVC['CEq'] = [  float(ele)
+        SH2LVC['labels'] = [ line.lower().split()[0]
+                for line in find_lines(self.NAtoms, 'Geometry',v0) ]
+
+        SH2LVC['CEq'] = np.array([  float(ele)
                 for line in find_lines(self.NAtoms, 'Geometry',v0)
-                for ele in line.split()[2:5] ]
+                for ele in line.split()[2:5] ])
 
-        SH2LVC['Ms'] =  [ (float(line.split()[5])*U_TO_AMU)**.5
+        SH2LVC['Ms'] = np.array([ (float(line.split()[5])*U_TO_AMU)**.5
                 for line in find_lines(self.NAtoms, 'Geometry',v0)
-                for i in range(3) ]
+                for i in range(3) ])
 
         # Frequencies (a.u.)
         tmp = find_lines(1, 'Frequencies',v0)
         if tmp==[]:
             print('No Frequencies defined in %s!'%fname)
             sys.exit(24)
-        SH2LVC['Om'] = list(map(float,tmp[0].split()))
+        SH2LVC['Om'] = np.array(list(map(float,tmp[0].split())))
         # Normal modes in mass-weighted coordinates
         tmp = find_lines(len(SH2LVC['Om']), 'Mass-weighted normal modes', v0)
         if tmp==[]:
             print('No normal modes given in %s!'%fname)
             sys.exit(24)
-        SH2LVC['V']  = [list(map(float,line.split())) for line in tmp] # transformation matrix
+        SH2LVC['V']  = np.array([list(map(float,line.split())) for line in tmp]) # transformation matrix
         return SH2LVC
 
 
@@ -546,10 +595,14 @@ def getCommandoLine():
     parser.add_argument("param", metavar="FILE",type=str,
                         default="QM/LVC.template", nargs='?',
                         help="param file, LVC.template")
+    parser.add_argument("-t", "--trajectories", metavar="DIR", type=str,
+                        nargs='+', default=None,
+                        help="run the trajectories in these directories in one batch, "
+                             "input and param are then relative to each directory")
 
     args = parser.parse_args()
 
-    return args.input, args.param
+    return args.input, args.param, args.trajectories
 
 
 def main():
@@ -558,7 +611,13 @@ def main():
 
     """
 
-    inp_file, param = getCommandoLine()
+    inp_file, param, trajectories = getCommandoLine()
+    if trajectories is not None:
+        # run all trajectories in lockstep, the LVC model is 
+        # evaluated for all of them in one call
+        batch = SHARC_BATCH(SHARC_LVC, trajectories, inp_file)
+        exitcodes = batch.run(os.path.join(os.path.abspath(trajectories[0]), param))
+        sys.exit(max(exitcodes))
     # init SHARC_LVC class
     lvc = SHARC_LVC()
     # run sharc dynamics
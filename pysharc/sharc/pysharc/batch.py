@@ -0,0 +1,179 @@
+#!/usr/bin/env python2
+
+#******************************************
+#
+#    SHARC Program Suite
+#
+#    Copyright (c) 2019 University of Vienna
+#
+#    This file is part of SHARC.
+#
+#    SHARC is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    SHARC is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    inside the SHARC manual.  If not, see <http://www.gnu.org/licenses/>.
+#
+#******************************************
+
+
+#!/usr/bin/env python2
+"""
+
+Driver for running many independent trajectories in lockstep.
+
+The SHARC propagator keeps its state in Fortran module variables,
+so every trajectory needs its own process for the propagation.
+These processes are forked from the driver and only send their
+QM requests (tasks and coordinates) back to it. The driver collects
+one request from each running trajectory and evaluates all of them
+in one call to do_qm_jobs of the interface, which model Hamiltonians
+(e.g. LVC) implement as a single vectorized evaluation.
+
+"""
+from __future__ import print_function
+
+import os
+import sys
+import traceback
+from multiprocessing import Process, Pipe
+
+# relative packages
+from .. import sharc
+
+
+def _run_trajectory(interface_class, path, inp_file, conn):
+    """
+
+    Runs one trajectory in path, QM requests are sent to the driver
+
+    """
+    os.chdir(path)
+    traj = interface_class()
+
+    def readParameter(*args, **kwargs):
+        conn.send(('setup', sharc.get_basic_info(), traj.constants))
+
+    def do_qm_job(tasks, Crd):
+        conn.send(('qm', tasks, Crd))
+        return conn.recv()
+
+    traj.readParameter = readParameter
+    traj.do_qm_job = do_qm_job
+    try:
+        traj.run_sharc(inp_file)
+        conn.send(('done', None, None))
+    except BaseException:
+        conn.send(('error', traceback.format_exc(), None))
+    conn.close()
+
+
+class SHARC_BATCH(object):
+    """
+    Runs several trajectories of the same system with one interface
+    """
+
+    def __init__(self, interface_class, paths, inp_file='input'):
+        """
+
+        interface_class: SHARC_INTERFACE subclass used for all trajectories
+        paths: list of trajectory directories, each containing inp_file
+
+        """
+        if interface_class.use_qmin is True or interface_class.set_qmout is True:
+            print('SHARC_BATCH needs an interface which returns QMout from do_qm_job!')
+            sys.exit(1)
+        self.interface_class = interface_class
+        self.paths = [ os.path.abspath(path) for path in paths ]
+        self.inp_file = inp_file
+
+    def start(self):
+        """ forks one process per trajectory """
+        self.workers = []
+        for path in self.paths:
+            conn, child_conn = Pipe()
+            proc = Process(target=_run_trajectory,
+                           args=(self.interface_class, path, self.inp_file, child_conn))
+            proc.start()
+            child_conn.close()
+            self.workers.append({'path': path, 'proc': proc, 'conn': conn, 'traj': None})
+
+    def setup(self, worker, basic_info, constants, *args, **kwargs):
+        """
+
+        Creates the interface object of a trajectory
+
+        Parameters are read only once (by the first trajectory),
+        all other trajectories share them through a copy of its storage
+
+        """
+        traj = self.interface_class()
+        traj.sharc_set_basic(basic_info, constants)
+        if self.master is None:
+            traj.storage = {}
+            traj.readParameter(*args, **kwargs)
+            self.master = traj
+            self.master_path = worker['path']
+        else:
+            if traj.NAtoms != self.master.NAtoms or traj.states['states'] != self.master.states['states']:
+                self.stop('Trajectory %s is inconsistent with %s!' % (worker['path'], self.master_path))
+            traj.storage = dict(self.master.storage)
+        worker['traj'] = traj
+
+    def stop(self, message):
+        """ terminates all trajectories """
+        print(message)
+        for worker in self.workers:
+            if worker['proc'].is_alive():
+                worker['proc'].terminate()
+        sys.exit(1)
+
+    def run(self, *args, **kwargs):
+        """
+
+        Main loop, arguments are passed to readParameter
+
+        In each cycle one message is received from every running trajectory.
+        Trajectories can send a different number of requests per time step
+        (e.g. after a hop), they simply continue in the next cycle.
+
+        """
+        self.master = None
+        self.start()
+        active = list(self.workers)
+        while active:
+            requests = []
+            for worker in list(active):
+                try:
+                    kind, data, extra = worker['conn'].recv()
+                except EOFError:
+                    kind, data = 'error', 'Trajectory process died.'
+                if kind == 'setup':
+                    self.setup(worker, data, extra, *args, **kwargs)
+                elif kind == 'qm':
+                    requests.append((worker, data, extra))
+                elif kind == 'done':
+                    worker['proc'].join()
+                    active.remove(worker)
+                else:
+                    print('Trajectory %s failed:\n%s' % (worker['path'], data))
+                    worker['proc'].join()
+                    active.remove(worker)
+            if not requests:
+                continue
+            try:
+                QMouts = self.master.do_qm_jobs([ w['traj'] for w, _, _ in requests ],
+                                                [ tasks for _, tasks, _ in requests ],
+                                                [ Crd for _, _, Crd in requests ])
+            except Exception:
+                self.stop(traceback.format_exc())
+            for (worker, _, _), QMout in zip(requests, QMouts):
+                worker['conn'].send(QMout)
+        return [ worker['proc'].exitcode for worker in self.workers ]
@@ -110,6 +110,24 @@ class SHARC_INTERFACE(object):
         """
         pass
 
+    def do_qm_jobs(self, trajectories, tasks, Crds):
+        """
+
+        Batched version of do_qm_job, used by SHARC_BATCH
+
+        trajectories is a list of interface objects, one per trajectory,
+        which hold the trajectory specific data (savedir, storage, ...),
+        tasks and Crds are the corresponding lists of tasks and coordinates
+
+        needs to return a list of QMout objects
+
+        The default calls do_qm_job for each trajectory, interfaces
+        for cheap model Hamiltonians should evaluate all geometries
+        in one vectorized call instead
+
+        """
+        return [ traj.do_qm_job(t, Crd) for traj, t, Crd in zip(trajectories, tasks, Crds) ]
+
 
     def do_single_job(self, QMin=None, tasks=None, Crd=None, basic_info=None, IAn=None, AtNames=None, *args, **kwargs):
         """ Run a single point charc Calculations starting from QMin """
@@ -167,9 +185,10 @@ class SHARC_INTERFACE(object):
         pass
 
 
-    def sharc_writeQMout(self, QMout, QMoutfile='QM.out'):
+    def sharc_writeQMout(self, QMout, QMoutfile='QM.out', binary=False):
         """
         writes QMout file, based on the QMout dct!
+        (binary=True: binary QM.out format, see $SHARC/../lib/qmout.py)
         """
         QMin = {
             'natom' : self.NAtoms,
@@ -178,7 +197,7 @@ class SHARC_INTERFACE(object):
             'nmstates' : self.states['nmstates'],
             }
 
-        writeQMout(QMin, QMout, QMoutfile)
+        writeQMout(QMin, QMout, QMoutfile, binary)
 
 
     def sharc_writeQMin(self, QMout='QM.in'):
@@ -217,7 +236,7 @@ class SHARC_INTERFACE(object):
         fileio.writeOutput(QMout, txt)
 
 
-    def sharc_set_basic(self, basic_info):
+    def sharc_set_basic(self, basic_info, constants=None):
 
         self.states = self.getStates(basic_info['states'])
         if self.save_atids is True:
@@ -234,7 +253,9 @@ class SHARC_INTERFACE(object):
         self.NAtoms = basic_info['NAtoms']
         self.nsteps = basic_info['NSteps']
         self.istep  = basic_info['istep']
-        self.constants = sharc.get_constants()
+        if constants is None:
+            constants = sharc.get_constants()
+        self.constants = constants
         self.QMin = { 'savedir' : basic_info['savedir'] }
 
     def sharc_get_sharc_tasks(self, icall, getCrd):
@@ -22,9 +22,13 @@
 #******************************************
 
 
+import os
 import sys
 from . import fileio
 
+# shared modules in $SHARC/../lib
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.realpath(__file__)),'..','..','..','lib'))
+
 def check_version(major, minor):
     if major != sys.version_info[0]:
         return False
@@ -40,10 +44,16 @@ else:
     def lst2dct(lst):
         return dict((i, value) for i, value in enumerate(lst) )
 
-def writeQMout(QMin, QMout, QMoutfile='QM.out'):
+def writeQMout(QMin, QMout, QMoutfile='QM.out', binary=False):
     """
 
+    Writes the QMout dictionary to QMoutfile, as text or (binary=True)
+    in the binary format described in $SHARC/../lib/qmout.py
+
     """
+    if binary:
+        writeQMoutbinary(QMin, QMout, QMoutfile)
+        return
     string=''
     if 'h' in QMout:
         string+=writeQMoutsoc(QMin,QMout)
@@ -63,6 +73,28 @@ def writeQMout(QMin, QMout, QMoutfile='QM.out'):
         string+=writeQmoutPhases(QMin,QMout)
     fileio.writeOutput(QMoutfile, string)
 
+def writeQMoutbinary(QMin, QMout, QMoutfile='QM.out'):
+    """
+
+    Writes the same quantities as writeQMout in the binary QM.out format,
+    which avoids formatting every number as text
+
+    """
+    import numpy
+    from qmout import write_binary
+    sections={}
+    for key in ['h', 'dm', 'grad', 'overlap', 'socdr', 'phases', 'runtime']:
+        if key in QMout:
+            sections[key]=QMout[key]
+    if 'dmdr' in QMout:
+        # QMout['dmdr'] is indexed [pol][i][j], the file is [i][j][pol]
+        sections['dmdr']=numpy.transpose(numpy.asarray(QMout['dmdr']), (1, 2, 0, 3, 4))
+    if 'ion' in QMout:
+        sections['prop']=QMout['prop']
+        sections['propmat']=(['Dyson norms'], [QMout['prop']])
+    write_binary(QMoutfile, sections, QMin['nmstates'], QMin['natom'])
+
+# ======================================================================= #
 def eformat(f, prec, exp_digits):
     '''Formats a float f into scientific notation with prec number of decimals and exp_digits number of exponent digits.
 
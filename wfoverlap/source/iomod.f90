@@ -152,6 +152,12 @@ CONTAINS
     INTEGER(KIND=ilong):: nb
     INTEGER(KIND=ilong):: ninv
 
+    ! binary format: "WFODETS"//char(0), version, nstate, nMO, nSD (4-byte integers),
+    ! then for each SD the determinant string (nMO characters) and the coefficients (nstate reals)
+    CHARACTER(LEN=8):: magic
+    INTEGER(KIND=ishort), DIMENSION(4):: bheader
+    LOGICAL:: binary
+
 
     INQUIRE(FILE=trim(adjustl(file)), EXIST=test)
     IF(.NOT.test)THEN
@@ -160,7 +166,15 @@ CONTAINS
       STOP 1
     ELSE
       detflio=freeunit()
-      OPEN(UNIT=detflio,FILE=trim(adjustl(file)),IOSTAT=iost,STATUS='old',ACTION='read')
+      ! check for the binary format
+      binary=.FALSE.
+      OPEN(UNIT=detflio,FILE=trim(adjustl(file)),IOSTAT=iost,STATUS='old',ACTION='read',ACCESS='stream',FORM='unformatted')
+      IF(iost == 0) THEN
+        READ(detflio,IOSTAT=iost)magic
+        binary=(iost == 0 .AND. magic == 'WFODETS'//char(0))
+        IF(.NOT.binary) CLOSE(detflio)
+      END IF
+      IF(.NOT.binary) OPEN(UNIT=detflio,FILE=trim(adjustl(file)),IOSTAT=iost,STATUS='old',ACTION='read')
       IF(iost .NE. 0) THEN
         WRITE(0,*) "Cannot open file ",trim(adjustl(file))," to read"
         WRITE(6,*) "Cannot open file ",trim(adjustl(file))," to read"
@@ -168,7 +182,19 @@ CONTAINS
       END IF
     END IF
 
-    READ(detflio,*)nstate, nMO, nSD
+    IF(binary)THEN
+      READ(detflio)bheader
+      IF(bheader(1) .NE. 1)THEN
+        WRITE(0,*) "Unknown version of the binary format in ",trim(adjustl(file))
+        WRITE(6,*) "Unknown version of the binary format in ",trim(adjustl(file))
+        STOP 1
+      END IF
+      nstate=bheader(2)
+      nMO=bheader(3)
+      nSD=bheader(4)
+    ELSE
+      READ(detflio,*)nstate, nMO, nSD
+    END IF
     allocstat=myalloc(coefs,nstate,nSD,'+ cicoef')
     IF(allocstat.NE.0)THEN
       WRITE(6,'("Could not allocate cicoefs in read_dets; error ",I5)')allocstat
@@ -178,7 +204,11 @@ CONTAINS
       STOP 1
     END IF
     ! semi-elegant: read the first determinant string to get the number of electrons
-    READ(detflio,*,IOSTAT=iost)detstring,coefs(1:nstate,1)
+    IF(binary)THEN
+      READ(detflio,IOSTAT=iost)detstring(1:nMO),coefs(1:nstate,1)
+    ELSE
+      READ(detflio,*,IOSTAT=iost)detstring,coefs(1:nstate,1)
+    END IF
 
     na=0
     nb=0
@@ -231,10 +261,18 @@ CONTAINS
     END IF
 
     REWIND(detflio)
-    READ(detflio,*) ! discard the fist line
+    IF(binary)THEN
+      READ(detflio)magic,bheader
+    ELSE
+      READ(detflio,*) ! discard the fist line
+    END IF
 
     DO i=1,nSD
-      READ(detflio,*,IOSTAT=iost)detstring,coefs(1:nstate,i)
+      IF(binary)THEN
+        READ(detflio,IOSTAT=iost)detstring(1:nMO),coefs(1:nstate,i)
+      ELSE
+        READ(detflio,*,IOSTAT=iost)detstring,coefs(1:nstate,i)
+      END IF
       IF(iost.NE.0)THEN
         WRITE(0,'("error in reading SD: ",I6,", file: ",A200)')i, trim(adjustl(file))
         PRINT*,coefs(nstate,i),detstring